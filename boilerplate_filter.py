@@ -0,0 +1,132 @@
+"""
+Precompiled boilerplate stripping for scraped text
+网页正文的无用文本清理：每个站点配置的所有模式在导入时编译成一个交替正则，
+一次扫描完成替换，而不是每个模式各扫描一遍全文；随后按行压缩空白（str.split，
+不再用两次正则）
+
+站点配置（SITE_PROFILES）：
+- generic：通用页面，沿用原先 _extract_main_content 中的模式列表
+- mediawiki：萌娘百科、维基百科等 MediaWiki 站点，额外去掉 [1] 等脚注标记
+- baike：百度/搜狗/360 百科，去掉“播报 编辑”、脚注与收藏/点赞文本
+- fandom：Fandom（原 Wikia），在 mediawiki 基础上去掉 [edit]、广告与社区提示
+
+register_profile 可以在某个配置的基础上扩展新的站点。
+
+与原先逐个模式替换的差异：单次扫描在每个位置取最左边的匹配，而原实现按列表
+顺序各扫一遍，前一个模式删掉的文本可能让后一个模式匹配到原本不相邻的内容。
+多数页面结果相同，已知不同的情况（见 scripts/test_boilerplate_filter.py）：
+- 「编辑.*?段落」「编辑.*?章节」跨过 [编辑] 标记时，原实现会连同中间的正文一起
+  删掉（角色[编辑]设定段落内容 → 角色[内容），现在只删标记（→ 角色设定段落内容）
+- 隐藏分类行：原实现由「分类：.*」删掉后半行、留下“隐藏”二字，现在整行删除
+"""
+import re
+from typing import Dict, Iterable, List, Optional
+from urllib.parse import urlparse
+
+GENERIC_PATTERNS = [
+    r'编辑.*?段落',
+    r'编辑.*?章节',
+    r'跳转至.*?导航',
+    r'萌娘百科.*?欢迎',
+    r'维基百科.*?自由',
+    r'登录.*?创建账户',
+    r'讨论.*?贡献.*?工具',
+    r'个人工具',
+    r'页面工具',
+    r'分类：.*',
+    r'隐藏分类：.*',
+    r'导航菜单',
+    r'参考资料\[编辑\]',
+    r'外部链接\[编辑\]',
+    r'\[编辑\]',
+    r'\[查看\]',
+    r'\[讨论\]',
+    r'\[×\]',
+]
+
+MEDIAWIKI_PATTERNS = [
+    r'\[编辑源代码\]',
+    r'\[\d+\]',                      # 脚注标记
+    r'本页面最后修订于.*',
+]
+
+BAIKE_PATTERNS = [
+    r'播报\s*编辑',
+    r'\[\d+(?:-\d+)?\]',             # 脚注标记，含 [1-3] 形式
+    r'本词条由.*?(?:审核|提供)',
+    r'查看我的收藏',
+    r'有用\+\d*',
+    r'词条统计.*',
+]
+
+FANDOM_PATTERNS = [
+    r'\[edit\]',
+    r'\[edit source\]',
+    r'Advertisement',
+    r'Fan Feed',
+    r'More Fandoms',
+    r'Community content is available under CC-BY-SA unless otherwise noted\.?',
+]
+
+
+class BoilerplateFilter:
+    """
+    一组清理模式编译成的单个交替正则（忽略大小写）
+
+    交替在同一位置按列表顺序尝试，较长的特定模式（如 参考资料[编辑]）应排在
+    其子串模式（[编辑]）之前
+    """
+
+    def __init__(self, name: str, patterns: Iterable[str]):
+        self.name = name
+        self.patterns: List[str] = list(dict.fromkeys(patterns))
+        self.regex = re.compile('|'.join(f'(?:{pattern})' for pattern in self.patterns), re.IGNORECASE)
+
+    def clean(self, text: str) -> str:
+        """去掉无用文本，压缩每行内的空白并删除空行（段落之间的换行保留）"""
+        if not text:
+            return ''
+        text = self.regex.sub('', text)
+        return '\n'.join(filter(None, (' '.join(line.split()) for line in text.split('\n'))))
+
+
+SITE_PROFILES: Dict[str, BoilerplateFilter] = {}
+
+
+def register_profile(name: str, patterns: Iterable[str], base: Optional[str] = 'generic') -> BoilerplateFilter:
+    """注册（或替换）一个站点配置：在 base 配置的模式之前加上该站点特有的模式"""
+    inherited = SITE_PROFILES[base].patterns if base else []
+    profile = BoilerplateFilter(name, list(patterns) + inherited)
+    SITE_PROFILES[name] = profile
+    return profile
+
+
+register_profile('generic', GENERIC_PATTERNS, base=None)
+register_profile('mediawiki', MEDIAWIKI_PATTERNS)
+register_profile('baike', BAIKE_PATTERNS)
+register_profile('fandom', FANDOM_PATTERNS, base='mediawiki')
+
+# 按域名识别的站点
+_HOST_PROFILES = [
+    (('baike.baidu.com', 'baike.sogou.com', 'baike.so.com'), 'baike'),
+    (('fandom.com', 'wikia.com', 'wikia.org'), 'fandom'),
+    (('moegirl.org.cn', 'moegirl.org', 'wikipedia.org', 'huijiwiki.com', 'wiki.biligame.com'), 'mediawiki'),
+]
+
+
+def detect_profile(url: Optional[str], soup=None) -> str:
+    """根据域名（以及页面的 generator 元信息）选择站点配置"""
+    host = (urlparse(url).hostname or '').lower() if url else ''
+    for suffixes, name in _HOST_PROFILES:
+        if any(host == suffix or host.endswith('.' + suffix) for suffix in suffixes):
+            return name
+    if soup is not None:
+        generator = soup.find('meta', attrs={'name': 'generator'})
+        if generator and (generator.get('content') or '').lower().startswith('mediawiki'):
+            return 'mediawiki'
+    return 'generic'
+
+
+def clean_text(text: str, profile: str = 'generic') -> str:
+    """用某个站点配置清理文本；未知配置按 generic 处理"""
+    return SITE_PROFILES.get(profile, SITE_PROFILES['generic']).clean(text)
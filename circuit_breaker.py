@@ -0,0 +1,234 @@
+"""
+Per-host circuit breakers
+上游熔断：按主机记录连续失败，故障期间快速失败而不是每轮都等满超时
+
+- closed：正常放行；连续失败达到阈值（EASYPROMPT_BREAKER_FAILURE_THRESHOLD，默认 3）后打开
+- open：直接抛出 CircuitOpenError；经过 EASYPROMPT_BREAKER_RESET_TIMEOUT 秒（默认 30）后半开
+- half_open：只放行一个探测请求，成功则关闭，失败则重新打开
+
+只有连接失败、超时和 5xx 计为失败；4xx、429 说明主机仍在响应，按成功处理
+（429 由 upstream_limiter 负责）。LLM、DuckDuckGo 搜索和网页抓取共用同一套熔断器。
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+from urllib.parse import urlparse
+
+import httpx
+import requests
+
+from runtime_config import env_float, env_int
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Gemini（google.api_core）表示服务端故障的异常
+_SERVER_ERROR_NAMES = ("ServiceUnavailable", "DeadlineExceeded", "InternalServerError", "GatewayTimeout")
+
+
+class CircuitOpenError(RuntimeError):
+    """目标主机处于熔断状态，本次请求未发出"""
+
+    def __init__(self, host: str, retry_in: float):
+        super().__init__(f"{host} 暂时不可用（熔断中，约 {retry_in:.0f}s 后重试）")
+        self.host = host
+        self.retry_in = retry_in
+
+
+def host_of(url: str) -> str:
+    """URL 的主机部分（含端口），作为熔断器的键"""
+    if not url:
+        return ""
+    if "://" not in url:
+        url = "https://" + url
+    return urlparse(url).netloc.lower() or url
+
+
+def is_upstream_failure(exc: BaseException) -> bool:
+    """异常是否说明上游主机不可用（连接失败、超时、5xx）"""
+    if isinstance(exc, CircuitOpenError):
+        return False
+    if isinstance(exc, (httpx.TransportError, httpx.TimeoutException, TimeoutError, ConnectionError)):
+        return True
+    if isinstance(exc, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    if isinstance(exc, (httpx.HTTPStatusError, requests.exceptions.HTTPError)):
+        response = getattr(exc, "response", None)
+        return response is not None and response.status_code >= 500
+    return type(exc).__name__ in _SERVER_ERROR_NAMES
+
+
+class _GuardedCall:
+    __slots__ = ("status_code",)
+
+    def __init__(self):
+        self.status_code: Optional[int] = None
+
+
+class CircuitBreaker:
+    """
+    单个主机的熔断器
+
+    Args:
+        host: 主机名（仅用于日志和统计）
+        failure_threshold: 连续失败多少次后打开
+        reset_timeout: 打开后多少秒进入半开状态
+    """
+
+    def __init__(self, host: str, failure_threshold: int = 3, reset_timeout: float = 30.0):
+        self.host = host
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self.last_error: Optional[str] = None
+
+        self._lock = threading.Lock()
+        self.stats: Dict[str, int] = {
+            "calls": 0,
+            "failures": 0,
+            "rejected": 0,
+            "opened": 0,
+        }
+
+    def _retry_in_locked(self) -> float:
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def is_open(self) -> bool:
+        """当前是否会拒绝请求（不占用半开探测名额，供调用方提前跳过可选步骤）"""
+        with self._lock:
+            if self.state == OPEN:
+                return self._retry_in_locked() > 0
+            return self.state == HALF_OPEN and self.probe_in_flight
+
+    def retry_in(self) -> float:
+        with self._lock:
+            return self._retry_in_locked() if self.state == OPEN else 0.0
+
+    def before_call(self):
+        """登记一次请求；熔断中抛出 CircuitOpenError"""
+        with self._lock:
+            if self.state == OPEN:
+                retry_in = self._retry_in_locked()
+                if retry_in > 0:
+                    self.stats["rejected"] += 1
+                    raise CircuitOpenError(self.host, retry_in)
+                self.state = HALF_OPEN
+                self.probe_in_flight = False
+            if self.state == HALF_OPEN:
+                if self.probe_in_flight:
+                    self.stats["rejected"] += 1
+                    raise CircuitOpenError(self.host, 0.0)
+                self.probe_in_flight = True
+            self.stats["calls"] += 1
+
+    def record_success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                print(f"✅ {self.host} 已恢复，熔断关闭")
+            self.state = CLOSED
+            self.consecutive_failures = 0
+            self.probe_in_flight = False
+
+    def record_failure(self, reason: str = ""):
+        with self._lock:
+            self.stats["failures"] += 1
+            self.consecutive_failures += 1
+            self.last_error = reason[:200] or None
+            self.probe_in_flight = False
+            if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self.stats["opened"] += 1
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                print(f"⚡ {self.host} 连续失败 {self.consecutive_failures} 次，熔断 {self.reset_timeout:.0f}s")
+
+    def record_cancelled(self):
+        """请求被调用方放弃（未得出主机是否可用的结论），只归还半开探测名额"""
+        with self._lock:
+            self.probe_in_flight = False
+
+    def record_status(self, status_code: int):
+        """按 HTTP 状态码记录结果：5xx 为失败，其余说明主机仍在响应"""
+        if status_code >= 500:
+            self.record_failure(f"HTTP {status_code}")
+        else:
+            self.record_success()
+
+    def record_exception(self, exc: BaseException):
+        """
+        按异常记录结果：上游故障计为失败；4xx 状态异常说明主机在响应，计为成功；
+        其余（调用方取消、排队超时、解析错误等）不能说明主机状态，只归还探测名额
+        """
+        if is_upstream_failure(exc):
+            reason = str(exc).splitlines()[0] if str(exc) else type(exc).__name__
+            self.record_failure(reason)
+        elif isinstance(exc, (httpx.HTTPStatusError, requests.exceptions.HTTPError)):
+            self.record_success()
+        else:
+            self.record_cancelled()
+
+    @contextmanager
+    def guard(self):
+        """
+        包住一次请求：熔断中快速失败，结束后按结果更新状态
+
+        不抛异常的 HTTP 调用可以把状态码写入 yield 出的对象（call.status_code），
+        5xx 按失败记录。
+        """
+        self.before_call()
+        call = _GuardedCall()
+        try:
+            yield call
+        except BaseException as exc:
+            self.record_exception(exc)
+            raise
+        if call.status_code is not None:
+            self.record_status(call.status_code)
+        else:
+            self.record_success()
+
+    def get_state(self) -> Dict[str, Any]:
+        with self._lock:
+            state = self.state
+            if state == OPEN and self._retry_in_locked() <= 0:
+                state = HALF_OPEN
+            return {
+                "state": state,
+                "consecutive_failures": self.consecutive_failures,
+                "retry_in_s": round(self._retry_in_locked(), 1) if self.state == OPEN else 0.0,
+                "last_error": self.last_error,
+                **self.stats,
+            }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(host: str) -> CircuitBreaker:
+    """
+    返回某个主机的全局熔断器（参数见 EASYPROMPT_BREAKER_FAILURE_THRESHOLD、
+    EASYPROMPT_BREAKER_RESET_TIMEOUT）
+    """
+    host = (host or "").lower()
+    with _breakers_lock:
+        breaker = _breakers.get(host)
+        if breaker is None:
+            breaker = CircuitBreaker(
+                host,
+                failure_threshold=env_int("EASYPROMPT_BREAKER_FAILURE_THRESHOLD", 3),
+                reset_timeout=env_float("EASYPROMPT_BREAKER_RESET_TIMEOUT", 30.0),
+            )
+            _breakers[host] = breaker
+        return breaker
+
+
+def get_breaker_states() -> Dict[str, Any]:
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {breaker.host: breaker.get_state() for breaker in breakers}
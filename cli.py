@@ -18,7 +18,6 @@ def main():
 
     from language_manager import lang_manager
     from conversation_handler import ConversationHandler
-    from evaluator_service import EvaluatorService
     import llm_helper
 
     parser = argparse.ArgumentParser(description="Easy-Prompt: An intelligent RolePlay Prompt Generator.")
@@ -36,8 +35,6 @@ def main():
 
     llm_helper.init_llm(nsfw_mode=args.nsfw)
     
-    evaluator = EvaluatorService()
-    evaluator.start()
     handler = ConversationHandler()
     
     print(f"\n--- {lang_manager.t('EASYPROMPT_INITIALIZED')} ---")
@@ -59,6 +56,8 @@ def main():
             
             full_response = ""
             for chunk in handler.handle_message(user_input):
+                if chunk.startswith("TRAIT_UPDATE::"):
+                    continue
                 full_response += chunk
                 print(chunk, end='', flush=True)
             
@@ -85,7 +84,6 @@ def main():
     except (KeyboardInterrupt, EOFError):
         print(f"\n{lang_manager.t('EXITING')}")
     finally:
-        evaluator.stop()
         print(lang_manager.t("APP_SHUTDOWN"))
 
 if __name__ == "__main__":
@@ -0,0 +1,92 @@
+"""
+Local completeness pre-scorer
+本地完整度预评分：基于类别关键词词典归类后的结构化特征估算四个类别的完整度
+
+早期轮次距离 is_ready_for_writing 还很远，没有必要每轮都调用评估模型；
+本地估算未达到阈值时直接给出临时评估（critique 指向最薄弱的类别）。
+"""
+from typing import Any, Dict, List, Tuple
+
+from profile_compactor import CATEGORY_TITLES, USER_NOTE_LABEL
+from runtime_config import env_float, env_int
+
+# 少于该字数的描述视为不够具体，不计入完整度
+MIN_CONCRETE_CHARS = 4
+
+CATEGORY_GUIDANCE = {
+    "core_identity": "角色的基本身份和背景（是谁、从哪里来、外貌与经历）",
+    "personality_traits": "角色的内在性格与价值观",
+    "behavioral_patterns": "角色在具体情境下的行为表现和习惯",
+    "interaction_patterns": "角色与他人交流的方式、语气和称呼",
+}
+
+
+def category_coverage(items: List[Tuple[str, str]], target: int) -> float:
+    """
+    某一类别的覆盖度（0~1）：具体描述的条数 / 目标条数
+
+    未提取到特征时记录的「用户输入」兜底备注不是特征，不计入覆盖度
+    """
+    concrete = sum(
+        1 for label, value in items
+        if label != USER_NOTE_LABEL and len(value) >= MIN_CONCRETE_CHARS
+    )
+    return min(1.0, concrete / max(1, target))
+
+
+def prescore_profile(compact_profile, target_per_category: int = None) -> Dict[str, Any]:
+    """
+    根据紧凑档案估算完整度
+
+    Returns:
+        {
+            "estimated_score": 0-10,
+            "coverage": {类别: 0~1},
+            "completeness_breakdown": {类别: 条数},
+            "weakest_category": 类别,
+        }
+    """
+    if target_per_category is None:
+        target_per_category = env_int("EASYPROMPT_PRESCORE_TARGET_ITEMS", 3)
+
+    coverage = {
+        category: category_coverage(compact_profile.items(category), target_per_category)
+        for category in CATEGORY_TITLES
+    }
+    weakest = min(coverage, key=lambda category: coverage[category])
+    return {
+        "estimated_score": round(10 * sum(coverage.values()) / len(coverage), 1),
+        "coverage": {category: round(value, 2) for category, value in coverage.items()},
+        "completeness_breakdown": compact_profile.counts(),
+        "weakest_category": weakest,
+    }
+
+
+def build_provisional_evaluation(estimate: Dict[str, Any]) -> Dict[str, Any]:
+    """由本地估算构造临时评估结果（字段与评估模型的输出一致）"""
+    weakest = estimate["weakest_category"]
+    missing = [
+        CATEGORY_GUIDANCE[category]
+        for category, value in estimate["coverage"].items()
+        if value < 1.0
+    ]
+    return {
+        "is_ready_for_writing": False,
+        "critique": f"需要引导用户补充{CATEGORY_GUIDANCE[weakest]}。",
+        "evaluation_score": estimate["estimated_score"],
+        "extracted_traits": [],
+        "extracted_keywords": [],
+        "completeness_breakdown": estimate["completeness_breakdown"],
+        "suggestions": [f"补充{item}" for item in missing],
+        "provisional": True,
+    }
+
+
+def prescore_threshold() -> float:
+    """本地估算达到该分数（0-10）后才调用评估模型"""
+    return env_float("EASYPROMPT_PRESCORE_THRESHOLD", 6.0)
+
+
+def llm_evaluation_interval() -> int:
+    """未达到阈值时，每隔多少轮仍调用一次评估模型（0 表示只看阈值）"""
+    return env_int("EASYPROMPT_EVAL_EVERY_TURNS", 4)
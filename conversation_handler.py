@@ -1,16 +1,27 @@
 import os
+import json
 from urllib.parse import urlparse
 from profile_manager import ProfileManager
 from llm_helper import (
     start_chat_session,
     get_conversation_response_stream,
     write_final_prompt_stream,
-    evaluate_profile
+    write_final_prompt_stream_async,
+    evaluate_profile,
+    evaluate_profile_stream
 )
+from profile_evaluator import ProfileEvaluator, EVALUATION_STATE_KEY
+from runtime_config import env_bool
 from language_manager import lang_manager
+from conversation_memory import ConversationMemory, estimate_tokens
+from profile_compactor import sanitize_user_note
+from schemas import ChatMessage
 from typing import Optional, Dict, Any, List
 from web_scraper import web_scraper
 from search_helper import search_helper
+from turn_deadline import TurnDeadline
+from passage_selector import link_excerpt_budget, search_excerpt_budget, select_passages
+from web_brief import get_web_brief
 
 class ConversationHandler:
     """
@@ -20,7 +31,8 @@ class ConversationHandler:
     def __init__(
         self, 
         session_id: Optional[str] = None,
-        user_id: Optional[str] = None
+        user_id: Optional[str] = None,
+        recent_messages: Optional[List[ChatMessage]] = None
     ):
         """
         初始化 ConversationHandler
@@ -28,6 +40,7 @@ class ConversationHandler:
         Args:
             session_id: 会话ID
             user_id: 用户ID（用于用户隔离）
+            recent_messages: 已持久化的最近消息，用于重建被淘汰的会话上下文
         """
         self.session_id = session_id
         self.user_id = user_id
@@ -35,29 +48,72 @@ class ConversationHandler:
             session_id=session_id,
             user_id=user_id
         )
-        self.chat_session = start_chat_session()
+        # 对话记忆同时服务于 OpenAI 和 Gemini，按 token 预算保持历史有界
+        self.memory = ConversationMemory.from_messages(recent_messages)
+        self.chat_session = start_chat_session(self.memory.build_gemini_history())
         self.last_critique = "角色档案为空，请引导用户描述角色的核心身份。"
+        # 最近一轮完整的 AI 回复，由调用方取走并持久化（见 take_ai_response）
+        self.last_ai_response: Optional[str] = None
+        # 评估器在全量评估与增量评估之间切换
+        self.evaluator = ProfileEvaluator(
+            self.profile_manager,
+            evaluate_fn=evaluate_profile,
+            evaluate_stream_fn=evaluate_profile_stream if env_bool("EASYPROMPT_STREAM_EVAL", True) else None
+        )
         
         # 如果是恢复的session，加载之前的critique
         if session_id:
             self.load_session_state()
     
+    def estimate_memory_bytes(self) -> int:
+        """Rough size of the state held by this handler (profile buffer, critique, chat memory)."""
+        size = self.profile_manager.buffered_profile_bytes()
+        size += len((self.last_critique or "").encode("utf-8"))
+        size += self.memory.estimated_bytes()
+        return size
+
+    def take_ai_response(self) -> Optional[str]:
+        """Returns the AI reply of the last completed turn (once), for persisting to the session."""
+        ai_response, self.last_ai_response = self.last_ai_response, None
+        return ai_response
+
     def load_session_state(self):
-        """Loads session state from metadata."""
-        metadata = self.profile_manager.load_session_metadata()
-        if metadata:
+        """Loads session state from the consolidated session record."""
+        state = self.profile_manager.load_session_metadata()
+        if state:
             # 恢复最后的critique
-            evaluation_data = metadata.get("evaluation_data", {})
-            self.last_critique = evaluation_data.get("last_critique", self.last_critique)
+            self.last_critique = state.get("last_critique") or self.last_critique
+            self.evaluator.load_state(state.get(EVALUATION_STATE_KEY))
     
     def save_session_state(self):
-        """Saves current session state to metadata."""
+        """Saves current session state to the consolidated session record."""
         self.profile_manager.update_session_metadata({
-            "evaluation_data": {
-                "last_critique": self.last_critique
-            }
+            "last_critique": self.last_critique,
+            EVALUATION_STATE_KEY: self.evaluator.dump_state()
         })
         
+    def evaluate_profile(self) -> dict:
+        """
+        Evaluates the profile (full or delta, see ProfileEvaluator), updates
+        the critique and persists the evaluation state.
+        """
+        evaluation: dict = {}
+        for kind, payload in self.evaluate_profile_stream():
+            if kind == "final":
+                evaluation = payload
+        return evaluation
+
+    def evaluate_profile_stream(self):
+        """
+        Streaming variant of evaluate_profile: yields ("partial", fields) as
+        evaluator fields close, then ("final", evaluation).
+        """
+        for kind, payload in self.evaluator.evaluate_stream():
+            if kind == "final":
+                self.last_critique = payload.get("critique", self.last_critique)
+                self.save_session_state()
+            yield kind, payload
+
     def get_initial_greeting(self):
         """
         Gets the initial greeting for the conversation.
@@ -74,68 +130,85 @@ class ConversationHandler:
             yield lang_manager.t("ERROR_LLM_NOT_CONFIGURED")
             return
         original_message = message
+        self.last_ai_response = None
+        # 首个回复 token 之前的步骤共享本轮时间预算（EASYPROMPT_TTFT_SLO）
+        deadline = TurnDeadline.for_turn()
 
         # 1. 根据搜索意图自动决定是否联网
-        search_plan = search_helper.plan_search_strategy(original_message)
+        with deadline.stage("planner"):
+            search_plan = search_helper.plan_search_strategy(original_message, deadline)
         if search_plan.get('should_search') and search_plan.get('query'):
-            search_logs, enhanced_message = self._execute_search_plan(original_message, message, search_plan)
+            with deadline.stage("search"):
+                search_logs, enhanced_message = self._execute_search_plan(original_message, message, search_plan, deadline)
             for log in search_logs:
                 yield log
             if enhanced_message:
                 message = enhanced_message
         
-        # 2. 检查用户输入是否包含链接
-        link_result = web_scraper.process_user_input(original_message)
-        if link_result['has_url']:
-            yield f"🔗 检测到链接: {link_result['url']}"
-            
-            if link_result['web_content'] and link_result['web_content']['success']:
-                web_content = link_result['web_content']
-                yield f"📄 网页标题: {web_content['title']}"
-                
-                if web_content['description']:
-                    yield f"📝 网页描述: {web_content['description']}"
-                
+        # 2. 检查用户输入中的链接：多个链接并发抓取，每完成一个就推送进度
+        link_request = web_scraper.prepare_user_links(original_message, deadline)
+        if link_request['has_url']:
+            urls = link_request['urls']
+            for url in urls or [link_request['url']]:
+                yield f"🔗 检测到链接: {url}"
+            if link_request['dropped_urls']:
+                yield f"⚠️ 每条消息最多抓取 {len(urls)} 个链接，已忽略: {', '.join(link_request['dropped_urls'])}"
+            if link_request['error']:
+                yield f"❌ 网页抓取失败: {link_request['error']}"
+
+            pages = []
+            scraping = web_scraper.iter_scrape(urls, deadline)
+            while True:
+                with deadline.stage("link"):
+                    web_content = next(scraping, None)
+                if web_content is None:
+                    break
+                if not web_content['success']:
+                    yield f"❌ 网页抓取失败: {web_content['url']} - {web_content.get('error') or '未知错误'}"
+                    continue
+                pages.append(web_content)
                 # 调试信息：显示网页内容长度
                 content_length = len(web_content['content']) if web_content['content'] else 0
-                yield f"📊 网页内容长度: {content_length} 字符"
+                yield f"📄 网页标题: {web_content['title']}（{content_length} 字符）"
+                if web_content['description']:
+                    yield f"📝 网页描述: {web_content['description']}"
+
+            if pages:
+                order = {url: idx for idx, url in enumerate(urls)}
+                pages.sort(key=lambda page: order.get(page['url'], len(order)))
+                with deadline.stage("link"):
+                    link_block = self._link_context(pages, original_message, deadline)
                 
                 # 将网页内容整合到消息中
                 enhanced_message = f"""
 用户输入: {message}
 
-网页内容:
-标题: {web_content['title']}
-描述: {web_content['description']}
-内容: {web_content['content']}
-关键词: {', '.join(web_content['keywords'])}
+{link_block}
 
 请基于以上网页内容帮助用户完善角色设定。
 """
                 message = enhanced_message
-                yield f"✅ 网页内容已整合到上下文中，内容长度: {content_length} 字符"
-            else:
-                error_msg = link_result.get('error', '网页抓取失败')
-                yield f"❌ 网页抓取失败: {error_msg}"
-                # 继续使用原始消息
+                yield f"✅ {len(pages)} 个网页的内容已整合到上下文中，摘录长度: {len(link_block)} 字符"
 
         # On subsequent turns, first evaluate the profile to get a new critique
         if not is_initial:
-            full_profile = self.profile_manager.get_full_profile()
-            if full_profile:
-                evaluation = evaluate_profile(full_profile)
-                self.last_critique = evaluation.get("critique", self.last_critique)
-                
-                # 保存session状态
-                self.save_session_state()
-                
-                if evaluation.get("is_ready_for_writing", False):
-                    confirmation_reason = evaluation.get("critique", "角色档案似乎已足够完整。")
-                    yield f"CONFIRM_GENERATION::{confirmation_reason}"
-                    return
+            if self.profile_manager.get_compact_profile():
+                # 已有评估结果时不调用模型；需要调用但预算不足时沿用上一轮诊断，回复后照常评估
+                if self.evaluator.has_current_result() or deadline.allows("evaluator"):
+                    with deadline.stage("evaluator"):
+                        evaluation = self.evaluate_profile()
+                    
+                    if evaluation.get("is_ready_for_writing", False):
+                        confirmation_reason = evaluation.get("critique", "角色档案似乎已足够完整。")
+                        yield f"CONFIRM_GENERATION::{confirmation_reason}"
+                        return
+                else:
+                    print(f"⏱️ 本轮时间预算不足（剩余 {deadline.remaining():.1f}s），对话前评估推迟到回复之后")
 
         # Get the generator for the streaming response
-        response_generator = get_conversation_response_stream(self.chat_session, message, self.last_critique)
+        response_generator = get_conversation_response_stream(
+            self.chat_session, message, self.last_critique, memory=self.memory
+        )
         
         # Handle the generator that yields chunks and final result
         full_response_chunks = []
@@ -146,16 +219,27 @@ class ConversationHandler:
                 # This is the final result tuple
                 _, ai_response, new_trait = chunk
                 break
+            if isinstance(chunk, tuple) and chunk[0] == "__TRAIT__":
+                # 特征段边生成边解析，实时推送给前端
+                yield f"TRAIT_UPDATE::{json.dumps(chunk[1].to_dict(), ensure_ascii=False)}"
+                continue
+            deadline.mark_first_token()
             yield chunk
             full_response_chunks.append(chunk)
+        else:
+            ai_response = "".join(c for c in full_response_chunks if isinstance(c, str))
+        
+        # 记录本轮对话；历史中只保留用户原始输入，网页/搜索上下文不进入稳定前缀
+        self.memory.add_turn(original_message, ai_response, self.last_critique)
+        self.last_ai_response = ai_response
         
         # Now that the stream is complete, append the new trait
         if new_trait and new_trait.lower() != "none":
             self.profile_manager.append_trait(new_trait)
         else:
-            # 即使没有提取到特征，也要记录用户输入，确保评估能够触发
-            # 这样可以处理网页内容、URL等特殊输入
-            self.profile_manager.append_trait(f"用户输入: {message}")
+            # 即使没有提取到特征，也要记录用户输入，确保评估能够触发；
+            # 只记录用户原始输入的简短备注，网页/搜索内容不写入特征日志
+            self.profile_manager.append_trait(sanitize_user_note(original_message))
         
         # Signal that evaluation should start (will be handled separately in main.py)
         yield f"EVALUATION_TRIGGER::{lang_manager.t('EVALUATOR_EVALUATING')}"
@@ -165,7 +249,7 @@ class ConversationHandler:
         Finalizes the process by generating and saving the prompt.
         Yields the streaming content of the final prompt.
         """
-        full_profile = self.profile_manager.get_full_profile()
+        full_profile = self.profile_manager.get_compact_profile()
         yield "\n" + lang_manager.t("FINAL_PROMPT_HEADER") + "\n"
         
         final_prompt_stream = write_final_prompt_stream(full_profile)
@@ -177,8 +261,68 @@ class ConversationHandler:
         self.profile_manager.save_final_prompt(final_prompt_content)
         yield "::FINAL_PROMPT_END::"
 
-    def _execute_search_plan(self, original_message: str, current_message: str, plan: Dict[str, Any]):
-        """Executes the resolved search plan and returns status logs plus an enhanced message."""
+    async def finalize_prompt_async(self):
+        """
+        Async variant of finalize_prompt; the writer stream does not block the
+        event loop (native async on Gemini, worker thread on OpenAI).
+        """
+        full_profile = self.profile_manager.get_compact_profile()
+        yield "\n" + lang_manager.t("FINAL_PROMPT_HEADER") + "\n"
+
+        final_prompt_content = ""
+        async for final_chunk in write_final_prompt_stream_async(full_profile):
+            yield final_chunk
+            final_prompt_content += final_chunk
+
+        self.profile_manager.save_final_prompt(final_prompt_content)
+        yield "::FINAL_PROMPT_END::"
+
+    def _web_context(self, web_content: Dict[str, Any], kind: str, message: str, focus: Optional[str],
+                     budget_tokens: int, deadline: Optional[TurnDeadline] = None) -> str:
+        """
+        Returns the form in which scraped page content enters the prompt: the cached
+        per-URL brief when enabled and available, otherwise the passages most relevant
+        to the user message within budget_tokens.
+        """
+        brief = get_web_brief(web_content, kind, focus=focus, deadline=deadline)
+        if brief:
+            return brief
+        return select_passages(web_content.get('content') or '', message, budget_tokens, focus=focus)
+
+    def _link_context(self, pages: List[Dict[str, Any]], message: str,
+                      deadline: Optional[TurnDeadline] = None) -> str:
+        """
+        Merges the pages scraped from the user's links into one context block.
+        Pages share the link token budget: shorter pages are placed first and
+        whatever they leave unused goes to the longer ones.
+        """
+        remaining_budget = link_excerpt_budget()
+        excerpts: Dict[int, str] = {}
+        by_length = sorted(range(len(pages)), key=lambda idx: len(pages[idx].get('content') or ''))
+        for position, idx in enumerate(by_length):
+            budget = max(1, remaining_budget // (len(pages) - position))
+            excerpts[idx] = self._web_context(pages[idx], 'link', message, None, budget, deadline)
+            remaining_budget = max(0, remaining_budget - estimate_tokens(excerpts[idx]))
+
+        blocks = []
+        for idx, page in enumerate(pages):
+            header = "网页内容:" if len(pages) == 1 else f"网页内容 {idx + 1}/{len(pages)}:"
+            blocks.append(
+                f"{header}\n"
+                f"标题: {page['title']}\n"
+                f"链接: {page['url']}\n"
+                f"描述: {page['description']}\n"
+                f"内容: {excerpts[idx]}\n"
+                f"关键词: {', '.join(page['keywords'])}"
+            )
+        return "\n\n".join(blocks)
+
+    def _execute_search_plan(self, original_message: str, current_message: str, plan: Dict[str, Any],
+                             deadline: Optional[TurnDeadline] = None):
+        """
+        Executes the resolved search plan and returns status logs plus an enhanced message.
+        Search is optional enrichment: it is skipped when the turn deadline leaves too little budget.
+        """
         logs: List[str] = []
         enhanced_message = None
 
@@ -192,9 +336,20 @@ class ConversationHandler:
         if reason:
             logs.append(f"📌 触发原因: {reason}")
 
+        # 搜索上游熔断中：联网增强是可选步骤，直接跳过，不让本轮等待超时
+        unavailable = search_helper.search_unavailable_reason()
+        if unavailable:
+            logs.append(f"⚡ 跳过联网搜索: {unavailable}")
+            logs.append("💡 将尝试基于现有知识回答您的问题")
+            return logs, enhanced_message
+        if deadline is not None and not deadline.allows("search"):
+            logs.append(f"⏱️ 本轮时间预算不足（剩余 {deadline.remaining():.1f}s），跳过联网搜索")
+            logs.append("💡 将尝试基于现有知识回答您的问题")
+            return logs, enhanced_message
+
         if intent_type == 'character':
             logs.append("⏳ 正在搜索角色相关的 wiki/百科资料...")
-            search_data = search_helper.search_character_info(query)
+            search_data = search_helper.search_character_info(query, deadline=deadline)
             if search_data['success'] and search_data['search_results']:
                 logs.append(f"\n📚 找到 {len(search_data['search_results'])} 个信息来源")
 
@@ -243,7 +398,9 @@ class ConversationHandler:
                 if web_content and web_content.get('success') and web_content.get('content'):
                     enhanced.append("\n=== 网页详细内容 ===\n")
                     enhanced.append(f"标题: {web_content.get('title', '')}\n")
-                    enhanced.append(f"内容: {web_content.get('content', '')[:1000]}\n")
+                    excerpt = self._web_context(web_content, 'character', original_message, query,
+                                                search_excerpt_budget(), deadline)
+                    enhanced.append(f"内容: {excerpt}\n")
 
                 enhanced.append(
                     "\n请基于以上搜索到的详细信息，帮助用户了解这个角色。\n"
@@ -260,7 +417,7 @@ class ConversationHandler:
             logs.append(f"🌐 检测到{intent_label}查询: {query}")
             logs.append("⏳ 正在联网检索相关资料...")
 
-            concept_data = search_helper.search_concept_info(query)
+            concept_data = search_helper.search_concept_info(query, deadline=deadline)
             if concept_data['success']:
                 summary = concept_data.get('concept_summary', '')
                 key_points = concept_data.get('key_points', [])
@@ -296,9 +453,10 @@ class ConversationHandler:
 
                 web_content = concept_data.get('web_content')
                 if web_content and web_content.get('content'):
-                    excerpt = web_content['content'][:1200]
+                    excerpt = self._web_context(web_content, 'concept', original_message, query,
+                                                search_excerpt_budget(), deadline)
                     enhanced.append("\n=== 来源正文摘录 ===\n")
-                    enhanced.append(excerpt + ("..." if len(web_content['content']) > len(excerpt) else ""))
+                    enhanced.append(excerpt)
 
                 if sources:
                     enhanced.append("\n=== 信息来源 (Top 3) ===\n")
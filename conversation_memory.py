@@ -0,0 +1,215 @@
+"""
+Per-session conversation memory shared by the OpenAI and Gemini paths
+每个会话的对话记忆：按 token 预算保留最近轮次，较早的轮次折叠为滚动摘要
+
+消息布局保持前缀稳定，便于服务商侧的提示词缓存命中：
+    [system prompt] [早先对话摘要] [历史轮次 ...] [诊断报告 + 当前用户输入]
+历史只在追加新轮次时变化；超出预算时一次性把较早的一半轮次折叠进摘要，
+而不是每轮滑动窗口，这样两次折叠之间的前缀逐字节不变。
+诊断报告每轮都会变化，因此只出现在最后一条用户消息中。
+"""
+import re
+import threading
+from typing import Any, Dict, List, Optional
+
+from runtime_config import env_int
+
+_CJK_PATTERN = re.compile(r'[　-〿぀-ヿ㐀-䶿一-鿿＀-￯]')
+
+SUMMARY_HEADER = "早先对话摘要（较早的轮次已压缩）:"
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：中日文字符约 1 token/字，其余约 4 字符/token"""
+    if not text:
+        return 0
+    cjk_count = len(_CJK_PATTERN.findall(text))
+    other_count = len(text) - cjk_count
+    return cjk_count + (other_count + 3) // 4
+
+
+# 全局统计（所有会话累计）
+_metrics_lock = threading.Lock()
+conversation_metrics = {
+    "turns": 0,
+    "prompt_tokens_total": 0,
+    "reported_turns": 0,
+    "cached_tokens_total": 0,
+    "summary_folds": 0,
+}
+
+
+def get_conversation_metrics() -> Dict[str, Any]:
+    """返回对话提示词 token 的累计统计"""
+    with _metrics_lock:
+        metrics = dict(conversation_metrics)
+    turns = metrics["turns"] or 1
+    metrics["avg_prompt_tokens_per_turn"] = round(metrics["prompt_tokens_total"] / turns, 1)
+    if metrics["prompt_tokens_total"]:
+        metrics["cached_token_ratio"] = round(metrics["cached_tokens_total"] / metrics["prompt_tokens_total"], 3)
+    else:
+        metrics["cached_token_ratio"] = 0.0
+    return metrics
+
+
+class ConversationMemory:
+    """
+    单个会话的有界对话记忆
+
+    - history_token_budget: 保留原文的历史轮次 token 上限
+    - summary_token_budget: 滚动摘要的 token 上限
+    """
+
+    def __init__(
+        self,
+        history_token_budget: Optional[int] = None,
+        summary_token_budget: Optional[int] = None
+    ):
+        if history_token_budget is None:
+            history_token_budget = env_int("EASYPROMPT_HISTORY_TOKENS", 4000)
+        if summary_token_budget is None:
+            summary_token_budget = env_int("EASYPROMPT_SUMMARY_TOKENS", 800)
+        self.history_token_budget = history_token_budget
+        self.summary_token_budget = summary_token_budget
+
+        self.turns: List[Dict[str, str]] = []
+        self.summary_lines: List[str] = []
+        self._turn_tokens: List[int] = []
+        self._pending_usage: Optional[Dict[str, int]] = None
+        self.turn_metrics: List[Dict[str, Any]] = []
+
+    @classmethod
+    def from_messages(cls, messages: Optional[List[Any]]) -> "ConversationMemory":
+        """从持久化的 ChatMessage 列表（user/ai 交替）恢复记忆"""
+        memory = cls()
+        pending_user = None
+        for message in messages or []:
+            message_type = getattr(message.type, "value", message.type)
+            if message_type == "user":
+                pending_user = message.content
+            elif message_type == "ai" and pending_user is not None:
+                memory._append_turn(pending_user, message.content)
+                pending_user = None
+        memory._compact()
+        return memory
+
+    # --- 布局 ---
+
+    @property
+    def summary(self) -> str:
+        return "\n".join(self.summary_lines)
+
+    def build_openai_history(self) -> List[Dict[str, str]]:
+        """system prompt 之后、当前用户消息之前的稳定消息序列（OpenAI 格式）"""
+        messages: List[Dict[str, str]] = []
+        if self.summary_lines:
+            messages.append({"role": "system", "content": f"{SUMMARY_HEADER}\n{self.summary}"})
+        for turn in self.turns:
+            messages.append({"role": "user", "content": turn["user"]})
+            messages.append({"role": "assistant", "content": turn["assistant"]})
+        return messages
+
+    def build_gemini_history(self) -> List[Dict[str, Any]]:
+        """稳定的 Gemini 聊天历史；摘要作为第一轮上下文注入"""
+        history: List[Dict[str, Any]] = []
+        if self.summary_lines:
+            history.append({"role": "user", "parts": [f"{SUMMARY_HEADER}\n{self.summary}"]})
+            history.append({"role": "model", "parts": ["好的，我会结合这些早先的对话继续。"]})
+        for turn in self.turns:
+            history.append({"role": "user", "parts": [turn["user"]]})
+            history.append({"role": "model", "parts": [turn["assistant"]]})
+        return history
+
+    # --- 更新 ---
+
+    def record_usage(self, prompt_tokens: Optional[int] = None, cached_tokens: Optional[int] = None):
+        """记录服务商返回的本轮 token 用量（在 add_turn 之前调用）"""
+        if prompt_tokens is None and cached_tokens is None:
+            return
+        self._pending_usage = {
+            "prompt_tokens": int(prompt_tokens or 0),
+            "cached_tokens": int(cached_tokens or 0),
+        }
+
+    def add_turn(self, user_message: str, assistant_message: str, critique: str = ""):
+        """追加一轮对话并记录本轮提示词 token；超出预算时折叠较早的轮次"""
+        estimated = (
+            self.history_tokens()
+            + estimate_tokens(self.summary)
+            + estimate_tokens(user_message)
+            + estimate_tokens(critique)
+        )
+        usage = self._pending_usage
+        self._pending_usage = None
+        turn_metric = {
+            "estimated_prompt_tokens": estimated,
+            "prompt_tokens": usage["prompt_tokens"] if usage else estimated,
+            "cached_tokens": usage["cached_tokens"] if usage else None,
+            "reported": usage is not None,
+        }
+        self.turn_metrics.append(turn_metric)
+        del self.turn_metrics[:-50]
+
+        with _metrics_lock:
+            conversation_metrics["turns"] += 1
+            conversation_metrics["prompt_tokens_total"] += turn_metric["prompt_tokens"]
+            if usage:
+                conversation_metrics["reported_turns"] += 1
+                conversation_metrics["cached_tokens_total"] += usage["cached_tokens"]
+
+        if user_message and assistant_message:
+            self._append_turn(user_message, assistant_message)
+            self._compact()
+
+    def _append_turn(self, user_message: str, assistant_message: str):
+        self.turns.append({"user": user_message, "assistant": assistant_message})
+        self._turn_tokens.append(estimate_tokens(user_message) + estimate_tokens(assistant_message))
+
+    def history_tokens(self) -> int:
+        return sum(self._turn_tokens)
+
+    def _compact(self):
+        """历史超出预算时，把较早的一半轮次折叠进摘要（一次性变更前缀）"""
+        if self.history_tokens() <= self.history_token_budget or not self.turns:
+            return
+
+        fold_count = max(1, len(self.turns) // 2)
+        while sum(self._turn_tokens[fold_count:]) > self.history_token_budget and fold_count < len(self.turns):
+            fold_count += 1
+
+        folded = self.turns[:fold_count]
+        self.turns = self.turns[fold_count:]
+        self._turn_tokens = self._turn_tokens[fold_count:]
+        self.summary_lines.extend(self._summarize_turns(folded))
+
+        while self.summary_lines and estimate_tokens(self.summary) > self.summary_token_budget:
+            self.summary_lines.pop(0)
+
+        with _metrics_lock:
+            conversation_metrics["summary_folds"] += 1
+
+    @staticmethod
+    def _summarize_turns(turns: List[Dict[str, str]]) -> List[str]:
+        """本地抽取式摘要：保留每轮用户输入与回复的开头"""
+        lines = []
+        for turn in turns:
+            user_text = " ".join(turn["user"].split())
+            assistant_text = " ".join(turn["assistant"].split())
+            user_part = user_text[:120] + ("…" if len(user_text) > 120 else "")
+            assistant_part = assistant_text[:60] + ("…" if len(assistant_text) > 60 else "")
+            lines.append(f"- 用户: {user_part} / 助手: {assistant_part}")
+        return lines
+
+    def estimated_bytes(self) -> int:
+        size = len(self.summary.encode("utf-8"))
+        for turn in self.turns:
+            size += len(turn["user"].encode("utf-8")) + len(turn["assistant"].encode("utf-8"))
+        return size
+
+    def get_metrics(self) -> Dict[str, Any]:
+        return {
+            "turns_in_window": len(self.turns),
+            "history_tokens": self.history_tokens(),
+            "summary_tokens": estimate_tokens(self.summary),
+            "last_turn": self.turn_metrics[-1] if self.turn_metrics else None,
+        }
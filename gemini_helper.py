@@ -3,10 +3,22 @@ Google Gemini API 支持模块
 支持前端配置 API Key 和模型选择
 """
 import json
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
 import google.generativeai as genai
 from google.generativeai.types import HarmCategory, HarmBlockThreshold
-from typing import Dict, Generator, Optional
+from typing import AsyncGenerator, Dict, Generator, Optional
 from language_manager import lang_manager
+from profile_compactor import TraitStreamParser
+from incremental_json import IncrementalJSONParser
+from structured_output import gemini_generation_config, parse_structured, record_parsed
+from model_routing import normalize_task_models, resolve_task_config
+from upstream_limiter import get_upstream_limiter
+from resilient_request import call_with_retries
+from circuit_breaker import get_breaker
+from turn_deadline import DEADLINE_TASKS, current_deadline, stage_timeout
 
 # --- 全局配置 ---
 gemini_config = {
@@ -14,15 +26,96 @@ gemini_config = {
     "model": "",  # 必须由用户配置
     "evaluator_model": "",  # 必须由用户配置
     "temperature": 0.7,
+    "task_models": {},  # 按任务覆盖 model/temperature/max_tokens，见 model_routing
     "nsfw_mode": False  # R18内容开关
 }
 
+# 上游并发准入（429 时由限流器暂停放行并降低并发）
+_GEMINI_LIMITER = get_upstream_limiter("gemini")
+# Gemini API 端点主机（熔断器的键）
+GEMINI_HOST = "generativelanguage.googleapis.com"
+
+# SDK 默认的 generate_content RPC 超时（秒）
+GEMINI_RPC_TIMEOUT = 600.0
+
+def _deadline_request_options(task: str) -> Dict:
+    """处于某轮截止时间内的规划/评估调用：把 RPC 超时压到剩余预算（见 turn_deadline）"""
+    deadline = current_deadline.get()
+    if deadline is None or task not in DEADLINE_TASKS or deadline.budget is None:
+        return {}
+    return {"request_options": {"timeout": stage_timeout(GEMINI_RPC_TIMEOUT, task)}}
+
+@contextmanager
+def _gemini_slot(task: str):
+    """熔断检查 + 上游并发准入；熔断中直接抛出 CircuitOpenError，不进入排队"""
+    with get_breaker(GEMINI_HOST).guard(), _GEMINI_LIMITER.slot(task):
+        yield
+
+@asynccontextmanager
+async def _gemini_slot_async(task: str):
+    """_gemini_slot 的异步版本"""
+    with get_breaker(GEMINI_HOST).guard():
+        async with _GEMINI_LIMITER.slot_async(task):
+            yield
+
 # --- Model Instances ---
 CONVERSATION_MODEL = None
 EVALUATOR_MODEL = None
 WRITER_MODEL = None
 
-def init_gemini_llm(api_key: str, model: str = "gemini-2.5-flash", evaluator_model: str = None, temperature: float = 0.7, nsfw_mode: bool = False):
+# --- GenerativeModel 实例缓存 ---
+# 键为 (模型名, 系统提示词哈希, 安全设置, generation_config)。
+# 模型实例在首次请求时绑定 API 客户端，更换 API Key 时整体清空。
+MODEL_CACHE_SIZE = 32
+_model_cache: "OrderedDict[tuple, genai.GenerativeModel]" = OrderedDict()
+_model_cache_lock = threading.Lock()
+model_cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
+_configured_api_key: Optional[str] = None
+
+
+def _model_cache_key(model_name: str, system_instruction: Optional[str], safety_settings, generation_config) -> tuple:
+    prompt_hash = hashlib.sha256((system_instruction or "").encode("utf-8")).hexdigest()
+    safety_key = tuple(sorted((int(category), int(threshold)) for category, threshold in (safety_settings or {}).items()))
+    config_key = json.dumps(generation_config or {}, sort_keys=True, ensure_ascii=False, default=str)
+    return (model_name, prompt_hash, safety_key, config_key)
+
+
+def get_cached_model(model_name: str, system_instruction: Optional[str] = None,
+                     safety_settings=None, generation_config: Optional[dict] = None) -> "genai.GenerativeModel":
+    """返回参数相同的 GenerativeModel 实例，不存在时创建并缓存（LRU）"""
+    key = _model_cache_key(model_name, system_instruction, safety_settings, generation_config)
+    with _model_cache_lock:
+        model = _model_cache.get(key)
+        if model is not None:
+            _model_cache.move_to_end(key)
+            model_cache_stats["hits"] += 1
+            return model
+        model_cache_stats["misses"] += 1
+
+    model = genai.GenerativeModel(
+        model_name,
+        system_instruction=system_instruction,
+        safety_settings=safety_settings,
+        generation_config=generation_config
+    )
+    with _model_cache_lock:
+        _model_cache[key] = model
+        while len(_model_cache) > MODEL_CACHE_SIZE:
+            _model_cache.popitem(last=False)
+            model_cache_stats["evictions"] += 1
+    return model
+
+
+def clear_model_cache():
+    with _model_cache_lock:
+        _model_cache.clear()
+
+
+def get_model_cache_stats() -> dict:
+    with _model_cache_lock:
+        return {**model_cache_stats, "size": len(_model_cache), "capacity": MODEL_CACHE_SIZE}
+
+def init_gemini_llm(api_key: str, model: str = "gemini-2.5-flash", evaluator_model: str = None, temperature: float = 0.7, nsfw_mode: bool = False, task_models: Optional[dict] = None):
     """
     初始化Gemini API配置
     
@@ -32,16 +125,18 @@ def init_gemini_llm(api_key: str, model: str = "gemini-2.5-flash", evaluator_mod
         evaluator_model: 评估模型名称，默认与对话模型相同
         temperature: 温度参数
         nsfw_mode: 是否启用R18内容模式
+        task_models: 可选，按任务（planner/evaluator/conversation/writer）覆盖的模型配置；
+            evaluator_model 等价于 task_models["evaluator"]["model"]
     """
-    global gemini_config, CONVERSATION_MODEL, EVALUATOR_MODEL, WRITER_MODEL
+    global gemini_config, CONVERSATION_MODEL, EVALUATOR_MODEL, WRITER_MODEL, _configured_api_key
     
-    if not evaluator_model:
-        evaluator_model = model
+    task_models = normalize_task_models(task_models)
+    if evaluator_model and evaluator_model.strip() and "model" not in task_models.get("evaluator", {}):
+        task_models.setdefault("evaluator", {})["model"] = evaluator_model.strip()
     
     # sanitize inputs
     api_key_clean = api_key.strip() if isinstance(api_key, str) else api_key
     model_clean = model.strip() if isinstance(model, str) else model
-    evaluator_model_clean = evaluator_model.strip() if isinstance(evaluator_model, str) else evaluator_model
 
     # basic validation
     if isinstance(api_key_clean, str) and any(ord(c) < 32 for c in api_key_clean):
@@ -51,14 +146,20 @@ def init_gemini_llm(api_key: str, model: str = "gemini-2.5-flash", evaluator_mod
     gemini_config.update({
         "api_key": api_key_clean,
         "model": model_clean,
-        "evaluator_model": evaluator_model_clean,
         "temperature": temperature,
+        "task_models": task_models,
         "nsfw_mode": nsfw_mode
     })
+    api_key_changed = _configured_api_key != api_key_clean
+    evaluator_model = resolve_task_config("evaluator", gemini_config)["model"]
+    gemini_config["evaluator_model"] = evaluator_model
     
     try:
-        # 配置Gemini API
-        genai.configure(api_key=api_key_clean)
+        # 配置Gemini API；Key 未变化时保留已绑定客户端的缓存模型
+        if api_key_changed:
+            genai.configure(api_key=api_key_clean)
+            clear_model_cache()
+            _configured_api_key = api_key_clean
         
         # 安全设置
         safety_settings = None
@@ -93,25 +194,26 @@ def init_gemini_llm(api_key: str, model: str = "gemini-2.5-flash", evaluator_mod
 生成的角色指南必须包含丰富的成人内容元素，让AI能够进行充满魅力和诱惑力的成人角色扮演。使用更直接、更具暗示性的语言。
 """
         
-        # 初始化模型
-        CONVERSATION_MODEL = genai.GenerativeModel(
-            model,
+        # 初始化模型（参数未变化时直接复用缓存实例）
+        CONVERSATION_MODEL = get_cached_model(
+            resolve_task_config("conversation", gemini_config)["model"],
             system_instruction=conversation_prompt,
-            safety_settings=safety_settings
+            safety_settings=safety_settings,
+            generation_config=_task_generation_config("conversation")
         )
         
-        EVALUATOR_MODEL = genai.GenerativeModel(
+        EVALUATOR_MODEL = get_cached_model(
             evaluator_model,
             system_instruction=evaluator_prompt,
-            safety_settings=safety_settings
+            safety_settings=safety_settings,
+            generation_config=_task_generation_config("evaluator")
         )
         
-        writer_generation_config = {"temperature": temperature}
-        WRITER_MODEL = genai.GenerativeModel(
-            model,
+        WRITER_MODEL = get_cached_model(
+            resolve_task_config("writer", gemini_config)["model"],
             system_instruction=writer_prompt,
             safety_settings=safety_settings,
-            generation_config=writer_generation_config
+            generation_config=_task_generation_config("writer")
         )
         
         print(f"Gemini API已配置: {model} (评估: {evaluator_model}) (R18: {'开启' if nsfw_mode else '关闭'})")
@@ -121,6 +223,23 @@ def init_gemini_llm(api_key: str, model: str = "gemini-2.5-flash", evaluator_mod
         print(f"Gemini API初始化失败: {e}")
         return False
 
+def _task_generation_config(task: str) -> Optional[dict]:
+    """
+    某个任务的 generation_config
+
+    与以往一致，只有写作模型默认使用全局温度；其余任务仅在 task_models
+    中显式指定 temperature / max_tokens 时才设置。
+    """
+    overrides = gemini_config.get("task_models", {}).get(task, {})
+    config = {}
+    if task == "writer":
+        config["temperature"] = gemini_config["temperature"]
+    if "temperature" in overrides:
+        config["temperature"] = overrides["temperature"]
+    if "max_tokens" in overrides:
+        config["max_output_tokens"] = overrides["max_tokens"]
+    return config or None
+
 def is_gemini_configured() -> bool:
     """检查Gemini配置是否完整"""
     return all([
@@ -129,7 +248,7 @@ def is_gemini_configured() -> bool:
         CONVERSATION_MODEL is not None
     ])
 
-def get_gemini_conversation_response_stream(chat_session, user_message: str, critique: str):
+def get_gemini_conversation_response_stream(chat_session, user_message: str, critique: str, usage_callback=None):
     """
     使用Gemini API获取对话响应流
     
@@ -137,9 +256,11 @@ def get_gemini_conversation_response_stream(chat_session, user_message: str, cri
         chat_session: Gemini聊天会话
         user_message: 用户消息
         critique: 诊断报告
+        usage_callback: 可选，接收 (prompt_tokens, cached_tokens)
     
     Yields:
-        Response chunks as strings, followed by a final result tuple
+        Response chunks as strings, ("__TRAIT__", TraitRecord) for each parsed
+        trait line after the separator, followed by a final result tuple
     """
     if not is_gemini_configured():
         error_msg = lang_manager.t("ERROR_LLM_NOT_CONFIGURED")
@@ -149,45 +270,16 @@ def get_gemini_conversation_response_stream(chat_session, user_message: str, cri
 
     try:
         message_with_context = f"诊断报告: {critique}\n\n---\n\n用户: {user_message}"
-        stream = chat_session.send_message(message_with_context, stream=True)
-        full_response_text = ""
-        ai_response_part = ""
-        trait_part = ""
-        found_separator = False
+        with _gemini_slot("conversation"):
+            stream = chat_session.send_message(message_with_context, stream=True)
+            splitter = _ConversationStreamSplitter()
         
-        for chunk in stream:
-            if chunk.parts:
-                chunk_text = chunk.text
-                full_response_text += chunk_text
-                
-                # 检查是否遇到分隔符
-                if not found_separator:
-                    if '---' in chunk_text:
-                        # 找到分隔符，分割当前块
-                        parts = chunk_text.split('---', 1)
-                        ai_response_part += parts[0]
-                        # 只 yield 分隔符之前的内容
-                        if parts[0]:
-                            yield parts[0]
-                        
-                        found_separator = True
-                        # 分隔符之后的内容是 trait 部分
-                        if len(parts) > 1:
-                            trait_part += parts[1]
-                    else:
-                        # 还没遇到分隔符，正常输出
-                        ai_response_part += chunk_text
-                        yield chunk_text
-                else:
-                    # 已经遇到分隔符，后续内容都是 trait 部分，不再 yield
-                    trait_part += chunk_text
+            for chunk in stream:
+                if chunk.parts:
+                    yield from splitter.feed(chunk.text)
         
-        # 清理 trait 部分
-        trait_part = trait_part.strip()
-        if not trait_part or trait_part.lower() == "none":
-            trait_part = "None"
-            
-        yield ("__FINAL_RESULT__", ai_response_part.strip(), trait_part)
+            _report_gemini_usage(stream, usage_callback)
+        yield from splitter.finish()
 
     except Exception as e:
         error_message = lang_manager.t("ERROR_CONVERSATION_LLM", error=e)
@@ -195,6 +287,57 @@ def get_gemini_conversation_response_stream(chat_session, user_message: str, cri
         yield error_message
         yield ("__FINAL_RESULT__", error_message, "None")
 
+class _ConversationStreamSplitter:
+    """
+    把对话流按 `---` 分隔符拆成回复正文和特征部分
+
+    feed() 返回应产出的内容：分隔符之前的文本块，以及分隔符之后逐行解析出的
+    ("__TRAIT__", TraitRecord)；finish() 返回剩余特征和最终结果元组。
+    """
+
+    def __init__(self):
+        self.ai_response_part = ""
+        self.trait_part = ""
+        self.found_separator = False
+        self.trait_parser = TraitStreamParser()
+
+    def feed(self, chunk_text: str) -> list:
+        outputs = []
+        if not self.found_separator:
+            if '---' in chunk_text:
+                # 找到分隔符，只产出分隔符之前的内容，之后的内容是 trait 部分
+                before, after = chunk_text.split('---', 1)
+                self.ai_response_part += before
+                if before:
+                    outputs.append(before)
+                self.found_separator = True
+                chunk_text = after
+            else:
+                self.ai_response_part += chunk_text
+                outputs.append(chunk_text)
+                return outputs
+        # 已经遇到分隔符，后续内容都是 trait 部分，逐行解析为结构化特征
+        self.trait_part += chunk_text
+        outputs.extend(("__TRAIT__", record) for record in self.trait_parser.feed(chunk_text))
+        return outputs
+
+    def finish(self) -> list:
+        outputs = [("__TRAIT__", record) for record in self.trait_parser.flush()]
+        trait_part = self.trait_part.strip()
+        if not trait_part or trait_part.lower() == "none":
+            trait_part = "None"
+        outputs.append(("__FINAL_RESULT__", self.ai_response_part.strip(), trait_part))
+        return outputs
+
+def _report_gemini_usage(stream, usage_callback) -> None:
+    """把 Gemini usage_metadata 交给回调"""
+    usage = getattr(stream, "usage_metadata", None)
+    if usage is not None and usage_callback:
+        usage_callback(
+            getattr(usage, "prompt_token_count", None),
+            getattr(usage, "cached_content_token_count", None)
+        )
+
 def evaluate_gemini_profile(full_profile: str) -> dict:
     """
     使用Gemini API评估角色档案
@@ -203,25 +346,82 @@ def evaluate_gemini_profile(full_profile: str) -> dict:
         return {"is_ready_for_writing": False, "critique": lang_manager.t("ERROR_LLM_NOT_CONFIGURED")}
     
     try:
-        response = EVALUATOR_MODEL.generate_content(full_profile)
-        cleaned_response = response.text.strip().replace("```json", "").replace("```", "")
-        return json.loads(cleaned_response)
+        def send():
+            with _gemini_slot("evaluator"):
+                return EVALUATOR_MODEL.generate_content(
+                    full_profile, generation_config=gemini_generation_config("evaluator"),
+                    **_deadline_request_options("evaluator")
+                )
+        response = call_with_retries(send, "evaluator")
+        return parse_structured(response.text, "evaluator")
     except Exception as e:
         error_message = lang_manager.t("ERROR_EVALUATOR_LLM", error=e)
         print(error_message)
         return {"is_ready_for_writing": False, "critique": error_message}
 
-def run_gemini_structured_prompt(system_prompt: str, user_prompt: str) -> str:
-    """Runs a single-turn Gemini prompt for control/analysis tasks."""
+def evaluate_gemini_profile_stream(full_profile: str):
+    """
+    使用Gemini API流式评估角色档案
+
+    Yields:
+        (字段名, 值)：评估 JSON 的顶层字段一闭合就产出；
+        最后产出 ("__FINAL_RESULT__", 完整评估字典)
+    """
+    if not is_gemini_configured():
+        yield ("__FINAL_RESULT__", {"is_ready_for_writing": False, "critique": lang_manager.t("ERROR_LLM_NOT_CONFIGURED")})
+        return
+
+    parser = IncrementalJSONParser()
+    full_text = ""
+    try:
+        with _gemini_slot("evaluator"):
+            stream = EVALUATOR_MODEL.generate_content(
+                full_profile, stream=True, generation_config=gemini_generation_config("evaluator", with_schema=False),
+                **_deadline_request_options("evaluator")
+            )
+            for chunk in stream:
+                if not chunk.parts:
+                    continue
+                full_text += chunk.text
+                for field in parser.feed(chunk.text):
+                    yield field
+
+        if parser.done:
+            record_parsed("evaluator")
+            yield ("__FINAL_RESULT__", parser.fields)
+        else:
+            yield ("__FINAL_RESULT__", parse_structured(full_text, "evaluator"))
+    except Exception as e:
+        error_message = lang_manager.t("ERROR_EVALUATOR_LLM", error=e)
+        print(error_message)
+        yield ("__FINAL_RESULT__", {"is_ready_for_writing": False, "critique": error_message})
+
+def _structured_prompt_model(system_prompt: str, task: Optional[str]):
+    route = task or "planner"
+    return get_cached_model(
+        resolve_task_config(route, gemini_config)["model"],
+        system_instruction=system_prompt,
+        generation_config=_task_generation_config(route)
+    )
+
+def run_gemini_structured_prompt(system_prompt: str, user_prompt: str, task: Optional[str] = None) -> str:
+    """
+    Runs a single-turn Gemini prompt for control/analysis tasks.
+    When `task` names a known schema, JSON output is requested via response_schema.
+    """
     if not is_gemini_configured():
         raise ValueError("Gemini API未配置")
 
     try:
-        planner_model = genai.GenerativeModel(
-            gemini_config["model"],
-            system_instruction=system_prompt
-        )
-        response = planner_model.generate_content(user_prompt)
+        planner_model = _structured_prompt_model(system_prompt, task)
+        generation_config = gemini_generation_config(task) if task else None
+        def send():
+            with _gemini_slot(task or "planner"):
+                return planner_model.generate_content(
+                    user_prompt, generation_config=generation_config,
+                    **_deadline_request_options(task or "planner")
+                )
+        response = call_with_retries(send, task or "planner")
         return response.text
     except Exception as e:
         raise RuntimeError(f"Gemini结构化请求失败: {e}")
@@ -235,20 +435,38 @@ def write_gemini_final_prompt_stream(full_profile: str) -> Generator[str, None,
         return
         
     try:
-        response_stream = WRITER_MODEL.generate_content(full_profile, stream=True)
-        for chunk in response_stream:
-            if chunk.parts:
-                yield chunk.text
+        with _gemini_slot("writer"):
+            response_stream = WRITER_MODEL.generate_content(full_profile, stream=True)
+            for chunk in response_stream:
+                if chunk.parts:
+                    yield chunk.text
+    except Exception as e:
+        error_message = lang_manager.t("ERROR_WRITER_LLM", error=e)
+        print(error_message)
+        yield error_message
+
+async def write_gemini_final_prompt_stream_async(full_profile: str) -> AsyncGenerator[str, None]:
+    """write_gemini_final_prompt_stream 的异步版本（generate_content_async）"""
+    if not is_gemini_configured():
+        yield lang_manager.t("ERROR_LLM_NOT_CONFIGURED")
+        return
+
+    try:
+        async with _gemini_slot_async("writer"):
+            response_stream = await WRITER_MODEL.generate_content_async(full_profile, stream=True)
+            async for chunk in response_stream:
+                if chunk.parts:
+                    yield chunk.text
     except Exception as e:
         error_message = lang_manager.t("ERROR_WRITER_LLM", error=e)
         print(error_message)
         yield error_message
 
-def start_gemini_chat_session():
-    """启动新的Gemini聊天会话"""
+def start_gemini_chat_session(history: list = None):
+    """启动新的Gemini聊天会话，可选传入历史消息用于恢复上下文"""
     if not is_gemini_configured():
         return None
-    return CONVERSATION_MODEL.start_chat(history=[])
+    return CONVERSATION_MODEL.start_chat(history=history or [])
 
 def get_gemini_config() -> dict:
     """获取当前Gemini配置（隐藏敏感信息）"""
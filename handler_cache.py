@@ -0,0 +1,182 @@
+"""
+Bounded cache for ConversationHandler instances
+对话处理器缓存：按 LRU + 空闲超时 + 内存上限淘汰
+"""
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from runtime_config import env_int
+
+
+class HandlerCache:
+    """
+    ConversationHandler 的有界缓存
+
+    - max_handlers: 最多保留的处理器数量（LRU 淘汰）
+    - ttl_seconds: 空闲超过该时长的处理器会被淘汰
+    - max_memory_bytes: 所有处理器估算内存之和的上限
+
+    每个处理器的估算大小在放入和 refresh_size 时计算一次并维护总和，
+    插入新处理器不会重新估算其他处理器。
+
+    被淘汰的处理器不会丢失数据：critique、角色档案和消息都已持久化，
+    会话再次活跃时由 SessionManager 重新构建。
+    """
+
+    def __init__(
+        self,
+        max_handlers: int = 200,
+        ttl_seconds: int = 1800,
+        max_memory_bytes: int = 64 * 1024 * 1024
+    ):
+        self.max_handlers = max_handlers
+        self.ttl_seconds = ttl_seconds
+        self.max_memory_bytes = max_memory_bytes
+
+        self._entries: "OrderedDict[str, Any]" = OrderedDict()
+        self._last_used: Dict[str, float] = {}
+        self._sizes: Dict[str, int] = {}
+        self._total_bytes = 0
+        self._lock = threading.RLock()
+
+        self.metrics = {
+            "hits": 0,
+            "misses": 0,
+            "evictions_lru": 0,
+            "evictions_ttl": 0,
+            "evictions_memory": 0,
+            "rehydrations": 0,
+        }
+
+    @classmethod
+    def from_env(cls) -> "HandlerCache":
+        """根据环境变量创建缓存"""
+        return cls(
+            max_handlers=env_int("EASYPROMPT_MAX_HANDLERS", 200),
+            ttl_seconds=env_int("EASYPROMPT_HANDLER_TTL", 1800),
+            max_memory_bytes=env_int("EASYPROMPT_HANDLER_MEMORY_MB", 64) * 1024 * 1024,
+        )
+
+    def __contains__(self, session_id: str) -> bool:
+        with self._lock:
+            return session_id in self._entries
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def get(self, session_id: str, default: Any = None) -> Any:
+        """获取处理器并刷新其使用时间，过期的条目视为不存在"""
+        with self._lock:
+            self.evict_idle()
+            handler = self._entries.get(session_id)
+            if handler is None:
+                self.metrics["misses"] += 1
+                return default
+            self._entries.move_to_end(session_id)
+            self._last_used[session_id] = time.monotonic()
+            self.metrics["hits"] += 1
+            return handler
+
+    def put(self, session_id: str, handler: Any):
+        """放入处理器，并按数量和内存上限淘汰最久未使用的条目"""
+        with self._lock:
+            self._entries[session_id] = handler
+            self._entries.move_to_end(session_id)
+            self._last_used[session_id] = time.monotonic()
+            self._set_size(session_id, self._estimate_handler_bytes(handler))
+            self.evict_idle()
+            self._enforce_limits(protect=session_id)
+
+    def refresh_size(self, session_id: str) -> int:
+        """处理器状态变化后（如一轮对话结束）重新估算它的大小，必要时按内存上限淘汰其他条目"""
+        with self._lock:
+            handler = self._entries.get(session_id)
+            if handler is None:
+                return 0
+            size = self._estimate_handler_bytes(handler)
+            self._set_size(session_id, size)
+            self._enforce_limits(protect=session_id)
+            return size
+
+    def _set_size(self, session_id: str, size: int):
+        self._total_bytes += size - self._sizes.get(session_id, 0)
+        self._sizes[session_id] = size
+
+    # 兼容字典写法
+    __setitem__ = put
+
+    def pop(self, session_id: str, default: Any = None) -> Any:
+        with self._lock:
+            self._last_used.pop(session_id, None)
+            self._total_bytes -= self._sizes.pop(session_id, 0)
+            return self._entries.pop(session_id, default)
+
+    def record_rehydration(self):
+        with self._lock:
+            self.metrics["rehydrations"] += 1
+
+    def evict_idle(self) -> int:
+        """淘汰所有空闲超时的处理器，返回淘汰数量"""
+        if self.ttl_seconds <= 0:
+            return 0
+        with self._lock:
+            deadline = time.monotonic() - self.ttl_seconds
+            expired = [sid for sid, used in self._last_used.items() if used < deadline]
+            for session_id in expired:
+                self._evict(session_id, "evictions_ttl")
+            return len(expired)
+
+    def _enforce_limits(self, protect: Optional[str] = None):
+        while len(self._entries) > max(1, self.max_handlers):
+            if not self._evict_oldest("evictions_lru", protect):
+                break
+
+        if self.max_memory_bytes <= 0:
+            return
+        while self._total_bytes > self.max_memory_bytes:
+            if not self._evict_oldest("evictions_memory", protect):
+                break
+
+    def _evict_oldest(self, reason: str, protect: Optional[str]) -> bool:
+        for session_id in self._entries:
+            if session_id != protect:
+                self._evict(session_id, reason)
+                return True
+        return False
+
+    def _evict(self, session_id: str, reason: str):
+        self._entries.pop(session_id, None)
+        self._last_used.pop(session_id, None)
+        self._total_bytes -= self._sizes.pop(session_id, 0)
+        self.metrics[reason] += 1
+        print(f"淘汰对话处理器: {session_id} ({reason})")
+
+    @staticmethod
+    def _estimate_handler_bytes(handler: Any) -> int:
+        estimate = getattr(handler, "estimate_memory_bytes", None)
+        if callable(estimate):
+            try:
+                return int(estimate())
+            except Exception:
+                return 0
+        return 0
+
+    def estimated_memory_bytes(self) -> int:
+        """各处理器最近一次估算大小之和（不重新估算）"""
+        with self._lock:
+            return self._total_bytes
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """返回缓存状态和淘汰统计"""
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_handlers": self.max_handlers,
+                "ttl_seconds": self.ttl_seconds,
+                "estimated_memory_bytes": self.estimated_memory_bytes(),
+                "max_memory_bytes": self.max_memory_bytes,
+                **self.metrics,
+            }
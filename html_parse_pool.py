@@ -0,0 +1,152 @@
+"""
+Optional process-pool HTML parsing
+网页解析（编码检测、BeautifulSoup 建树、正文提取与清理）是 CPU 密集且持有 GIL 的工作；
+并发抓取多个网页时会和事件循环、流式输出线程争抢 GIL。开启后把原始 HTML 字节交给
+工作进程解析，只把提取结果（title / description / content / keywords）传回来。
+
+- 开关：EASYPROMPT_PARSE_PROCESSES（默认 0：在抓取线程中解析；>0：工作进程数）
+- 工作进程用 spawn 启动（Windows 与 Linux 行为一致，不会 fork 带着线程和连接的服务进程），
+  启动时预先导入 lxml / bs4 / web_scraper，第一次解析不再承担导入开销
+- 单次解析最长等待 EASYPROMPT_PARSE_TIMEOUT 秒（默认 10，且不超过本轮剩余预算）
+- 工作进程异常退出时重建进程池，本次改为在当前线程解析
+"""
+import multiprocessing
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Deque, Dict, Optional
+
+from runtime_config import env_float, env_int
+from turn_deadline import TurnDeadline
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+# --- 统计 ---
+
+_metrics_lock = threading.Lock()
+parse_metrics: Dict[str, Any] = {
+    "parsed_inline": 0,
+    "parsed_in_pool": 0,
+    "pool_timeouts": 0,
+    "pool_failures": 0,
+}
+_parse_ms: Deque[float] = deque(maxlen=500)
+
+
+def _record(key: str, elapsed_ms: Optional[float] = None):
+    with _metrics_lock:
+        parse_metrics[key] += 1
+        if elapsed_ms is not None:
+            _parse_ms.append(elapsed_ms)
+
+
+def get_parse_metrics() -> Dict[str, Any]:
+    """解析方式计数、进程池超时/故障次数与解析耗时分位数"""
+    with _metrics_lock:
+        metrics = dict(parse_metrics)
+        durations = sorted(_parse_ms)
+    metrics["processes"] = env_int("EASYPROMPT_PARSE_PROCESSES", 0)
+    metrics["pool_running"] = _pool is not None
+    metrics["parse_ms"] = {
+        "p50": round(durations[int(0.5 * (len(durations) - 1))], 1) if durations else 0.0,
+        "p95": round(durations[int(0.95 * (len(durations) - 1))], 1) if durations else 0.0,
+    }
+    return metrics
+
+
+# --- 工作进程 ---
+
+def _init_worker():
+    """工作进程启动时预先导入解析依赖"""
+    import bs4  # noqa: F401
+    try:
+        import lxml.etree  # noqa: F401
+    except ImportError:
+        pass
+    import web_scraper  # noqa: F401
+
+
+def _parse_in_worker(raw: bytes, url: str, content_type: str) -> Dict[str, Any]:
+    from web_scraper import parse_page
+    return parse_page(raw, url, content_type)
+
+
+def _warm_up():
+    return None
+
+
+def start_parse_pool(processes: Optional[int] = None) -> Optional[ProcessPoolExecutor]:
+    """按配置启动进程池（未开启时返回 None）；服务启动时调用，避免第一次抓取等待进程启动"""
+    global _pool
+    processes = env_int("EASYPROMPT_PARSE_PROCESSES", 0) if processes is None else processes
+    if processes <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=processes,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+            )
+            # 提交空任务让所有工作进程完成启动和预导入
+            for future in [_pool.submit(_warm_up) for _ in range(processes)]:
+                future.result()
+            print(f"🧵 网页解析进程池已启动（{processes} 个工作进程）")
+        return _pool
+
+
+def shutdown_parse_pool():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _discard_pool(pool: ProcessPoolExecutor):
+    """工作进程异常退出：丢弃进程池，下次解析时重建"""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def parse_html(raw: bytes, url: str, content_type: str = "",
+               deadline: Optional[TurnDeadline] = None) -> Dict[str, Any]:
+    """
+    解析抓取到的网页，返回 title / description / content / keywords
+
+    开启进程池时在工作进程中解析；超时抛出 TimeoutError，进程池故障时退回当前线程解析
+    """
+    from web_scraper import parse_page
+
+    started = time.monotonic()
+    pool = start_parse_pool()
+    if pool is None:
+        page = parse_page(raw, url, content_type)
+        _record("parsed_inline", (time.monotonic() - started) * 1000)
+        return page
+
+    timeout = env_float("EASYPROMPT_PARSE_TIMEOUT", 10.0)
+    if deadline is not None:
+        timeout = deadline.timeout(timeout)
+    try:
+        future = pool.submit(_parse_in_worker, raw, url, content_type)
+        page = future.result(timeout=timeout)
+    except FutureTimeoutError:
+        future.cancel()
+        _record("pool_timeouts")
+        raise TimeoutError(f"网页解析超过 {timeout:.1f}s")
+    except BrokenProcessPool as exc:
+        print(f"⚠️ 网页解析进程池异常，改为在当前线程解析: {exc}")
+        _record("pool_failures")
+        _discard_pool(pool)
+        page = parse_page(raw, url, content_type)
+        _record("parsed_inline", (time.monotonic() - started) * 1000)
+        return page
+    _record("parsed_in_pool", (time.monotonic() - started) * 1000)
+    return page
@@ -0,0 +1,138 @@
+"""
+Incremental JSON object parser
+增量 JSON 解析器：边接收流式文本边解析顶层对象，每个字段的值一闭合就立即产出
+
+用于评估模型的流式输出：is_ready_for_writing、evaluation_score、critique
+等字段不必等整个 JSON 结束即可推送给前端。开头的 ```json 代码块标记等
+第一个 `{` 之前的内容会被忽略。
+"""
+import json
+from typing import Any, Dict, List, Tuple
+
+_WHITESPACE = " \t\r\n"
+
+
+class IncrementalJSONParser:
+    """
+    流式解析单个顶层 JSON 对象
+
+    feed(text) 返回本次新闭合的 [(字段名, 值), ...]；
+    已解析的字段累积在 fields 中，done 表示顶层对象已结束。
+    """
+
+    def __init__(self):
+        self.fields: Dict[str, Any] = {}
+        self.done = False
+        self.errors = 0
+
+        self._buf = ""
+        self._pos = 0
+        self._started = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = -1
+        # 顶层状态: key / colon / value / scalar / nested / after_value
+        self._expect = "key"
+        self._key = None
+        self._value_start = -1
+
+    def feed(self, text: str) -> List[Tuple[str, Any]]:
+        emitted: List[Tuple[str, Any]] = []
+        self._buf += text or ""
+        buf = self._buf
+        while self._pos < len(buf) and not self.done:
+            i = self._pos
+            ch = buf[i]
+            self._pos += 1
+
+            if not self._started:
+                if ch == "{":
+                    self._started = True
+                    self._depth = 1
+                continue
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        self._close_top_level_string(i, emitted)
+                continue
+
+            if self._expect == "nested":
+                if ch == '"':
+                    self._in_string = True
+                elif ch in "{[":
+                    self._depth += 1
+                elif ch in "}]":
+                    self._depth -= 1
+                    if self._depth == 1:
+                        self._emit(buf[self._value_start:i + 1], emitted)
+                        self._expect = "after_value"
+                continue
+
+            if self._expect == "scalar":
+                if ch in _WHITESPACE or ch in ",}":
+                    self._emit(buf[self._value_start:i], emitted)
+                    self._expect = "after_value"
+                    self._after_value(ch)
+                continue
+
+            if ch in _WHITESPACE:
+                continue
+
+            if self._expect == "key":
+                if ch == '"':
+                    self._in_string = True
+                    self._string_start = i
+                elif ch == "}":
+                    self.done = True
+            elif self._expect == "colon":
+                if ch == ":":
+                    self._expect = "value"
+            elif self._expect == "value":
+                self._value_start = i
+                if ch == '"':
+                    self._in_string = True
+                    self._string_start = i
+                elif ch in "{[":
+                    self._depth += 1
+                    self._expect = "nested"
+                else:
+                    self._expect = "scalar"
+            elif self._expect == "after_value":
+                self._after_value(ch)
+        return emitted
+
+    def _after_value(self, ch: str):
+        if ch == ",":
+            self._expect = "key"
+        elif ch == "}":
+            self.done = True
+
+    def _close_top_level_string(self, end: int, emitted: List[Tuple[str, Any]]):
+        literal = self._buf[self._string_start:end + 1]
+        if self._expect == "key":
+            try:
+                self._key = json.loads(literal)
+            except ValueError:
+                self._key = literal.strip('"')
+            self._expect = "colon"
+        else:
+            self._emit(literal, emitted)
+            self._expect = "after_value"
+
+    def _emit(self, literal: str, emitted: List[Tuple[str, Any]]):
+        try:
+            value = json.loads(literal)
+        except ValueError:
+            self.errors += 1
+            return
+        if self._key is not None:
+            self.fields[self._key] = value
+            emitted.append((self._key, value))
+        self._key = None
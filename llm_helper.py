@@ -4,22 +4,30 @@ and OpenAI-compatible APIs (OpenAI, Claude, DeepSeek, etc.)
 """
 import os
 import json
+import asyncio
+import contextvars
 from language_manager import lang_manager
 from openai_helper import (
     init_openai_llm, is_openai_configured,
     get_openai_conversation_response_stream,
     evaluate_openai_profile,
+    evaluate_openai_profile_stream,
     write_openai_final_prompt_stream,
-    run_openai_structured_prompt
+    run_openai_structured_prompt,
+    openai_task_host
 )
 from gemini_helper import (
     init_gemini_llm, is_gemini_configured,
     get_gemini_conversation_response_stream,
     evaluate_gemini_profile,
+    evaluate_gemini_profile_stream,
     write_gemini_final_prompt_stream,
     start_gemini_chat_session,
-    run_gemini_structured_prompt
+    run_gemini_structured_prompt,
+    write_gemini_final_prompt_stream_async,
+    GEMINI_HOST
 )
+from circuit_breaker import get_breaker
 
 # --- API Type Configuration ---
 # 移除全局状态，改为每个连接独立的配置管理
@@ -50,7 +58,9 @@ def init_llm(nsfw_mode: bool = False, api_type: str = "openai", **kwargs):
                 model=kwargs["model"],
                 temperature=kwargs.get("temperature", 0.7),
                 max_tokens=kwargs.get("max_tokens", 4000),
-                nsfw_mode=nsfw_mode
+                nsfw_mode=nsfw_mode,
+                task_models=kwargs.get("task_models"),
+                evaluator_model=kwargs.get("evaluator_model")
             )
             print(f"OpenAI兼容API已初始化: {kwargs['model']} (R18: {'开启' if nsfw_mode else '关闭'})")
             return True
@@ -72,7 +82,8 @@ def init_llm(nsfw_mode: bool = False, api_type: str = "openai", **kwargs):
                 model=kwargs["model"],
                 evaluator_model=kwargs.get("evaluator_model"),
                 temperature=kwargs.get("temperature", 0.7),
-                nsfw_mode=nsfw_mode
+                nsfw_mode=nsfw_mode,
+                task_models=kwargs.get("task_models")
             )
             chat_session = None  # Reset chat session
             print(f"Gemini API已初始化: {kwargs['model']} (R18: {'开启' if nsfw_mode else '关闭'})")
@@ -85,21 +96,28 @@ def init_llm(nsfw_mode: bool = False, api_type: str = "openai", **kwargs):
         print(f"不支持的API类型: {api_type}")
         return False
 
-def get_conversation_response_stream(chat_session, user_message: str, critique: str):
+def get_conversation_response_stream(chat_session, user_message: str, critique: str, memory=None):
     """
     Gets a streaming response from the conversation model, guided by a critique.
     Supports both Gemini and OpenAI-compatible APIs.
+
+    `memory` (ConversationMemory) supplies the bounded, prefix-stable history for
+    both providers and receives the provider-reported token usage. The caller
+    records the finished turn with `memory.add_turn`.
     """
     # 检查当前配置的API类型
     from openai_helper import is_openai_configured
     from gemini_helper import is_gemini_configured
     
+    usage_callback = memory.record_usage if memory is not None else None
+    
     if is_openai_configured():
-        # For OpenAI, use chat history instead of session
+        # For OpenAI, the history comes from the per-session conversation memory
         try:
-            # 创建临时的聊天历史
-            chat_history = []
-            stream_gen = get_openai_conversation_response_stream(chat_history, user_message, critique)
+            chat_history = memory.build_openai_history() if memory is not None else []
+            stream_gen = get_openai_conversation_response_stream(
+                chat_history, user_message, critique, usage_callback=usage_callback
+            )
             ai_response = ""
             trait = "None"
             
@@ -120,7 +138,12 @@ def get_conversation_response_stream(chat_session, user_message: str, critique:
     
     elif is_gemini_configured():
         try:
-            stream_gen = get_gemini_conversation_response_stream(chat_session, user_message, critique)
+            if memory is not None and chat_session is not None:
+                # 用有界记忆替换会话历史，避免 Gemini 历史无限增长
+                chat_session.history = memory.build_gemini_history()
+            stream_gen = get_gemini_conversation_response_stream(
+                chat_session, user_message, critique, usage_callback=usage_callback
+            )
             for chunk in stream_gen:
                 yield chunk
                 
@@ -152,6 +175,24 @@ def evaluate_profile(full_profile: str) -> dict:
     else:
         return {"is_ready_for_writing": False, "critique": lang_manager.t("ERROR_LLM_NOT_CONFIGURED")}
 
+def evaluate_profile_stream(full_profile: str):
+    """
+    Streams the diagnostic report from the evaluator model.
+    Yields (field, value) pairs as each top-level JSON field closes, then
+    ("__FINAL_RESULT__", evaluation_dict).
+    """
+    from openai_helper import is_openai_configured
+    from gemini_helper import is_gemini_configured
+    
+    if is_openai_configured():
+        yield from evaluate_openai_profile_stream(full_profile)
+    
+    elif is_gemini_configured():
+        yield from evaluate_gemini_profile_stream(full_profile)
+    
+    else:
+        yield ("__FINAL_RESULT__", {"is_ready_for_writing": False, "critique": lang_manager.t("ERROR_LLM_NOT_CONFIGURED")})
+
 def write_final_prompt_stream(full_profile: str):
     """
     Gets the final, formatted System Prompt from the writer model as a stream.
@@ -173,8 +214,12 @@ def write_final_prompt_stream(full_profile: str):
     else:
         yield lang_manager.t("ERROR_LLM_NOT_CONFIGURED")
 
-def start_chat_session():
-    """Starts a new chat session with the conversation model."""
+def start_chat_session(history: list = None):
+    """
+    Starts a new chat session with the conversation model.
+    `history` optionally seeds the session with earlier turns
+    ([{"role": "user"|"model", "parts": [text]}]).
+    """
     from openai_helper import is_openai_configured
     from gemini_helper import is_gemini_configured, start_gemini_chat_session
     
@@ -184,7 +229,7 @@ def start_chat_session():
     
     elif is_gemini_configured():
         # Start Gemini chat session
-        return start_gemini_chat_session()
+        return start_gemini_chat_session(history)
     
     else:
         return None
@@ -209,15 +254,71 @@ def get_current_api_type() -> str:
     else:
         return "none"
 
+def llm_unavailable_reason(task: str = "conversation"):
+    """
+    Return a reason string when the endpoint `task` is routed to sits behind an
+    open circuit breaker (callers skip optional LLM stages); otherwise None.
+    """
+    api_type = get_current_api_type()
+    if api_type == "openai":
+        host = openai_task_host(task)
+    elif api_type == "gemini":
+        host = GEMINI_HOST
+    else:
+        return None
+    breaker = get_breaker(host)
+    if breaker.is_open():
+        return f"{host} 连续失败，已熔断（约 {breaker.retry_in():.0f}s 后重试）"
+    return None
+
 def reset_chat_history():
     """Reset chat history for OpenAI sessions - 不再需要，因为不再使用全局状态"""
     pass
 
-def run_structured_prompt(system_prompt: str, user_prompt: str) -> str:
-    """Run a lightweight structured prompt with whichever API is configured."""
+def run_structured_prompt(system_prompt: str, user_prompt: str, task: str = None) -> str:
+    """
+    Run a lightweight structured prompt with whichever API is configured.
+    `task` ("planner", "evaluator") selects the JSON schema requested from the provider.
+    """
     api_type = get_current_api_type()
     if api_type == "openai":
-        return run_openai_structured_prompt(system_prompt, user_prompt)
+        return run_openai_structured_prompt(system_prompt, user_prompt, task=task)
     if api_type == "gemini":
-        return run_gemini_structured_prompt(system_prompt, user_prompt)
-    raise ValueError("LLM未配置，无法运行结构化提示")
\ No newline at end of file
+        return run_gemini_structured_prompt(system_prompt, user_prompt, task=task)
+    raise ValueError("LLM未配置，无法运行结构化提示")
+
+# --- Async variants ---
+# 对话、评估、规划会与抓取、搜索一起在 ConversationHandler 的同步生成器中执行，
+# 由 iterate_in_thread 放到线程池中逐块迭代。只有最终提示词的写作是独立的一步：
+# Gemini 使用 SDK 的原生异步接口，OpenAI 兼容路径（同步 httpx）同样放到线程池中。
+# 因此每个进行中的对话轮次（含随后的评估）在流式输出期间占用一个线程池工作线程；
+# 对话与评估改用原生异步接口需要先把 handle_message 与 ProfileEvaluator 的
+# 档案读写、搜索、抓取一并改为异步，单换模型调用并不能释放这个线程。
+
+_ITERATION_DONE = object()
+
+async def iterate_in_thread(generator):
+    """
+    在线程池中逐个取出同步生成器的元素，作为异步生成器产出
+    调用方的 contextvars（如上游限流器的当前用户）会带入工作线程
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    while True:
+        item = await loop.run_in_executor(None, context.run, next, generator, _ITERATION_DONE)
+        if item is _ITERATION_DONE:
+            return
+        yield item
+
+def _use_gemini_async() -> bool:
+    # 与同步版本的分派顺序一致：OpenAI 已配置时优先 OpenAI
+    return not is_openai_configured() and is_gemini_configured()
+
+async def write_final_prompt_stream_async(full_profile: str):
+    """Async variant of write_final_prompt_stream."""
+    if _use_gemini_async():
+        async for chunk in write_gemini_final_prompt_stream_async(full_profile):
+            yield chunk
+        return
+    async for chunk in iterate_in_thread(write_final_prompt_stream(full_profile)):
+        yield chunk
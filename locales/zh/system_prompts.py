@@ -388,8 +388,8 @@ def get_evaluator_system_prompt(nsfw_mode: bool = False) -> str:
 **输出要求:**
 你必须返回一个详细的JSON对象，包含：
 - is_ready_for_writing: 布尔值，是否准备好生成最终指南
-- critique: 简洁的评估意见，指出需要补充的方面或确认已完整
 - evaluation_score: 数字(1-10)，角色完整度评分
+- critique: 简洁的评估意见，指出需要补充的方面或确认已完整
 - extracted_traits: 数组，从输入中提取出的所有角色特征
 - extracted_keywords: 数组，相关的关键词标签
 - completeness_breakdown: 对象，各个方面的具体统计
@@ -398,8 +398,8 @@ def get_evaluator_system_prompt(nsfw_mode: bool = False) -> str:
 **输出格式:**
 {
   "is_ready_for_writing": <true/false>,
-  "critique": "<评估意见>",
   "evaluation_score": <1-10>,
+  "critique": "<评估意见>",
   "extracted_traits": ["特征1", "特征2", ...],
   "extracted_keywords": ["关键词1", "关键词2", ...],
   "completeness_breakdown": {
@@ -410,6 +410,7 @@ def get_evaluator_system_prompt(nsfw_mode: bool = False) -> str:
   },
   "suggestions": ["建议1", "建议2", ...]
 }
+请严格按上述字段顺序输出。
 """
     
     if nsfw_mode:
@@ -425,6 +426,19 @@ def get_evaluator_system_prompt(nsfw_mode: bool = False) -> str:
     
     return base_prompt
 
+def get_evaluator_delta_input(previous_evaluation: str, new_traits: str) -> str:
+    """增量评估的用户输入：上一次评估结果 + 之后新增/更新的特征（系统提示词与全量评估相同）"""
+    return f"""【增量评估】
+以下是上一次对该角色的评估结果（JSON）：
+{previous_evaluation}
+
+自上一次评估以来新增或更新的角色特征：
+{new_traits}
+
+请在上一次评估的基础上，结合新增特征输出更新后的评估 JSON（格式与要求不变）。
+上一次结果中省略了已提取的特征和关键词：extracted_traits 与 extracted_keywords 只需列出本次新增的内容。
+"""
+
 def get_writer_system_prompt(nsfw_mode: bool = False) -> str:
     """根据R18模式获取写作系统提示词"""
     base_prompt = """
@@ -3,8 +3,12 @@ import json
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends
 from fastapi.middleware.cors import CORSMiddleware
 from conversation_handler import ConversationHandler
+from conversation_memory import get_conversation_metrics
+from profile_evaluator import get_evaluation_metrics
 from profile_manager import ProfileManager
-from evaluator_service import EvaluatorService
+from structured_output import get_structured_output_metrics
+from upstream_limiter import current_upstream_user, get_upstream_metrics
+from html_parse_pool import shutdown_parse_pool, start_parse_pool
 from language_manager import lang_manager
 import llm_helper
 import os
@@ -36,7 +40,8 @@ async def lifespan(app: FastAPI):
             with open(os.path.join(env_dir, f), 'r', encoding='utf-8') as file:
                 os.environ[f] = file.read().strip()
     
-    evaluator_service.start()
+    # 开启 EASYPROMPT_PARSE_PROCESSES 时预先启动网页解析进程
+    await asyncio.to_thread(start_parse_pool)
     try:
         # If server already has a configured global LLM (from REST /api/config), allow the socket to proceed
         try:
@@ -47,7 +52,7 @@ async def lifespan(app: FastAPI):
             _is_gemini_configured = lambda: False
         yield
     finally:
-        evaluator_service.stop()
+        shutdown_parse_pool()
 
 app = FastAPI(
     title="Easy-Prompt API",
@@ -73,7 +78,7 @@ app.include_router(session_router)
 async def set_api_config(api_config: ApiConfig, session_id: Optional[str] = None):
     """Allow frontend to POST ApiConfig (so users can enter API key/model in the UI)
 
-    Optional query param `session_id` will persist the config to that session's metadata.
+    Optional query param `session_id` will persist the config to that session's record.
     The route attempts to initialize the configured LLM and returns success/failure.
     """
     # sanitize string fields
@@ -104,12 +109,14 @@ async def set_api_config(api_config: ApiConfig, session_id: Optional[str] = None
     # Try to initialize API (reuse existing initialize_api path)
     ok = initialize_api(config)
     if ok:
-        # Persist to session metadata if provided
+        # Persist to the session record if provided
         if session_id:
             try:
-                from profile_manager import ProfileManager
-                pm = ProfileManager(session_id=session_id)
-                pm.update_session_metadata({"api_config": config, "api_type": config.get("api_type", "unknown")})
+                from session_manager import session_manager as _session_manager
+                await _session_manager.update_session_state(
+                    session_id,
+                    {"api_config": config, "api_type": config.get("api_type", "unknown")}
+                )
             except Exception as e:
                 print(f"Warning: unable to persist api_config to session {session_id}: {e}")
 
@@ -117,7 +124,21 @@ async def set_api_config(api_config: ApiConfig, session_id: Optional[str] = None
     else:
         return {"success": False, "message": "API初始化失败，请检查配置参数"}
 
-evaluator_service = EvaluatorService()
+async def save_ai_reply(session_manager: SessionManager, session_id: str, handler: ConversationHandler):
+    """
+    Persists the AI reply of the turn that just finished, so a handler rebuilt
+    after eviction restores the user/AI history (no-op if already saved).
+    """
+    ai_response = handler.take_ai_response()
+    if not ai_response:
+        return
+    ai_message = ChatMessage(
+        id=f"msg_{int(asyncio.get_event_loop().time() * 1000)}_ai",
+        type=MessageType.AI,
+        content=ai_response,
+        is_complete=True
+    )
+    await session_manager.add_message_to_session(session_id, ai_message)
 
 async def send_json(websocket: WebSocket, message_type: str, payload: dict):
     """Utility to send a structured JSON message."""
@@ -142,7 +163,8 @@ def get_empty_api_config() -> dict:
         "evaluator_model": "",
         "temperature": 0.7,
         "max_tokens": 4000,
-        "nsfw_mode": False
+        "nsfw_mode": False,
+        "task_models": {}
     }
 
 
@@ -170,6 +192,8 @@ def initialize_api(api_config: dict) -> bool:
                     model=model,
                     temperature=temperature,
                     max_tokens=max_tokens,
+                    evaluator_model=api_config.get("evaluator_model") or None,
+                    task_models=api_config.get("task_models"),
                 )
             elif api_config.get("api_type") == "gemini":
                 api_key = api_config.get("api_key", "")
@@ -188,6 +212,7 @@ def initialize_api(api_config: dict) -> bool:
                     model=model,
                     evaluator_model=evaluator_model if evaluator_model else None,
                     temperature=temperature,
+                    task_models=api_config.get("task_models"),
                 )
             else:
                 print(f"不支持的API类型: {api_config.get('api_type')}")
@@ -287,8 +312,10 @@ async def websocket_endpoint(
                         "success": True,
                         "message": f"API已重新配置: {current_api_config['api_type']}"
                     })
-                    # Reset handler with new API
-                    handler = session_manager.create_handler(session_id)
+                    # Drop the cached handler; it is rebuilt with the new API on the next message
+                    if session_id:
+                        session_manager.remove_handler(session_id)
+                    handler = None
                 else:
                     await send_json(websocket, "api_config_result", {
                         "success": False,
@@ -300,9 +327,10 @@ async def websocket_endpoint(
                 if not session_id:
                     try:
                         session = await session_manager.create_session()
-                        handler = session_manager.get_handler(session.id)
                         session_id = session.id
                         print(f"收到用户第一条消息，创建session: {session_id}")
+                        # 上游并发准入按会话做同级公平调度
+                        current_upstream_user.set(session.user_id or session_id)
                     except Exception as e:
                         print(f"创建session失败: {e}")
                         await send_json(websocket, "error", {
@@ -310,6 +338,9 @@ async def websocket_endpoint(
                         })
                         continue
                 
+                # 获取对话处理器（首次或被淘汰后从持久化状态重建），需在写入本轮消息前获取
+                handler = await session_manager.get_or_create_handler(session_id)
+                
                 # 添加用户消息到session
                 user_message = ChatMessage(
                     id=f"msg_{int(asyncio.get_event_loop().time() * 1000)}",
@@ -319,40 +350,73 @@ async def websocket_endpoint(
                 )
                 await session_manager.add_message_to_session(session_id, user_message)
                 
-                response_generator = handler.handle_message(payload.get("answer", ""))
+                # 同步的处理流程（抓取、搜索、对话模型）在线程池中逐块迭代，不阻塞事件循环
+                response_generator = llm_helper.iterate_in_thread(handler.handle_message(payload.get("answer", "")))
 
-                for chunk in response_generator:
+                async for chunk in response_generator:
                     if chunk.startswith("CONFIRM_GENERATION::"):
                         reason = chunk.split("::", 1)[1]
                         await send_json(websocket, "confirmation_request", {"reason": reason})
+                    elif chunk.startswith("TRAIT_UPDATE::"):
+                        trait = json.loads(chunk.split("::", 1)[1])
+                        await send_json(websocket, "trait_update", trait)
                     elif chunk.startswith("EVALUATION_TRIGGER::"):
                         evaluation_message = chunk.split("::", 1)[1]
-                        await send_json(websocket, "evaluation_update", {"message": evaluation_message})
+                        # 回复已完整生成：先写入会话，评估耗时较长，断开连接也不丢失本轮回复
+                        await save_ai_reply(session_manager, session_id, handler)
+                        # 完整度由结构化特征在本地预评分，先推送临时结果，无需等待评估模型
+                        estimate = handler.profile_manager.get_completeness_estimate()
+                        local_breakdown = estimate["completeness_breakdown"]
+                        await send_json(websocket, "evaluation_update", {
+                            "message": evaluation_message,
+                            "evaluation_score": estimate["estimated_score"],
+                            "completeness_breakdown": local_breakdown,
+                            "provisional": True
+                        })
 
                         # 执行实际的评估逻辑
                         try:
-                            full_profile = handler.profile_manager.get_full_profile()
+                            full_profile = handler.profile_manager.get_compact_profile()
                             if full_profile:
-                                from llm_helper import evaluate_profile
-                                evaluation_result = evaluate_profile(full_profile)
+                                evaluation_result = None
+                                async for kind, fields in llm_helper.iterate_in_thread(handler.evaluate_profile_stream()):
+                                    if kind == "final":
+                                        evaluation_result = fields
+                                        continue
+                                    # 评估字段一闭合就推送（评分、是否就绪、评估意见最先到达）
+                                    partial_update = {
+                                        "message": f"[评估中] {fields['critique']}" if "critique" in fields else evaluation_message,
+                                        "partial": True
+                                    }
+                                    if "evaluation_score" in fields:
+                                        partial_update["evaluation_score"] = fields["evaluation_score"]
+                                    if "is_ready_for_writing" in fields:
+                                        partial_update["is_ready"] = fields["is_ready_for_writing"]
+                                    for key in ("extracted_traits", "extracted_keywords", "suggestions"):
+                                        if key in fields:
+                                            partial_update[key] = fields[key]
+                                    await send_json(websocket, "evaluation_update", partial_update)
                                 if evaluation_result:
                                     critique = evaluation_result.get("critique", "")
                                     extracted_traits = evaluation_result.get("extracted_traits", [])
                                     extracted_keywords = evaluation_result.get("extracted_keywords", [])
                                     evaluation_score = evaluation_result.get("evaluation_score")
-                                    completeness_breakdown = evaluation_result.get("completeness_breakdown", {})
+                                    completeness_breakdown = evaluation_result.get("completeness_breakdown") or local_breakdown
                                     suggestions = evaluation_result.get("suggestions", [])
                                     is_ready = evaluation_result.get("is_ready_for_writing", False)
+                                    provisional = evaluation_result.get("provisional", False)
+                                    status = "[初步评估]" if provisional else "[评估完成]"
 
                                     # 发送完整的评估结果
                                     await send_json(websocket, "evaluation_update", {
-                                        "message": f"[评估完成] {critique}",
+                                        "message": f"{status} {critique}",
                                         "extracted_traits": extracted_traits,
                                         "extracted_keywords": extracted_keywords,
                                         "evaluation_score": evaluation_score,
                                         "completeness_breakdown": completeness_breakdown,
                                         "suggestions": suggestions,
-                                        "is_ready": is_ready
+                                        "is_ready": is_ready,
+                                        "provisional": provisional
                                     })
                                 else:
                                     await send_json(websocket, "evaluation_update", {"message": "[评估服务] 评估失败"})
@@ -364,16 +428,18 @@ async def websocket_endpoint(
 
                     else:
                         await send_json(websocket, "ai_response_chunk", {"chunk": chunk})
+                await save_ai_reply(session_manager, session_id, handler)
 
             elif message_type == "user_confirmation":
-                if not session_id or not handler:
+                if not session_id:
                     await send_json(websocket, "error", {"message": "会话未初始化，请先发送消息"})
                     continue
+                handler = await session_manager.get_or_create_handler(session_id)
                     
                 if payload.get("confirm", False):
                     await send_json(websocket, "system_message", {"message": lang_manager.t("AI_PROMPT")})
-                    final_prompt_stream = handler.finalize_prompt()
-                    for chunk in final_prompt_stream:
+                    final_prompt_stream = handler.finalize_prompt_async()
+                    async for chunk in final_prompt_stream:
                         if chunk == "::FINAL_PROMPT_END::":
                             break
                         await send_json(websocket, "final_prompt_chunk", {"chunk": chunk})
@@ -392,14 +458,15 @@ async def websocket_endpoint(
                     await send_json(websocket, "ai_response_chunk", {"chunk": lang_manager.t('CONTINUE_PROMPT')})
             
             elif message_type == "generate_prompt":
-                if not session_id or not handler:
+                if not session_id:
                     await send_json(websocket, "error", {"message": "会话未初始化，请先发送消息"})
                     continue
+                handler = await session_manager.get_or_create_handler(session_id)
                     
                 # 新增：用户随时请求生成提示词
                 await send_json(websocket, "system_message", {"message": "正在生成最终提示词..."})
-                final_prompt_stream = handler.finalize_prompt()
-                for chunk in final_prompt_stream:
+                final_prompt_stream = handler.finalize_prompt_async()
+                async for chunk in final_prompt_stream:
                     if chunk == "::FINAL_PROMPT_END::":
                         break
                     await send_json(websocket, "final_prompt_chunk", {"chunk": chunk})
@@ -456,6 +523,99 @@ async def get_api_status():
 
 
 
+@app.get("/api/debug/handlers")
+async def debug_handlers(session_manager: SessionManager = Depends(get_session_manager)):
+    """Handler cache size, memory estimate and eviction counters."""
+    return session_manager.get_handler_metrics()
+
+
+@app.get("/api/debug/conversation")
+async def debug_conversation():
+    """Prompt tokens per conversation turn and provider-reported cached tokens."""
+    return get_conversation_metrics()
+
+
+@app.get("/api/debug/evaluation")
+async def debug_evaluation():
+    """Full vs delta evaluation counts, input tokens and latency."""
+    return get_evaluation_metrics()
+
+
+@app.get("/api/debug/upstream")
+async def debug_upstream():
+    """Per-provider in-flight requests, adaptive limit, queue depth and queue-wait percentiles."""
+    return get_upstream_metrics()
+
+
+@app.get("/api/debug/turn-latency")
+async def debug_turn_latency():
+    """Time-to-first-token percentiles, SLO hit rate, per-stage latency and budget-driven skips."""
+    from turn_deadline import get_turn_metrics
+    return get_turn_metrics()
+
+
+@app.get("/api/debug/search-prefetch")
+async def debug_search_prefetch():
+    """Speculative search prefetch: planner confirmation rate, queries served early and latency saved."""
+    from search_prefetch import get_prefetch_metrics
+    return get_prefetch_metrics()
+
+
+@app.get("/api/debug/passages")
+async def debug_passages():
+    """Web passage selection: passthrough/fallback counts and share of scraped tokens injected."""
+    from passage_selector import get_passage_metrics
+    return get_passage_metrics()
+
+
+@app.get("/api/debug/web-briefs")
+async def debug_web_briefs():
+    """Per-URL web brief cache: hit rate, generated/failed/skipped counts and brief vs page token ratio."""
+    from web_brief import get_brief_metrics
+    return get_brief_metrics()
+
+
+@app.get("/api/debug/scraper-hosts")
+async def debug_scraper_hosts():
+    """Per-host scraper/search concurrency, token-bucket rate, queue-wait percentiles and robots.txt cache."""
+    from scrape_transport import get_transport_metrics
+    return get_transport_metrics()
+
+
+@app.get("/api/debug/html-parsing")
+async def debug_html_parsing():
+    """Scraped-page parsing: in-thread vs process-pool counts, pool timeouts/failures and parse latency."""
+    from html_parse_pool import get_parse_metrics
+    return get_parse_metrics()
+
+
+@app.get("/api/debug/breakers")
+async def debug_breakers():
+    """Per-host circuit breaker state (closed/open/half_open), failure and rejection counts."""
+    from circuit_breaker import get_breaker_states
+    return get_breaker_states()
+
+
+@app.get("/api/debug/llm-requests")
+async def debug_llm_requests():
+    """Retries, hedges, streaming first-byte/idle timeouts and per-task p95 latency."""
+    from resilient_request import get_request_metrics
+    return get_request_metrics()
+
+
+@app.get("/api/debug/gemini-models")
+async def debug_gemini_models():
+    """GenerativeModel instance cache hits, misses and size."""
+    from gemini_helper import get_model_cache_stats
+    return get_model_cache_stats()
+
+
+@app.get("/api/debug/structured-output")
+async def debug_structured_output():
+    """Structured output mode and per-task JSON parse/repair/failure counts."""
+    return get_structured_output_metrics()
+
+
 @app.get("/api/debug/config")
 async def debug_config():
     """Debug endpoint (local only) — returns masked configuration state without secret values.
@@ -472,6 +632,8 @@ async def debug_config():
     except Exception:
         gemini_config = None
 
+    from model_routing import describe_routing
+
     def mask_key(key: str | None) -> str | None:
         if not key:
             return None
@@ -489,14 +651,16 @@ async def debug_config():
             "configured": is_openai_configured(),
             "base_url": openai_config.get("base_url"),
             "model": openai_config.get("model"),
-            "api_key_masked": mask_key(openai_config.get("api_key"))
+            "api_key_masked": mask_key(openai_config.get("api_key")),
+            "task_routing": describe_routing(openai_config)
         }
 
     if gemini_config is not None:
         response["gemini"] = {
             "configured": is_gemini_configured(),
             "model": gemini_config.get("model"),
-            "api_key_masked": mask_key(gemini_config.get("api_key"))
+            "api_key_masked": mask_key(gemini_config.get("api_key")),
+            "task_routing": describe_routing(gemini_config)
         }
 
     return response
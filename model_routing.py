@@ -0,0 +1,77 @@
+"""
+Per-task model routing
+按任务路由模型：搜索规划、评估、对话、最终写作可以分别使用不同的模型
+
+规划和评估是延迟敏感的控制类调用，输出是短 JSON，适合交给快速的小模型；
+对话和最终写作仍使用主模型。每个任务可单独指定 model / base_url / api_key /
+temperature / max_tokens，未指定的字段一律继承对话模型的配置。
+
+优先级：ApiConfig.task_models > 环境变量 EASYPROMPT_<TASK>_MODEL > 对话模型
+"""
+from typing import Any, Dict, Optional
+
+from runtime_config import env_str
+
+TASKS = ("conversation", "planner", "evaluator", "writer")
+
+# 允许按任务覆盖的字段；Gemini 只使用 model / temperature / max_tokens
+ROUTABLE_FIELDS = ("model", "base_url", "api_key", "temperature", "max_tokens")
+
+
+def normalize_task_models(raw: Optional[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """
+    清洗前端/会话记录中的 task_models
+
+    去掉未知任务、未知字段、空字符串和 None，字符串两端去空白；
+    base_url 与 init_openai_llm 一样去掉结尾的 /。
+    """
+    normalized: Dict[str, Dict[str, Any]] = {}
+    for task, overrides in (raw or {}).items():
+        if task not in TASKS or not overrides:
+            continue
+        if hasattr(overrides, "dict"):
+            overrides = overrides.dict()
+        cleaned = {}
+        for field in ROUTABLE_FIELDS:
+            value = overrides.get(field)
+            if isinstance(value, str):
+                value = value.strip()
+                if field == "base_url":
+                    value = value.rstrip("/")
+            if value is None or value == "":
+                continue
+            cleaned[field] = value
+        if cleaned:
+            normalized[task] = cleaned
+    return normalized
+
+
+def resolve_task_config(task: str, base_config: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    返回某个任务实际使用的配置（对话模型配置 + 该任务的覆盖项）
+
+    Args:
+        task: conversation / planner / evaluator / writer
+        base_config: openai_config 或 gemini_config（含可选的 task_models）
+    """
+    resolved = {field: base_config.get(field) for field in ROUTABLE_FIELDS if field in base_config}
+    if task not in TASKS or task == "conversation":
+        overrides = (base_config.get("task_models") or {}).get("conversation", {})
+        resolved.update(overrides)
+        return resolved
+
+    env_model = env_str(f"EASYPROMPT_{task.upper()}_MODEL")
+    if env_model:
+        resolved["model"] = env_model
+    resolved.update((base_config.get("task_models") or {}).get(task, {}))
+    return resolved
+
+
+def describe_routing(base_config: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """各任务的路由结果（不含 api_key），用于日志和调试接口"""
+    routing = {}
+    for task in TASKS:
+        resolved = resolve_task_config(task, base_config)
+        resolved.pop("api_key", None)
+        routing[task] = resolved
+    return routing
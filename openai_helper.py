@@ -3,12 +3,29 @@ OpenAI格式API支持模块
 支持OpenAI、Claude、DeepSeek等兼容API
 """
 import os
+import sys
 import json
 import time
+from contextlib import ExitStack
 from typing import Dict, Generator, Optional, Any
 from language_manager import lang_manager
+from profile_compactor import TraitStreamParser
+from incremental_json import IncrementalJSONParser
+from structured_output import openai_response_format, parse_structured, record_parsed
+from model_routing import describe_routing, normalize_task_models, resolve_task_config
+from upstream_limiter import UpstreamThrottledError, get_upstream_limiter, parse_retry_after
+from runtime_config import env_bool, env_float
+from circuit_breaker import CircuitOpenError, get_breaker, host_of
+from turn_deadline import stage_timeout
+from resilient_request import (
+    RETRYABLE_TASKS, StreamTimeoutError, call_with_retries, connect_timeout,
+    first_byte_timeout, idle_timeout, stream_watchdog
+)
 import httpx
 
+# 服务端可能不支持、400 时可以去掉重试的可选请求参数
+OPTIONAL_PARAMS = ("response_format", "stream_options")
+
 # --- 全局配置 ---
 openai_config = {
     "api_key": None,
@@ -17,10 +34,12 @@ openai_config = {
     "temperature": 0.7,
     "max_tokens": 4000,
     "timeout": 30,
+    "task_models": {},  # 按任务覆盖 model/base_url/api_key/temperature/max_tokens，见 model_routing
     "nsfw_mode": False  # R18内容开关
 }
 
-def init_openai_llm(api_key: str, base_url: str, model: str, temperature: float = 0.7, max_tokens: int = 4000, nsfw_mode: bool = False):
+def init_openai_llm(api_key: str, base_url: str, model: str, temperature: float = 0.7, max_tokens: int = 4000, nsfw_mode: bool = False,
+                    task_models: Optional[dict] = None, evaluator_model: Optional[str] = None):
     """
     初始化OpenAI格式的LLM配置
     
@@ -31,6 +50,8 @@ def init_openai_llm(api_key: str, base_url: str, model: str, temperature: float
         temperature: 温度参数
         max_tokens: 最大token数
         nsfw_mode: 是否启用R18内容模式
+        task_models: 可选，按任务（planner/evaluator/conversation/writer）覆盖的模型配置
+        evaluator_model: 可选，等价于 task_models["evaluator"]["model"]
     """
     global openai_config
     
@@ -39,6 +60,10 @@ def init_openai_llm(api_key: str, base_url: str, model: str, temperature: float
     base_url_clean = base_url.strip().rstrip('/') if isinstance(base_url, str) else base_url
     model_clean = model.strip() if isinstance(model, str) else model
 
+    task_models = normalize_task_models(task_models)
+    if evaluator_model and evaluator_model.strip() and "model" not in task_models.get("evaluator", {}):
+        task_models.setdefault("evaluator", {})["model"] = evaluator_model.strip()
+
     # Basic validation: ensure base_url doesn't contain control or non-printable characters
     if isinstance(base_url_clean, str) and any(ord(c) < 32 for c in base_url_clean):
         raise ValueError(f"Invalid characters in base_url: {repr(base_url)}")
@@ -49,10 +74,17 @@ def init_openai_llm(api_key: str, base_url: str, model: str, temperature: float
         "model": model_clean,
         "temperature": temperature,
         "max_tokens": max_tokens,
-        "nsfw_mode": nsfw_mode
+        "nsfw_mode": nsfw_mode,
+        "task_models": task_models,
+        # 新的服务端重新探测是否支持 response_format / stream_options
+        "response_format_unsupported": set(),
+        "stream_options_unsupported": set()
     })
     
     print(f"OpenAI兼容API已配置: {base_url_clean} -> {model_clean} (R18: {'开启' if nsfw_mode else '关闭'})")
+    for task, routed in describe_routing(openai_config).items():
+        if routed.get("model") != model_clean or routed.get("base_url") != base_url_clean:
+            print(f"  任务路由: {task} -> {routed.get('base_url')} -> {routed.get('model')}")
 
 def is_openai_configured() -> bool:
     """检查OpenAI配置是否完整"""
@@ -99,46 +131,63 @@ def _create_httpx_client():
         timeout=30.0
     )
 
-def _make_openai_request(messages: list, stream: bool = False) -> dict:
+def _make_openai_request(messages: list, stream: bool = False, response_format: Optional[dict] = None,
+                         task: str = "conversation") -> dict:
     """
-    发送OpenAI格式的API请求，带重试机制
+    发送OpenAI格式的API请求
+
+    - 评估、规划等幂等的非流式请求：可重试错误按指数退避 + 抖动重试，可选对冲
+    - 流式请求：返回真正的流式响应，首包超时与块间空闲超时分开控制
+
+    response_format: 可选的结构化输出参数；它和流式请求的 stream_options
+    都是可选参数，服务端不支持（返回 400）时去掉重试，并在本次配置期间
+    不再向该模型发送（见 _drop_optional_param）。
+    task: conversation / planner / evaluator / writer，决定使用哪个模型和端点
     """
     if not is_openai_configured():
         raise ValueError("OpenAI API未配置")
     
+    task_config = resolve_task_config(task, openai_config)
+    model = task_config["model"]
     headers = {
-        "Authorization": f"Bearer {openai_config['api_key']}",
+        "Authorization": f"Bearer {task_config['api_key']}",
         "Content-Type": "application/json; charset=utf-8",
         "User-Agent": "EasyPrompt/1.0"
     }
     
     payload = {
-        "model": openai_config["model"],
+        "model": model,
         "messages": messages,
-        "temperature": openai_config["temperature"],
-        "max_tokens": openai_config["max_tokens"],
+        "temperature": task_config["temperature"],
+        "max_tokens": task_config["max_tokens"],
         "stream": stream
     }
+    # 流式请求时要求返回 usage（含缓存命中 token）；EASYPROMPT_STREAM_USAGE=0 可整体关闭
+    if stream and env_bool("EASYPROMPT_STREAM_USAGE", True) \
+            and model not in openai_config.get("stream_options_unsupported", ()):
+        payload["stream_options"] = {"include_usage": True}
+    if response_format and model not in openai_config.get("response_format_unsupported", ()):
+        payload["response_format"] = response_format
     
     # R18模式下的特殊参数配置
     if openai_config.get("nsfw_mode", False):
         payload.update({
-            "temperature": min(openai_config["temperature"] + 0.2, 1.0),  # 增加创造性
+            "temperature": min(task_config["temperature"] + 0.2, 1.0),  # 增加创造性
             "top_p": 0.95,  # 增加多样性
             "frequency_penalty": -0.5,  # 鼓励重复性主题
             "presence_penalty": -0.3,   # 鼓励引入新概念
         })
         
         # 如果支持，添加安全过滤器禁用参数
-        if "gpt" in openai_config["model"].lower():
+        if "gpt" in model.lower():
             # OpenAI模型特定参数
             payload["moderation"] = False
-        elif "claude" in openai_config["model"].lower():
+        elif "claude" in model.lower():
             # Claude模型特定参数
             payload["disable_safety"] = True
     
     # 检查base_url是否已经包含完整路径，如果没有则添加/chat/completions
-    base_url = openai_config['base_url']
+    base_url = task_config['base_url']
     # defensive check: ensure base_url is string and trimmed
     if isinstance(base_url, str):
         base_url = base_url.strip()
@@ -149,66 +198,244 @@ def _make_openai_request(messages: list, stream: bool = False) -> dict:
     else:
         url = f"{base_url}/chat/completions"
     
-    # 使用httpx客户端
+    print(f"正在发送API请求到: {url}")
+    print(f"使用模型: {model} (任务: {task})")
+    try:
+        if stream:
+            return _open_openai_stream(url, headers, payload, task, model)
+        send = lambda: _send_openai_request(url, headers, payload, task, model)
+        if task in RETRYABLE_TASKS:
+            # 评估、规划是幂等的控制类调用：失败时退避重试，可选对冲
+            return call_with_retries(send, task)
+        return send()
+    
+    except (httpx.TimeoutException, StreamTimeoutError) as e:
+        error_msg = f"API连接超时: {base_url} - {str(e)}"
+        print(f"❌ {error_msg}")
+        raise Exception(error_msg)
+    except httpx.ConnectError as e:
+        error_msg = f"API连接错误: {base_url} - {str(e)}"
+        print(f"❌ {error_msg}")
+        raise Exception(error_msg)
+    except httpx.HTTPStatusError as e:
+        error_msg = f"API HTTP错误: {e.response.status_code} - {str(e)}"
+        print(f"❌ {error_msg}")
+        raise Exception(error_msg)
+    except CircuitOpenError as e:
+        # 熔断中快速失败：保留异常类型，调用方可据此跳过可选步骤
+        print(f"⚡ 跳过API请求: {e}")
+        raise
+    except Exception as e:
+        error_msg = f"未知错误: {str(e)}"
+        print(f"❌ {error_msg}")
+        raise Exception(error_msg)
+
+def openai_task_host(task: str) -> str:
+    """某任务路由到的端点主机（熔断器的键）"""
+    return host_of(resolve_task_config(task, openai_config).get("base_url") or "")
+
+def _request_timeout(stream: bool, task: str = "conversation") -> httpx.Timeout:
+    """
+    非流式请求沿用整体超时（openai_config["timeout"]），规划、评估还受本轮剩余预算约束
+    （见 turn_deadline）；流式请求的读超时只是兜底，首包与块间空闲超时由 stream_watchdog 分别控制
+    """
+    total = openai_config["timeout"]
+    if not stream:
+        total = stage_timeout(total, task)
+        return httpx.Timeout(total, connect=connect_timeout())
+    read_backstop = max(first_byte_timeout(total), idle_timeout()) + 5
+    return httpx.Timeout(read_backstop, connect=connect_timeout())
+
+def _log_failed_response(response, payload: dict) -> None:
+    print(f"❌ API请求失败: {response.status_code}")
+    print(f"📄 错误响应: {response.text}")
+    print(f"📋 请求头: {dict(response.headers)}")
+    print(f"📦 请求体: {json.dumps(payload, ensure_ascii=False, indent=2)}")
+
+def _send_openai_request(url: str, headers: dict, payload: dict, task: str, model: str):
+    """发送一次非流式请求（整个响应体读完后返回）；HTTP 错误抛出 httpx.HTTPStatusError"""
+    payload = dict(payload)
     with _create_httpx_client() as client:
+        # 使用httpx发送请求（经过上游并发准入）
+        response = _post_with_admission(client, url, headers, payload, task)
+        
+        if response.status_code == 400 and _drop_optional_param(payload, response.text, model):
+            response = _post_with_admission(client, url, headers, payload, task)
+        
+        # 检查响应状态
+        if response.status_code != 200:
+            _log_failed_response(response, payload)
+        
+        response.raise_for_status()
+        return response
+
+def _post_with_admission(client, url: str, headers: dict, payload: dict, task: str):
+    """
+    在上游限流器的名额内发送请求
+
+    返回 429 时把 Retry-After 交给限流器（暂停放行并降低并发上限）；
+    等待时间不超过 EASYPROMPT_MAX_RETRY_AFTER 秒（默认 30）时排队重试一次。
+    """
+    limiter = get_upstream_limiter("openai")
+    breaker = get_breaker(host_of(url))
+    max_retry_after = env_float("EASYPROMPT_MAX_RETRY_AFTER", 30.0)
+    for attempt in range(2):
         try:
-            print(f"正在发送API请求到: {url}")
-            print(f"使用模型: {openai_config['model']}")
-            
-            # 使用httpx发送请求
-            if stream:
+            # 熔断中直接失败，不进入限流器排队
+            with breaker.guard() as call, limiter.slot(task):
                 response = client.post(
-                    url, 
-                    headers=headers, 
+                    url,
+                    headers=headers,
                     json=payload,
-                    timeout=openai_config["timeout"]
+                    timeout=_request_timeout(stream=False, task=task)
                 )
-            else:
-                response = client.post(
-                    url, 
-                    headers=headers, 
-                    json=payload,
-                    timeout=openai_config["timeout"]
-                )
-            
-            # 检查响应状态
-            if response.status_code != 200:
-                print(f"❌ API请求失败: {response.status_code}")
-                print(f"📄 错误响应: {response.text}")
-                print(f"📋 请求头: {dict(response.headers)}")
-                print(f"📦 请求体: {json.dumps(payload, ensure_ascii=False, indent=2)}")
-            
-            response.raise_for_status()
-            return response
-        
-        except httpx.TimeoutException as e:
-            error_msg = f"API连接超时: {openai_config['base_url']} - {str(e)}"
-            print(f"❌ {error_msg}")
-            raise Exception(error_msg)
-        except httpx.ConnectError as e:
-            error_msg = f"API连接错误: {openai_config['base_url']} - {str(e)}"
-            print(f"❌ {error_msg}")
-            raise Exception(error_msg)
-        except httpx.HTTPStatusError as e:
-            error_msg = f"API HTTP错误: {e.response.status_code} - {str(e)}"
-            print(f"❌ {error_msg}")
-            raise Exception(error_msg)
-        except Exception as e:
-            error_msg = f"未知错误: {str(e)}"
-            print(f"❌ {error_msg}")
-            raise Exception(error_msg)
-
-def get_openai_conversation_response_stream(chat_history: list, user_message: str, critique: str):
+                call.status_code = response.status_code
+                if response.status_code == 429:
+                    raise UpstreamThrottledError(
+                        f"上游限流: {response.text[:200]}",
+                        retry_after=parse_retry_after(response.headers.get("retry-after"))
+                    )
+                return response
+        except UpstreamThrottledError as e:
+            if attempt > 0 or (e.retry_after or 0) > max_retry_after:
+                return response
+            print(f"⏳ 上游返回 429，等待限流器放行后重试 (Retry-After: {e.retry_after})")
+    return response
+
+class _OpenAIStream:
+    """
+    真正的流式响应（client.send(stream=True)，而不是读完整个响应体再返回）
+
+    在整个流的生命周期内持有 httpx 客户端和上游限流名额；iter_lines() 结束、
+    出错或被提前关闭时释放。首包/块间空闲超时由 stream_watchdog 监控。
+    """
+
+    def __init__(self, url: str, headers: dict, payload: dict, task: str):
+        self._stack = ExitStack()
+        self._closed = False
+        self._task = task
+        # 熔断器在收到响应头时就给出结论，半开探测不必等整个流结束
+        self._breaker = get_breaker(host_of(url))
+        self._breaker.before_call()
+        try:
+            client = self._stack.enter_context(_create_httpx_client())
+            self._stack.enter_context(get_upstream_limiter("openai").slot(task))
+            request = client.build_request("POST", url, headers=headers, json=payload,
+                                           timeout=_request_timeout(stream=True))
+            self.response = client.send(request, stream=True)
+        except BaseException as exc:
+            self._breaker.record_exception(exc)
+            self.close(*sys.exc_info())
+            raise
+        self._breaker.record_status(self.response.status_code)
+        self.status_code = self.response.status_code
+        self.headers = self.response.headers
+
+    def read_text(self) -> str:
+        """读取错误响应体（非 200 时使用）"""
+        try:
+            return self.response.read().decode("utf-8", errors="replace")
+        except httpx.HTTPError:
+            return ""
+
+    def iter_lines(self):
+        first_byte = stage_timeout(first_byte_timeout(openai_config["timeout"]), self._task)
+        watched = stream_watchdog.watch(self.response, first_byte, idle_timeout())
+        try:
+            for line in self.response.iter_lines():
+                watched.touch()
+                yield line
+            # 按连接关闭界定响应体时，超时关闭连接表现为正常结束
+            timeout_error = watched.check()
+            if timeout_error is not None:
+                raise timeout_error
+            self.close()
+        except StreamTimeoutError as exc:
+            self._breaker.record_failure(str(exc))
+            self.close(StreamTimeoutError, exc, None)
+            raise
+        except BaseException as exc:
+            timeout_error = watched.check()
+            if timeout_error is not None:
+                self._breaker.record_failure(str(timeout_error))
+                self.close(type(timeout_error), timeout_error, None)
+                raise timeout_error from exc
+            self.close(*sys.exc_info())
+            raise
+        finally:
+            stream_watchdog.unwatch(watched)
+            self.close()
+
+    def close(self, exc_type=None, exc=None, tb=None):
+        if self._closed:
+            return
+        self._closed = True
+        self._stack.__exit__(exc_type, exc, tb)
+
+def _drop_optional_param(payload: dict, error_text: str, model: str) -> Optional[str]:
+    """
+    400 响应后去掉一个可选参数（response_format / stream_options）并记下该模型不支持，
+    返回去掉的参数名；没有可去掉的参数时返回 None。错误信息提到某个参数时优先去掉它。
+    """
+    present = [name for name in OPTIONAL_PARAMS if name in payload]
+    if not present:
+        return None
+    name = next((name for name in present if name in error_text), present[0])
+    print(f"⚠️ 服务端不支持 {name}，去掉该参数重试: {error_text[:200]}")
+    openai_config.setdefault(f"{name}_unsupported", set()).add(model)
+    payload.pop(name)
+    return name
+
+def _open_openai_stream(url: str, headers: dict, payload: dict, task: str, model: str) -> _OpenAIStream:
+    """打开流式请求；429 按 Retry-After 重试一次，400 时逐个去掉不支持的可选参数重试"""
+    payload = dict(payload)
+    max_retry_after = env_float("EASYPROMPT_MAX_RETRY_AFTER", 30.0)
+    for attempt in range(1 + len(OPTIONAL_PARAMS)):
+        stream = _OpenAIStream(url, headers, payload, task)
+        if stream.status_code == 200:
+            return stream
+        error_text = stream.read_text()
+        if stream.status_code == 429:
+            throttled = UpstreamThrottledError(
+                f"上游限流: {error_text[:200]}",
+                retry_after=parse_retry_after(stream.headers.get("retry-after"))
+            )
+            stream.close(UpstreamThrottledError, throttled, None)
+            if attempt == 0 and (throttled.retry_after or 0) <= max_retry_after:
+                print(f"⏳ 上游返回 429，等待限流器放行后重试 (Retry-After: {throttled.retry_after})")
+                continue
+        elif stream.status_code == 400 and _drop_optional_param(payload, error_text, model):
+            stream.close()
+            continue
+        stream.close()
+        _log_failed_response(stream.response, payload)
+        stream.response.raise_for_status()
+    raise RuntimeError("流式请求未能建立")
+
+def _report_openai_usage(usage: Optional[dict], usage_callback) -> None:
+    """把 OpenAI usage（含 prompt_tokens_details.cached_tokens）交给回调"""
+    if not usage or not usage_callback:
+        return
+    details = usage.get("prompt_tokens_details") or {}
+    cached_tokens = details.get("cached_tokens")
+    if cached_tokens is None:
+        # 部分兼容服务（如 DeepSeek）使用 prompt_cache_hit_tokens
+        cached_tokens = usage.get("prompt_cache_hit_tokens")
+    usage_callback(usage.get("prompt_tokens"), cached_tokens)
+
+def get_openai_conversation_response_stream(chat_history: list, user_message: str, critique: str, usage_callback=None):
     """
     使用OpenAI格式API获取对话响应流
     
     Args:
-        chat_history: 对话历史
+        chat_history: 对话历史（system prompt 之后的稳定前缀）
         user_message: 用户消息
-        critique: 诊断报告
+        critique: 诊断报告（放在稳定前缀之后的最后一条消息中）
+        usage_callback: 可选，接收 (prompt_tokens, cached_tokens)
     
     Yields:
-        Response chunks as strings, followed by a final result tuple
+        Response chunks as strings, ("__TRAIT__", TraitRecord) for each parsed
+        trait line after the separator, followed by a final result tuple
     """
     if not is_openai_configured():
         error_msg = lang_manager.t("ERROR_LLM_NOT_CONFIGURED")
@@ -252,6 +479,7 @@ def get_openai_conversation_response_stream(chat_history: list, user_message: st
         ai_response_part = ""
         trait_part = ""
         found_separator = False
+        trait_parser = TraitStreamParser()
         
         for line in response.iter_lines():
             if line:
@@ -267,6 +495,8 @@ def get_openai_conversation_response_stream(chat_history: list, user_message: st
                     
                     try:
                         chunk_data = json.loads(data)
+                        if chunk_data.get('usage'):
+                            _report_openai_usage(chunk_data['usage'], usage_callback)
                         if 'choices' in chunk_data and len(chunk_data['choices']) > 0:
                             delta = chunk_data['choices'][0].get('delta', {})
                             chunk_text = delta.get('content', '')
@@ -288,16 +518,23 @@ def get_openai_conversation_response_stream(chat_history: list, user_message: st
                                         # 分隔符之后的内容是 trait 部分
                                         if len(parts) > 1:
                                             trait_part += parts[1]
+                                            for record in trait_parser.feed(parts[1]):
+                                                yield ("__TRAIT__", record)
                                     else:
                                         # 还没遇到分隔符，正常输出
                                         ai_response_part += chunk_text
                                         yield chunk_text
                                 else:
-                                    # 已经遇到分隔符，后续内容都是 trait 部分，不再 yield
+                                    # 已经遇到分隔符，后续内容都是 trait 部分，逐行解析为结构化特征
                                     trait_part += chunk_text
+                                    for record in trait_parser.feed(chunk_text):
+                                        yield ("__TRAIT__", record)
                     except json.JSONDecodeError:
                         continue
         
+        for record in trait_parser.flush():
+            yield ("__TRAIT__", record)
+        
         # 清理 trait 部分
         trait_part = trait_part.strip()
         if not trait_part or trait_part.lower() == "none":
@@ -327,13 +564,13 @@ def evaluate_openai_profile(full_profile: str) -> dict:
             {"role": "user", "content": full_profile}
         ]
         
-        response = _make_openai_request(messages, stream=False)
+        response = _make_openai_request(messages, stream=False, response_format=openai_response_format("evaluator"),
+                                        task="evaluator")
         response_data = response.json()
         
         if 'choices' in response_data and len(response_data['choices']) > 0:
             content = response_data['choices'][0]['message']['content']
-            cleaned_response = content.strip().replace("```json", "").replace("```", "")
-            return json.loads(cleaned_response)
+            return parse_structured(content, "evaluator")
         else:
             raise Exception("API响应格式错误")
             
@@ -342,8 +579,68 @@ def evaluate_openai_profile(full_profile: str) -> dict:
         print(error_message)
         return {"is_ready_for_writing": False, "critique": error_message}
 
-def run_openai_structured_prompt(system_prompt: str, user_prompt: str) -> str:
-    """Runs a lightweight non-streaming request for control tasks (e.g., intent classification)."""
+def evaluate_openai_profile_stream(full_profile: str):
+    """
+    使用OpenAI格式API流式评估角色档案
+
+    Yields:
+        (字段名, 值)：评估 JSON 的顶层字段一闭合就产出；
+        最后产出 ("__FINAL_RESULT__", 完整评估字典)
+    """
+    if not is_openai_configured():
+        yield ("__FINAL_RESULT__", {"is_ready_for_writing": False, "critique": lang_manager.t("ERROR_LLM_NOT_CONFIGURED")})
+        return
+
+    parser = IncrementalJSONParser()
+    full_text = ""
+    try:
+        prompts = lang_manager.system_prompts
+        nsfw_mode = openai_config.get("nsfw_mode", False)
+        messages = [
+            {"role": "system", "content": prompts.get_evaluator_system_prompt(nsfw_mode)},
+            {"role": "user", "content": full_profile}
+        ]
+
+        response = _make_openai_request(messages, stream=True, response_format=openai_response_format("evaluator"),
+                                        task="evaluator")
+        for line in response.iter_lines():
+            if not line:
+                continue
+            if isinstance(line, bytes):
+                line = line.decode('utf-8', errors='replace')
+            if not line.startswith('data: '):
+                continue
+            data = line[6:]
+            if data == '[DONE]':
+                break
+            try:
+                chunk_data = json.loads(data)
+            except json.JSONDecodeError:
+                continue
+            if not chunk_data.get('choices'):
+                continue
+            chunk_text = chunk_data['choices'][0].get('delta', {}).get('content') or ''
+            if chunk_text:
+                full_text += chunk_text
+                for field in parser.feed(chunk_text):
+                    yield field
+
+        if parser.done:
+            record_parsed("evaluator")
+            yield ("__FINAL_RESULT__", parser.fields)
+        else:
+            yield ("__FINAL_RESULT__", parse_structured(full_text, "evaluator"))
+
+    except Exception as e:
+        error_message = lang_manager.t("ERROR_EVALUATOR_LLM", error=e)
+        print(error_message)
+        yield ("__FINAL_RESULT__", {"is_ready_for_writing": False, "critique": error_message})
+
+def run_openai_structured_prompt(system_prompt: str, user_prompt: str, task: Optional[str] = None) -> str:
+    """
+    Runs a lightweight non-streaming request for control tasks (e.g., intent classification).
+    When `task` names a known schema, JSON output is requested via response_format.
+    """
     if not is_openai_configured():
         raise ValueError("OpenAI API未配置")
 
@@ -352,7 +649,8 @@ def run_openai_structured_prompt(system_prompt: str, user_prompt: str) -> str:
         {"role": "user", "content": user_prompt}
     ]
 
-    response = _make_openai_request(messages, stream=False)
+    response_format = openai_response_format(task) if task else None
+    response = _make_openai_request(messages, stream=False, response_format=response_format, task=task or "planner")
     response_data = response.json()
 
     if 'choices' not in response_data or not response_data['choices']:
@@ -391,7 +689,7 @@ def write_openai_final_prompt_stream(full_profile: str) -> Generator[str, None,
             {"role": "user", "content": full_profile}
         ]
         
-        response = _make_openai_request(messages, stream=True)
+        response = _make_openai_request(messages, stream=True, task="writer")
         
         for line in response.iter_lines():
             if line:
@@ -0,0 +1,227 @@
+"""
+Relevance-ranked passage selection for injected web content
+网页正文的段落选择：把抓取到的全文切成约 300 字的段落，用 BM25 按用户消息和搜索对象
+打分，只把得分最高、总量不超过 token 预算的段落（按原文顺序）注入上下文，
+代替固定截取正文开头的做法
+
+- 中日文按相邻两字（bigram）切词，拉丁字母/数字按单词切分并转小写
+- 搜索对象（角色名、概念名）的词权重加倍
+- 全文本身在预算内时原样返回；没有任何段落命中查询时退回按顺序取开头的段落
+
+预算：EASYPROMPT_SEARCH_EXCERPT_TOKENS（联网搜索的网页摘录，默认 600）、
+      EASYPROMPT_LINK_EXCERPT_TOKENS（用户发来的链接，默认 1500）
+"""
+import math
+import re
+import threading
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from conversation_memory import estimate_tokens
+from runtime_config import env_int
+
+PASSAGE_CHARS = 300
+
+# BM25 参数
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# 搜索对象的词在查询中的权重
+FOCUS_WEIGHT = 2.0
+
+# 不相邻的段落之间的分隔
+GAP_SEPARATOR = "\n……\n"
+
+_SENTENCE_END = re.compile(r'(?<=[。！？；!?;])|(?<=\.)\s+')
+_CJK_RUN = re.compile(r'[぀-ヿ㐀-䶿一-鿿]+')
+_LATIN_WORD = re.compile(r'[a-z0-9]+')
+
+
+def search_excerpt_budget() -> int:
+    return env_int("EASYPROMPT_SEARCH_EXCERPT_TOKENS", 600)
+
+
+def link_excerpt_budget() -> int:
+    return env_int("EASYPROMPT_LINK_EXCERPT_TOKENS", 1500)
+
+
+def tokenize(text: str) -> List[str]:
+    """切词：中日文连续片段取 bigram（单字片段保留单字），其余按单词"""
+    if not text:
+        return []
+    text = text.lower()
+    tokens = _LATIN_WORD.findall(text)
+    for run in _CJK_RUN.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def _split_long(paragraph: str, target_chars: int) -> List[str]:
+    """过长的段落按句末标点拆开；单句仍过长时按字数硬切"""
+    if len(paragraph) <= target_chars * 1.5:
+        return [paragraph]
+    pieces: List[str] = []
+    buffer = ""
+    for sentence in _SENTENCE_END.split(paragraph):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        if buffer and len(buffer) + len(sentence) > target_chars:
+            pieces.append(buffer)
+            buffer = ""
+        buffer = f"{buffer} {sentence}" if buffer and _joins_with_space(buffer, sentence) else buffer + sentence
+        while len(buffer) > target_chars * 2:
+            pieces.append(buffer[:target_chars])
+            buffer = buffer[target_chars:]
+    if buffer:
+        pieces.append(buffer)
+    return pieces
+
+
+def _joins_with_space(left: str, right: str) -> bool:
+    return left[-1].isascii() and right[0].isascii()
+
+
+def split_passages(text: str, target_chars: int = PASSAGE_CHARS) -> List[str]:
+    """按换行分段，短段落合并、长段落拆分，得到长度接近 target_chars 的段落"""
+    passages: List[str] = []
+    buffer = ""
+    for paragraph in (text or "").split("\n"):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        for piece in _split_long(paragraph, target_chars):
+            if buffer and len(buffer) + len(piece) > target_chars:
+                passages.append(buffer)
+                buffer = ""
+            buffer = f"{buffer}\n{piece}" if buffer else piece
+    if buffer:
+        passages.append(buffer)
+    return passages
+
+
+def _bm25_scores(passages: List[List[str]], query_weights: Dict[str, float]) -> List[float]:
+    count = len(passages)
+    avg_length = sum(len(tokens) for tokens in passages) / count or 1.0
+    document_frequency: Counter = Counter()
+    for tokens in passages:
+        document_frequency.update(set(tokens))
+
+    scores = []
+    for tokens in passages:
+        frequencies = Counter(tokens)
+        length_norm = BM25_K1 * (1 - BM25_B + BM25_B * len(tokens) / avg_length)
+        score = 0.0
+        for term, weight in query_weights.items():
+            frequency = frequencies.get(term)
+            if not frequency:
+                continue
+            df = document_frequency[term]
+            idf = math.log(1 + (count - df + 0.5) / (df + 0.5))
+            score += weight * idf * frequency * (BM25_K1 + 1) / (frequency + length_norm)
+        scores.append(score)
+    return scores
+
+
+def _query_weights(query: str, focus: Optional[str]) -> Dict[str, float]:
+    weights: Dict[str, float] = {term: 1.0 for term in tokenize(query)}
+    for term in tokenize(focus or ""):
+        weights[term] = FOCUS_WEIGHT
+    return weights
+
+
+def _truncate_to_budget(text: str, budget_tokens: int) -> str:
+    """单个段落就超出预算时截断（中日文按 1 token/字 估算，偏保守）"""
+    cut = text[:max(1, budget_tokens)]
+    while len(cut) > 1 and estimate_tokens(cut) > budget_tokens:
+        cut = cut[:int(len(cut) * 0.9)]
+    return cut + "..."
+
+
+# --- 统计 ---
+
+_metrics_lock = threading.Lock()
+passage_metrics: Dict[str, Any] = {
+    "selections": 0,
+    "passthrough": 0,
+    "fallback_to_lead": 0,
+    "input_tokens_total": 0,
+    "output_tokens_total": 0,
+}
+
+
+def _record(key: Optional[str], input_tokens: int, output_tokens: int):
+    with _metrics_lock:
+        passage_metrics["selections"] += 1
+        if key:
+            passage_metrics[key] += 1
+        passage_metrics["input_tokens_total"] += input_tokens
+        passage_metrics["output_tokens_total"] += output_tokens
+
+
+def get_passage_metrics() -> Dict[str, Any]:
+    """段落选择次数、原样返回/退回开头的次数，以及注入 token 占全文的比例"""
+    with _metrics_lock:
+        metrics = dict(passage_metrics)
+    if metrics["input_tokens_total"]:
+        metrics["kept_token_ratio"] = round(metrics["output_tokens_total"] / metrics["input_tokens_total"], 3)
+    else:
+        metrics["kept_token_ratio"] = 0.0
+    return metrics
+
+
+def select_passages(text: str, query: str, budget_tokens: int, focus: Optional[str] = None) -> str:
+    """
+    选出与查询最相关、总量不超过 budget_tokens 的段落，按原文顺序拼接
+
+    Args:
+        text: 抓取到的正文（段落之间以换行分隔）
+        query: 用户消息
+        focus: 搜索对象（角色名/概念名），权重加倍
+        budget_tokens: 注入上下文的 token 上限
+    """
+    if not text:
+        return ""
+    total_tokens = estimate_tokens(text)
+    if total_tokens <= budget_tokens:
+        _record("passthrough", total_tokens, total_tokens)
+        return text
+
+    passages = split_passages(text)
+    weights = _query_weights(query, focus)
+    scores = _bm25_scores([tokenize(passage) for passage in passages], weights) if weights else [0.0] * len(passages)
+
+    fallback = not any(score > 0 for score in scores)
+    if fallback:
+        order = list(range(len(passages)))
+    else:
+        order = sorted((i for i, score in enumerate(scores) if score > 0), key=lambda i: (-scores[i], i))
+
+    chosen: List[int] = []
+    used = 0
+    for index in order:
+        cost = estimate_tokens(passages[index])
+        if used + cost > budget_tokens:
+            if fallback:
+                break
+            continue
+        chosen.append(index)
+        used += cost
+
+    if not chosen:
+        best = order[0]
+        excerpt = _truncate_to_budget(passages[best], budget_tokens)
+    else:
+        chosen.sort()
+        parts = [GAP_SEPARATOR.lstrip() if chosen[0] > 0 else "", passages[chosen[0]]]
+        for previous, index in zip(chosen, chosen[1:]):
+            parts.append(("\n" if index == previous + 1 else GAP_SEPARATOR) + passages[index])
+        excerpt = "".join(parts)
+        if chosen[-1] != len(passages) - 1:
+            excerpt += GAP_SEPARATOR.rstrip()
+
+    _record("fallback_to_lead" if fallback else None, total_tokens, estimate_tokens(excerpt))
+    return excerpt
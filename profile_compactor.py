@@ -0,0 +1,326 @@
+"""
+Incremental character profile compaction
+角色档案压缩：去重特征并归并到评估器的四个类别，保证评估/写作输入有界
+
+character_profile.txt 是只追加的特征日志；CompactProfile 随每次追加增量更新，
+得到的紧凑档案按类别分组、去除重复项，并剔除网页原文等非特征内容。
+"""
+import re
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from runtime_config import env_int
+
+# 评估器使用的四个类别（与 completeness_breakdown 的键一致）
+CATEGORY_TITLES = OrderedDict([
+    ("core_identity", "角色身份"),
+    ("personality_traits", "性格特质"),
+    ("behavioral_patterns", "行为方式"),
+    ("interaction_patterns", "互动风格"),
+])
+
+DEFAULT_CATEGORY = "personality_traits"
+
+# 按标签（或内容）中的关键词归类，顺序即优先级
+CATEGORY_KEYWORDS: List[Tuple[str, Tuple[str, ...]]] = [
+    ("interaction_patterns", (
+        "互动", "交流", "说话", "语气", "口癖", "口头禅", "称呼", "对话", "沟通",
+        "关系", "对待", "态度", "措辞", "用语",
+    )),
+    ("behavioral_patterns", (
+        "行为", "习惯", "反应", "表现", "动作", "爱好", "兴趣", "日常", "技能",
+        "能力", "偏好", "喜好", "厌恶",
+    )),
+    ("core_identity", (
+        "身份", "背景", "姓名", "名字", "年龄", "性别", "外貌", "外表", "职业",
+        "种族", "出身", "经历", "设定", "作品", "来源", "世界观", "身材", "服装",
+    )),
+    ("personality_traits", (
+        "性格", "个性", "特质", "价值观", "内心", "情感", "情绪", "信念", "动机",
+        "缺点", "优点",
+    )),
+]
+
+# `- **标签**: 内容` 或 `- 内容`
+_LIST_ITEM_PATTERN = re.compile(r'^\s*(?:[-*+]|\d+[.)])\s+(.*)$')
+_LABELLED_PATTERN = re.compile(r'^\*\*(.+?)\*\*\s*[:：]\s*(.*)$')
+_PLAIN_LABEL_PATTERN = re.compile(r'^([^:：]{1,12})[:：]\s*(.+)$')
+_USER_NOTE_PREFIX = "用户输入:"
+# 兜底备注解析后的标签：它是用户原话而不是提取出的特征
+USER_NOTE_LABEL = "用户输入"
+_NORMALIZE_PATTERN = re.compile(r'[\s\W_]+', re.UNICODE)
+
+
+def _normalize(text: str) -> str:
+    return _NORMALIZE_PATTERN.sub("", text).lower()
+
+
+def classify_trait(label: str, value: str = "") -> str:
+    """根据标签（其次内容）把特征归入四个类别之一"""
+    for source in (label, value):
+        if not source:
+            continue
+        for category, keywords in CATEGORY_KEYWORDS:
+            if any(keyword in source for keyword in keywords):
+                return category
+    return DEFAULT_CATEGORY
+
+
+def sanitize_user_note(message: str, max_chars: Optional[int] = None) -> str:
+    """把用户原始输入压成一行短备注，用于未提取到特征时的兜底记录"""
+    if max_chars is None:
+        max_chars = env_int("EASYPROMPT_TRAIT_NOTE_CHARS", 200)
+    text = " ".join((message or "").split())
+    if len(text) > max_chars:
+        text = text[:max_chars] + "…"
+    return f"{_USER_NOTE_PREFIX} {text}"
+
+
+def parse_trait_line(line: str, note_chars: Optional[int] = None) -> Optional[Tuple[str, str]]:
+    """
+    解析单行特征，返回 (标签, 内容)
+
+    只接受 Markdown 列表项、带加粗标签的行和单行「用户输入:」备注；
+    其他自由文本（例如旧版本写入的整页网页内容）返回 None。
+    """
+    line = line.strip()
+    if not line:
+        return None
+
+    if line.startswith(_USER_NOTE_PREFIX) or line.startswith("用户输入："):
+        if note_chars is None:
+            note_chars = env_int("EASYPROMPT_TRAIT_NOTE_CHARS", 200)
+        note = line.split(":", 1)[-1] if ":" in line else line.split("：", 1)[-1]
+        note = note.strip()
+        return (USER_NOTE_LABEL, note[:note_chars]) if note else None
+
+    match = _LIST_ITEM_PATTERN.match(line)
+    if match:
+        body = match.group(1).strip()
+    elif _LABELLED_PATTERN.match(line):
+        # 没有列表符号但带有加粗标签的特征行
+        body = line
+    else:
+        return None
+    labelled = _LABELLED_PATTERN.match(body) or _PLAIN_LABEL_PATTERN.match(body)
+    if labelled:
+        label, value = labelled.group(1).strip(), labelled.group(2).strip()
+    else:
+        label, value = "", body.strip("* ")
+    if not value or value.lower() == "none":
+        return None
+    return label, value
+
+
+def parse_trait_lines(text: str) -> List[Tuple[str, str]]:
+    """从一段特征文本中逐行解析 (标签, 内容)"""
+    note_chars = env_int("EASYPROMPT_TRAIT_NOTE_CHARS", 200)
+    items = []
+    for line in (text or "").splitlines():
+        item = parse_trait_line(line, note_chars)
+        if item:
+            items.append(item)
+    return items
+
+
+@dataclass(frozen=True)
+class TraitRecord:
+    """一条结构化特征记录"""
+    category: str
+    label: str
+    value: str
+    seq: int = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+class TraitStreamParser:
+    """
+    对话回复 `---` 之后特征段的流式解析器
+
+    每收到一个完整行就产出一条 TraitRecord，不必等待整段回复结束。
+    """
+
+    def __init__(self):
+        self._buffer = ""
+
+    def feed(self, text: str) -> List[TraitRecord]:
+        self._buffer += text or ""
+        if "\n" not in self._buffer:
+            return []
+        *lines, self._buffer = self._buffer.split("\n")
+        return self._parse(lines)
+
+    def flush(self) -> List[TraitRecord]:
+        lines, self._buffer = [self._buffer], ""
+        return self._parse(lines)
+
+    @staticmethod
+    def _parse(lines: List[str]) -> List[TraitRecord]:
+        records = []
+        for line in lines:
+            item = parse_trait_line(line)
+            if item:
+                label, value = item
+                records.append(TraitRecord(classify_trait(label, value), label, value))
+        return records
+
+
+class CompactProfile:
+    """
+    增量维护的紧凑角色档案
+
+    - 同一类别内规范化后相同或被包含的特征只保留信息更多的一条
+    - 每个类别最多保留 max_items_per_category 条（超出时淘汰最早的）
+    - 每条特征最多 max_item_chars 个字符
+    - 每次新增/更新都分配递增的 seq，changes_since(seq) 返回之后的变化
+    """
+
+    def __init__(
+        self,
+        max_items_per_category: Optional[int] = None,
+        max_item_chars: Optional[int] = None
+    ):
+        if max_items_per_category is None:
+            max_items_per_category = env_int("EASYPROMPT_PROFILE_ITEMS_PER_CATEGORY", 30)
+        if max_item_chars is None:
+            max_item_chars = env_int("EASYPROMPT_PROFILE_ITEM_CHARS", 300)
+        self.max_items_per_category = max_items_per_category
+        self.max_item_chars = max_item_chars
+
+        # category -> OrderedDict[normalized_key, (label, value, seq)]
+        self.categories: Dict[str, "OrderedDict[str, Tuple[str, str, int]]"] = {
+            category: OrderedDict() for category in CATEGORY_TITLES
+        }
+        self.seq = 0
+        # 因容量上限被淘汰的条目数；变化时说明已评估过的特征被压缩掉了
+        self.removals = 0
+        self.raw_chars = 0
+        self.duplicates_dropped = 0
+        self._rendered: Optional[str] = None
+
+    @classmethod
+    def from_text(cls, text: str) -> "CompactProfile":
+        profile = cls()
+        profile.add_block(text)
+        return profile
+
+    def add_block(self, text: str) -> int:
+        """合并一段追加的特征文本，返回新增/更新的条目数"""
+        self.raw_chars += len(text or "")
+        changed = 0
+        for label, value in parse_trait_lines(text):
+            if self.add_trait(label, value):
+                changed += 1
+        return changed
+
+    def add_trait(self, label: str, value: str, category: Optional[str] = None) -> bool:
+        value = " ".join(value.split())
+        if len(value) > self.max_item_chars:
+            value = value[:self.max_item_chars] + "…"
+        key = _normalize(value)
+        if not key:
+            return False
+
+        category = category or classify_trait(label, value)
+        entries = self.categories[category]
+
+        for existing_key in list(entries.keys()):
+            if key == existing_key or key in existing_key:
+                # 已有更完整的描述
+                self.duplicates_dropped += 1
+                return False
+            if existing_key in key:
+                # 新描述包含旧描述，替换旧条目
+                del entries[existing_key]
+                self.duplicates_dropped += 1
+                break
+
+        self.seq += 1
+        entries[key] = (label, value, self.seq)
+        while len(entries) > self.max_items_per_category:
+            entries.popitem(last=False)
+            self.removals += 1
+        self._rendered = None
+        return True
+
+    def items(self, category: str) -> List[Tuple[str, str]]:
+        return [(label, value) for label, value, _ in self.categories[category].values()]
+
+    def records(self) -> List[TraitRecord]:
+        return self.changes_since(0)
+
+    def changes_since(self, seq: int) -> List[TraitRecord]:
+        """返回 seq 之后新增或更新的特征（按 seq 排序）"""
+        changes = [
+            TraitRecord(category, label, value, item_seq)
+            for category, entries in self.categories.items()
+            for label, value, item_seq in entries.values()
+            if item_seq > seq
+        ]
+        return sorted(changes, key=lambda record: record.seq)
+
+    def counts(self) -> Dict[str, int]:
+        """各类别的特征条数（「用户输入」兜底备注不是特征，不计入，与预评分一致）"""
+        return {
+            category: sum(1 for label, _, _ in entries.values() if label != USER_NOTE_LABEL)
+            for category, entries in self.categories.items()
+        }
+
+    def render(self) -> str:
+        """按四个类别输出紧凑档案（Markdown）"""
+        if self._rendered is not None:
+            return self._rendered
+        sections = []
+        for category, title in CATEGORY_TITLES.items():
+            entries = self.categories[category]
+            if not entries:
+                continue
+            lines = [f"## {title} ({category})"]
+            for label, value, _ in entries.values():
+                lines.append(f"- **{label}**: {value}" if label else f"- {value}")
+            sections.append("\n".join(lines))
+        self._rendered = "\n\n".join(sections) + ("\n" if sections else "")
+        return self._rendered
+
+    def to_dict(self) -> Dict[str, Any]:
+        """紧凑的可持久化结构：{"seq", "raw_chars", "categories": {类别: [[seq, 标签, 内容], ...]}}"""
+        return {
+            "seq": self.seq,
+            "removals": self.removals,
+            "raw_chars": self.raw_chars,
+            "duplicates_dropped": self.duplicates_dropped,
+            "categories": {
+                category: [[item_seq, label, value] for label, value, item_seq in entries.values()]
+                for category, entries in self.categories.items()
+            },
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "CompactProfile":
+        profile = cls()
+        profile.seq = int(data.get("seq", 0))
+        profile.removals = int(data.get("removals", 0))
+        profile.raw_chars = int(data.get("raw_chars", 0))
+        profile.duplicates_dropped = int(data.get("duplicates_dropped", 0))
+        for category, items in (data.get("categories") or {}).items():
+            if category not in profile.categories:
+                continue
+            for item_seq, label, value in items:
+                profile.categories[category][_normalize(value)] = (label, value, int(item_seq))
+        return profile
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            "raw_chars": self.raw_chars,
+            "compact_chars": len(self.render()),
+            "duplicates_dropped": self.duplicates_dropped,
+            **self.counts(),
+        }
+
+
+def compact_profile_text(text: str) -> str:
+    """一次性压缩完整的特征日志（供没有增量状态的调用方使用）"""
+    return CompactProfile.from_text(text).render()
@@ -0,0 +1,286 @@
+"""
+Full / delta profile evaluation
+角色档案评估：在全量评估与增量评估之间切换，控制评估器输入的 token 和延迟
+
+增量评估只发送上一次评估的 JSON（省略已提取的特征/关键词列表）和之后
+新增/更新的结构化特征，模型只返回新增的特征/关键词，由本地合并；
+以下情况回退到全量评估：
+- 还没有可用的上一次评估结果
+- 距离上次全量评估已经做了 full_every 次增量评估
+- 上次评估之后档案发生了压缩（已评估的特征因容量上限被淘汰）
+
+调用评估模型之前先做本地完整度预评分：估算分数低于阈值时返回临时评估，
+只有超过阈值或每隔 eval_every_turns 轮才真正调用评估模型。
+"""
+import json
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from completeness_prescorer import (
+    build_provisional_evaluation,
+    llm_evaluation_interval,
+    prescore_threshold as default_prescore_threshold,
+)
+from conversation_memory import estimate_tokens
+from language_manager import lang_manager
+from profile_compactor import CATEGORY_TITLES, TraitRecord
+from runtime_config import env_bool, env_int
+
+EVALUATION_STATE_KEY = "evaluation_state"
+
+# 增量评估时不回传给模型、由本地合并的列表字段
+ACCUMULATED_FIELDS = ("extracted_traits", "extracted_keywords")
+
+# 全局统计（所有会话累计）
+_metrics_lock = threading.Lock()
+evaluation_metrics: Dict[str, Any] = {
+    "full": {"count": 0, "input_tokens": 0, "latency_ms": 0.0, "streamed": 0, "first_field_ms": 0.0},
+    "delta": {"count": 0, "input_tokens": 0, "latency_ms": 0.0, "streamed": 0, "first_field_ms": 0.0},
+    "skipped": 0,
+    "provisional": 0,
+}
+
+
+def get_evaluation_metrics() -> Dict[str, Any]:
+    """返回全量/增量评估的次数、平均输入 token 与平均延迟"""
+    with _metrics_lock:
+        snapshot = json.loads(json.dumps(evaluation_metrics))
+    for mode in ("full", "delta"):
+        count = snapshot[mode]["count"] or 1
+        snapshot[mode]["avg_input_tokens"] = round(snapshot[mode]["input_tokens"] / count, 1)
+        snapshot[mode]["avg_latency_ms"] = round(snapshot[mode]["latency_ms"] / count, 1)
+        streamed = snapshot[mode]["streamed"] or 1
+        snapshot[mode]["avg_first_field_ms"] = round(snapshot[mode]["first_field_ms"] / streamed, 1)
+    return snapshot
+
+
+def format_trait_changes(records: List[TraitRecord]) -> str:
+    """把结构化特征格式化为增量评估输入"""
+    lines = []
+    for record in records:
+        title = CATEGORY_TITLES.get(record.category, record.category)
+        text = f"**{record.label}**: {record.value}" if record.label else record.value
+        lines.append(f"- [{title}] {text}")
+    return "\n".join(lines)
+
+
+def is_valid_evaluation(result: Optional[Dict[str, Any]]) -> bool:
+    """评估出错时只返回 critique，不能作为下一次增量评估的基础"""
+    return bool(result) and "evaluation_score" in result and "critique" in result
+
+
+class ProfileEvaluator:
+    """
+    单个会话的评估状态
+
+    - full_every: 每做多少次增量评估后强制一次全量评估
+    - delta_enabled: 关闭时始终全量评估（EASYPROMPT_DELTA_EVAL=0）
+    - prescore_threshold: 本地估算分数（0-10）低于该值时不调用评估模型（0 表示关闭预评分）
+    - eval_every_turns: 未达到阈值时每隔多少轮仍调用一次评估模型
+    - evaluate_stream_fn: 流式评估函数，产出 (字段, 值) 和 ("__FINAL_RESULT__", 结果)；
+      提供时优先于 evaluate_fn
+    """
+
+    def __init__(
+        self,
+        profile_manager,
+        evaluate_fn: Optional[Callable[[str], Dict[str, Any]]] = None,
+        evaluate_stream_fn: Optional[Callable[[str], Iterator[Tuple[str, Any]]]] = None,
+        full_every: Optional[int] = None,
+        delta_enabled: Optional[bool] = None,
+        prescore_threshold: Optional[float] = None,
+        eval_every_turns: Optional[int] = None
+    ):
+        if full_every is None:
+            full_every = env_int("EASYPROMPT_FULL_EVAL_EVERY", 5)
+        if delta_enabled is None:
+            delta_enabled = env_bool("EASYPROMPT_DELTA_EVAL", True)
+        if prescore_threshold is None:
+            prescore_threshold = default_prescore_threshold()
+        if eval_every_turns is None:
+            eval_every_turns = llm_evaluation_interval()
+        if evaluate_fn is None and evaluate_stream_fn is None:
+            from llm_helper import evaluate_profile, evaluate_profile_stream
+            evaluate_fn = evaluate_profile
+            if env_bool("EASYPROMPT_STREAM_EVAL", True):
+                evaluate_stream_fn = evaluate_profile_stream
+
+        self.profile_manager = profile_manager
+        self.evaluate_fn = evaluate_fn
+        self.evaluate_stream_fn = evaluate_stream_fn
+        self.full_every = max(1, full_every)
+        self.delta_enabled = delta_enabled
+        self.prescore_threshold = prescore_threshold
+        self.eval_every_turns = eval_every_turns
+
+        self.last_evaluation: Optional[Dict[str, Any]] = None
+        self.last_seq = 0
+        self.last_removals = 0
+        self.deltas_since_full = 0
+        self.turns_since_llm = 0
+        self.last_provisional: Optional[Dict[str, Any]] = None
+        self.provisional_seq = -1
+        self.last_run: Optional[Dict[str, Any]] = None
+
+    # --- 状态持久化（保存在会话记录的 runtime 中） ---
+
+    def load_state(self, state: Optional[Dict[str, Any]]):
+        if not state:
+            return
+        evaluation = state.get("last_evaluation")
+        if is_valid_evaluation(evaluation):
+            self.last_evaluation = evaluation
+            self.last_seq = int(state.get("last_seq", 0))
+            self.last_removals = int(state.get("last_removals", 0))
+            self.deltas_since_full = int(state.get("deltas_since_full", 0))
+        self.turns_since_llm = int(state.get("turns_since_llm", 0))
+
+    def dump_state(self) -> Dict[str, Any]:
+        return {
+            "last_evaluation": self.last_evaluation,
+            "last_seq": self.last_seq,
+            "last_removals": self.last_removals,
+            "deltas_since_full": self.deltas_since_full,
+            "turns_since_llm": self.turns_since_llm,
+        }
+
+    # --- 评估 ---
+
+    def should_defer(self, estimate: Dict[str, Any]) -> bool:
+        """本地估算未达阈值、且还没到定期调用的轮次时，跳过评估模型"""
+        if self.prescore_threshold <= 0 or estimate["estimated_score"] >= self.prescore_threshold:
+            return False
+        if self.eval_every_turns > 0 and self.turns_since_llm + 1 >= self.eval_every_turns:
+            return False
+        return True
+
+    def choose_mode(self, current_removals: int) -> str:
+        if not self.delta_enabled or self.last_evaluation is None:
+            return "full"
+        if self.deltas_since_full >= self.full_every:
+            return "full"
+        if current_removals != self.last_removals:
+            return "full"
+        return "delta"
+
+    def build_input(self, mode: str, changes: List[TraitRecord]) -> str:
+        if mode == "full":
+            return self.profile_manager.get_compact_profile()
+        summary = {k: v for k, v in self.last_evaluation.items() if k not in ACCUMULATED_FIELDS}
+        previous = json.dumps(summary, ensure_ascii=False, separators=(",", ":"))
+        return lang_manager.system_prompts.get_evaluator_delta_input(previous, format_trait_changes(changes))
+
+    def has_current_result(self) -> bool:
+        """当前档案已有评估结果或临时结果，evaluate_stream 不会调用评估模型"""
+        seq = self.profile_manager.trait_seq
+        if self.last_evaluation is not None and seq == self.last_seq:
+            return True
+        return self.last_provisional is not None and seq == self.provisional_seq
+
+    def evaluate(self) -> Dict[str, Any]:
+        """评估当前档案并返回最终结果（内部仍可使用流式评估）"""
+        result: Dict[str, Any] = {}
+        for kind, payload in self.evaluate_stream():
+            if kind == "final":
+                result = payload
+        return result
+
+    def evaluate_stream(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        评估当前档案
+
+        Yields:
+            ("partial", 已闭合的字段)：流式评估时每闭合一个字段产出一次
+            ("final", 评估结果)：最后一项；没有新特征时直接复用上一次结果
+        """
+        seq = self.profile_manager.trait_seq
+        removals = self.profile_manager.trait_removals
+
+        if self.last_evaluation is not None and seq == self.last_seq:
+            with _metrics_lock:
+                evaluation_metrics["skipped"] += 1
+            yield ("final", self.last_evaluation)
+            return
+        if self.last_provisional is not None and seq == self.provisional_seq:
+            yield ("final", self.last_provisional)
+            return
+
+        estimate = self.profile_manager.get_completeness_estimate()
+        if self.should_defer(estimate):
+            self.turns_since_llm += 1
+            self.last_provisional = build_provisional_evaluation(estimate)
+            self.provisional_seq = seq
+            self.last_run = {"mode": "provisional", "input_tokens": 0, "latency_ms": 0.0}
+            with _metrics_lock:
+                evaluation_metrics["provisional"] += 1
+            yield ("final", self.last_provisional)
+            return
+
+        mode = self.choose_mode(removals)
+        changes = self.profile_manager.get_trait_changes(self.last_seq) if mode == "delta" else []
+        evaluation_input = self.build_input(mode, changes)
+        if not evaluation_input.strip():
+            yield ("final", {"is_ready_for_writing": False, "critique": "档案为空，请开始描述。"})
+            return
+
+        self.turns_since_llm = 0
+        started = time.perf_counter()
+        first_field_ms = None
+        if self.evaluate_stream_fn is not None:
+            result = None
+            partial: Dict[str, Any] = {}
+            for item in self.evaluate_stream_fn(evaluation_input):
+                if item[0] == "__FINAL_RESULT__":
+                    result = item[1]
+                    break
+                field, value = item
+                if first_field_ms is None:
+                    first_field_ms = (time.perf_counter() - started) * 1000
+                if mode == "delta" and field in ACCUMULATED_FIELDS:
+                    value = self._merge_field(field, value)
+                partial[field] = value
+                yield ("partial", dict(partial))
+        else:
+            result = self.evaluate_fn(evaluation_input)
+        latency_ms = (time.perf_counter() - started) * 1000
+        input_tokens = estimate_tokens(evaluation_input)
+
+        self.last_run = {
+            "mode": mode,
+            "input_tokens": input_tokens,
+            "latency_ms": round(latency_ms, 1),
+            "first_field_ms": round(first_field_ms, 1) if first_field_ms is not None else None,
+        }
+        with _metrics_lock:
+            bucket = evaluation_metrics[mode]
+            bucket["count"] += 1
+            bucket["input_tokens"] += input_tokens
+            bucket["latency_ms"] += latency_ms
+            if first_field_ms is not None:
+                bucket["streamed"] += 1
+                bucket["first_field_ms"] += first_field_ms
+
+        if is_valid_evaluation(result):
+            if mode == "delta":
+                result = self._merge_accumulated(result)
+            self.last_evaluation = result
+            self.last_seq = seq
+            self.last_removals = removals
+            self.deltas_since_full = 0 if mode == "full" else self.deltas_since_full + 1
+        yield ("final", result or {"is_ready_for_writing": False, "critique": "评估结果为空"})
+
+    def _merge_accumulated(self, result: Dict[str, Any]) -> Dict[str, Any]:
+        """把增量评估返回的新特征/关键词合并到上一次的列表后面（去重保序）"""
+        merged = dict(result)
+        for field in ACCUMULATED_FIELDS:
+            merged[field] = self._merge_field(field, result.get(field))
+        return merged
+
+    def _merge_field(self, field: str, new_items: Optional[List[Any]]) -> List[Any]:
+        combined = list(self.last_evaluation.get(field) or []) + list(new_items or [])
+        # 模型也可能返回 {"label": ..., "value": ...} 这类不可哈希的条目，按 JSON 序列化结果去重
+        merged: Dict[str, Any] = {}
+        for item in combined:
+            merged.setdefault(json.dumps(item, sort_keys=True, ensure_ascii=False, default=str), item)
+        return list(merged.values())
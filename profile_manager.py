@@ -1,8 +1,20 @@
 import os
 import uuid
 import json
+import hashlib
+import threading
 from pathlib import Path
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
+
+from completeness_prescorer import prescore_profile
+from profile_compactor import CompactProfile, TraitRecord
+from session_locks import session_locks
+
+
+def profile_content_hash(text: str) -> str:
+    """Returns the content hash used to key caches on a profile snapshot."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
 
 class ProfileManager:
     """
@@ -36,25 +48,165 @@ class ProfileManager:
         
         self.profile_file = self.session_path / "character_profile.txt"
         self.evaluation_file = self.session_path / "evaluation.json"
+        self.traits_file = self.session_path / "traits.json"
         self.final_prompt_file = self.session_path / "final_prompt.md"
-        self.session_metadata_file = self.session_path / "session_metadata.json"
         
+        # 会话元数据统一保存在 session.json 中，由 SessionStore 负责写入
         self.session_path.mkdir(parents=True, exist_ok=True)
-        
-        # 如果是新session，初始化元数据
-        if not self.session_metadata_file.exists():
-            self.save_session_metadata()
+
+        # 内存中的档案缓冲区：追加写入时与文件同步更新，
+        # 通过 (mtime_ns, size) 检测其他进程对文件的修改
+        self._profile_lock = threading.RLock()
+        self._profile_text = ""
+        self._profile_hasher = hashlib.sha256()
+        self._profile_version = 0
+        self._profile_stat: Optional[Tuple[int, int]] = None
+        # 与缓冲区同步增量维护的紧凑档案（评估和写作使用）
+        self._compact_profile = CompactProfile()
+
+    def _stat_profile(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = self.profile_file.stat()
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _reload_profile(self, current_stat: Optional[Tuple[int, int]]):
+        """Re-reads the profile file into the buffer and bumps the version."""
+        text = self.profile_file.read_text(encoding="utf-8") if current_stat else ""
+        self._profile_text = text
+        self._profile_hasher = hashlib.sha256(text.encode("utf-8"))
+        self._profile_stat = current_stat
+        self._profile_version += 1
+        self._compact_profile = self._load_compact_profile(text)
+
+    def _load_compact_profile(self, text: str) -> CompactProfile:
+        """
+        Loads the persisted structured traits if they were built from this
+        exact profile content; otherwise rebuilds them from the trait log.
+        """
+        content_hash = self._profile_hasher.hexdigest()
+        try:
+            data = json.loads(self.traits_file.read_text(encoding="utf-8"))
+            if data.get("profile_hash") == content_hash:
+                return CompactProfile.from_dict(data)
+        except (FileNotFoundError, json.JSONDecodeError, TypeError, ValueError):
+            pass
+        compact = CompactProfile.from_text(text)
+        if text:
+            self._save_compact_profile(compact)
+        return compact
+
+    def _save_compact_profile(self, compact: CompactProfile):
+        data = compact.to_dict()
+        data["profile_hash"] = self._profile_hasher.hexdigest()
+        tmp_file = self.traits_file.with_suffix(".json.tmp")
+        tmp_file.write_text(json.dumps(data, ensure_ascii=False, separators=(",", ":")), encoding="utf-8")
+        os.replace(tmp_file, self.traits_file)
+
+    def _sync_profile(self):
+        """Reloads the buffer if the file changed on disk since the last sync."""
+        current_stat = self._stat_profile()
+        if self._profile_version == 0 or current_stat != self._profile_stat:
+            self._reload_profile(current_stat)
 
     def append_trait(self, trait: str):
-        """Appends a new trait to the character profile file."""
-        with open(self.profile_file, "a", encoding="utf-8") as f:
-            f.write(trait + "\n")
+        """Appends a new trait to the character profile file and the in-memory buffer."""
+        entry = trait + "\n"
+        with self._profile_lock:
+            self._sync_profile()
+            with open(self.profile_file, "a", encoding="utf-8") as f:
+                f.write(entry)
+            self._profile_text += entry
+            self._profile_hasher.update(entry.encode("utf-8"))
+            self._profile_stat = self._stat_profile()
+            self._profile_version += 1
+            self._compact_profile.add_block(entry)
+            self._save_compact_profile(self._compact_profile)
+
+    def buffered_profile_bytes(self) -> int:
+        """Size of the in-memory profile buffer; does not stat or re-read the file."""
+        with self._profile_lock:
+            return len(self._profile_text.encode("utf-8"))
 
     def get_full_profile(self) -> str:
-        """Reads the entire character profile."""
-        if not self.profile_file.exists():
-            return ""
-        return self.profile_file.read_text(encoding="utf-8")
+        """Returns the entire character profile from the buffer, re-reading only on external changes."""
+        with self._profile_lock:
+            self._sync_profile()
+            return self._profile_text
+
+    def get_compact_profile(self) -> str:
+        """
+        Returns the deduplicated profile grouped into the four evaluator
+        categories; this is what the evaluator and writer receive.
+        """
+        with self._profile_lock:
+            self._sync_profile()
+            return self._compact_profile.render()
+
+    def get_compaction_stats(self) -> Dict[str, int]:
+        """Raw vs compact size and per-category item counts."""
+        with self._profile_lock:
+            self._sync_profile()
+            return self._compact_profile.get_stats()
+
+    def get_trait_records(self) -> List[TraitRecord]:
+        """All structured (category, label, value) trait records."""
+        with self._profile_lock:
+            self._sync_profile()
+            return self._compact_profile.records()
+
+    def get_trait_changes(self, since_seq: int = 0) -> List[TraitRecord]:
+        """Trait records added or updated after `since_seq`."""
+        with self._profile_lock:
+            self._sync_profile()
+            return self._compact_profile.changes_since(since_seq)
+
+    @property
+    def trait_seq(self) -> int:
+        """Sequence number of the latest structured trait change."""
+        with self._profile_lock:
+            self._sync_profile()
+            return self._compact_profile.seq
+
+    @property
+    def trait_removals(self) -> int:
+        """How many structured traits were evicted by the per-category cap."""
+        with self._profile_lock:
+            self._sync_profile()
+            return self._compact_profile.removals
+
+    def get_completeness_counts(self) -> Dict[str, int]:
+        """Per-category trait counts, computed locally without an evaluator call."""
+        with self._profile_lock:
+            self._sync_profile()
+            return self._compact_profile.counts()
+
+    def get_completeness_estimate(self) -> Dict[str, object]:
+        """Local rule-based completeness estimate (see completeness_prescorer)."""
+        with self._profile_lock:
+            self._sync_profile()
+            return prescore_profile(self._compact_profile)
+
+    @property
+    def profile_version(self) -> int:
+        """Monotonically increasing version of the profile buffer."""
+        with self._profile_lock:
+            self._sync_profile()
+            return self._profile_version
+
+    @property
+    def profile_hash(self) -> str:
+        """SHA-256 of the current profile content."""
+        with self._profile_lock:
+            self._sync_profile()
+            return self._profile_hasher.hexdigest()
+
+    def get_profile_snapshot(self) -> Tuple[int, str, str]:
+        """Returns (version, content_hash, text) taken atomically."""
+        with self._profile_lock:
+            self._sync_profile()
+            return self._profile_version, self._profile_hasher.hexdigest(), self._profile_text
 
     def get_latest_evaluation(self) -> dict:
         """
@@ -72,39 +224,21 @@ class ProfileManager:
         self.final_prompt_file.write_text(prompt_content, encoding="utf-8")
         print(f"\n[Info] Final prompt saved to: {self.final_prompt_file.resolve()}")
 
-    def save_session_metadata(self, metadata: dict = None):
-        """Saves session metadata to a JSON file."""
-        if metadata is None:
-            metadata = {
-                "session_id": self.session_id,
-                "created_at": self.get_current_timestamp(),
-                "last_updated": self.get_current_timestamp(),
-                "api_type": "unknown",
-                "api_config": {},
-                "chat_messages": [],
-                "evaluation_data": {}
-            }
-        
-        with open(self.session_metadata_file, "w", encoding="utf-8") as f:
-            json.dump(metadata, f, ensure_ascii=False, indent=2)
-
     def load_session_metadata(self) -> dict:
-        """Loads session metadata from JSON file."""
-        if not self.session_metadata_file.exists():
-            return {}
-        
-        try:
-            with open(self.session_metadata_file, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except (json.JSONDecodeError, FileNotFoundError):
-            return {}
+        """
+        Loads the runtime state (api_config, last_critique, ...) from the
+        consolidated session record (session.json).
+        """
+        return self.store.load_runtime_state(self.session_id, self.user_id)
 
     def update_session_metadata(self, updates: dict):
-        """Updates specific fields in session metadata."""
-        metadata = self.load_session_metadata()
-        metadata.update(updates)
-        metadata["last_updated"] = self.get_current_timestamp()
-        self.save_session_metadata(metadata)
+        """
+        Merges fields into the runtime state of the consolidated session record.
+        Takes the same per-session lock as SessionManager's message and metadata
+        writes; call it from worker threads (or the CLI), not the event loop.
+        """
+        with session_locks.hold_sync(self.session_id):
+            return self.store.update_runtime_state(self.session_id, updates, self.user_id)
 
     def get_current_timestamp(self) -> str:
         """Gets current timestamp as ISO string."""
@@ -137,19 +271,23 @@ class ProfileManager:
             return None
         
         latest_session = None
-        latest_time = 0
+        latest_time = ""
         
         for session_dir in user_dir.iterdir():
             if session_dir.is_dir():
-                metadata_file = session_dir / "session_metadata.json"
-                if metadata_file.exists():
+                record_file = session_dir / "session.json"
+                if record_file.exists():
                     try:
-                        with open(metadata_file, "r", encoding="utf-8") as f:
-                            metadata = json.load(f)
-                            last_updated = metadata.get("last_updated", "")
+                        with open(record_file, "r", encoding="utf-8") as f:
+                            record = json.load(f)
+                            runtime = record.get("runtime") or {}
+                            last_updated = max(
+                                str(record.get("updated_at") or ""),
+                                str(runtime.get("last_updated") or "")
+                            )
                             if last_updated:
-                                # 简单的字符串比较，实际项目中应该使用datetime
-                                if last_updated > str(latest_time):
+                                # ISO格式时间戳可以直接按字符串比较
+                                if last_updated > latest_time:
                                     latest_time = last_updated
                                     latest_session = session_dir.name
                     except (json.JSONDecodeError, KeyError):
@@ -0,0 +1,264 @@
+"""
+Resilient LLM request layer
+LLM 请求的重试、对冲与流式超时
+
+- 非流式、幂等的控制类调用（评估、搜索规划）失败时按指数退避 + 抖动重试；
+  处于某轮截止时间内时（turn_deadline），剩余预算不足以再试一次就不再重试
+- 可选请求对冲：等待超过该任务近期延迟的 p95 仍未返回时，再发出一个相同请求，
+  取先返回的结果（EASYPROMPT_LLM_HEDGING，默认关闭）
+- 流式调用区分首包超时（等待第一段内容）与块间空闲超时；
+  由 StreamWatchdog 监控，超时后关闭底层连接使阻塞的读取立即返回
+"""
+import contextvars
+import random
+import socket
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Deque, Dict, Optional
+
+import httpx
+
+from runtime_config import env_bool, env_float, env_int
+from upstream_limiter import is_throttle_error
+from turn_deadline import DEADLINE_TASKS, MIN_TIMEOUT, current_deadline
+
+# 可以安全重试/对冲的任务：输入相同、输出只用于控制流程，重复请求没有副作用
+RETRYABLE_TASKS = ("evaluator", "planner")
+
+
+class StreamTimeoutError(TimeoutError):
+    """流式响应在首包或块间超时"""
+
+    def __init__(self, kind: str, seconds: float):
+        label = "首包" if kind == "first_byte" else "块间空闲"
+        super().__init__(f"流式响应{label}超时 ({seconds:.0f}s)")
+        self.kind = kind
+
+
+def connect_timeout() -> float:
+    return env_float("EASYPROMPT_LLM_CONNECT_TIMEOUT", 10.0)
+
+
+def first_byte_timeout(default: float = 30.0) -> float:
+    return env_float("EASYPROMPT_LLM_FIRST_BYTE_TIMEOUT", default)
+
+
+def idle_timeout() -> float:
+    return env_float("EASYPROMPT_LLM_IDLE_TIMEOUT", 15.0)
+
+
+def is_retryable_error(exc: BaseException) -> bool:
+    """连接失败、超时、429 和 5xx 可以重试；其余 4xx 重试也不会成功"""
+    if isinstance(exc, (httpx.TimeoutException, httpx.TransportError, StreamTimeoutError)):
+        return True
+    if isinstance(exc, httpx.HTTPStatusError):
+        status = exc.response.status_code
+        return status == 429 or status >= 500
+    if is_throttle_error(exc):
+        return True
+    # Gemini（google.api_core）的暂时性错误
+    return type(exc).__name__ in ("ServiceUnavailable", "DeadlineExceeded", "InternalServerError")
+
+
+def backoff_delay(attempt: int, base: float = 0.5, cap: float = 8.0) -> float:
+    """第 attempt 次重试前的等待时间：指数退避 + 全抖动"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+# --- 统计 ---
+
+_metrics_lock = threading.Lock()
+request_metrics: Dict[str, int] = {
+    "calls": 0,
+    "retries": 0,
+    "retry_successes": 0,
+    "failures": 0,
+    "hedges_fired": 0,
+    "hedge_wins": 0,
+    "first_byte_timeouts": 0,
+    "idle_timeouts": 0,
+}
+_latencies: Dict[str, Deque[float]] = {}
+
+
+def _count(key: str, amount: int = 1):
+    with _metrics_lock:
+        request_metrics[key] += amount
+
+
+def record_latency(task: str, seconds: float):
+    with _metrics_lock:
+        _latencies.setdefault(task, deque(maxlen=200)).append(seconds)
+
+
+def latency_percentile(task: str, percentile: float = 0.95) -> Optional[float]:
+    """某任务近期成功请求延迟的分位数（样本不足时返回 None）"""
+    min_samples = env_int("EASYPROMPT_HEDGE_MIN_SAMPLES", 20)
+    with _metrics_lock:
+        samples = sorted(_latencies.get(task, ()))
+    if len(samples) < min_samples:
+        return None
+    return samples[int(percentile * (len(samples) - 1))]
+
+
+def get_request_metrics() -> Dict[str, Any]:
+    with _metrics_lock:
+        metrics: Dict[str, Any] = dict(request_metrics)
+        tasks = list(_latencies)
+    metrics["latency_p95_s"] = {}
+    for task in tasks:
+        p95 = latency_percentile(task)
+        metrics["latency_p95_s"][task] = round(p95, 3) if p95 is not None else None
+    metrics["hedging_enabled"] = env_bool("EASYPROMPT_LLM_HEDGING", False)
+    return metrics
+
+
+# --- 重试与对冲 ---
+
+_hedge_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="llm-hedge")
+
+
+def _hedged_call(send: Callable[[], Any], task: str) -> Any:
+    """超过 p95 延迟仍未返回时发出对冲请求，返回先成功的结果"""
+    delay = latency_percentile(task)
+    if delay is None or not env_bool("EASYPROMPT_LLM_HEDGING", False):
+        return send()
+    delay = max(delay, env_float("EASYPROMPT_HEDGE_MIN_DELAY", 0.5))
+
+    primary = _hedge_executor.submit(contextvars.copy_context().run, send)
+    done, _ = wait([primary], timeout=delay)
+    if done:
+        return primary.result()
+
+    _count("hedges_fired")
+    print(f"⏱️ {task} 请求超过 p95 ({delay:.1f}s) 未返回，发出对冲请求")
+    hedge = _hedge_executor.submit(contextvars.copy_context().run, send)
+    pending = {primary, hedge}
+    error: Optional[BaseException] = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                if future is hedge:
+                    _count("hedge_wins")
+                # 落后的请求在后台自然结束，名额由限流器回收
+                return future.result()
+            error = future.exception()
+    raise error
+
+
+def call_with_retries(send: Callable[[], Any], task: str) -> Any:
+    """
+    执行一次幂等请求；可重试的错误按指数退避 + 抖动重试
+    （EASYPROMPT_LLM_MAX_RETRIES，默认 2）
+    """
+    max_retries = env_int("EASYPROMPT_LLM_MAX_RETRIES", 2)
+    _count("calls")
+    for attempt in range(max_retries + 1):
+        started = time.monotonic()
+        try:
+            result = _hedged_call(send, task)
+        except Exception as exc:
+            if attempt >= max_retries or not is_retryable_error(exc):
+                _count("failures")
+                raise
+            delay = backoff_delay(attempt)
+            deadline = current_deadline.get()
+            if task in DEADLINE_TASKS and deadline is not None and deadline.remaining() < delay + MIN_TIMEOUT:
+                # 本轮剩余预算不够再等一次退避和请求，放弃重试
+                _count("failures")
+                raise
+            _count("retries")
+            reason = str(exc).splitlines()[0] if str(exc) else type(exc).__name__
+            print(f"🔁 {task} 请求失败（{reason}），{delay:.2f}s 后第 {attempt + 1} 次重试")
+            time.sleep(delay)
+            continue
+        record_latency(task, time.monotonic() - started)
+        if attempt:
+            _count("retry_successes")
+        return result
+
+
+# --- 流式超时监控 ---
+
+class _WatchedStream:
+    __slots__ = ("sock", "started", "last_activity", "got_first", "first_byte", "idle", "timed_out")
+
+    def __init__(self, sock, first_byte: float, idle: float):
+        self.sock = sock
+        self.started = self.last_activity = time.monotonic()
+        self.got_first = False
+        self.first_byte = first_byte
+        self.idle = idle
+        self.timed_out: Optional[str] = None
+
+    def touch(self):
+        self.got_first = True
+        self.last_activity = time.monotonic()
+
+    def check(self):
+        """超时则返回 StreamTimeoutError，否则返回 None"""
+        if self.timed_out == "first_byte":
+            return StreamTimeoutError("first_byte", self.first_byte)
+        if self.timed_out == "idle":
+            return StreamTimeoutError("idle", self.idle)
+        return None
+
+
+class StreamWatchdog:
+    """
+    单个后台线程监控所有进行中的流式响应
+
+    超时后对底层 socket 调用 shutdown，正在阻塞的 recv 立即返回，
+    读取方随后通过 check() 得到 StreamTimeoutError。
+    """
+
+    def __init__(self, interval: float = 0.2):
+        self.interval = interval
+        self._streams = set()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def watch(self, response: httpx.Response, first_byte: float, idle: float) -> _WatchedStream:
+        network_stream = response.extensions.get("network_stream")
+        sock = network_stream.get_extra_info("socket") if network_stream is not None else None
+        watched = _WatchedStream(sock, first_byte, idle)
+        with self._lock:
+            self._streams.add(watched)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="llm-stream-watchdog", daemon=True)
+                self._thread.start()
+        return watched
+
+    def unwatch(self, watched: _WatchedStream):
+        with self._lock:
+            self._streams.discard(watched)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            now = time.monotonic()
+            with self._lock:
+                streams = list(self._streams)
+            for watched in streams:
+                if watched.timed_out:
+                    continue
+                if not watched.got_first and now - watched.started > watched.first_byte:
+                    watched.timed_out = "first_byte"
+                    _count("first_byte_timeouts")
+                elif watched.got_first and now - watched.last_activity > watched.idle:
+                    watched.timed_out = "idle"
+                    _count("idle_timeouts")
+                else:
+                    continue
+                self.unwatch(watched)
+                if watched.sock is not None:
+                    try:
+                        watched.sock.shutdown(socket.SHUT_RDWR)
+                    except OSError:
+                        pass
+
+
+stream_watchdog = StreamWatchdog()
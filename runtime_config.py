@@ -0,0 +1,41 @@
+"""
+Environment-driven tuning knobs
+从环境变量读取运行参数（缓存大小、预算、并发限制等），解析失败时回退默认值
+"""
+import os
+
+
+def env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    if value is None or not value.strip():
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        print(f"警告: 环境变量 {name}={value!r} 不是整数，使用默认值 {default}")
+        return default
+
+
+def env_float(name: str, default: float) -> float:
+    value = os.getenv(name)
+    if value is None or not value.strip():
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        print(f"警告: 环境变量 {name}={value!r} 不是数字，使用默认值 {default}")
+        return default
+
+
+def env_bool(name: str, default: bool = False) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def env_str(name: str, default: str = "") -> str:
+    value = os.getenv(name)
+    if value is None or not value.strip():
+        return default
+    return value.strip()
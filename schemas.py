@@ -86,6 +86,15 @@ class Session(BaseModel):
         }
 
 
+class TaskModelConfig(BaseModel):
+    """单个任务的模型覆盖配置，未填写的字段继承对话模型"""
+    model: Optional[str] = Field(default=None, description="模型名称")
+    base_url: Optional[str] = Field(default=None, description="基础URL（仅OpenAI兼容API）")
+    api_key: Optional[str] = Field(default=None, description="API密钥（仅OpenAI兼容API）")
+    temperature: Optional[float] = Field(default=None, description="温度参数")
+    max_tokens: Optional[int] = Field(default=None, description="最大令牌数")
+
+
 class ApiConfig(BaseModel):
     """API配置模型"""
     api_type: ApiType = Field(..., description="API类型")
@@ -96,6 +105,10 @@ class ApiConfig(BaseModel):
     temperature: float = Field(default=0.7, description="温度参数")
     max_tokens: int = Field(default=4000, description="最大令牌数")
     nsfw_mode: bool = Field(default=False, description="NSFW模式")
+    task_models: Dict[str, TaskModelConfig] = Field(
+        default_factory=dict,
+        description="按任务路由模型：planner / evaluator / conversation / writer，未配置的任务使用对话模型"
+    )
 
 
 class SessionCreate(BaseModel):
@@ -114,7 +127,8 @@ class SessionResponse(BaseModel):
     """会话响应模型"""
     success: bool = Field(..., description="操作是否成功")
     message: str = Field(..., description="响应消息")
-    data: Optional[Union[Session, List[Session]]] = Field(default=None, description="响应数据")
+    data: Optional[Union[Session, List[Session], List[ChatMessage], EvaluationData]] = Field(default=None, description="响应数据")
+    next_cursor: Optional[str] = Field(default=None, description="下一页游标，没有更多数据时为空")
 
 
 class WebSocketMessage(BaseModel):
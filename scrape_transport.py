@@ -0,0 +1,329 @@
+"""
+Per-host polite HTTP transport for the scraper and search
+网页抓取与搜索的按站点礼貌访问：所有用户、所有线程发往同一站点的请求共用一个 HostGate
+
+- 每个站点的并发上限（EASYPROMPT_SCRAPER_HOST_CONCURRENCY，默认 4）
+- 令牌桶限速：每秒 EASYPROMPT_SCRAPER_HOST_RATE 个请求（默认 2），
+  允许突发 EASYPROMPT_SCRAPER_HOST_BURST 个（默认 4）；robots.txt 的 Crawl-delay 更严时按它来
+- 站点返回 429 时按 Retry-After 暂停发往该站点的请求
+- 排队最长 EASYPROMPT_SCRAPER_QUEUE_TIMEOUT 秒（默认 10，且不超过本次请求的超时），
+  超时抛出 HostBusyError；排队时间计入请求超时
+- 每个站点单独的连接池，池大小与并发上限一致
+- robots.txt 按站点缓存 EASYPROMPT_ROBOTS_TTL 秒（默认 3600），禁止的页面抛出 RobotsDisallowedError；
+  EASYPROMPT_SCRAPER_RESPECT_ROBOTS=0 关闭（搜索接口不检查 robots.txt）
+
+PoliteSession 是 requests.Session 的子类，WebScraper / SearchHelper 的 session.get/post 用法不变。
+"""
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlparse
+from urllib.robotparser import RobotFileParser
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from circuit_breaker import host_of
+from runtime_config import env_bool, env_float, env_int
+from upstream_limiter import DEFAULT_RETRY_AFTER, parse_retry_after
+
+# 读取 robots.txt 时使用的 User-agent 名称
+ROBOTS_AGENT = "EasyPrompt"
+
+# 获取 robots.txt 的超时上限（秒）
+ROBOTS_FETCH_TIMEOUT = 3.0
+
+# 每个 PoliteSession 最多单独挂载的站点连接池数，超出的站点使用默认连接池
+MAX_HOST_POOLS = 64
+
+# robots.txt 获取失败（网络错误、5xx）时多久后重试（秒），期间视为允许
+ROBOTS_RETRY_AFTER = 300.0
+
+
+class HostBusyError(RuntimeError):
+    """排队等待某个站点的名额超时"""
+
+
+class RobotsDisallowedError(RuntimeError):
+    """robots.txt 不允许抓取该页面"""
+
+
+class HostGate:
+    """
+    单个站点的并发上限 + 令牌桶
+
+    Args:
+        host: 站点（含端口）
+        max_concurrency: 同时进行的请求数上限
+        rate: 每秒补充的令牌数
+        burst: 令牌桶容量
+    """
+
+    def __init__(self, host: str, max_concurrency: int = 4, rate: float = 2.0, burst: int = 4):
+        self.host = host
+        self.max_concurrency = max(1, max_concurrency)
+        self.rate = max(0.01, rate)
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.in_flight = 0
+        self.waiting = 0
+        self.cooldown_until = 0.0
+        self._refilled_at = time.monotonic()
+        self._condition = threading.Condition()
+        self.stats: Dict[str, Any] = {
+            "requests": 0,
+            "queued": 0,
+            "timeouts": 0,
+            "throttled": 0,
+            "wait_ms": deque(maxlen=500),
+        }
+
+    def _refill_locked(self, now: float):
+        self.tokens = min(float(self.burst), self.tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+
+    def _wait_needed_locked(self, now: float) -> float:
+        """还需等待多久才能放行（0 表示可以立即放行）"""
+        if now < self.cooldown_until:
+            return self.cooldown_until - now
+        if self.in_flight >= self.max_concurrency:
+            return float("inf")  # 等待其他请求释放名额时被唤醒
+        if self.tokens < 1.0:
+            return (1.0 - self.tokens) / self.rate
+        return 0.0
+
+    def acquire(self, timeout: float) -> float:
+        """获取一个名额，返回排队的秒数；超过 timeout 抛出 HostBusyError"""
+        started = time.monotonic()
+        give_up_at = started + timeout
+        with self._condition:
+            queued = False
+            while True:
+                now = time.monotonic()
+                self._refill_locked(now)
+                wait = self._wait_needed_locked(now)
+                if wait <= 0:
+                    break
+                if now >= give_up_at:
+                    self.stats["timeouts"] += 1
+                    if queued:
+                        self.waiting -= 1
+                    raise HostBusyError(f"{self.host} 请求排队超过 {timeout:.1f}s")
+                if not queued:
+                    queued = True
+                    self.waiting += 1
+                    self.stats["queued"] += 1
+                self._condition.wait(min(wait, give_up_at - now))
+            if queued:
+                self.waiting -= 1
+            self.tokens -= 1.0
+            self.in_flight += 1
+            self.stats["requests"] += 1
+            waited = time.monotonic() - started
+            self.stats["wait_ms"].append(waited * 1000)
+        return waited
+
+    def release(self):
+        with self._condition:
+            self.in_flight = max(0, self.in_flight - 1)
+            self._condition.notify_all()
+
+    def report_throttled(self, retry_after: Optional[float] = None):
+        """站点返回 429：暂停发往该站点的请求"""
+        delay = retry_after if retry_after is not None else DEFAULT_RETRY_AFTER
+        with self._condition:
+            self.stats["throttled"] += 1
+            self.cooldown_until = max(self.cooldown_until, time.monotonic() + delay)
+        print(f"⚠️ {self.host} 返回 429，暂停抓取 {delay:.1f}s")
+
+    def apply_crawl_delay(self, delay: Optional[float]):
+        """robots.txt 要求的 Crawl-delay 比当前速率更严时降低速率"""
+        if not delay or delay <= 0:
+            return
+        with self._condition:
+            self.rate = min(self.rate, 1.0 / delay)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        with self._condition:
+            waits = sorted(self.stats["wait_ms"])
+            metrics = {
+                "in_flight": self.in_flight,
+                "queue_depth": self.waiting,
+                "max_concurrency": self.max_concurrency,
+                "rate_per_s": round(self.rate, 3),
+                "tokens": round(self.tokens, 2),
+                "cooldown_remaining_s": round(max(0.0, self.cooldown_until - time.monotonic()), 2),
+                "requests": self.stats["requests"],
+                "queued": self.stats["queued"],
+                "timeouts": self.stats["timeouts"],
+                "throttled": self.stats["throttled"],
+            }
+        metrics["queue_wait_ms"] = {
+            "avg": round(sum(waits) / len(waits), 1) if waits else 0.0,
+            "p95": round(waits[int(0.95 * (len(waits) - 1))], 1) if waits else 0.0,
+            "max": round(waits[-1], 1) if waits else 0.0,
+        }
+        return metrics
+
+
+_gates: Dict[str, HostGate] = {}
+_gates_lock = threading.Lock()
+
+
+def get_host_gate(host: str) -> HostGate:
+    """返回某个站点的全局 HostGate（所有 PoliteSession 共用）"""
+    with _gates_lock:
+        gate = _gates.get(host)
+        if gate is None:
+            gate = HostGate(
+                host,
+                max_concurrency=env_int("EASYPROMPT_SCRAPER_HOST_CONCURRENCY", 4),
+                rate=env_float("EASYPROMPT_SCRAPER_HOST_RATE", 2.0),
+                burst=env_int("EASYPROMPT_SCRAPER_HOST_BURST", 4),
+            )
+            _gates[host] = gate
+        return gate
+
+
+# --- robots.txt ---
+
+_robots_lock = threading.Lock()
+_robots: Dict[str, Tuple[Optional[RobotFileParser], float]] = {}
+_robots_fetch_locks: Dict[str, threading.Lock] = {}
+robots_metrics: Dict[str, int] = {
+    "fetched": 0,
+    "fetch_failures": 0,
+    "blocked": 0,
+}
+
+
+def _cached_robots(host: str) -> Tuple[bool, Optional[RobotFileParser]]:
+    with _robots_lock:
+        entry = _robots.get(host)
+    if entry is None or time.monotonic() >= entry[1]:
+        return False, None
+    return True, entry[0]
+
+
+def _store_robots(host: str, parser: Optional[RobotFileParser], ttl: float):
+    with _robots_lock:
+        _robots[host] = (parser, time.monotonic() + ttl)
+
+
+# --- Session ---
+
+class PoliteSession(requests.Session):
+    """
+    经过站点 HostGate 的 requests.Session
+
+    Args:
+        respect_robots: 是否在请求前检查 robots.txt（网页抓取开启，搜索接口关闭）
+    """
+
+    def __init__(self, respect_robots: bool = True):
+        super().__init__()
+        self.respect_robots = respect_robots
+        self._mounted = set()
+        self._mount_lock = threading.Lock()
+
+    def _ensure_pool(self, scheme: str, host: str, gate: HostGate):
+        """每个站点单独挂载一个连接池，大小与该站点的并发上限一致"""
+        prefix = f"{scheme}://{host}/"
+        if prefix in self._mounted or len(self._mounted) >= MAX_HOST_POOLS:
+            return
+        with self._mount_lock:
+            if prefix not in self._mounted and len(self._mounted) < MAX_HOST_POOLS:
+                self.mount(prefix, HTTPAdapter(pool_connections=1, pool_maxsize=gate.max_concurrency))
+                self._mounted.add(prefix)
+
+    def request(self, method, url, *args, **kwargs):
+        parsed = urlparse(url)
+        host = host_of(url)
+        gate = get_host_gate(host)
+        self._ensure_pool(parsed.scheme, parsed.netloc, gate)
+
+        timeout = kwargs.get("timeout")
+        if self.respect_robots and env_bool("EASYPROMPT_SCRAPER_RESPECT_ROBOTS", True):
+            self._check_robots(url, parsed, host, gate, timeout)
+        return self._gated_request(gate, method, url, *args, **kwargs)
+
+    def _gated_request(self, gate: HostGate, method, url, *args, **kwargs):
+        timeout = kwargs.get("timeout")
+        budget = timeout if isinstance(timeout, (int, float)) else None
+        queue_timeout = env_float("EASYPROMPT_SCRAPER_QUEUE_TIMEOUT", 10.0)
+        if budget is not None:
+            queue_timeout = min(queue_timeout, budget)
+
+        waited = gate.acquire(queue_timeout)
+        try:
+            if budget is not None:
+                # 排队时间计入本次请求的超时
+                kwargs["timeout"] = max(0.5, budget - waited)
+            response = super().request(method, url, *args, **kwargs)
+        finally:
+            gate.release()
+        if response.status_code == 429:
+            gate.report_throttled(parse_retry_after(response.headers.get("retry-after")))
+        return response
+
+    def _check_robots(self, url: str, parsed, host: str, gate: HostGate, timeout):
+        parser = self._robots_for(parsed, host, gate, timeout)
+        if parser is not None and not parser.can_fetch(ROBOTS_AGENT, url):
+            with _robots_lock:
+                robots_metrics["blocked"] += 1
+            raise RobotsDisallowedError(f"{host} 的 robots.txt 不允许抓取该页面")
+
+    def _robots_for(self, parsed, host: str, gate: HostGate, timeout) -> Optional[RobotFileParser]:
+        cached, parser = _cached_robots(host)
+        if cached:
+            return parser
+        with _robots_lock:
+            fetch_lock = _robots_fetch_locks.setdefault(host, threading.Lock())
+        # 同一站点只由一个线程获取 robots.txt，其余线程等待结果
+        with fetch_lock:
+            cached, parser = _cached_robots(host)
+            if cached:
+                return parser
+            return self._fetch_robots(parsed, host, gate, timeout)
+
+    def _fetch_robots(self, parsed, host: str, gate: HostGate, timeout) -> Optional[RobotFileParser]:
+        robots_url = f"{parsed.scheme}://{parsed.netloc}/robots.txt"
+        fetch_timeout = min(ROBOTS_FETCH_TIMEOUT, timeout) if isinstance(timeout, (int, float)) else ROBOTS_FETCH_TIMEOUT
+        try:
+            response = self._gated_request(gate, "GET", robots_url, timeout=fetch_timeout)
+        except (requests.exceptions.RequestException, HostBusyError) as exc:
+            print(f"⚠️ 获取 {robots_url} 失败，暂按允许处理: {exc}")
+            with _robots_lock:
+                robots_metrics["fetch_failures"] += 1
+            _store_robots(host, None, ROBOTS_RETRY_AFTER)
+            return None
+
+        with _robots_lock:
+            robots_metrics["fetched"] += 1
+        if response.status_code >= 500:
+            _store_robots(host, None, ROBOTS_RETRY_AFTER)
+            return None
+        if response.status_code >= 400:
+            # 没有 robots.txt（404 等）：允许抓取全部页面
+            _store_robots(host, None, env_float("EASYPROMPT_ROBOTS_TTL", 3600.0))
+            return None
+
+        parser = RobotFileParser(robots_url)
+        parser.parse(response.text.splitlines())
+        gate.apply_crawl_delay(parser.crawl_delay(ROBOTS_AGENT))
+        _store_robots(host, parser, env_float("EASYPROMPT_ROBOTS_TTL", 3600.0))
+        return parser
+
+
+def get_transport_metrics() -> Dict[str, Any]:
+    """每个站点的并发、限速、排队时间，以及 robots.txt 缓存情况"""
+    with _gates_lock:
+        gates = dict(_gates)
+    with _robots_lock:
+        robots = dict(robots_metrics)
+        robots["cached_hosts"] = len(_robots)
+    return {
+        "hosts": {host: gate.get_metrics() for host, gate in sorted(gates.items())},
+        "robots": robots,
+    }
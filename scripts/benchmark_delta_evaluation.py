@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+增量评估 vs 全量评估基准测试
+在 30 轮脚本化会话上比较评估器的提示词 token 与延迟
+
+默认使用模拟评估器（按 token 数估算延迟，无需 API）；
+配置好 API 后加 --live 调用真实评估模型。
+
+用法:
+    python scripts/benchmark_delta_evaluation.py [--turns 30] [--full-every 5] [--live]
+"""
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+from pathlib import Path
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from conversation_memory import estimate_tokens
+from language_manager import lang_manager
+from profile_evaluator import ProfileEvaluator
+from profile_manager import ProfileManager
+from storage import FileSystemSessionStore
+
+# 模拟延迟：首包固定开销 + 预填充 + 输出解码
+SIMULATED_BASE_MS = 400.0
+SIMULATED_PREFILL_MS_PER_TOKEN = 0.15
+SIMULATED_DECODE_MS_PER_TOKEN = 12.0
+
+SCRIPTED_TRAITS = [
+    ("身份", "高中二年级学生，学生会副会长"),
+    ("性格特征", "典型的傲娇性格，口是心非"),
+    ("行为表现", "面对关爱时会口头拒绝但身体诚实"),
+    ("说话方式", "称呼用户为笨蛋，句尾常带“哼”"),
+    ("外貌", "银色双马尾，红色瞳孔，身材娇小"),
+    ("爱好", "偷偷喜欢看少女漫画"),
+    ("价值观", "非常重视承诺，讨厌说谎的人"),
+    ("互动风格", "对熟人毒舌，对陌生人礼貌疏远"),
+    ("习惯", "紧张时会摆弄发梢"),
+    ("背景", "出身剑道世家，从小接受严格训练"),
+    ("情绪", "被夸奖时会脸红并转移话题"),
+    ("能力", "剑道全国大赛亚军"),
+    ("关系", "和青梅竹马的用户关系微妙"),
+    ("缺点", "不擅长坦率表达感情"),
+    ("日常", "每天早上六点晨练"),
+]
+
+
+def scripted_turn(turn: int) -> str:
+    """第 turn 轮的特征段：两条新特征，偶尔重复旧特征"""
+    lines = []
+    for offset in (0, 1):
+        label, value = SCRIPTED_TRAITS[(turn * 2 + offset) % len(SCRIPTED_TRAITS)]
+        lines.append(f"- **{label}**: {value}（第{turn + 1}轮补充）" if turn >= 8 else f"- **{label}**: {value}")
+    return "\n".join(lines)
+
+
+class SimulatedEvaluator:
+    """返回合法评估 JSON，并按输入 token 估算延迟"""
+
+    def __init__(self, system_prompt: str):
+        self.system_prompt_tokens = estimate_tokens(system_prompt)
+        self.calls = []
+
+    def __call__(self, evaluation_input: str) -> dict:
+        input_tokens = estimate_tokens(evaluation_input)
+        result = {
+            "is_ready_for_writing": False,
+            "critique": "继续补充角色的互动细节。",
+            "evaluation_score": 6,
+            "extracted_traits": [line[2:40] for line in evaluation_input.splitlines() if line.startswith("- ")],
+            "extracted_keywords": ["傲娇", "剑道"],
+            "completeness_breakdown": {},
+            "suggestions": ["补充具体场景"],
+        }
+        output_tokens = estimate_tokens(json.dumps(result, ensure_ascii=False))
+        prompt_tokens = self.system_prompt_tokens + input_tokens
+        latency_ms = (
+            SIMULATED_BASE_MS
+            + prompt_tokens * SIMULATED_PREFILL_MS_PER_TOKEN
+            + output_tokens * SIMULATED_DECODE_MS_PER_TOKEN
+        )
+        self.calls.append({"prompt_tokens": prompt_tokens, "latency_ms": latency_ms})
+        return result
+
+
+def run_session(turns: int, delta_enabled: bool, full_every: int, live: bool, prescore_threshold: float = 0) -> dict:
+    base_path = tempfile.mkdtemp(prefix="easyprompt_eval_bench_")
+    try:
+        store = FileSystemSessionStore(base_path=base_path)
+        manager = ProfileManager(session_id="bench", session_store=store)
+        system_prompt = lang_manager.system_prompts.get_evaluator_system_prompt(False)
+
+        if live:
+            from llm_helper import evaluate_profile
+            evaluate_fn = evaluate_profile
+        else:
+            evaluate_fn = SimulatedEvaluator(system_prompt)
+        evaluator = ProfileEvaluator(
+            manager,
+            evaluate_fn=evaluate_fn,
+            full_every=full_every,
+            delta_enabled=delta_enabled,
+            prescore_threshold=prescore_threshold
+        )
+
+        prompt_tokens, latencies, modes = [], [], []
+        for turn in range(turns):
+            manager.append_trait(scripted_turn(turn))
+            started = time.perf_counter()
+            evaluator.evaluate()
+            wall_ms = (time.perf_counter() - started) * 1000
+
+            run = evaluator.last_run
+            modes.append(run["mode"])
+            if run["mode"] == "provisional":
+                # 本地预评分，没有调用评估模型
+                prompt_tokens.append(0)
+                latencies.append(wall_ms)
+                continue
+            prompt_tokens.append(estimate_tokens(system_prompt) + run["input_tokens"])
+            latencies.append(evaluate_fn.calls[-1]["latency_ms"] if not live else wall_ms)
+
+        return {
+            "prompt_tokens_total": sum(prompt_tokens),
+            "prompt_tokens_last": prompt_tokens[-1],
+            "latency_ms_total": sum(latencies),
+            "latency_ms_last": latencies[-1],
+            "full_count": modes.count("full"),
+            "delta_count": modes.count("delta"),
+            "provisional_count": modes.count("provisional"),
+        }
+    finally:
+        shutil.rmtree(base_path, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="增量评估基准测试")
+    parser.add_argument("--turns", type=int, default=30)
+    parser.add_argument("--full-every", type=int, default=5)
+    parser.add_argument("--prescore-threshold", type=float, default=6.0)
+    parser.add_argument("--live", action="store_true", help="调用真实评估模型（需先配置API）")
+    args = parser.parse_args()
+
+    full = run_session(args.turns, delta_enabled=False, full_every=args.full_every, live=args.live)
+    delta = run_session(args.turns, delta_enabled=True, full_every=args.full_every, live=args.live)
+    prescored = run_session(
+        args.turns, delta_enabled=True, full_every=args.full_every, live=args.live,
+        prescore_threshold=args.prescore_threshold
+    )
+
+    print(f"📊 {args.turns} 轮会话评估对比（{'真实模型' if args.live else '模拟延迟'}）")
+    print(f"{'':<10}{'提示词token(总)':>16}{'最后一轮token':>14}{'延迟ms(总)':>14}{'最后一轮ms':>12}{'全量/增量/本地':>14}")
+    for name, result in (("全量评估", full), ("增量评估", delta), ("预评分+增量", prescored)):
+        print(
+            f"{name:<10}{result['prompt_tokens_total']:>16}{result['prompt_tokens_last']:>14}"
+            f"{result['latency_ms_total']:>14.0f}{result['latency_ms_last']:>12.0f}"
+            f"{result['full_count']:>7}/{result['delta_count']}/{result['provisional_count']}"
+        )
+    for name, result in (("增量模式", delta), ("预评分+增量", prescored)):
+        saved = 1 - result["prompt_tokens_total"] / max(1, full["prompt_tokens_total"])
+        print(f"✅ {name}节省提示词 token: {saved:.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+网页解析吞吐基准测试
+在保存的网页语料上比较：线程池解析（受 GIL 限制）与进程池解析（1..CPU 核数个工作进程）的每秒页数
+
+没有语料目录时生成一批类 MediaWiki 的长页面（可用 --save-corpus 保存下来重复使用）。
+
+用法:
+    python scripts/benchmark_html_parsing.py [--corpus DIR] [--pages 40] [--max-workers N] [--save-corpus DIR]
+"""
+import sys
+import os
+import time
+import random
+import argparse
+import multiprocessing
+from contextlib import redirect_stdout
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from html_parse_pool import _init_worker, _parse_in_worker
+from web_scraper import parse_page
+
+SENTENCES = [
+    "鹿目圆是见泷原中学二年级的学生，性格温柔善良。",
+    "她在丘比的劝诱下考虑成为魔法少女，并目睹了同伴的战斗。",
+    "作品讲述了魔法少女与魔女之间残酷的战斗以及背后的真相。",
+    "Kaname Madoka is the protagonist of Puella Magi Madoka Magica.",
+    "她的武器是弓箭，魔力潜能在所有魔法少女之中极其巨大。",
+    "相关条目：魔法少女小圆 角色列表 [编辑] [查看] [讨论]",
+]
+
+
+def synthetic_page(rng: random.Random, paragraphs: int = 120) -> bytes:
+    """类 MediaWiki 的页面：导航、目录、信息框、分类，以及大量正文段落"""
+    body = []
+    for index in range(paragraphs):
+        if index % 15 == 0:
+            body.append(f'<h2><span class="mw-headline">章节{index // 15}</span>'
+                        f'<span class="mw-editsection">[编辑]</span></h2>')
+        text = "".join(rng.choice(SENTENCES) for _ in range(rng.randint(2, 6)))
+        body.append(f"<p>{text}<sup>[{index}]</sup></p>")
+    navbox = "".join(f'<a href="/wiki/{i}">导航链接{i}</a>' for i in range(200))
+    return (
+        '<!DOCTYPE html><html><head><meta charset="utf-8"><title>鹿目圆 - 萌娘百科</title>'
+        '<meta name="description" content="鹿目圆是魔法少女小圆的主角"></head><body>'
+        '<div id="mw-navigation"><nav>跳转至导航</nav></div>'
+        '<div id="mw-content-text"><div class="mw-parser-output">'
+        '<table class="infobox"><tr><td>信息框</td></tr></table><div id="toc">目录</div>'
+        + "".join(body)
+        + f'<div class="navbox">{navbox}</div></div></div>'
+        '<div id="catlinks">分类：魔法少女小圆 | 虚构角色</div><footer>页脚</footer></body></html>'
+    ).encode("utf-8")
+
+
+def load_corpus(args) -> list:
+    if args.corpus:
+        files = sorted(Path(args.corpus).glob("*.htm*"))
+        if not files:
+            raise SystemExit(f"{args.corpus} 中没有 .html 文件")
+        return [(f"file://{path.name}", path.read_bytes()) for path in files]
+    rng = random.Random(42)
+    pages = [(f"https://zh.moegirl.org.cn/page{i}", synthetic_page(rng)) for i in range(args.pages)]
+    if args.save_corpus:
+        target = Path(args.save_corpus)
+        target.mkdir(parents=True, exist_ok=True)
+        for index, (_, raw) in enumerate(pages):
+            (target / f"page{index:03d}.html").write_bytes(raw)
+        print(f"💾 已保存 {len(pages)} 个页面到 {target}")
+    return pages
+
+
+def _quiet_worker():
+    """工作进程：预导入解析依赖，并丢弃解析过程中的日志输出"""
+    _init_worker()
+    sys.stdout = open(os.devnull, "w")
+
+
+def _parse(item):
+    url, raw = item
+    return parse_page(raw, url, "text/html; charset=utf-8")
+
+
+def bench_threads(pages, workers: int) -> float:
+    # 解析日志在整个计时期间统一丢弃（redirect_stdout 是进程级的，不能在各线程里各自切换）
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull), ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(_parse, pages[:workers]))  # 预热
+        started = time.perf_counter()
+        list(pool.map(_parse, pages))
+        return time.perf_counter() - started
+
+
+def bench_processes(pages, workers: int) -> float:
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_quiet_worker) as pool:
+        args = [(raw, url, "text/html; charset=utf-8") for url, raw in pages]
+        list(pool.map(_parse_in_worker, *zip(*args[:workers])))  # 启动并预热所有工作进程
+        started = time.perf_counter()
+        list(pool.map(_parse_in_worker, *zip(*args)))
+        return time.perf_counter() - started
+
+
+def worker_counts(max_workers: int) -> list:
+    counts, count = [], 1
+    while count < max_workers:
+        counts.append(count)
+        count *= 2
+    counts.append(max_workers)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="网页解析吞吐基准测试")
+    parser.add_argument("--corpus", help="保存的网页目录（*.html）")
+    parser.add_argument("--pages", type=int, default=40, help="未指定语料时生成的页面数")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--save-corpus", help="把生成的页面保存到该目录")
+    args = parser.parse_args()
+
+    pages = load_corpus(args)
+    total_mb = sum(len(raw) for _, raw in pages) / 1024 / 1024
+    print(f"📊 {len(pages)} 个页面（{total_mb:.1f} MB），CPU 核数 {os.cpu_count()}")
+
+    baseline = None
+    best = {"线程池": (0.0, 1), "进程池": (0.0, 1)}
+    print(f"{'模式':<12}{'并发':>6}{'页/秒':>10}{'相对单线程':>12}")
+    for mode, bench in (("线程池", bench_threads), ("进程池", bench_processes)):
+        for workers in worker_counts(args.max_workers):
+            rate = len(pages) / bench(pages, workers)
+            baseline = baseline or rate
+            best[mode] = max(best[mode], (rate, workers))
+            print(f"{mode:<12}{workers:>6}{rate:>10.1f}{rate / baseline:>11.2f}x")
+    (thread_rate, _), (process_rate, process_workers) = best["线程池"], best["进程池"]
+    print(f"✅ 线程池最高 {thread_rate / baseline:.2f}x；进程池最高 {process_rate / baseline:.2f}x"
+          f"（{process_workers} 个工作进程）")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+无用文本清理测试
+验证预编译的单次扫描在常见页面文本上与原先逐个模式替换结果一致，列出已知差异，
+以及站点配置识别与扩展正确
+"""
+import re
+import sys
+from pathlib import Path
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from bs4 import BeautifulSoup
+
+from boilerplate_filter import GENERIC_PATTERNS, SITE_PROFILES, clean_text, detect_profile, register_profile
+from web_scraper import parse_page
+
+SAMPLE = (
+    "跳转至：导航、搜索  鹿目圆是见泷原中学的学生。[编辑]\n\n"
+    "  参考资料[编辑]  她的武器是弓箭[1]。 \n"
+    "分类：魔法少女小圆 | 虚构角色\n"
+    "KANAME MADOKA [×]  is   the protagonist.\r\n"
+)
+
+
+def _legacy_clean(content: str) -> str:
+    """原实现：按列表顺序逐个模式替换，再用两次正则压缩空白
+    （「隐藏分类：」后来扩展为整行，但「分类：.*」先执行，原实现的结果不受影响）"""
+    for pattern in GENERIC_PATTERNS:
+        content = re.sub(pattern, '', content, flags=re.IGNORECASE)
+    content = re.sub(r'[^\S\n]+', ' ', content)
+    return re.sub(r' *\n[\s]*', '\n', content).strip()
+
+
+# 从 MediaWiki（萌娘百科）和百度百科页面提取出的正文（清理前）
+MEDIAWIKI_TEXT = (
+    "跳转至：导航、搜索\n萌娘百科欢迎你参与完善本条目☆\n"
+    "鹿目圆是《魔法少女小圆》的主角，见泷原中学二年级学生。\n"
+    "简介[编辑]\n性格温柔善良，总是为别人着想。\n"
+    "经历[编辑]\n在丘比的劝诱下，她犹豫是否要成为魔法少女。\n"
+    "参考资料[编辑]\n外部链接[编辑]\n"
+    "导航菜单 个人工具 页面工具 登录 / 创建账户\n"
+    "分类：魔法少女小圆 | 虚构角色 | 弓使用者\n"
+)
+BAIKE_TEXT = (
+    "鹿目圆 播报 编辑 讨论 上传视频\n"
+    "鹿目圆是动画《魔法少女小圆》中的角色，见泷原中学二年级学生。\n"
+    "角色经历 播报 编辑\n她在目睹魔法少女的战斗后，思考自己的愿望。\n"
+    "角色评价 播报 编辑\n温柔而坚定的主人公。\n"
+)
+
+# 已知差异：单次扫描取最左边的匹配，原实现按列表顺序各扫一遍
+KNOWN_DIFFERENCES = [
+    # 「编辑.*?段落」跨过 [编辑] 标记：原实现连同正文一起删掉
+    ("角色[编辑]设定段落内容", "角色[内容", "角色设定段落内容"),
+    ("角色[编辑]在第三章节登场。", "角色[登场。", "角色在第三章节登场。"),
+    # 隐藏分类行：原实现留下“隐藏”二字
+    ("正文\n隐藏分类：需要补充的条目", "正文\n隐藏", "正文"),
+]
+
+
+def test_generic_matches_sequential_substitution_on_page_text():
+    for text in (SAMPLE, MEDIAWIKI_TEXT, BAIKE_TEXT):
+        cleaned = clean_text(text)
+        assert cleaned == _legacy_clean(text), cleaned
+    cleaned = clean_text(MEDIAWIKI_TEXT)
+    assert "[编辑]" not in cleaned and "分类：" not in cleaned and "个人工具" not in cleaned
+    assert "性格温柔善良，总是为别人着想。" in cleaned
+    print("✅ 常见页面文本上单次扫描与逐个模式替换结果一致")
+
+
+def test_known_differences_from_sequential_substitution():
+    for text, legacy, cleaned in KNOWN_DIFFERENCES:
+        assert _legacy_clean(text) == legacy, _legacy_clean(text)
+        assert clean_text(text) == cleaned, clean_text(text)
+    print(f"✅ {len(KNOWN_DIFFERENCES)} 处已知差异：单次扫描不再误删标记与段落之间的正文")
+
+
+def test_site_profiles():
+    assert "[1]" in clean_text(SAMPLE) and "[1]" not in clean_text(SAMPLE, "mediawiki")
+    assert clean_text("鹿目圆 播报 编辑 是主角[2-3]。查看我的收藏", "baike") == "鹿目圆 是主角。"
+    fandom = clean_text("Madoka [edit] Advertisement is a magical girl[4].", "fandom")
+    assert fandom == "Madoka is a magical girl.", fandom
+    assert clean_text(SAMPLE, "unknown") == clean_text(SAMPLE)
+    print("✅ MediaWiki / 百科 / Fandom 配置去掉各自站点的无用文本")
+
+
+def test_detect_and_register_profile():
+    assert detect_profile("https://baike.baidu.com/item/鹿目圆") == "baike"
+    assert detect_profile("https://madoka.fandom.com/wiki/Madoka") == "fandom"
+    assert detect_profile("https://zh.moegirl.org.cn/鹿目圆") == "mediawiki"
+    soup = BeautifulSoup('<meta name="generator" content="MediaWiki 1.39">', "html.parser")
+    assert detect_profile("https://wiki.example.com/page", soup) == "mediawiki"
+    assert detect_profile("https://example.com/blog") == "generic"
+
+    register_profile("example_wiki", [r"本站广告位"], base="mediawiki")
+    assert clean_text("正文[3]本站广告位内容", "example_wiki") == "正文内容"
+    del SITE_PROFILES["example_wiki"]
+    print("✅ 按域名和 generator 识别站点配置，可在已有配置上扩展")
+
+
+def test_scraper_uses_site_profile():
+    html = (
+        '<html><head><title>鹿目圆</title></head><body><div class="mw-parser-output">'
+        + "".join(f"<p>鹿目圆是魔法少女小圆的主角，使用弓箭作战[{i}]。[编辑]</p>" for i in range(5))
+        + "</div></body></html>"
+    ).encode("utf-8")
+    content = parse_page(html, "https://zh.moegirl.org.cn/鹿目圆", "text/html; charset=utf-8")["content"]
+    assert "[编辑]" not in content and "[1]" not in content
+    assert content.count("\n") == 4
+    print("✅ 抓取时按站点配置清理正文")
+
+
+if __name__ == "__main__":
+    test_generic_matches_sequential_substitution_on_page_text()
+    test_known_differences_from_sequential_substitution()
+    test_site_profiles()
+    test_detect_and_register_profile()
+    test_scraper_uses_site_profile()
+    print("✅ 无用文本清理测试通过")
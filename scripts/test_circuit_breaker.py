@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+上游熔断测试
+验证 closed/open/half_open 状态切换，以及网页抓取、搜索、OpenAI 请求在熔断时快速失败
+"""
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import requests
+
+import openai_helper
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError, get_breaker, get_breaker_states
+from search_helper import DUCKDUCKGO_API_HOST, DUCKDUCKGO_HTML_HOST, search_helper
+from web_scraper import web_scraper
+
+HITS = {"count": 0}
+
+
+class DownUpstream(BaseHTTPRequestHandler):
+    """所有请求都返回 503，模拟故障中的上游"""
+
+    def log_message(self, *args):
+        pass
+
+    def _fail(self):
+        # robots.txt 请求由抓取传输层发出，不计入页面访问次数
+        if self.path != "/robots.txt":
+            HITS["count"] += 1
+        self.rfile.read(int(self.headers.get("content-length", 0) or 0))
+        self.send_response(503)
+        self.send_header("content-length", "0")
+        self.end_headers()
+
+    do_GET = _fail
+    do_POST = _fail
+
+
+def _start_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), DownUpstream)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _http_error(status):
+    response = requests.Response()
+    response.status_code = status
+    return requests.exceptions.HTTPError(f"HTTP {status}", response=response)
+
+
+def test_state_transitions():
+    breaker = CircuitBreaker("example.test", failure_threshold=2, reset_timeout=0.2)
+    for _ in range(2):
+        breaker.before_call()
+        breaker.record_failure("boom")
+    assert breaker.state == OPEN and breaker.is_open()
+    try:
+        breaker.before_call()
+        raise AssertionError("熔断中应拒绝请求")
+    except CircuitOpenError:
+        pass
+
+    time.sleep(0.25)
+    assert not breaker.is_open() and breaker.get_state()["state"] == HALF_OPEN
+    breaker.before_call()  # 半开探测
+    try:
+        breaker.before_call()
+        raise AssertionError("半开状态只放行一个探测请求")
+    except CircuitOpenError:
+        pass
+    breaker.record_failure("still down")
+    assert breaker.state == OPEN
+
+    time.sleep(0.25)
+    with breaker.guard():
+        pass
+    assert breaker.state == CLOSED and breaker.consecutive_failures == 0
+    assert breaker.stats["opened"] == 2 and breaker.stats["rejected"] == 2
+    print("✅ closed → open → half_open → closed 状态切换正确")
+
+
+def test_failure_classification():
+    breaker = CircuitBreaker("classify.test", failure_threshold=1, reset_timeout=60)
+    for exc in (_http_error(404), ValueError("解析失败")):
+        try:
+            with breaker.guard():
+                raise exc
+        except Exception:
+            pass
+    assert breaker.state == CLOSED, "4xx 和解析错误不应计为上游故障"
+
+    with breaker.guard() as call:
+        call.status_code = 502
+    assert breaker.state == OPEN, "5xx 响应应计为失败"
+
+    breaker = CircuitBreaker("timeout.test", failure_threshold=1, reset_timeout=60)
+    try:
+        with breaker.guard():
+            raise requests.exceptions.ConnectTimeout("timed out")
+    except requests.exceptions.ConnectTimeout:
+        pass
+    assert breaker.state == OPEN
+    print("✅ 只有连接失败、超时和 5xx 计为上游故障")
+
+
+def test_scraper_fails_fast_when_host_open():
+    server = _start_server()
+    try:
+        host, port = server.server_address
+        url = f"http://{host}:{port}/wiki/page"
+        HITS["count"] = 0
+        for _ in range(3):
+            assert not web_scraper.scrape_webpage(url)["success"]
+        assert HITS["count"] == 3
+
+        started = time.monotonic()
+        result = web_scraper.scrape_webpage(url)
+        assert not result["success"] and "熔断" in result["error"]
+        assert HITS["count"] == 3, "熔断中不应再访问站点"
+        assert time.monotonic() - started < 0.5
+        assert get_breaker_states()[f"{host}:{port}"]["state"] == OPEN
+        print("✅ 站点连续 503 后抓取直接失败，不再等待超时")
+    finally:
+        server.shutdown()
+
+
+def test_search_skipped_when_duckduckgo_open():
+    for host in (DUCKDUCKGO_API_HOST, DUCKDUCKGO_HTML_HOST):
+        breaker = get_breaker(host)
+        for _ in range(breaker.failure_threshold):
+            breaker.record_failure("connection refused")
+
+    def no_network(*args, **kwargs):
+        raise AssertionError("熔断中不应发起搜索请求")
+
+    original_get, original_post = search_helper.session.get, search_helper.session.post
+    search_helper.session.get = search_helper.session.post = no_network
+    try:
+        assert "熔断" in search_helper.search_unavailable_reason()
+        result = search_helper.search_concept_info("测试概念")
+        assert not result["success"]
+    finally:
+        search_helper.session.get, search_helper.session.post = original_get, original_post
+        for host in (DUCKDUCKGO_API_HOST, DUCKDUCKGO_HTML_HOST):
+            get_breaker(host).record_success()
+    print("✅ DuckDuckGo 熔断时跳过联网增强")
+
+
+def test_openai_requests_fail_fast_when_endpoint_open():
+    server = _start_server()
+    original_config = dict(openai_helper.openai_config)
+    try:
+        host, port = server.server_address
+        openai_helper.init_openai_llm("sk-test", f"http://{host}:{port}/v1", "test-model")
+        messages = [{"role": "user", "content": "hi"}]
+        HITS["count"] = 0
+        for _ in range(3):
+            try:
+                openai_helper._make_openai_request(messages)
+            except Exception:
+                pass
+        assert HITS["count"] == 3
+
+        for stream in (False, True):
+            try:
+                openai_helper._make_openai_request(messages, stream=stream)
+                raise AssertionError("熔断中应快速失败")
+            except CircuitOpenError:
+                pass
+        assert HITS["count"] == 3
+        print("✅ LLM 端点连续 503 后请求直接失败（流式与非流式）")
+    finally:
+        server.shutdown()
+        openai_helper.openai_config.clear()
+        openai_helper.openai_config.update(original_config)
+
+
+if __name__ == "__main__":
+    test_state_transitions()
+    test_failure_classification()
+    test_scraper_fails_fast_when_host_open()
+    test_search_skipped_when_duckduckgo_open()
+    test_openai_requests_fail_fast_when_endpoint_open()
+    print("✅ 上游熔断测试通过")
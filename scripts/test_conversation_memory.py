@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+对话记忆测试
+验证历史按 token 预算保持有界，且两次折叠之间消息前缀逐字节稳定
+"""
+import sys
+import json
+from pathlib import Path
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from conversation_memory import ConversationMemory, estimate_tokens
+from schemas import ChatMessage, MessageType
+
+
+def _prefix_bytes(messages):
+    return json.dumps(messages, ensure_ascii=False).encode("utf-8")
+
+
+def test_history_stays_bounded():
+    memory = ConversationMemory(history_token_budget=300, summary_token_budget=120)
+    for i in range(60):
+        memory.add_turn(f"第{i}轮：角色喜欢在雨天读书" * 3, f"好的，第{i}轮的回复" * 4, critique="补充背景")
+        assert memory.history_tokens() <= 300
+        assert estimate_tokens(memory.summary) <= 120
+    assert memory.summary_lines, "较早的轮次应折叠进摘要"
+    print(f"✅ 历史有界：窗口 {len(memory.turns)} 轮，摘要 {estimate_tokens(memory.summary)} tokens")
+
+
+def test_prefix_is_stable_between_folds():
+    memory = ConversationMemory(history_token_budget=2000, summary_token_budget=400)
+    previous = _prefix_bytes(memory.build_openai_history())
+    stable_turns = 0
+    for i in range(40):
+        folds_before = len(memory.summary_lines)
+        memory.add_turn(f"用户消息{i}", f"助手回复{i}", critique=f"第{i}次诊断")
+        current = _prefix_bytes(memory.build_openai_history())
+        if len(memory.summary_lines) == folds_before:
+            # 未折叠时，新前缀必须以旧前缀（去掉结尾的 ]）开头
+            assert current.startswith(previous[:-1]), f"第{i}轮前缀发生变化"
+            stable_turns += 1
+        previous = current
+    assert stable_turns > 30
+    assert all("诊断" not in m["content"] for m in memory.build_openai_history())
+    print(f"✅ 前缀稳定：{stable_turns}/40 轮逐字节追加")
+
+
+def test_usage_metrics_and_rehydration():
+    messages = [
+        ChatMessage(id="1", type=MessageType.USER, content="她是一名侦探"),
+        ChatMessage(id="2", type=MessageType.AI, content="了解，请继续描述"),
+    ]
+    memory = ConversationMemory.from_messages(messages)
+    assert memory.build_gemini_history()[0] == {"role": "user", "parts": ["她是一名侦探"]}
+
+    memory.record_usage(prompt_tokens=1200, cached_tokens=1024)
+    memory.add_turn("她很冷静", "好的")
+    last = memory.get_metrics()["last_turn"]
+    assert last["reported"] and last["cached_tokens"] == 1024
+
+    memory.add_turn("她怕猫", "有意思")
+    assert memory.get_metrics()["last_turn"]["cached_tokens"] is None
+    print("✅ token 统计与历史恢复正常")
+
+
+if __name__ == "__main__":
+    test_history_stays_bounded()
+    test_prefix_is_stable_between_folds()
+    test_usage_metrics_and_rehydration()
+    print("✅ 对话记忆测试通过")
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Gemini 模型实例缓存与异步调用测试
+验证相同参数复用 GenerativeModel、异步写作流与同步版本产出一致
+"""
+import asyncio
+import sys
+from pathlib import Path
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import gemini_helper
+import llm_helper
+import openai_helper
+
+PROMPT_CHUNKS = ["# 角色设定\n", "你是剑道部部长，", "说话冷淡但内心温柔。"]
+
+
+class _FakeChunk:
+    def __init__(self, text):
+        self.text = text
+        self.parts = [text]
+
+
+class _FakeAsyncStream:
+    usage_metadata = None
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._chunks)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class FakeWriterModel:
+    def generate_content(self, prompt, stream=False):
+        return [_FakeChunk(text) for text in PROMPT_CHUNKS]
+
+    async def generate_content_async(self, prompt, stream=False):
+        return _FakeAsyncStream([_FakeChunk(text) for text in PROMPT_CHUNKS])
+
+
+def _configured():
+    """只配置 Gemini（其他测试可能留下了 OpenAI 配置，OpenAI 已配置时会优先使用）"""
+    original = (gemini_helper.gemini_config["api_key"], gemini_helper.gemini_config["model"],
+                gemini_helper.CONVERSATION_MODEL, gemini_helper.WRITER_MODEL, openai_helper.openai_config["api_key"])
+    gemini_helper.gemini_config.update({"api_key": "test-key", "model": "gemini-2.5-flash"})
+    openai_helper.openai_config["api_key"] = None
+    gemini_helper.CONVERSATION_MODEL = object()
+    gemini_helper.WRITER_MODEL = FakeWriterModel()
+    return original
+
+
+def _restore(original):
+    (gemini_helper.gemini_config["api_key"], gemini_helper.gemini_config["model"],
+     gemini_helper.CONVERSATION_MODEL, gemini_helper.WRITER_MODEL, openai_helper.openai_config["api_key"]) = original
+
+
+def test_model_cache_reuses_instances():
+    gemini_helper.clear_model_cache()
+    first = gemini_helper.get_cached_model("gemini-2.5-flash", "系统提示词", generation_config={"temperature": 0.2})
+    second = gemini_helper.get_cached_model("gemini-2.5-flash", "系统提示词", generation_config={"temperature": 0.2})
+    other = gemini_helper.get_cached_model("gemini-2.5-flash", "系统提示词", generation_config={"temperature": 0.9})
+    assert first is second and first is not other
+    stats = gemini_helper.get_model_cache_stats()
+    assert stats["hits"] >= 1 and stats["size"] == 2
+    print(f"✅ GenerativeModel 实例按参数复用: {stats}")
+
+
+def test_async_writer_stream_matches_sync():
+    original = _configured()
+    try:
+        sync_chunks = list(gemini_helper.write_gemini_final_prompt_stream("档案"))
+
+        async def collect():
+            return [chunk async for chunk in llm_helper.write_final_prompt_stream_async("档案")]
+
+        async_chunks = asyncio.run(collect())
+    finally:
+        _restore(original)
+    assert sync_chunks == async_chunks == PROMPT_CHUNKS, async_chunks
+    print("✅ 异步写作流与同步版本产出一致")
+
+
+def test_iterate_in_thread_keeps_order():
+    async def collect():
+        return [item async for item in llm_helper.iterate_in_thread(iter(range(5)))]
+
+    assert asyncio.run(collect()) == [0, 1, 2, 3, 4]
+    print("✅ 同步生成器可在线程池中逐块迭代")
+
+
+if __name__ == "__main__":
+    test_model_cache_reuses_instances()
+    test_async_writer_stream_matches_sync()
+    test_iterate_in_thread_keeps_order()
+    print("✅ Gemini 缓存与异步调用测试通过")
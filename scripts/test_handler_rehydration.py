@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+对话处理器淘汰后重建测试
+验证每轮的用户消息和 AI 回复都写入会话，处理器被淘汰后重建时恢复对话历史；
+缓存按处理器维护估算大小，插入时不重新估算其他处理器
+"""
+import sys
+import asyncio
+from contextlib import contextmanager
+from pathlib import Path
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import conversation_handler
+import llm_helper
+from handler_cache import HandlerCache
+from main import save_ai_reply
+from schemas import ChatMessage, MessageType
+from search_helper import search_helper
+from session_manager import SessionManager
+from storage import default_store
+
+REPLY = "鹿目圆是一位温柔的魔法少女，她还有哪些让你印象深刻的经历？"
+
+
+@contextmanager
+def offline_turn():
+    """不联网、不调用模型：对话模型直接返回固定回复"""
+    def fake_stream(chat_session, message, critique, memory=None):
+        yield REPLY
+        yield ("__FINAL_RESULT__", REPLY, "核心身份: 魔法少女")
+
+    originals = (
+        conversation_handler.start_chat_session,
+        conversation_handler.get_conversation_response_stream,
+        search_helper.plan_search_strategy,
+    )
+    conversation_handler.start_chat_session = lambda history=None: object()
+    conversation_handler.get_conversation_response_stream = fake_stream
+    search_helper.plan_search_strategy = lambda message, deadline=None: {"should_search": False}
+    try:
+        yield
+    finally:
+        (
+            conversation_handler.start_chat_session,
+            conversation_handler.get_conversation_response_stream,
+            search_helper.plan_search_strategy,
+        ) = originals
+
+
+async def _turn_then_evict():
+    manager = SessionManager(store=default_store, handler_cache=HandlerCache(max_handlers=1), rehydrate_message_limit=20)
+    session = await manager.create_session(name="重建测试")
+    other = await manager.create_session(name="挤出缓存")
+    try:
+        # 与 main.py 的 user_response 流程一致：写入用户消息，迭代回复，保存 AI 回复
+        handler = await manager.get_or_create_handler(session.id)
+        answer = "我想写鹿目圆"
+        await manager.add_message_to_session(
+            session.id, ChatMessage(id="msg_user", type=MessageType.USER, content=answer)
+        )
+        async for chunk in llm_helper.iterate_in_thread(handler.handle_message(answer)):
+            if chunk.startswith("EVALUATION_TRIGGER::"):
+                await save_ai_reply(manager, session.id, handler)
+        await save_ai_reply(manager, session.id, handler)  # 已保存过，不会重复写入
+
+        await manager.get_or_create_handler(other.id)
+        assert session.id not in manager.active_handlers, "容量为 1 时应淘汰先前的处理器"
+
+        stored = await manager.get_session(session.id)
+        rebuilt = await manager.get_or_create_handler(session.id)
+        return handler, rebuilt, stored, manager.get_handler_metrics()
+    finally:
+        await manager.delete_session(session.id)
+        await manager.delete_session(other.id)
+
+
+def test_history_restored_after_eviction():
+    with offline_turn():
+        handler, rebuilt, stored, metrics = asyncio.run(_turn_then_evict())
+    assert [message.type for message in stored.messages] == [MessageType.USER, MessageType.AI]
+    assert stored.messages[-1].content == REPLY
+    assert rebuilt is not handler
+    assert rebuilt.memory.turns == handler.memory.turns and len(rebuilt.memory.turns) == 1
+    assert rebuilt.memory.turns[0]["assistant"] == REPLY
+    assert metrics["rehydrations"] == 1
+    print("✅ 处理器被淘汰后重建，对话历史完整恢复")
+
+
+class SizedHandler:
+    def __init__(self, size: int):
+        self.size = size
+        self.estimates = 0
+
+    def estimate_memory_bytes(self) -> int:
+        self.estimates += 1
+        return self.size
+
+
+def test_cache_keeps_running_size_total():
+    cache = HandlerCache(max_handlers=10, ttl_seconds=0, max_memory_bytes=350)
+    handlers = [SizedHandler(100) for _ in range(3)]
+    for index, handler in enumerate(handlers):
+        cache.put(f"s{index}", handler)
+    assert [handler.estimates for handler in handlers] == [1, 1, 1], "插入时只估算新处理器"
+    assert cache.get_metrics()["estimated_memory_bytes"] == 300
+    assert [handler.estimates for handler in handlers] == [1, 1, 1], "读取指标不重新估算"
+
+    handlers[2].size = 200
+    assert cache.refresh_size("s2") == 200
+    assert "s0" not in cache and cache.estimated_memory_bytes() == 300
+    assert cache.metrics["evictions_memory"] == 1
+    cache.pop("s1")
+    assert cache.estimated_memory_bytes() == 200
+    print("✅ 缓存维护各处理器大小的总和，超出内存上限时淘汰最久未用的处理器")
+
+
+if __name__ == "__main__":
+    test_history_restored_after_eviction()
+    test_cache_keeps_running_size_total()
+    print("✅ 处理器重建测试通过")
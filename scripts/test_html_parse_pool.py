@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+网页解析进程池测试
+验证默认在当前线程解析，开启后工作进程返回与当前线程相同的提取结果
+"""
+import os
+import sys
+from pathlib import Path
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from html_parse_pool import get_parse_metrics, parse_html, shutdown_parse_pool
+from web_scraper import parse_page
+
+PAGE = (
+    '<html><head><meta charset="utf-8"><title>鹿目圆 - 萌娘百科</title>'
+    '<meta name="description" content="魔法少女小圆的主角"></head><body>'
+    '<div class="mw-parser-output"><div id="toc">目录</div>'
+    + "".join(f"<p>第{i}段：鹿目圆成为魔法少女后使用弓箭作战。[编辑]</p>" for i in range(30))
+    + '</div></body></html>'
+).encode("utf-8")
+URL = "https://zh.moegirl.org.cn/鹿目圆"
+
+
+def test_inline_by_default():
+    os.environ.pop("EASYPROMPT_PARSE_PROCESSES", None)
+    before = get_parse_metrics()
+    page = parse_html(PAGE, URL, "text/html; charset=utf-8")
+    assert page == parse_page(PAGE, URL, "text/html; charset=utf-8")
+    assert "第29段" in page["content"] and "[编辑]" not in page["content"]
+    assert get_parse_metrics()["parsed_inline"] == before["parsed_inline"] + 1
+    print("✅ 默认在当前线程解析")
+
+
+def test_process_pool_matches_inline():
+    os.environ["EASYPROMPT_PARSE_PROCESSES"] = "1"
+    try:
+        before = get_parse_metrics()
+        page = parse_html(PAGE, URL, "text/html; charset=utf-8")
+        metrics = get_parse_metrics()
+    finally:
+        os.environ.pop("EASYPROMPT_PARSE_PROCESSES", None)
+        shutdown_parse_pool()
+    assert page == parse_page(PAGE, URL, "text/html; charset=utf-8")
+    assert metrics["parsed_in_pool"] == before["parsed_in_pool"] + 1 and metrics["pool_running"]
+    print("✅ 工作进程解析结果与当前线程一致")
+
+
+if __name__ == "__main__":
+    test_inline_by_default()
+    test_process_pool_matches_inline()
+    print("✅ 网页解析进程池测试通过")
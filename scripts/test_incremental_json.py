@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+增量 JSON 解析与流式评估测试
+验证字段随流式文本逐个产出，且与一次性解析结果一致
+"""
+import sys
+import json
+import random
+import shutil
+import tempfile
+from pathlib import Path
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from incremental_json import IncrementalJSONParser
+from profile_evaluator import ProfileEvaluator
+from profile_manager import ProfileManager
+from storage import FileSystemSessionStore
+
+EVALUATION_TEXT = """```json
+{
+  "is_ready_for_writing": false,
+  "evaluation_score": 6.5,
+  "critique": "需要补充\\"互动\\"细节, 例如 {称呼} 与 [语气]",
+  "extracted_traits": ["傲娇", "剑道]部"],
+  "extracted_keywords": [],
+  "completeness_breakdown": {"core_identity": 2, "personality_traits": 1},
+  "suggestions": ["补充场景"]
+}
+```"""
+
+
+def _chunks(text, rng):
+    i = 0
+    while i < len(text):
+        size = rng.randint(1, 8)
+        yield text[i:i + size]
+        i += size
+
+
+def test_fields_emitted_in_order_for_any_chunking():
+    expected = json.loads(EVALUATION_TEXT.strip("`").split("\n", 1)[1])
+    rng = random.Random(7)
+    for _ in range(100):
+        parser = IncrementalJSONParser()
+        emitted = []
+        for chunk in _chunks(EVALUATION_TEXT, rng):
+            emitted.extend(parser.feed(chunk))
+        assert parser.done and parser.fields == expected
+        assert [key for key, _ in emitted][:3] == ["is_ready_for_writing", "evaluation_score", "critique"]
+    print("✅ 增量解析在任意分块下结果一致")
+
+
+def test_score_available_before_stream_ends():
+    parser = IncrementalJSONParser()
+    head = EVALUATION_TEXT[:EVALUATION_TEXT.index('"critique"')]
+    fields = dict(parser.feed(head))
+    assert fields == {"is_ready_for_writing": False, "evaluation_score": 6.5}
+    assert not parser.done
+    print("✅ 评分在评估意见之前即可获得")
+
+
+def test_evaluator_streams_partial_fields():
+    def fake_stream(_evaluation_input):
+        parser = IncrementalJSONParser()
+        for chunk in _chunks(EVALUATION_TEXT, random.Random(1)):
+            yield from parser.feed(chunk)
+        yield ("__FINAL_RESULT__", parser.fields)
+
+    base_path = tempfile.mkdtemp(prefix="easyprompt_stream_eval_")
+    try:
+        store = FileSystemSessionStore(base_path=base_path)
+        manager = ProfileManager(session_id="stream", session_store=store)
+        manager.append_trait("- **身份**: 剑道部部长")
+        evaluator = ProfileEvaluator(manager, evaluate_stream_fn=fake_stream, prescore_threshold=0)
+
+        events = list(evaluator.evaluate_stream())
+        partials = [payload for kind, payload in events if kind == "partial"]
+        assert partials[0] == {"is_ready_for_writing": False}
+        assert partials[1]["evaluation_score"] == 6.5
+        assert events[-1][0] == "final" and events[-1][1]["suggestions"] == ["补充场景"]
+        assert evaluator.last_run["first_field_ms"] is not None
+        print(f"✅ 流式评估产出 {len(partials)} 次部分结果")
+    finally:
+        shutil.rmtree(base_path, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    test_fields_emitted_in_order_for_any_chunking()
+    test_score_available_before_stream_ends()
+    test_evaluator_streams_partial_fields()
+    print("✅ 增量 JSON 解析测试通过")
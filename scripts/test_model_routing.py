@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+按任务路由模型测试
+验证未配置的任务继承对话模型，以及 OpenAI 请求按任务选择模型和端点
+"""
+import os
+import sys
+from pathlib import Path
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import openai_helper
+from model_routing import describe_routing, normalize_task_models, resolve_task_config
+from schemas import ApiConfig
+
+
+BASE_CONFIG = {
+    "api_key": "sk-main",
+    "base_url": "https://api.example.com/v1",
+    "model": "big-model",
+    "temperature": 0.7,
+    "max_tokens": 4000,
+}
+
+
+def test_tasks_default_to_conversation_model():
+    routing = describe_routing(BASE_CONFIG)
+    assert all(route["model"] == "big-model" for route in routing.values())
+    assert all("api_key" not in route for route in routing.values())
+    print("✅ 未配置的任务使用对话模型")
+
+
+def test_overrides_and_env_fallback():
+    api_config = ApiConfig(
+        api_type="openai",
+        task_models={
+            "planner": {"model": " small-model ", "temperature": 0, "max_tokens": 300},
+            "evaluator": {"base_url": "https://fast.example.com/v1/", "api_key": "sk-fast", "model": ""},
+            "unknown": {"model": "ignored"},
+        },
+    )
+    config = dict(BASE_CONFIG, task_models=normalize_task_models(api_config.dict()["task_models"]))
+    assert set(config["task_models"]) == {"planner", "evaluator"}
+
+    planner = resolve_task_config("planner", config)
+    assert planner["model"] == "small-model" and planner["temperature"] == 0 and planner["max_tokens"] == 300
+    evaluator = resolve_task_config("evaluator", config)
+    assert evaluator["model"] == "big-model" and evaluator["base_url"] == "https://fast.example.com/v1"
+
+    os.environ["EASYPROMPT_WRITER_MODEL"] = "env-writer"
+    try:
+        assert resolve_task_config("writer", config)["model"] == "env-writer"
+        assert resolve_task_config("conversation", config)["model"] == "big-model"
+    finally:
+        os.environ.pop("EASYPROMPT_WRITER_MODEL")
+    print("✅ 任务覆盖项与环境变量生效")
+
+
+class _FakeResponse:
+    status_code = 200
+    text = ""
+
+    def raise_for_status(self):
+        pass
+
+
+class _FakeClient:
+    requests = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def post(self, url, headers=None, json=None, timeout=None):
+        self.requests.append((url, headers["Authorization"], json))
+        return _FakeResponse()
+
+
+def test_openai_request_uses_task_route():
+    original_client = openai_helper._create_httpx_client
+    original_config = dict(openai_helper.openai_config)
+    openai_helper._create_httpx_client = _FakeClient
+    try:
+        openai_helper.init_openai_llm(
+            "sk-main", "https://api.example.com/v1", "big-model",
+            task_models={"planner": {"model": "small-model", "base_url": "https://fast.example.com/v1", "api_key": "sk-fast"}},
+        )
+        openai_helper._make_openai_request([{"role": "user", "content": "hi"}], task="planner")
+        openai_helper._make_openai_request([{"role": "user", "content": "hi"}])
+        (planner_url, planner_auth, planner_payload), (chat_url, chat_auth, chat_payload) = _FakeClient.requests[-2:]
+        assert planner_url == "https://fast.example.com/v1/chat/completions" and planner_auth == "Bearer sk-fast"
+        assert planner_payload["model"] == "small-model"
+        assert chat_url == "https://api.example.com/v1/chat/completions" and chat_payload["model"] == "big-model"
+        print("✅ OpenAI 请求按任务选择模型和端点")
+    finally:
+        openai_helper._create_httpx_client = original_client
+        openai_helper.openai_config.clear()
+        openai_helper.openai_config.update(original_config)
+
+
+if __name__ == "__main__":
+    test_tasks_default_to_conversation_model()
+    test_overrides_and_env_fallback()
+    test_openai_request_uses_task_route()
+    print("✅ 模型路由测试通过")
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+多链接抓取测试
+验证一条消息中的所有链接被提取、去重、并发抓取，按完成顺序返回并共享本轮预算
+"""
+import os
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from conversation_handler import ConversationHandler
+from conversation_memory import estimate_tokens
+from turn_deadline import TurnDeadline
+from web_scraper import canonical_url, web_scraper
+
+DELAYS = {"https://a.example/1": 0.6, "https://b.example/2": 0.2, "https://c.example/3": 0.4}
+
+
+@contextmanager
+def _fake_scrape(delays):
+    """按 URL 设定耗时的假抓取，记录每次调用"""
+    calls = []
+
+    def scrape(url, deadline=None):
+        calls.append(url)
+        time.sleep(delays.get(url, 0.1))
+        return {"url": url, "title": f"页面 {url[-1]}", "description": "", "content": f"{url} 的正文。" * 40,
+                "keywords": [], "success": True, "error": None}
+
+    web_scraper.scrape_webpage = scrape
+    try:
+        yield calls
+    finally:
+        del web_scraper.scrape_webpage
+
+
+def test_extract_all_urls_deduped():
+    text = ("参考【@https://a.example/1 设定集】和 https://b.example/2，"
+            "还有 https://A.example/1/#top 以及 https://c.example/3?utm_source=x。")
+    urls = web_scraper.extract_urls_from_text(text)
+    assert urls == ["https://a.example/1", "https://b.example/2", "https://c.example/3?utm_source=x"], urls
+    assert canonical_url(urls[2]) == "https://c.example/3"
+    assert web_scraper.extract_url_from_text(text) == "https://a.example/1"
+    print("✅ 提取全部链接，按规范化 URL 去重，去掉链接后的中文标点")
+
+
+def test_concurrent_scrape_with_cap():
+    text = "看看 " + " ".join(DELAYS) + " https://d.example/4"
+    os.environ["EASYPROMPT_LINK_MAX_URLS"] = "3"
+    try:
+        with _fake_scrape(DELAYS) as calls:
+            started = time.monotonic()
+            result = web_scraper.process_user_input(text)
+            elapsed = time.monotonic() - started
+    finally:
+        os.environ.pop("EASYPROMPT_LINK_MAX_URLS", None)
+
+    assert result["dropped_urls"] == ["https://d.example/4"]
+    assert sorted(calls) == sorted(DELAYS)
+    assert [page["url"] for page in result["pages"]] == list(DELAYS), "结果按链接顺序排列"
+    assert elapsed < sum(DELAYS.values()) - 0.3, f"耗时 {elapsed:.2f}s，未并发抓取"
+    print(f"✅ 3 个链接并发抓取: {elapsed:.2f}s（串行约 {sum(DELAYS.values()):.1f}s），超出上限的链接被忽略")
+
+
+def test_results_stream_in_completion_order_within_deadline():
+    delays = dict(DELAYS, **{"https://slow.example/9": 5.0})
+    with _fake_scrape(delays):
+        started = time.monotonic()
+        finished = []
+        for page in web_scraper.iter_scrape(list(delays), deadline=TurnDeadline(1.0)):
+            finished.append((page["url"], page["success"], time.monotonic() - started))
+    order = [url for url, _, _ in finished]
+    assert order[:3] == ["https://b.example/2", "https://c.example/3", "https://a.example/1"], order
+    assert finished[0][2] < 0.4, "第一个完成的链接应立即返回，而不是等全部完成"
+    assert finished[-1][0] == "https://slow.example/9" and not finished[-1][1]
+    assert finished[-1][2] < 1.5, "预算用完后不再等待慢链接"
+    print("✅ 按完成顺序逐个返回，预算用完时慢链接直接记为失败")
+
+
+def test_merged_block_shares_budget():
+    pages = [
+        {"url": "https://a.example/1", "title": "短页面", "description": "", "keywords": [],
+         "content": "短页面的正文。", "success": True},
+        {"url": "https://b.example/2", "title": "长页面", "description": "", "keywords": [],
+         "content": "\n".join(["长页面的一段正文，内容很多。" * 10] * 40), "success": True},
+    ]
+    handler = ConversationHandler.__new__(ConversationHandler)
+    os.environ["EASYPROMPT_LINK_EXCERPT_TOKENS"] = "600"
+    try:
+        block = handler._link_context(pages, "介绍一下")
+    finally:
+        os.environ.pop("EASYPROMPT_LINK_EXCERPT_TOKENS", None)
+    assert "网页内容 1/2" in block and "网页内容 2/2" in block
+    assert block.index("短页面") < block.index("长页面")
+    assert estimate_tokens(block) < 700
+    print(f"✅ 多个网页合并为一个上下文块，共享 token 预算（{estimate_tokens(block)} tokens）")
+
+
+if __name__ == "__main__":
+    test_extract_all_urls_deduped()
+    test_concurrent_scrape_with_cap()
+    test_results_stream_in_completion_order_within_deadline()
+    test_merged_block_shares_budget()
+    print("✅ 多链接抓取测试通过")
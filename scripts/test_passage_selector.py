@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+网页段落选择测试
+验证长页面按 BM25 选出与用户消息相关的段落、遵守 token 预算，并且抓取不再截断正文
+"""
+import sys
+from pathlib import Path
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from bs4 import BeautifulSoup
+
+from conversation_memory import estimate_tokens
+from passage_selector import get_passage_metrics, select_passages, split_passages, tokenize
+from web_scraper import web_scraper
+
+INTRO = "鹿目圆是动画《魔法少女小圆》的主角，见泷原中学二年级学生，性格温柔善良，家庭和睦。"
+FILLER = "这一段介绍了作品的制作背景、播出时间与相关周边商品的发售情况，与角色本身关系不大。"
+ABILITY = "鹿目圆成为魔法少女后使用弓箭作战，她的魔力潜能极其巨大，最终的愿望改写了宇宙的法则。"
+
+
+def _long_page() -> str:
+    paragraphs = [INTRO] + [FILLER * 4] * 12 + [ABILITY * 2] + [FILLER * 4] * 6
+    return "\n".join(paragraphs)
+
+
+def test_tokenize_and_split():
+    assert tokenize("魔法少女") == ["魔法", "法少", "少女"]
+    assert tokenize("Kaname Madoka 圆") == ["kaname", "madoka", "圆"]
+
+    passages = split_passages(_long_page())
+    assert all(len(passage) <= 600 for passage in passages)
+    assert passages[0].startswith(INTRO)
+    assert "".join(passages).replace("\n", "") == _long_page().replace("\n", "")
+    print(f"✅ 中文 bigram 切词，长文切成 {len(passages)} 个段落且不丢内容")
+
+
+def test_relevant_passage_selected_within_budget():
+    text = _long_page()
+    excerpt = select_passages(text, "鹿目圆的能力和武器是什么？", 300, focus="鹿目圆")
+    assert ABILITY in excerpt, "相关段落位于页面后部，固定截取开头会丢失它"
+    assert estimate_tokens(excerpt) <= 300 + 10
+    assert excerpt.count(FILLER) <= 4, "最多带上相邻合并的一个无关段落"
+    print(f"✅ 选中页面后部的相关段落，注入 {estimate_tokens(excerpt)} tokens（全文 {estimate_tokens(text)}）")
+
+
+def test_short_text_passthrough_and_lead_fallback():
+    before = get_passage_metrics()
+    assert select_passages(INTRO, "无关的问题", 600) == INTRO
+
+    text = _long_page()
+    excerpt = select_passages(text, "zzz qqq", 200)
+    assert excerpt.startswith(INTRO), "没有命中时应退回开头的段落"
+    assert estimate_tokens(excerpt) <= 200 + 10
+    after = get_passage_metrics()
+    assert after["passthrough"] == before["passthrough"] + 1
+    assert after["fallback_to_lead"] == before["fallback_to_lead"] + 1
+    print("✅ 短文原样返回，未命中时退回开头段落")
+
+
+def test_scraper_keeps_full_text_with_paragraph_breaks():
+    body = "".join(f"<p>第{i}段：{FILLER}</p>" for i in range(60))
+    soup = BeautifulSoup(f"<html><body><main>{body}</main></body></html>", "html.parser")
+    content = web_scraper._extract_main_content(soup)
+    assert "第59段" in content, "正文不应只保留前 20 段或前 2500 字"
+    assert content.count("\n") == 59
+    print(f"✅ 抓取保留全部 {content.count(chr(10)) + 1} 段正文（{len(content)} 字）")
+
+
+if __name__ == "__main__":
+    test_tokenize_and_split()
+    test_relevant_passage_selected_within_budget()
+    test_short_text_passthrough_and_lead_fallback()
+    test_scraper_keeps_full_text_with_paragraph_breaks()
+    print("✅ 网页段落选择测试通过")
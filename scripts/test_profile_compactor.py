@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+角色档案压缩测试
+验证特征去重、四类归并、网页原文过滤，以及追加时的增量更新
+"""
+import sys
+import shutil
+import tempfile
+from pathlib import Path
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from profile_compactor import CompactProfile, TraitStreamParser, compact_profile_text, sanitize_user_note
+from profile_manager import ProfileManager
+from storage import FileSystemSessionStore
+
+LEGACY_WEB_DUMP = """
+用户输入: 帮我参考这个页面 【@https://example.com/wiki】
+
+网页内容:
+标题: 某角色 - 百科
+描述: 一段描述
+内容: """ + "很长的网页正文。" * 500 + """
+关键词: 角色, 百科
+
+请基于以上网页内容帮助用户完善角色设定。
+"""
+
+
+def test_dedupe_and_categories():
+    profile = CompactProfile()
+    profile.add_block("- **性格特征**: 傲娇\n- **行为表现**: 面对关爱时会口头拒绝")
+    profile.add_block("- **性格特征**: 典型的傲娇性格，口是心非\n- **行为表现**: 面对关爱时会口头拒绝")
+    profile.add_block("- **说话方式**: 称呼用户为笨蛋\n- **身份**: 高中二年级学生")
+
+    counts = profile.counts()
+    assert counts == {
+        "core_identity": 1,
+        "personality_traits": 1,
+        "behavioral_patterns": 1,
+        "interaction_patterns": 1,
+    }, counts
+    assert profile.items("personality_traits")[0][1] == "典型的傲娇性格，口是心非"
+    assert profile.duplicates_dropped == 2
+    print("✅ 特征去重并归入四个类别")
+
+
+def test_web_dump_is_dropped():
+    compact = compact_profile_text(LEGACY_WEB_DUMP + "- **外貌**: 银发红瞳\n")
+    assert "网页正文" not in compact
+    assert "银发红瞳" in compact
+    assert len(compact) < 400, len(compact)
+
+    note = sanitize_user_note("很长的输入" * 200)
+    assert note.startswith("用户输入:") and len(note) < 260
+    print("✅ 网页原文不会进入紧凑档案")
+
+
+def test_profile_manager_compacts_incrementally():
+    base_path = tempfile.mkdtemp(prefix="easyprompt_compact_")
+    try:
+        store = FileSystemSessionStore(base_path=base_path)
+        manager = ProfileManager(session_id="compact", session_store=store)
+        for i in range(200):
+            manager.append_trait("- **性格特征**: 傲娇，口是心非\n- **行为表现**: 会偷偷照顾别人")
+        compact = manager.get_compact_profile()
+        assert compact.count("傲娇") == 1
+        stats = manager.get_compaction_stats()
+        assert stats["compact_chars"] * 20 < stats["raw_chars"], stats
+
+        # 新实例从文件重建，结果一致
+        reloaded = ProfileManager(session_id="compact", session_store=store)
+        assert reloaded.get_compact_profile() == compact
+        print(f"✅ 增量压缩：{stats['raw_chars']} → {stats['compact_chars']} 字符")
+    finally:
+        shutil.rmtree(base_path, ignore_errors=True)
+
+
+def test_stream_parser_emits_records_per_line():
+    parser = TraitStreamParser()
+    chunks = ["\n- **性格", "特征**: 傲娇\n- **说话", "方式**: 称呼用户为笨蛋\n", "- **身份**: 学生"]
+    records = []
+    for chunk in chunks:
+        records.extend(parser.feed(chunk))
+    assert [r.category for r in records] == ["personality_traits", "interaction_patterns"]
+    records.extend(parser.flush())
+    assert records[-1].category == "core_identity" and records[-1].value == "学生"
+    print("✅ 流式解析逐行产出结构化特征")
+
+
+def test_structured_traits_persist_and_track_changes():
+    base_path = tempfile.mkdtemp(prefix="easyprompt_traits_")
+    try:
+        store = FileSystemSessionStore(base_path=base_path)
+        manager = ProfileManager(session_id="traits", session_store=store)
+        manager.append_trait("- **性格特征**: 傲娇")
+        seq = manager.trait_seq
+        manager.append_trait("- **性格特征**: 傲娇\n- **说话方式**: 语气冷淡")
+        changes = manager.get_trait_changes(seq)
+        assert [(c.category, c.value) for c in changes] == [("interaction_patterns", "语气冷淡")]
+        assert manager.get_completeness_counts()["interaction_patterns"] == 1
+        assert manager.traits_file.exists()
+
+        reloaded = ProfileManager(session_id="traits", session_store=store)
+        assert reloaded.get_trait_records() == manager.get_trait_records()
+        assert reloaded.trait_seq == manager.trait_seq
+        print("✅ 结构化特征持久化并支持增量读取")
+    finally:
+        shutil.rmtree(base_path, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    test_dedupe_and_categories()
+    test_web_dump_is_dropped()
+    test_profile_manager_compacts_incrementally()
+    test_stream_parser_emits_records_per_line()
+    test_structured_traits_persist_and_track_changes()
+    print("✅ 角色档案压缩测试通过")
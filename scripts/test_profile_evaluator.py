@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+增量评估测试
+验证全量/增量模式切换、本地合并以及评估出错时的回退
+"""
+import sys
+import shutil
+import tempfile
+from pathlib import Path
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from profile_compactor import sanitize_user_note
+from profile_evaluator import ProfileEvaluator
+from profile_manager import ProfileManager
+from storage import FileSystemSessionStore
+
+
+class RecordingEvaluator:
+    def __init__(self):
+        self.inputs = []
+        self.fail_next = False
+
+    def __call__(self, evaluation_input: str) -> dict:
+        self.inputs.append(evaluation_input)
+        if self.fail_next:
+            self.fail_next = False
+            return {"is_ready_for_writing": False, "critique": "评估模型出错"}
+        return {
+            "is_ready_for_writing": False,
+            "critique": f"第{len(self.inputs)}次评估",
+            "evaluation_score": 5,
+            "extracted_traits": [f"特征{len(self.inputs)}"],
+            "extracted_keywords": [],
+        }
+
+
+def test_delta_mode_and_fallbacks():
+    base_path = tempfile.mkdtemp(prefix="easyprompt_delta_eval_")
+    try:
+        store = FileSystemSessionStore(base_path=base_path)
+        manager = ProfileManager(session_id="delta", session_store=store)
+        fake = RecordingEvaluator()
+        evaluator = ProfileEvaluator(
+            manager, evaluate_fn=fake, full_every=2, delta_enabled=True, prescore_threshold=0
+        )
+
+        manager.append_trait("- **身份**: 剑道部部长")
+        evaluator.evaluate()
+        assert evaluator.last_run["mode"] == "full"
+
+        # 没有新特征时复用上一次结果，不调用模型
+        evaluator.evaluate()
+        assert len(fake.inputs) == 1
+
+        manager.append_trait("- **说话方式**: 语气冷淡")
+        result = evaluator.evaluate()
+        assert evaluator.last_run["mode"] == "delta"
+        assert "语气冷淡" in fake.inputs[-1] and "剑道部部长" not in fake.inputs[-1]
+        assert result["extracted_traits"] == ["特征1", "特征2"], result["extracted_traits"]
+
+        # 出错的结果不会成为下一次增量评估的基础
+        manager.append_trait("- **爱好**: 看少女漫画")
+        fake.fail_next = True
+        evaluator.evaluate()
+        assert evaluator.last_evaluation["critique"] == "第2次评估"
+        evaluator.evaluate()
+        assert "语气冷淡" not in fake.inputs[-1] and "看少女漫画" in fake.inputs[-1]
+
+        # 达到 full_every 次增量评估后回退到全量评估
+        manager.append_trait("- **习惯**: 紧张时摆弄发梢")
+        evaluator.evaluate()
+        assert evaluator.last_run["mode"] == "full"
+        assert "剑道部部长" in fake.inputs[-1]
+        print("✅ 增量评估模式切换正常")
+    finally:
+        shutil.rmtree(base_path, ignore_errors=True)
+
+
+def test_delta_merge_accepts_structured_items():
+    base_path = tempfile.mkdtemp(prefix="easyprompt_delta_merge_")
+    try:
+        store = FileSystemSessionStore(base_path=base_path)
+        manager = ProfileManager(session_id="delta_merge", session_store=store)
+        replies = iter([
+            [{"label": "身份", "value": "剑道部部长"}],
+            [{"value": "剑道部部长", "label": "身份"}, {"label": "说话方式", "value": "语气冷淡"}],
+        ])
+
+        def structured(evaluation_input: str) -> dict:
+            return {"is_ready_for_writing": False, "critique": "评估", "evaluation_score": 5, "extracted_traits": next(replies)}
+
+        evaluator = ProfileEvaluator(manager, evaluate_fn=structured, delta_enabled=True, prescore_threshold=0)
+        manager.append_trait("- **身份**: 剑道部部长")
+        evaluator.evaluate()
+        manager.append_trait("- **说话方式**: 语气冷淡")
+        result = evaluator.evaluate()
+        assert evaluator.last_run["mode"] == "delta"
+        assert result["extracted_traits"] == [
+            {"label": "身份", "value": "剑道部部长"},
+            {"label": "说话方式", "value": "语气冷淡"},
+        ], result["extracted_traits"]
+        print("✅ 增量评估合并结构化特征时按内容去重")
+    finally:
+        shutil.rmtree(base_path, ignore_errors=True)
+
+
+def test_prescorer_defers_llm_until_threshold():
+    base_path = tempfile.mkdtemp(prefix="easyprompt_prescore_")
+    try:
+        store = FileSystemSessionStore(base_path=base_path)
+        manager = ProfileManager(session_id="prescore", session_store=store)
+        fake = RecordingEvaluator()
+        evaluator = ProfileEvaluator(manager, evaluate_fn=fake, prescore_threshold=6.0, eval_every_turns=3)
+
+        manager.append_trait("- **身份**: 剑道部部长")
+        result = evaluator.evaluate()
+        assert result["provisional"] and not result["is_ready_for_writing"]
+        assert "性格" in result["critique"] or "行为" in result["critique"] or "交流" in result["critique"]
+        manager.append_trait("- **外貌**: 银发红瞳")
+        evaluator.evaluate()
+        assert fake.inputs == [], "未达到阈值时不应调用评估模型"
+
+        # 每隔 eval_every_turns 轮仍调用一次评估模型
+        manager.append_trait("- **背景**: 出身剑道世家")
+        evaluator.evaluate()
+        assert len(fake.inputs) == 1
+
+        # 四个类别都有足够具体的描述后，每轮都调用评估模型
+        for category_traits in (
+            ["**性格特征**: 傲娇且口是心非", "**价值观**: 重视承诺讨厌说谎", "**情绪**: 被夸时会脸红"],
+            ["**行为表现**: 嘴上拒绝却偷偷帮忙", "**习惯**: 紧张时摆弄发梢", "**爱好**: 喜欢看少女漫画"],
+            ["**说话方式**: 称呼用户为笨蛋", "**语气**: 句尾常带一声哼", "**关系**: 和青梅竹马关系微妙"],
+        ):
+            manager.append_trait("\n".join(f"- {trait}" for trait in category_traits))
+        estimate = manager.get_completeness_estimate()
+        assert estimate["estimated_score"] >= 6.0, estimate
+        evaluator.evaluate()
+        assert len(fake.inputs) == 2
+        print(f"✅ 本地预评分 {estimate['estimated_score']} 分后才调用评估模型")
+    finally:
+        shutil.rmtree(base_path, ignore_errors=True)
+
+
+def test_user_notes_do_not_count_as_traits():
+    base_path = tempfile.mkdtemp(prefix="easyprompt_prescore_")
+    try:
+        store = FileSystemSessionStore(base_path=base_path)
+        manager = ProfileManager(session_id="notes_only", session_store=store)
+        fake = RecordingEvaluator()
+        evaluator = ProfileEvaluator(manager, evaluate_fn=fake, prescore_threshold=6.0, eval_every_turns=0)
+
+        # 每轮都没有提取到特征，只记录了用户原话
+        for message in ("我想写一个傲娇的剑道部部长", "她平时说话很冲但其实很温柔", "再帮我想想她的口头禅吧"):
+            manager.append_trait(sanitize_user_note(message))
+        estimate = manager.get_completeness_estimate()
+        assert estimate["estimated_score"] == 0, estimate
+        assert all(value == 0 for value in estimate["coverage"].values()), estimate
+        assert not any(estimate["completeness_breakdown"].values()), estimate
+        stats = manager.get_compaction_stats()
+        assert not any(stats[category] for category in estimate["completeness_breakdown"]), stats
+
+        result = evaluator.evaluate()
+        assert result["provisional"] and fake.inputs == [], "只有用户备注时不应调用评估模型"
+        print("✅ 「用户输入」兜底备注不计入本地完整度")
+    finally:
+        shutil.rmtree(base_path, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    test_delta_mode_and_fallbacks()
+    test_delta_merge_accepts_structured_items()
+    test_prescorer_defers_llm_until_threshold()
+    test_user_notes_do_not_count_as_traits()
+    print("✅ 增量评估测试通过")
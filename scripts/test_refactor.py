@@ -80,8 +80,15 @@ async def test_session_manager():
     
     # 7. 测试 Handler 管理
     print("\n7. 测试 Handler 管理...")
-    handler = manager.get_handler(session1.id)
-    print(f"✅ 获取 Handler 成功: {handler is not None}")
+    assert manager.get_handler(session1.id) is None, "REST 创建的会话不应预先创建 Handler"
+    handler = await manager.get_or_create_handler(session1.id)
+    print(f"✅ 按需创建 Handler 成功: {handler is not None}")
+    
+    # 淘汰后重新获取会从持久化状态重建
+    manager.remove_handler(session1.id)
+    rebuilt = await manager.get_or_create_handler(session1.id)
+    assert rebuilt is not handler
+    print(f"✅ 重建 Handler 成功，缓存统计: {manager.get_handler_metrics()}")
     
     # 8. 测试路径获取
     print("\n8. 测试路径获取...")
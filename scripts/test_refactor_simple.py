@@ -75,6 +75,17 @@ async def test_storage_layer():
     user_list = await store.list_sessions(user_id="user_123")
     print(f"✅ 用户会话列表: {len(user_list)} 个")
     
+    # 游标分页：逐页读取不重复、不遗漏
+    page, cursor = await store.query_sessions(limit=1)
+    seen_ids = [s.id for s in page]
+    while cursor:
+        page, cursor = await store.query_sessions(limit=1, cursor=cursor)
+        seen_ids.extend(s.id for s in page)
+    assert session1.id in seen_ids and len(seen_ids) == len(set(seen_ids))
+    paused, _ = await store.query_sessions(status=SessionStatus.PAUSED)
+    assert session1.id not in [s.id for s in paused]
+    print(f"✅ 游标分页: 共 {len(seen_ids)} 个会话")
+    
     # 5. 测试更新会话
     print("\n5. 测试更新会话...")
     session1.name = "更新后的名称"
@@ -130,6 +141,15 @@ async def test_profile_manager():
     profile = pm1.get_full_profile()
     print(f"✅ 档案操作成功，内容: {len(profile)} 字符")
     
+    # 内存缓冲区与文件保持一致，外部修改时自动重新加载
+    version = pm1.profile_version
+    assert profile == pm1.profile_file.read_text(encoding="utf-8")
+    with open(pm1.profile_file, "a", encoding="utf-8") as f:
+        f.write("外部追加\n")
+    assert pm1.get_full_profile().endswith("外部追加\n")
+    assert pm1.profile_version > version
+    print(f"✅ 档案缓冲区版本: {pm1.profile_version}, 哈希: {pm1.profile_hash[:8]}")
+    
     # 2. 测试注册用户
     print("\n2. 测试注册用户 ProfileManager...")
     pm2 = ProfileManager(session_id="test_pm_user", user_id="user_456")
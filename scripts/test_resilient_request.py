@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+LLM 请求重试、对冲与流式超时测试
+使用本地 HTTP 服务模拟上游：首包过慢、流中途停顿、暂时性 5xx、偶发慢请求、
+不支持 stream_options 的兼容服务
+"""
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import openai_helper
+import resilient_request
+
+CALLS = {}
+
+
+def _sse(text):
+    return f"data: {json.dumps({'choices': [{'delta': {'content': text}}]}, ensure_ascii=False)}\n\n".encode("utf-8")
+
+
+class FakeUpstream(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get("content-length", 0))))
+        scenario = self.path.split("/")[1]
+        CALLS[scenario] = CALLS.get(scenario, 0) + 1
+        call = CALLS[scenario]
+
+        if scenario == "no_stream_options" and "stream_options" in request:
+            body = b'{"error": {"message": "Unrecognized request argument supplied: stream_options"}}'
+            self.send_response(400)
+            self.send_header("content-type", "application/json")
+            self.send_header("content-length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        if scenario == "flaky" and call == 1:
+            self.send_response(503)
+            self.end_headers()
+            return
+        if scenario == "hedge" and call == 1:
+            time.sleep(1.5)
+        if scenario in ("flaky", "hedge"):
+            body = json.dumps({"choices": [{"message": {"content": f"第{call}次"}}]}).encode("utf-8")
+            self.send_response(200)
+            self.send_header("content-type", "application/json")
+            self.send_header("content-length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        self.send_response(200)
+        self.send_header("content-type", "text/event-stream")
+        self.end_headers()
+        self.wfile.flush()
+        try:
+            if scenario == "slow_first":
+                time.sleep(3)
+            self.wfile.write(_sse("你好"))
+            self.wfile.flush()
+            if scenario == "stall":
+                time.sleep(3)
+            self.wfile.write(_sse("世界"))
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+def _configure(server, scenario):
+    host, port = server.server_address
+    openai_helper.init_openai_llm("sk-test", f"http://{host}:{port}/{scenario}/v1", "test-model")
+
+
+def _stream_text(scenario, server):
+    _configure(server, scenario)
+    return _read_stream()
+
+
+def _read_stream():
+    """用当前配置发一次流式请求并拼接返回的文本"""
+    response = openai_helper._make_openai_request([{"role": "user", "content": "hi"}], stream=True)
+    chunks = []
+    for line in response.iter_lines():
+        if line.startswith("data: ") and line[6:] != "[DONE]":
+            chunks.append(json.loads(line[6:])["choices"][0]["delta"]["content"])
+    return "".join(chunks)
+
+
+def run_tests(server):
+    os.environ["EASYPROMPT_LLM_FIRST_BYTE_TIMEOUT"] = "1"
+    os.environ["EASYPROMPT_LLM_IDLE_TIMEOUT"] = "1"
+    try:
+        assert _stream_text("normal", server) == "你好世界"
+        print("✅ 正常流式响应逐行读取")
+
+        for scenario, kind in (("slow_first", "首包"), ("stall", "块间空闲")):
+            started = time.monotonic()
+            try:
+                _stream_text(scenario, server)
+                assert False, "应当超时"
+            except resilient_request.StreamTimeoutError as exc:
+                assert kind in str(exc), exc
+            elapsed = time.monotonic() - started
+            assert elapsed < 2.5, elapsed
+            print(f"✅ {kind}超时在 {elapsed:.1f}s 内生效")
+        assert openai_helper.get_upstream_limiter("openai").in_flight == 0
+
+        assert _stream_text("no_stream_options", server) == "你好世界"
+        assert CALLS["no_stream_options"] == 2
+        assert _read_stream() == "你好世界"
+        assert CALLS["no_stream_options"] == 3, "已知不支持后不再发送 stream_options"
+        print("✅ 不支持 stream_options 的服务去掉该参数后重试成功")
+    finally:
+        os.environ.pop("EASYPROMPT_LLM_FIRST_BYTE_TIMEOUT")
+        os.environ.pop("EASYPROMPT_LLM_IDLE_TIMEOUT")
+
+    _configure(server, "flaky")
+    retries_before = resilient_request.request_metrics["retry_successes"]
+    response = openai_helper._make_openai_request([{"role": "user", "content": "hi"}], task="evaluator")
+    assert response.json()["choices"][0]["message"]["content"] == "第2次"
+    assert resilient_request.request_metrics["retry_successes"] == retries_before + 1
+    print("✅ 评估请求遇到 503 后退避重试成功")
+
+    os.environ["EASYPROMPT_LLM_HEDGING"] = "1"
+    try:
+        for _ in range(20):
+            resilient_request.record_latency("planner", 0.1)
+        _configure(server, "hedge")
+        started = time.monotonic()
+        response = openai_helper._make_openai_request([{"role": "user", "content": "hi"}], task="planner")
+        elapsed = time.monotonic() - started
+        assert response.json()["choices"][0]["message"]["content"] == "第2次" and elapsed < 1.2, elapsed
+        assert resilient_request.request_metrics["hedge_wins"] >= 1
+        print(f"✅ 超过 p95 后发出对冲请求，{elapsed:.2f}s 返回")
+    finally:
+        os.environ.pop("EASYPROMPT_LLM_HEDGING")
+
+
+def test_resilient_request_layer():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeUpstream)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    original_config = dict(openai_helper.openai_config)
+    try:
+        run_tests(server)
+    finally:
+        server.shutdown()
+        openai_helper.openai_config.clear()
+        openai_helper.openai_config.update(original_config)
+
+
+if __name__ == "__main__":
+    test_resilient_request_layer()
+    print("✅ LLM 请求重试与超时测试通过")
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+按站点礼貌访问测试
+验证每个站点的并发上限、令牌桶限速、429 暂停、robots.txt 缓存与排队时间统计
+"""
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from scrape_transport import (
+    HostBusyError, HostGate, PoliteSession, RobotsDisallowedError, get_host_gate, get_transport_metrics
+)
+
+STATE = {"active": 0, "peak": 0, "robots": 0, "pages": 0}
+STATE_LOCK = threading.Lock()
+
+
+class PoliteUpstream(BaseHTTPRequestHandler):
+    """/robots.txt 禁止 /private；/slow 耗时 0.3s；/limited 返回 429"""
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, body=b"ok", headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("content-length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/robots.txt":
+            with STATE_LOCK:
+                STATE["robots"] += 1
+            return self._reply(200, b"User-agent: *\nDisallow: /private\n")
+        if self.path == "/limited":
+            return self._reply(429, headers={"retry-after": "0.6"})
+        with STATE_LOCK:
+            STATE["pages"] += 1
+            STATE["active"] += 1
+            STATE["peak"] = max(STATE["peak"], STATE["active"])
+        time.sleep(0.3 if self.path == "/slow" else 0)
+        with STATE_LOCK:
+            STATE["active"] -= 1
+        self._reply(200)
+
+
+def _start_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), PoliteUpstream)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address
+    return server, f"http://{host}:{port}", f"{host}:{port}"
+
+
+def test_token_bucket_paces_requests():
+    gate = HostGate("bucket.test", max_concurrency=8, rate=5.0, burst=1)
+    started = time.monotonic()
+    for _ in range(4):
+        gate.acquire(timeout=5)
+        gate.release()
+    elapsed = time.monotonic() - started
+    assert elapsed >= 0.55, f"4 次请求耗时 {elapsed:.2f}s，未按 5/s 限速"
+
+    try:
+        gate.acquire(timeout=0.05)
+        raise AssertionError("令牌不足且超过排队时间时应抛出 HostBusyError")
+    except HostBusyError:
+        pass
+    metrics = gate.get_metrics()
+    assert metrics["queued"] >= 3 and metrics["timeouts"] == 1 and metrics["queue_wait_ms"]["max"] > 100
+    print(f"✅ 令牌桶按速率放行（4 次请求 {elapsed:.2f}s），排队超时抛出 HostBusyError")
+
+
+def test_per_host_concurrency_limit():
+    server, base, host = _start_server()
+    os.environ["EASYPROMPT_SCRAPER_HOST_CONCURRENCY"] = "2"
+    os.environ["EASYPROMPT_SCRAPER_HOST_BURST"] = "10"
+    try:
+        get_host_gate(host)  # 按上面的配置创建该站点的 HostGate
+        session = PoliteSession(respect_robots=False)
+        STATE["peak"] = 0
+        threads = [threading.Thread(target=lambda: session.get(f"{base}/slow", timeout=10)) for _ in range(6)]
+        started = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started
+    finally:
+        os.environ.pop("EASYPROMPT_SCRAPER_HOST_CONCURRENCY", None)
+        os.environ.pop("EASYPROMPT_SCRAPER_HOST_BURST", None)
+        server.shutdown()
+
+    assert STATE["peak"] <= 2, f"同一站点最多同时 {STATE['peak']} 个请求"
+    assert elapsed >= 0.85
+    host_metrics = get_transport_metrics()["hosts"][host]
+    assert host_metrics["requests"] == 6 and host_metrics["queued"] >= 4
+    assert host_metrics["queue_wait_ms"]["max"] > 200
+    print(f"✅ 同一站点并发不超过 2（6 个请求 {elapsed:.2f}s），统计排队时间")
+
+
+def test_robots_cached_and_enforced():
+    server, base, host = _start_server()
+    try:
+        session = PoliteSession(respect_robots=True)
+        STATE["robots"] = 0
+        assert session.get(f"{base}/public", timeout=5).status_code == 200
+        try:
+            session.get(f"{base}/private/page", timeout=5)
+            raise AssertionError("robots.txt 禁止的页面不应抓取")
+        except RobotsDisallowedError:
+            pass
+        assert session.get(f"{base}/public/2", timeout=5).status_code == 200
+        assert STATE["robots"] == 1, "robots.txt 应按站点缓存"
+        assert get_transport_metrics()["robots"]["blocked"] >= 1
+    finally:
+        server.shutdown()
+    print("✅ robots.txt 每个站点只获取一次，禁止的页面不抓取")
+
+
+def test_retry_after_pauses_host():
+    server, base, host = _start_server()
+    try:
+        session = PoliteSession(respect_robots=False)
+        assert session.get(f"{base}/limited", timeout=5).status_code == 429
+        started = time.monotonic()
+        session.get(f"{base}/public", timeout=5)
+        waited = time.monotonic() - started
+    finally:
+        server.shutdown()
+    assert waited >= 0.5, f"429 后只等待了 {waited:.2f}s"
+    assert get_transport_metrics()["hosts"][host]["throttled"] == 1
+    print(f"✅ 站点返回 429 后按 Retry-After 暂停（{waited:.2f}s）")
+
+
+if __name__ == "__main__":
+    test_token_bucket_paces_requests()
+    test_per_host_concurrency_limit()
+    test_robots_cached_and_enforced()
+    test_retry_after_pauses_host()
+    print("✅ 按站点礼貌访问测试通过")
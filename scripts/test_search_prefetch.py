@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+搜索预取测试
+验证启发式查询明确时在 LLM 规划期间提前搜索，规划确认后复用结果、否定后停止预取
+"""
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import search_helper as search_module
+from search_helper import SearchHelper, SearchIntent
+from search_prefetch import get_prefetch_metrics, normalize_query
+from web_scraper import web_scraper
+
+SEARCH_DELAY = 0.4
+PLANNER_DELAY = 0.8
+
+
+@contextmanager
+def _fake_environment():
+    """预取只在有 LLM 规划时启用：假装已配置 LLM，网页抓取直接返回失败"""
+    original_api_type = search_module.get_current_api_type
+    search_module.get_current_api_type = lambda: "openai"
+    web_scraper.scrape_webpage = lambda url, deadline=None: {"success": False, "url": url, "content": None}
+    try:
+        yield
+    finally:
+        search_module.get_current_api_type = original_api_type
+        del web_scraper.scrape_webpage
+
+
+def _make_helper(planner_result):
+    """本地假搜索与假规划：搜索每次 0.4s，规划 0.8s"""
+    helper = SearchHelper()
+    calls = []
+    lock = threading.Lock()
+
+    def fake_search(query, max_results=3, deadline=None):
+        with lock:
+            calls.append(query)
+        time.sleep(SEARCH_DELAY)
+        return {"success": True, "query": query, "error": None,
+                "results": [{"title": query, "url": f"https://example.invalid/{query}", "snippet": f"{query} 的摘要"}]}
+
+    def fake_planner(message, heuristic_intent, deadline=None):
+        time.sleep(PLANNER_DELAY)
+        return planner_result(heuristic_intent)
+
+    helper.search_duckduckgo = fake_search
+    helper._call_llm_planner = fake_planner
+    return helper, calls
+
+
+def test_query_normalization():
+    assert normalize_query("《魔法少女小圆》") == normalize_query("魔法少女 小圆")
+    assert normalize_query("Kaname Madoka") == normalize_query("kaname madoka")
+    print("✅ 书名号、空白与大小写不影响查询等价判断")
+
+
+def test_confirmed_speculation_reuses_results():
+    helper, calls = _make_helper(lambda intent: SearchIntent(
+        should_search=True, intent_type=intent.intent_type, query=f"《{intent.query}》", confidence=0.9
+    ))
+    before = get_prefetch_metrics()
+    with _fake_environment():
+        started = time.monotonic()
+        plan = helper.plan_search_strategy("帮我搜索《魔法少女小圆》的角色资料")
+        assert plan["should_search"]
+        result = helper.search_character_info(plan["query"]) if plan["intent_type"] == "character" \
+            else helper.search_concept_info(plan["query"])
+        elapsed = time.monotonic() - started
+
+    after = get_prefetch_metrics()
+    # 预取与本轮搜索共享请求，每个查询词只发出一次
+    assert sorted(calls) == sorted(helper._search_queries(plan["intent_type"], "魔法少女小圆"))
+    assert after["confirmed"] == before["confirmed"] + 1
+    assert after["served_from_prefetch"] > before["served_from_prefetch"]
+    assert after["saved_ms"] > before["saved_ms"]
+    sequential = PLANNER_DELAY + SEARCH_DELAY * len(calls)
+    assert elapsed < sequential - 0.4, f"耗时 {elapsed:.2f}s，未与规划重叠（串行约 {sequential:.2f}s）"
+    assert result["success"]
+    print(f"✅ 规划确认后复用预取结果: {elapsed:.2f}s（串行约 {sequential:.2f}s）")
+
+
+def test_rejected_speculation_stops_prefetch():
+    helper, calls = _make_helper(lambda intent: SearchIntent(should_search=False, reason="创作需求"))
+    before = get_prefetch_metrics()
+    with _fake_environment():
+        plan = helper.plan_search_strategy("搜索《某个原创世界观》")
+    time.sleep(SEARCH_DELAY * 2)
+    after = get_prefetch_metrics()
+
+    assert not plan["should_search"]
+    assert after["rejected"] == before["rejected"] + 1
+    # 规划期间最多完成两次预取，之后不再继续
+    assert 0 < len(calls) <= 3, calls
+    settled = len(calls)
+    time.sleep(SEARCH_DELAY * 2)
+    assert len(calls) == settled
+    print(f"✅ 规划否定后停止预取（共发出 {settled} 次）")
+
+
+def test_weak_focus_is_not_prefetched():
+    helper, calls = _make_helper(lambda intent: None)
+    before = get_prefetch_metrics()
+    with _fake_environment():
+        helper.plan_search_strategy("我想写一个温柔的角色，最近流行什么设定？")
+    assert get_prefetch_metrics()["speculations"] == before["speculations"]
+    assert calls == []
+    print("✅ 查询对象不明确时不预取")
+
+
+if __name__ == "__main__":
+    test_query_normalization()
+    test_confirmed_speculation_reuses_results()
+    test_rejected_speculation_stops_prefetch()
+    test_weak_focus_is_not_prefetched()
+    print("✅ 搜索预取测试通过")
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+会话级锁并发压力测试
+验证同一会话的并发写入不丢失更新，不同会话的写入可以并行；
+线程池中的运行时状态写入与事件循环上的消息写入共用同一把会话锁
+"""
+import sys
+import asyncio
+import random
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from profile_manager import ProfileManager
+from session_manager import SessionManager
+from storage import FileSystemSessionStore
+from schemas import ChatMessage, MessageType, EvaluationData, SessionStatus
+
+
+class YieldingStore(FileSystemSessionStore):
+    """在读写之间主动让出事件循环，模拟真正异步的存储后端"""
+
+    def __init__(self, base_path: str):
+        super().__init__(base_path=base_path)
+        self.in_flight = {}
+        self.max_in_flight_per_session = 0
+        self.max_in_flight_total = 0
+
+    async def get_session(self, session_id, user_id=None):
+        await asyncio.sleep(random.uniform(0, 0.002))
+        return await super().get_session(session_id, user_id)
+
+    async def update_session(self, session, user_id=None):
+        self.in_flight[session.id] = self.in_flight.get(session.id, 0) + 1
+        self.max_in_flight_per_session = max(self.max_in_flight_per_session, self.in_flight[session.id])
+        self.max_in_flight_total = max(self.max_in_flight_total, sum(self.in_flight.values()))
+        try:
+            await asyncio.sleep(random.uniform(0, 0.002))
+            return await super().update_session(session, user_id)
+        finally:
+            self.in_flight[session.id] -= 1
+
+    def _write_record(self, session_dir, record):
+        # 拉长“读取-合并-写回”的窗口，没有锁时并发写入必然互相覆盖
+        time.sleep(random.uniform(0, 0.001))
+        super()._write_record(session_dir, record)
+
+
+async def _run_stress(messages_per_session: int = 40, session_count: int = 4):
+    base_path = tempfile.mkdtemp(prefix="easyprompt_locks_")
+    try:
+        store = YieldingStore(base_path)
+        manager = SessionManager(store=store)
+        sessions = [await manager.create_session(name=f"并发会话{i}") for i in range(session_count)]
+
+        async def add_message(session_id: str, index: int):
+            message = ChatMessage(id=f"{session_id}_{index}", type=MessageType.USER, content=f"消息{index}")
+            await manager.add_message_to_session(session_id, message)
+
+        tasks = []
+        for session in sessions:
+            for index in range(messages_per_session):
+                tasks.append(add_message(session.id, index))
+                if index % 10 == 0:
+                    tasks.append(manager.update_evaluation_data(
+                        session.id, EvaluationData(evaluation_score=float(index))
+                    ))
+                    tasks.append(manager.update_session(session.id, status=SessionStatus.ACTIVE))
+        random.shuffle(tasks)
+        await asyncio.gather(*tasks)
+
+        for session in sessions:
+            stored = await manager.get_session(session.id)
+            ids = {message.id for message in stored.messages}
+            assert stored.message_count == messages_per_session, stored.message_count
+            assert ids == {f"{session.id}_{i}" for i in range(messages_per_session)}
+
+        assert len(manager.session_locks) == 0, "空闲后锁表应被清理"
+        return store
+    finally:
+        shutil.rmtree(base_path, ignore_errors=True)
+
+
+def test_concurrent_mutations_are_linearizable():
+    store = asyncio.run(_run_stress())
+    assert store.max_in_flight_per_session == 1
+    print(f"✅ 同一会话写入串行，未丢失更新")
+
+
+def test_different_sessions_write_in_parallel():
+    store = asyncio.run(_run_stress(messages_per_session=20, session_count=6))
+    assert store.max_in_flight_total > 1
+    print(f"✅ 不同会话并行写入，最大并发: {store.max_in_flight_total}")
+
+
+async def _run_cross_thread(count: int = 30):
+    base_path = tempfile.mkdtemp(prefix="easyprompt_locks_")
+    try:
+        store = YieldingStore(base_path)
+        manager = SessionManager(store=store)
+        session = await manager.create_session(name="跨线程会话")
+        profile_manager = ProfileManager(session_id=session.id, session_store=store)
+
+        def save_state_in_worker():
+            # 与 ConversationHandler.save_session_state 一样在线程池中写入运行时状态
+            for index in range(count):
+                profile_manager.update_session_metadata({"last_critique": f"诊断{index}"})
+
+        async def add_message(index: int):
+            message = ChatMessage(id=f"{session.id}_{index}", type=MessageType.USER, content=f"消息{index}")
+            await manager.add_message_to_session(session.id, message)
+
+        await asyncio.gather(
+            asyncio.to_thread(save_state_in_worker),
+            manager.update_session_state(session.id, {"api_type": "openai"}),
+            *(add_message(index) for index in range(count)),
+        )
+
+        stored = await manager.get_session(session.id)
+        state = store.load_runtime_state(session.id)
+        assert len(manager.session_locks) == 0, "空闲后锁表应被清理"
+        return stored, state
+    finally:
+        shutil.rmtree(base_path, ignore_errors=True)
+
+
+def test_runtime_state_writes_from_threads_keep_messages():
+    count = 30
+    stored, state = asyncio.run(_run_cross_thread(count))
+    assert stored.message_count == count and len(stored.messages) == count, stored.message_count
+    assert state["last_critique"] == f"诊断{count - 1}" and state["api_type"] == "openai", state
+    print(f"✅ 线程中的运行时状态写入与消息写入互斥，{count} 条消息全部保留")
+
+
+if __name__ == "__main__":
+    test_concurrent_mutations_are_linearizable()
+    test_different_sessions_write_in_parallel()
+    test_runtime_state_writes_from_threads_keep_messages()
+    print("✅ 会话锁压力测试通过")
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+结构化输出测试
+验证 JSON 容错解析、解析统计以及搜索规划响应的解析
+"""
+import os
+import sys
+from pathlib import Path
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import structured_output
+from structured_output import (
+    gemini_generation_config,
+    get_structured_output_metrics,
+    openai_response_format,
+    parse_structured,
+    repair_json,
+)
+
+
+def test_repair_json_common_failures():
+    fenced = '好的，结果如下：\n```json\n{"should_search": true, "query": "雷姆",}\n```'
+    assert repair_json(fenced) == {"should_search": True, "query": "雷姆"}
+    assert repair_json('{"should_search": True, "focus_term": None}') == {"should_search": True, "focus_term": None}
+    assert repair_json('{"critique": "被截断的评') == {"critique": "被截断的评"}
+    assert repair_json('{"breakdown": {"core_identity": [1, 2') == {"breakdown": {"core_identity": [1, 2]}}
+    print("✅ 代码块、尾随逗号、Python 字面量和截断对象均可修复")
+
+
+def test_parse_metrics_and_failure_rate():
+    structured_output.parse_metrics.clear()
+    parse_structured('{"is_ready_for_writing": false}', "evaluator")
+    parse_structured('```json\n{"is_ready_for_writing": false}\n```', "evaluator")
+    try:
+        parse_structured("抱歉，我无法评估", "evaluator")
+        assert False, "无法解析时应抛出 ValueError"
+    except ValueError:
+        pass
+    metrics = get_structured_output_metrics()["evaluator"]
+    assert (metrics["direct"], metrics["repaired"], metrics["failed"]) == (1, 1, 1)
+    assert metrics["failure_rate"] == 0.333
+    print(f"✅ 解析统计正确: {metrics}")
+
+
+def test_request_parameters_follow_mode():
+    previous = os.environ.get("EASYPROMPT_STRUCTURED_OUTPUT")
+    try:
+        os.environ["EASYPROMPT_STRUCTURED_OUTPUT"] = "json_schema"
+        schema_format = openai_response_format("planner")
+        assert schema_format["type"] == "json_schema"
+        assert schema_format["json_schema"]["schema"]["required"] == ["should_search", "intent_type", "query"]
+        assert "response_schema" not in gemini_generation_config("evaluator", with_schema=False)
+
+        os.environ["EASYPROMPT_STRUCTURED_OUTPUT"] = "none"
+        assert openai_response_format("evaluator") is None
+        assert gemini_generation_config("evaluator") == {}
+    finally:
+        if previous is None:
+            os.environ.pop("EASYPROMPT_STRUCTURED_OUTPUT", None)
+        else:
+            os.environ["EASYPROMPT_STRUCTURED_OUTPUT"] = previous
+    assert openai_response_format("evaluator") == {"type": "json_object"}
+    print("✅ 请求参数随结构化输出模式切换")
+
+
+def test_planner_response_parsing():
+    from search_helper import SearchHelper
+
+    helper = SearchHelper()
+    parsed = helper._parse_planner_response('```json\n{"should_search": True, "intent_type": "character", "query": "雷姆",}\n```')
+    assert parsed["should_search"] is True and parsed["query"] == "雷姆"
+    assert helper._parse_planner_response("不需要搜索") is None
+    print("✅ 搜索规划响应解析失败时回退到启发式结果")
+
+
+if __name__ == "__main__":
+    test_repair_json_common_failures()
+    test_parse_metrics_and_failure_rate()
+    test_request_parameters_follow_mode()
+    test_planner_response_parsing()
+    print("✅ 结构化输出测试通过")
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+单轮时间预算测试
+验证截止时间在搜索、抓取、LLM 规划请求之间传递，预算不足时可选步骤被跳过或截断
+"""
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import openai_helper
+from search_helper import search_helper
+from turn_deadline import TurnDeadline, get_turn_metrics, stage_timeout
+from web_scraper import web_scraper
+
+
+class SlowUpstream(BaseHTTPRequestHandler):
+    """2 秒后才返回，模拟缓慢的规划模型"""
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("content-length", 0)))
+        time.sleep(2)
+        try:
+            self.send_response(200)
+            self.send_header("content-length", "2")
+            self.end_headers()
+            self.wfile.write(b"{}")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+def test_budget_and_stage_timeouts():
+    deadline = TurnDeadline(5.0, slo=8.0)
+    assert 4.5 < deadline.timeout(10) <= 5.0
+    assert deadline.timeout(2) == 2
+    assert deadline.allows("search")
+
+    with deadline.stage("planner"):
+        assert stage_timeout(30, "planner") <= 5.0
+        assert stage_timeout(30, "conversation") == 30, "对话不受截止时间约束"
+    assert stage_timeout(30, "planner") == 30, "离开步骤后不再受约束"
+
+    spent = TurnDeadline(0.0)
+    assert spent.expired() and spent.timeout(10) == 0.5
+    assert not spent.allows("link") and spent.skipped == ["link"]
+    assert get_turn_metrics()["skipped"]["link"] >= 1
+
+    unlimited = TurnDeadline(None)
+    assert unlimited.allows("evaluator") and unlimited.timeout(20) == 20
+    print("✅ 剩余预算正确约束步骤超时，预算不足时跳过可选步骤")
+
+
+def test_search_truncated_by_deadline():
+    queries, scrape_deadlines = [], []
+
+    def fake_search(query, max_results=3, deadline=None):
+        queries.append(query)
+        time.sleep(0.6)
+        return {"success": True, "query": query, "error": None,
+                "results": [{"title": query, "url": f"http://example.invalid/{len(queries)}", "snippet": "摘要"}]}
+
+    def fake_scrape(url, deadline=None):
+        scrape_deadlines.append(deadline.timeout(web_scraper.timeout))
+        return {"success": True, "url": url, "title": "页面", "content": "测试概念是一种用于测试的概念。"}
+
+    original_scrape = web_scraper.scrape_webpage
+    search_helper.search_duckduckgo = fake_search
+    web_scraper.scrape_webpage = fake_scrape
+    try:
+        result = search_helper.search_concept_info("测试概念", deadline=TurnDeadline(2.5))
+    finally:
+        del search_helper.search_duckduckgo
+        web_scraper.scrape_webpage = original_scrape
+
+    assert result["success"]
+    assert len(queries) == 1, f"预算只够一次搜索，实际执行了 {len(queries)} 次"
+    assert len(scrape_deadlines) == 1 and scrape_deadlines[0] < 2.0
+    print("✅ 预算不足时减少搜索词，抓取超时取剩余预算")
+
+    queries.clear()
+    search_helper.search_duckduckgo = fake_search
+    try:
+        for search in (search_helper.search_concept_info, search_helper.search_character_info):
+            result = search("测试概念", deadline=TurnDeadline(0.1))
+            assert not result["success"]
+    finally:
+        del search_helper.search_duckduckgo
+    assert queries == [], f"预算已用完仍执行了搜索: {queries}"
+    print("✅ 预算用完时第一个搜索词也不再执行")
+
+
+def test_link_scrape_skipped_when_budget_spent():
+    def no_scrape(url, deadline=None):
+        raise AssertionError("预算用完时不应抓取网页")
+
+    web_scraper.scrape_webpage = no_scrape
+    try:
+        result = web_scraper.process_user_input("看看这个 https://example.com/wiki", deadline=TurnDeadline(0.5))
+    finally:
+        del web_scraper.scrape_webpage
+    assert result["has_url"] and result["web_content"] is None
+    assert "时间预算不足" in result["error"]
+    print("✅ 预算用完时跳过链接抓取并给出原因")
+
+
+def test_planner_request_bounded_by_deadline():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SlowUpstream)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    original_config = dict(openai_helper.openai_config)
+    try:
+        host, port = server.server_address
+        openai_helper.init_openai_llm("sk-test", f"http://{host}:{port}/v1", "test-model")
+        deadline = TurnDeadline(1.0)
+        started = time.monotonic()
+        try:
+            with deadline.stage("planner"):
+                openai_helper._make_openai_request([{"role": "user", "content": "hi"}], task="planner")
+            raise AssertionError("规划请求应在预算用完时超时")
+        except Exception as exc:
+            assert "超时" in str(exc), exc
+        elapsed = time.monotonic() - started
+        assert elapsed < 1.8, f"规划请求耗时 {elapsed:.2f}s，超过了本轮预算"
+        print(f"✅ 规划请求在剩余预算内超时且不再重试 ({elapsed:.2f}s)")
+    finally:
+        server.shutdown()
+        openai_helper.openai_config.clear()
+        openai_helper.openai_config.update(original_config)
+
+
+if __name__ == "__main__":
+    test_budget_and_stage_timeouts()
+    test_search_truncated_by_deadline()
+    test_link_scrape_skipped_when_budget_spent()
+    test_planner_request_bounded_by_deadline()
+    print("✅ 单轮时间预算测试通过")
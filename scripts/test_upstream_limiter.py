@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+上游并发准入测试
+验证优先级、同级用户轮询、429 后的暂停与并发下调，排队超时，以及异步等待被取消后名额不泄漏
+"""
+import asyncio
+import sys
+import threading
+import time
+from pathlib import Path
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from upstream_limiter import UpstreamBusyError, UpstreamLimiter, UpstreamThrottledError
+
+
+def _queue_in_order(limiter, requests):
+    """依次启动排队的线程，返回获得名额的顺序"""
+    order = []
+    threads = []
+    for task, user, label in requests:
+        def run(task=task, user=user, label=label):
+            with limiter.slot(task, user=user):
+                order.append(label)
+        queued_before = limiter.stats["queued"]
+        thread = threading.Thread(target=run)
+        thread.start()
+        threads.append(thread)
+        while limiter.stats["queued"] == queued_before:
+            time.sleep(0.001)
+    return order, threads
+
+
+def test_priority_and_per_user_fairness():
+    limiter = UpstreamLimiter("test", max_in_flight=1)
+    with limiter.slot("conversation", user="holder"):
+        order, threads = _queue_in_order(limiter, [
+            ("planner", "a", "planner-a"),
+            ("evaluator", "a", "eval-a1"),
+            ("evaluator", "a", "eval-a2"),
+            ("evaluator", "a", "eval-a3"),
+            ("evaluator", "b", "eval-b1"),
+            ("conversation", "c", "chat-c"),
+        ])
+    for thread in threads:
+        thread.join(timeout=5)
+    assert order == ["chat-c", "eval-a1", "eval-b1", "eval-a2", "eval-a3", "planner-a"], order
+    waits = limiter.get_metrics()["queue_wait_ms"]
+    assert waits["evaluation"]["count"] == 4 and waits["planner"]["count"] == 1
+    print(f"✅ 优先级与同级用户轮询正确: {order}")
+
+
+def test_throttle_pauses_and_reduces_concurrency():
+    limiter = UpstreamLimiter("test", max_in_flight=4)
+    try:
+        with limiter.slot("evaluator", user="a"):
+            raise UpstreamThrottledError("429", retry_after=0.2)
+    except UpstreamThrottledError:
+        pass
+    metrics = limiter.get_metrics()
+    assert metrics["limit"] == 2 and metrics["throttled"] == 1 and metrics["cooldown_remaining_s"] > 0
+
+    started = time.monotonic()
+    with limiter.slot("conversation", user="b"):
+        waited = time.monotonic() - started
+    assert waited >= 0.15, waited
+
+    for _ in range(20):
+        with limiter.slot("conversation", user="b"):
+            pass
+    assert limiter.get_metrics()["limit"] == 4
+    print(f"✅ 429 后暂停 {waited:.2f}s，并发上限减半后逐步恢复")
+
+
+def test_queue_timeout_and_async_slot():
+    limiter = UpstreamLimiter("test", max_in_flight=1, queue_timeout=0.05)
+    with limiter.slot("conversation", user="a"):
+        try:
+            with limiter.slot("planner", user="b"):
+                assert False, "不应获得名额"
+        except UpstreamBusyError:
+            pass
+
+        async def wait_async():
+            async with limiter.slot_async("planner", user="b"):
+                pass
+
+        try:
+            asyncio.run(wait_async())
+            assert False, "不应获得名额"
+        except UpstreamBusyError:
+            pass
+
+    async def run_async():
+        async with limiter.slot_async("writer", user="a"):
+            return limiter.in_flight
+
+    assert asyncio.run(run_async()) == 1 and limiter.in_flight == 0
+    assert limiter.get_metrics()["timeouts"] == 2
+    print("✅ 排队超时与异步名额正常")
+
+
+class _Response:
+    def __init__(self, status_code, retry_after=None):
+        self.status_code = status_code
+        self.text = ""
+        self.headers = {"retry-after": retry_after} if retry_after else {}
+
+
+class _ThrottlingClient:
+    def __init__(self):
+        self.responses = [_Response(429, retry_after="0.1"), _Response(200)]
+
+    def post(self, url, headers=None, json=None, timeout=None):
+        return self.responses.pop(0)
+
+
+def test_openai_request_honors_retry_after():
+    import openai_helper
+    from upstream_limiter import get_upstream_limiter
+
+    limiter = get_upstream_limiter("openai")
+    throttled_before = limiter.stats["throttled"]
+    started = time.monotonic()
+    response = openai_helper._post_with_admission(_ThrottlingClient(), "http://upstream", {}, {}, "evaluator")
+    assert response.status_code == 200
+    assert time.monotonic() - started >= 0.08
+    assert limiter.stats["throttled"] == throttled_before + 1
+    print("✅ OpenAI 请求收到 429 后按 Retry-After 排队重试")
+
+
+async def _cancel_waiter(limiter, after_grant: bool):
+    """占满唯一名额后让一个异步请求排队，然后取消它（after_grant: 名额刚发放给它之后再取消）"""
+    async def wait_for_slot():
+        async with limiter.slot_async("conversation", user="b"):
+            pass
+
+    async def cancel_and_wait(waiter):
+        waiter.cancel()
+        try:
+            await waiter
+            assert False, "应当被取消"
+        except asyncio.CancelledError:
+            pass
+
+    queued_before = limiter.stats["queued"]
+    with limiter.slot("conversation", user="a"):
+        waiter = asyncio.ensure_future(wait_for_slot())
+        while limiter.stats["queued"] == queued_before:
+            await asyncio.sleep(0)
+        if not after_grant:
+            await cancel_and_wait(waiter)
+    if after_grant:
+        # 退出 with 时 release() 已把名额发给排队的请求，它还没来得及恢复运行就被取消
+        await cancel_and_wait(waiter)
+
+
+def test_cancelled_async_waiter_does_not_leak_slot():
+    for after_grant in (False, True):
+        limiter = UpstreamLimiter("cancel", max_in_flight=1, queue_timeout=5)
+        asyncio.run(_cancel_waiter(limiter, after_grant))
+        metrics = limiter.get_metrics()
+        assert limiter.in_flight == 0, metrics
+        assert sum(metrics["queue_depth"].values()) == 0, metrics
+        assert metrics["cancelled"] == (0 if after_grant else 1), metrics
+    print("✅ 排队中被取消的异步请求移出队列，已发放的名额被归还")
+
+
+if __name__ == "__main__":
+    test_priority_and_per_user_fairness()
+    test_throttle_pauses_and_reduces_concurrency()
+    test_queue_timeout_and_async_slot()
+    test_cancelled_async_waiter_does_not_leak_slot()
+    test_openai_request_honors_retry_after()
+    print("✅ 上游并发准入测试通过")
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+网页要点缓存测试
+验证要点按规范化 URL + 正文哈希缓存并跨轮复用，生成失败或预算不足时退回段落摘录
+"""
+import os
+import sys
+from contextlib import contextmanager
+from pathlib import Path
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import web_brief
+from conversation_memory import estimate_tokens
+from passage_selector import select_passages
+from turn_deadline import TurnDeadline
+from web_brief import brief_cache, get_brief_metrics, get_web_brief
+
+PAGE = "\n".join(
+    ["鹿目圆是《魔法少女小圆》的主角，性格温柔，成为魔法少女后使用弓箭。"] * 3
+    + ["这一段介绍了作品的制作背景与周边商品的发售情况，与角色本身关系不大。" * 4] * 20
+)
+BRIEF = "- 身份：《魔法少女小圆》主角\n- 性格：温柔\n- 能力：弓箭"
+
+
+@contextmanager
+def _fake_llm(fail=False):
+    """假装已配置 LLM；要点生成只返回固定文本并记录调用次数"""
+    calls = []
+
+    def fake_prompt(system_prompt, user_prompt, task=None):
+        calls.append(user_prompt)
+        if fail:
+            raise RuntimeError("upstream 503")
+        return BRIEF
+
+    originals = (web_brief.run_structured_prompt, web_brief.get_current_api_type, web_brief.llm_unavailable_reason)
+    web_brief.run_structured_prompt = fake_prompt
+    web_brief.get_current_api_type = lambda: "openai"
+    web_brief.llm_unavailable_reason = lambda task="conversation": None
+    os.environ["EASYPROMPT_WEB_BRIEF"] = "1"
+    brief_cache.clear()
+    try:
+        yield calls
+    finally:
+        web_brief.run_structured_prompt, web_brief.get_current_api_type, web_brief.llm_unavailable_reason = originals
+        os.environ.pop("EASYPROMPT_WEB_BRIEF", None)
+        brief_cache.clear()
+
+
+def _page(url, content=PAGE):
+    return {"success": True, "url": url, "title": "鹿目圆", "content": content}
+
+
+def test_disabled_by_default():
+    os.environ.pop("EASYPROMPT_WEB_BRIEF", None)
+    assert get_web_brief(_page("https://example.invalid/madoka"), "character", "鹿目圆") is None
+    print("✅ 默认关闭，不调用模型")
+
+
+def test_brief_cached_by_url_and_content_hash():
+    with _fake_llm() as calls:
+        before = get_brief_metrics()
+        first = get_web_brief(_page("https://Example.invalid/%E9%B9%BF%E7%9B%AE%E5%9C%86#top"), "character", "鹿目圆")
+        again = get_web_brief(_page("https://example.invalid/鹿目圆/"), "character", "鹿目圆")
+        assert first == again == BRIEF
+        assert len(calls) == 1, "同一页面（URL 写法不同）只生成一次要点"
+
+        changed = get_web_brief(_page("https://example.invalid/鹿目圆", PAGE + "\n新增段落内容。"), "character", "鹿目圆")
+        assert changed == BRIEF and len(calls) == 2, "正文变化时重新生成"
+        after = get_brief_metrics()
+
+    assert after["cache_hits"] == before["cache_hits"] + 1
+    assert after["generated"] == before["generated"] + 2
+    excerpt = select_passages(PAGE, "鹿目圆的性格", 600, focus="鹿目圆")
+    assert estimate_tokens(BRIEF) < estimate_tokens(excerpt) / 4
+    print(f"✅ 同一页面复用要点，注入 {estimate_tokens(BRIEF)} tokens（段落摘录 {estimate_tokens(excerpt)}）")
+
+
+def test_failure_and_short_budget_fall_back():
+    with _fake_llm(fail=True) as calls:
+        assert get_web_brief(_page("https://example.invalid/a"), "concept", "概念") is None
+        assert len(brief_cache) == 0, "失败结果不缓存"
+    with _fake_llm() as calls:
+        assert get_web_brief(_page("https://example.invalid/b"), "link", deadline=TurnDeadline(1.0)) is None
+        assert calls == [], "预算不足时不生成要点"
+    print("✅ 生成失败或预算不足时返回 None，由调用方退回段落摘录")
+
+
+if __name__ == "__main__":
+    test_disabled_by_default()
+    test_brief_cached_by_url_and_content_hash()
+    test_failure_and_short_budget_fall_back()
+    print("✅ 网页要点缓存测试通过")
@@ -3,11 +3,23 @@ Handles all interactions with the web search tool.
 """
 import json
 import re
-import requests
 from dataclasses import dataclass, field
 from typing import Optional, Dict, Any, List
 from web_scraper import web_scraper
-from llm_helper import run_structured_prompt, get_current_api_type
+from llm_helper import run_structured_prompt, get_current_api_type, llm_unavailable_reason
+from structured_output import parse_structured
+from circuit_breaker import get_breaker
+from scrape_transport import PoliteSession
+from turn_deadline import TurnDeadline
+from search_prefetch import SearchResultCache, Speculation
+from runtime_config import env_bool, env_float
+
+# 搜索上游主机（熔断器按主机区分）
+DUCKDUCKGO_API_HOST = 'api.duckduckgo.com'
+DUCKDUCKGO_HTML_HOST = 'html.duckduckgo.com'
+
+# 等待进行中的（预取）搜索的最长秒数：API 与 HTML 备用搜索各 10s
+SEARCH_WAIT_TIMEOUT = 20.0
 
 
 @dataclass
@@ -40,10 +52,13 @@ class SearchHelper:
     """
     
     def __init__(self):
-        self.session = requests.Session()
+        # 搜索接口同样按站点限并发与速率（不检查 robots.txt）
+        self.session = PoliteSession(respect_robots=False)
         self.session.headers.update({
             'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
         })
+        # 搜索结果缓存：预取与本轮搜索共享进行中的请求（见 search_prefetch）
+        self.search_cache = SearchResultCache(ttl=env_float("EASYPROMPT_SEARCH_CACHE_TTL", 120.0))
 
         # Precompiled keyword lists for intent detection
         self.explicit_search_words = [
@@ -289,18 +304,76 @@ class SearchHelper:
             return 'fresh_news'
         return 'concept'
 
-    def plan_search_strategy(self, message: str) -> Dict[str, Any]:
-        """Assess whether the assistant should perform a web search before answering."""
+    def plan_search_strategy(self, message: str, deadline: Optional[TurnDeadline] = None) -> Dict[str, Any]:
+        """
+        Assess whether the assistant should perform a web search before answering.
+        With a turn deadline the LLM planner is skipped once the budget is nearly spent.
+        """
         content = (message or "").strip()
         if not content:
             return SearchIntent(False).to_dict()
 
         heuristic_intent = self._build_heuristic_intent(content)
+        # 启发式已有明确的查询对象时，等待 LLM 规划的同时先发出搜索
+        speculation = self._start_speculation(content, heuristic_intent, deadline)
+
+        llm_plan = self._call_llm_planner(content, heuristic_intent, deadline)
+        plan = (llm_plan or heuristic_intent).to_dict()
+        if speculation is not None:
+            if speculation.resolve(plan):
+                print(f"⚡ 搜索规划确认了预取的查询: {plan['query']}")
+            else:
+                print(f"↩️ 搜索规划未采用预取的查询，停止预取: {heuristic_intent.query}")
+        return plan
+
+    def _has_strong_focus(self, content: str, intent: SearchIntent) -> bool:
+        """查询对象足够明确（用户明确要求搜索，或用引号/书名号标出名称），规划大概率会采用"""
+        if not intent.should_search or not intent.query or not intent.focus_term:
+            return False
+        if 'explicit_request' in intent.signals:
+            return True
+        return bool(re.search(r'[“"《「『【]\s*' + re.escape(intent.focus_term), content))
 
-        llm_plan = self._call_llm_planner(content, heuristic_intent)
-        if llm_plan:
-            return llm_plan.to_dict()
-        return heuristic_intent.to_dict()
+    def _start_speculation(self, content: str, intent: SearchIntent,
+                           deadline: Optional[TurnDeadline]) -> Optional[Speculation]:
+        if not env_bool("EASYPROMPT_SEARCH_PREFETCH", True):
+            return None
+        # 没有 LLM 规划就没有需要重叠的等待
+        if get_current_api_type() == "none" or not self._has_strong_focus(content, intent):
+            return None
+        if self.search_unavailable_reason() or (deadline is not None and deadline.expired()):
+            return None
+        queries = self._search_queries(intent.intent_type, intent.query)
+        print(f"🔮 预取搜索: {intent.query}（等待搜索规划确认）")
+        return Speculation(
+            intent.intent_type, intent.query, queries,
+            lambda query: self._cached_search(query, 2, deadline, speculative=True)
+        )
+
+    def _search_queries(self, intent_type: str, name: str) -> List[str]:
+        """search_character_info / search_concept_info 依次使用的查询词"""
+        if intent_type == 'character':
+            return [
+                f"{name} 萌娘百科",
+                f"{name} 维基百科",
+                f"{name} 角色设定",
+            ]
+        return [
+            name,
+            f"{name} 是什么",
+            f"{name} 意义",
+            f"{name} 用途"
+        ]
+
+    def _cached_search(self, query: str, max_results: int, deadline: Optional[TurnDeadline],
+                       speculative: bool = False) -> Dict[str, Any]:
+        """经由搜索结果缓存执行 search_duckduckgo（复用预取或进行中的同一查询）"""
+        return self.search_cache.fetch(
+            query, max_results,
+            lambda: self.search_duckduckgo(query, max_results=max_results, deadline=deadline),
+            speculative=speculative,
+            wait_timeout=self._timeout(SEARCH_WAIT_TIMEOUT, deadline)
+        )
 
     def _build_heuristic_intent(self, content: str) -> SearchIntent:
         focus_term = self._extract_focus_term(content)
@@ -340,9 +413,17 @@ class SearchHelper:
             signals=signals
         )
 
-    def _call_llm_planner(self, message: str, heuristic_intent: SearchIntent) -> Optional[SearchIntent]:
+    def _call_llm_planner(self, message: str, heuristic_intent: SearchIntent,
+                          deadline: Optional[TurnDeadline] = None) -> Optional[SearchIntent]:
         if get_current_api_type() == "none":
             return None
+        if deadline is not None and not deadline.allows("planner"):
+            print(f"⏱️ 本轮时间预算不足（剩余 {deadline.remaining():.1f}s），跳过LLM搜索规划")
+            return None
+        unavailable = llm_unavailable_reason("planner")
+        if unavailable:
+            print(f"⚡ 跳过LLM搜索规划，使用启发式结果: {unavailable}")
+            return None
 
         heuristic_payload = heuristic_intent.to_dict().copy()
         try:
@@ -355,7 +436,7 @@ class SearchHelper:
                 "</HeuristicSuggestion>\n"
                 "请基于用户输入与启发式建议，判断是否需要联网搜索，并输出严格的JSON。"
             )
-            response = run_structured_prompt(self.llm_planner_system_prompt, user_prompt)
+            response = run_structured_prompt(self.llm_planner_system_prompt, user_prompt, task="planner")
             parsed = self._parse_planner_response(response)
             if not parsed:
                 return None
@@ -387,15 +468,10 @@ class SearchHelper:
     def _parse_planner_response(self, response_text: str) -> Optional[Dict[str, Any]]:
         if not response_text:
             return None
-        cleaned = response_text.strip()
-        if cleaned.startswith("```"):
-            cleaned = cleaned.strip('`')
-            if cleaned.lower().startswith("json"):
-                cleaned = cleaned[4:]
-        cleaned = cleaned.strip()
         try:
-            return json.loads(cleaned)
-        except json.JSONDecodeError:
+            return parse_structured(response_text, "planner")
+        except ValueError as exc:
+            print(f"⚠️ 搜索规划响应无法解析，回退到启发式结果: {exc}")
             return None
     
     def detect_character_query(self, message: str) -> Optional[Dict[str, Any]]:
@@ -432,13 +508,28 @@ class SearchHelper:
             }
         return None
     
-    def search_duckduckgo(self, query: str, max_results: int = 3) -> Dict[str, Any]:
+    @staticmethod
+    def _timeout(cap: float, deadline: Optional[TurnDeadline]) -> float:
+        return deadline.timeout(cap) if deadline is not None else cap
+
+    def search_unavailable_reason(self) -> Optional[str]:
+        """DuckDuckGo 的两个入口都在熔断中时返回原因，调用方据此跳过联网增强"""
+        api_breaker = get_breaker(DUCKDUCKGO_API_HOST)
+        html_breaker = get_breaker(DUCKDUCKGO_HTML_HOST)
+        if api_breaker.is_open() and html_breaker.is_open():
+            retry_in = max(api_breaker.retry_in(), html_breaker.retry_in())
+            return f"搜索服务连续失败，已熔断（约 {retry_in:.0f}s 后重试）"
+        return None
+
+    def search_duckduckgo(self, query: str, max_results: int = 3,
+                          deadline: Optional[TurnDeadline] = None) -> Dict[str, Any]:
         """
         使用DuckDuckGo进行搜索
         
         Args:
             query: 搜索关键词
             max_results: 最大返回结果数
+            deadline: 本轮截止时间，请求超时不超过剩余预算
             
         Returns:
             {
@@ -460,10 +551,14 @@ class SearchHelper:
             }
             
             print(f"正在搜索: {query}")
-            response = self.session.get(api_url, params=params, timeout=10)
-            response.raise_for_status()
-            
-            data = response.json()
+            if get_breaker(DUCKDUCKGO_API_HOST).is_open():
+                # Instant Answer API 熔断中，直接走下面的 HTML 搜索
+                data = {}
+            else:
+                with get_breaker(DUCKDUCKGO_API_HOST).guard():
+                    response = self.session.get(api_url, params=params, timeout=self._timeout(10, deadline))
+                    response.raise_for_status()
+                data = response.json()
             
             results = []
             
@@ -489,7 +584,7 @@ class SearchHelper:
             
             # 如果DuckDuckGo没有直接结果，尝试使用HTML搜索
             if not results:
-                html_results = self._search_duckduckgo_html(query, max_results)
+                html_results = self._search_duckduckgo_html(query, max_results, deadline)
                 if html_results['success']:
                     results = html_results['results']
             
@@ -509,7 +604,8 @@ class SearchHelper:
                 'error': str(e)
             }
     
-    def _search_duckduckgo_html(self, query: str, max_results: int = 3) -> Dict[str, Any]:
+    def _search_duckduckgo_html(self, query: str, max_results: int = 3,
+                                deadline: Optional[TurnDeadline] = None) -> Dict[str, Any]:
         """
         使用DuckDuckGo HTML搜索作为备用方案
         """
@@ -519,8 +615,9 @@ class SearchHelper:
             search_url = 'https://html.duckduckgo.com/html/'
             data = {'q': query}
             
-            response = self.session.post(search_url, data=data, timeout=10)
-            response.raise_for_status()
+            with get_breaker(DUCKDUCKGO_HTML_HOST).guard():
+                response = self.session.post(search_url, data=data, timeout=self._timeout(10, deadline))
+                response.raise_for_status()
             
             soup = BeautifulSoup(response.text, 'html.parser')
             results = []
@@ -712,12 +809,13 @@ class SearchHelper:
             'key_points': key_points[:4]
         }
     
-    def search_character_info(self, character_name: str) -> Dict[str, Any]:
+    def search_character_info(self, character_name: str, deadline: Optional[TurnDeadline] = None) -> Dict[str, Any]:
         """
         搜索角色信息，优先使用wiki/百科类网站
         
         Args:
             character_name: 角色名称
+            deadline: 本轮截止时间；预算不足时少搜几个查询词、少抓几个候选网页
             
         Returns:
             {
@@ -730,17 +828,18 @@ class SearchHelper:
             }
         """
         # 构建多个搜索查询，提高搜索质量
-        search_queries = [
-            f"{character_name} 萌娘百科",
-            f"{character_name} 维基百科",
-            f"{character_name} 角色设定",
-        ]
+        search_queries = self._search_queries('character', character_name)
         
         all_results = []
         
         # 执行多次搜索，收集结果
         for query in search_queries:
-            search_result = self.search_duckduckgo(query, max_results=2)
+            if self.search_unavailable_reason():
+                break
+            if deadline is not None and not deadline.allows("search"):
+                print("⏱️ 本轮时间预算不足，停止执行剩余的搜索查询")
+                break
+            search_result = self._cached_search(query, 2, deadline)
             if search_result['success'] and search_result['results']:
                 all_results.extend(search_result['results'])
         
@@ -773,11 +872,14 @@ class SearchHelper:
         character_details = None
         
         for i, result in enumerate(prioritized_results[:3]):  # 尝试前3个结果
+            if deadline is not None and not deadline.allows("scrape"):
+                print("⏱️ 本轮时间预算不足，停止抓取候选网页，使用搜索摘要")
+                break
             url = result.get('url', '')
             if url and url.startswith('http'):
                 try:
                     print(f"尝试抓取第 {i+1} 个结果: {url}")
-                    content = web_scraper.scrape_webpage(url)
+                    content = web_scraper.scrape_webpage(url, deadline=deadline)
                     
                     if content and content.get('success') and content.get('content'):
                         web_content = content
@@ -800,18 +902,18 @@ class SearchHelper:
             'error': None
         }
 
-    def search_concept_info(self, concept_name: str) -> Dict[str, Any]:
-        """搜索通用概念/术语的信息"""
-        search_queries = [
-            concept_name,
-            f"{concept_name} 是什么",
-            f"{concept_name} 意义",
-            f"{concept_name} 用途"
-        ]
+    def search_concept_info(self, concept_name: str, deadline: Optional[TurnDeadline] = None) -> Dict[str, Any]:
+        """搜索通用概念/术语的信息（deadline 与 search_character_info 相同）"""
+        search_queries = self._search_queries('concept', concept_name)
 
         aggregated_results: List[Dict[str, Any]] = []
         for query in search_queries:
-            search_result = self.search_duckduckgo(query, max_results=2)
+            if self.search_unavailable_reason():
+                break
+            if deadline is not None and not deadline.allows("search"):
+                print("⏱️ 本轮时间预算不足，停止执行剩余的搜索查询")
+                break
+            search_result = self._cached_search(query, 2, deadline)
             if search_result['success'] and search_result['results']:
                 aggregated_results.extend(search_result['results'])
 
@@ -840,10 +942,13 @@ class SearchHelper:
         highlights = {'definition': '', 'key_points': []}
 
         for i, result in enumerate(prioritized_results[:3]):
+            if deadline is not None and not deadline.allows("scrape"):
+                print("⏱️ 本轮时间预算不足，停止抓取候选网页，使用搜索摘要")
+                break
             url = result.get('url', '')
             if url and url.startswith('http'):
                 try:
-                    content = web_scraper.scrape_webpage(url)
+                    content = web_scraper.scrape_webpage(url, deadline=deadline)
                     if content and content.get('success') and content.get('content'):
                         web_content = content
                         highlights = self._extract_concept_highlights(content.get('content', ''))
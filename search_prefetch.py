@@ -0,0 +1,203 @@
+"""
+Speculative search prefetch
+搜索预取：启发式判断已有明确的查询对象（《名称》、"搜索 X"）时，在等待 LLM 搜索规划的
+同时先发出这些搜索；规划确认同一查询后直接使用结果，省掉一次规划往返的等待
+
+- SearchResultCache：按规范化查询词缓存 search_duckduckgo 的结果，进行中的请求以 Future
+  共享（预取线程和本轮搜索不会重复请求同一个词）；失败结果不缓存
+- 规划否定或改用其他查询时停止后续预取；已完成的结果保留
+  EASYPROMPT_SEARCH_CACHE_TTL 秒（默认 120），之后的轮次搜索同一个词仍可复用
+- 统计预取命中率（规划确认的比例）与节省的等待时间
+
+开关：EASYPROMPT_SEARCH_PREFETCH（默认开启）
+"""
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+_QUERY_NOISE = re.compile(r'[\s“”"《》「」『』【】()（）\'‘’]+')
+
+
+def normalize_query(query: str) -> str:
+    """判断两个查询是否等价时使用：忽略大小写、空白和引号/书名号"""
+    return _QUERY_NOISE.sub('', (query or '').lower())
+
+
+def search_family(intent_type: str) -> str:
+    """角色搜索与概念/资讯搜索使用不同的查询词组合"""
+    return 'character' if intent_type == 'character' else 'concept'
+
+
+# --- 统计 ---
+
+_metrics_lock = threading.Lock()
+prefetch_metrics: Dict[str, Any] = {
+    "speculations": 0,
+    "confirmed": 0,
+    "rejected": 0,
+    "prefetched_queries": 0,
+    "served_from_prefetch": 0,
+    "wasted_queries": 0,
+    "saved_ms": 0.0,
+}
+
+
+def _count(key: str, amount=1):
+    with _metrics_lock:
+        prefetch_metrics[key] += amount
+
+
+def get_prefetch_metrics() -> Dict[str, Any]:
+    with _metrics_lock:
+        metrics = dict(prefetch_metrics)
+    resolved = metrics["confirmed"] + metrics["rejected"]
+    metrics["hit_rate"] = round(metrics["confirmed"] / resolved, 3) if resolved else 0.0
+    metrics["saved_ms"] = round(metrics["saved_ms"], 1)
+    served = metrics["served_from_prefetch"]
+    metrics["avg_saved_ms"] = round(metrics["saved_ms"] / served, 1) if served else 0.0
+    return metrics
+
+
+# --- 结果缓存 ---
+
+class _Entry:
+    __slots__ = ("future", "started_at", "completed_at", "speculative", "served")
+
+    def __init__(self, speculative: bool):
+        self.future: Future = Future()
+        self.started_at = time.monotonic()
+        self.completed_at: Optional[float] = None
+        self.speculative = speculative
+        self.served = False
+
+
+class SearchResultCache:
+    """
+    搜索结果缓存（含进行中的请求）
+
+    Args:
+        ttl: 成功结果保留的秒数
+        max_entries: 最多保留的查询数
+    """
+
+    def __init__(self, ttl: float = 120.0, max_entries: int = 64):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, int], _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def fetch(self, query: str, max_results: int, search_fn: Callable[[], Dict[str, Any]],
+              speculative: bool = False, wait_timeout: Optional[float] = None) -> Dict[str, Any]:
+        """
+        返回某个查询的搜索结果：已缓存或正在请求时直接复用，否则调用 search_fn
+
+        wait_timeout: 等待他人进行中的请求的最长秒数，超时返回失败结果
+        """
+        key = (normalize_query(query), max_results)
+        with self._lock:
+            self._evict_locked(time.monotonic())
+            entry = self._entries.get(key)
+            owner = entry is None
+            if owner:
+                entry = _Entry(speculative)
+                self._entries[key] = entry
+                if speculative:
+                    _count("prefetched_queries")
+
+        if owner:
+            self._run(key, entry, search_fn)
+        elif not speculative:
+            self._mark_served(entry)
+
+        try:
+            return entry.future.result(timeout=None if owner else wait_timeout)
+        except FutureTimeoutError:
+            return {'success': False, 'query': query, 'results': [], 'error': '等待预取的搜索结果超时'}
+
+    def _run(self, key, entry: _Entry, search_fn):
+        try:
+            result = search_fn()
+        except Exception as exc:
+            result = {'success': False, 'query': key[0], 'results': [], 'error': str(exc)}
+        entry.completed_at = time.monotonic()
+        if not result.get('success'):
+            with self._lock:
+                if self._entries.get(key) is entry:
+                    del self._entries[key]
+        entry.future.set_result(result)
+
+    def _mark_served(self, entry: _Entry):
+        """本轮搜索用上了预取的请求：记一次命中，节省的时间是它提前运行的部分"""
+        with self._lock:
+            if not entry.speculative or entry.served:
+                return
+            entry.served = True
+            finished = entry.completed_at if entry.completed_at is not None else time.monotonic()
+        _count("served_from_prefetch")
+        _count("saved_ms", (finished - entry.started_at) * 1000)
+
+    def _evict_locked(self, now: float):
+        for key, entry in list(self._entries.items()):
+            if entry.completed_at is not None and now - entry.completed_at > self.ttl:
+                self._drop_locked(key, entry)
+        while len(self._entries) >= self.max_entries:
+            key, entry = next(iter(self._entries.items()))
+            self._drop_locked(key, entry)
+
+    def _drop_locked(self, key, entry: _Entry):
+        # 仍在等待该请求的调用方持有 Future，从缓存移除不影响它们
+        if entry.speculative and not entry.served:
+            _count("wasted_queries")
+        del self._entries[key]
+
+
+# --- 预取 ---
+
+_prefetch_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="search-prefetch")
+
+
+class Speculation:
+    """
+    一次预取：按启发式的查询依次发出搜索，直到规划给出结论
+
+    Args:
+        intent_type: 启发式判断的意图类型
+        query: 启发式查询
+        queries: 本轮搜索会使用的查询词（与 search_*_info 相同的顺序）
+        fetch: 执行单个查询（经由 SearchResultCache）
+    """
+
+    def __init__(self, intent_type: str, query: str, queries: List[str], fetch: Callable[[str], Any]):
+        self.family = search_family(intent_type)
+        self.key = normalize_query(query)
+        self.queries = queries
+        self.rejected = threading.Event()
+        self._fetch = fetch
+        _count("speculations")
+        _prefetch_executor.submit(self._run)
+
+    def _run(self):
+        for query in self.queries:
+            if self.rejected.is_set():
+                return
+            self._fetch(query)
+
+    def matches(self, plan: Dict[str, Any]) -> bool:
+        """规划是否确认了同一（或等价的）查询"""
+        return (
+            bool(plan.get('should_search'))
+            and search_family(plan.get('intent_type', 'concept')) == self.family
+            and normalize_query(plan.get('query', '')) == self.key
+        )
+
+    def resolve(self, plan: Dict[str, Any]) -> bool:
+        """规划完成：确认则继续预取供本轮使用，否则停止剩余的预取"""
+        if self.matches(plan):
+            _count("confirmed")
+            return True
+        _count("rejected")
+        self.rejected.set()
+        return False
@@ -0,0 +1,103 @@
+"""
+Per-session locks shared by async handlers and worker threads
+按会话划分的锁表：同一会话的写操作串行，不同会话互不阻塞
+
+事件循环上的协程通过 hold() 获取，线程池中的同步代码（如对话流程里的
+运行时状态写入）通过 hold_sync() 获取，两者互斥的是同一把锁。
+"""
+import asyncio
+import threading
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict, List
+
+
+class _SessionLock:
+    """一个会话的锁：asyncio.Lock 让协程之间按顺序排队，threading.Lock 才是真正的互斥"""
+
+    __slots__ = ("async_lock", "thread_lock", "refcount")
+
+    def __init__(self):
+        self.async_lock = asyncio.Lock()
+        self.thread_lock = threading.Lock()
+        self.refcount = 0
+
+
+class SessionLockTable:
+    """
+    按键（会话ID）惰性创建的锁表
+
+    每个锁带引用计数，最后一个持有/等待者释放后立即从表中移除，
+    因此锁表大小只与当前并发写入的会话数相关，不会随历史会话增长。
+
+    协程持有锁期间可以 await；线程持有锁期间协程在线程池中等待获取，
+    不阻塞事件循环。不要在事件循环线程上调用 hold_sync()。
+    """
+
+    def __init__(self):
+        self._locks: Dict[str, _SessionLock] = {}
+        self._table_lock = threading.Lock()
+
+    def _acquire_entry(self, key: str) -> _SessionLock:
+        with self._table_lock:
+            entry = self._locks.get(key)
+            if entry is None:
+                entry = _SessionLock()
+                self._locks[key] = entry
+            entry.refcount += 1
+            return entry
+
+    def _release_entry(self, key: str, entry: _SessionLock):
+        with self._table_lock:
+            entry.refcount -= 1
+            if not entry.refcount:
+                del self._locks[key]
+
+    @asynccontextmanager
+    async def hold(self, key: str):
+        """在协程中获取指定会话的锁（async with locks.hold(session_id): ...）"""
+        entry = self._acquire_entry(key)
+        try:
+            async with entry.async_lock:
+                if not entry.thread_lock.acquire(blocking=False):
+                    # 锁被线程持有：在线程池中等待，不阻塞事件循环
+                    acquiring = asyncio.get_running_loop().run_in_executor(None, entry.thread_lock.acquire)
+                    try:
+                        await asyncio.shield(acquiring)
+                    except asyncio.CancelledError:
+                        # 取消后等待仍在进行，获取到锁时立即释放
+                        acquiring.add_done_callback(
+                            lambda done: None if done.cancelled() else entry.thread_lock.release()
+                        )
+                        raise
+                try:
+                    yield
+                finally:
+                    entry.thread_lock.release()
+        finally:
+            self._release_entry(key, entry)
+
+    @contextmanager
+    def hold_sync(self, key: str):
+        """在线程中获取指定会话的锁（with locks.hold_sync(session_id): ...）"""
+        entry = self._acquire_entry(key)
+        try:
+            with entry.thread_lock:
+                yield
+        finally:
+            self._release_entry(key, entry)
+
+    def is_locked(self, key: str) -> bool:
+        entry = self._locks.get(key)
+        return bool(entry and entry.thread_lock.locked())
+
+    def active_keys(self) -> List[str]:
+        """当前有持有者或等待者的会话ID"""
+        with self._table_lock:
+            return list(self._locks.keys())
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+
+# 全局锁表：SessionManager 与 ProfileManager 共用，保证同一会话记录的所有写入互斥
+session_locks = SessionLockTable()
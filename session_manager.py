@@ -4,12 +4,15 @@ Session Manager - 统一的会话管理接口
 """
 import uuid
 from datetime import datetime
-from typing import Dict, Optional, List
+from typing import Dict, Optional, List, Any, Tuple
 from fastapi import Depends, HTTPException
 
 from schemas import Session, SessionStatus, ChatMessage, EvaluationData
 from conversation_handler import ConversationHandler
-from storage import SessionStore, FileSystemSessionStore
+from handler_cache import HandlerCache
+from runtime_config import env_int
+from session_locks import session_locks
+from storage import SessionStore, FileSystemSessionStore, default_store
 
 
 class SessionManager:
@@ -20,15 +23,29 @@ class SessionManager:
     通过依赖注入的存储层，可以轻松切换不同的存储后端。
     """
     
-    def __init__(self, store: SessionStore):
+    def __init__(
+        self,
+        store: SessionStore,
+        handler_cache: Optional[HandlerCache] = None,
+        rehydrate_message_limit: Optional[int] = None
+    ):
         """
         初始化会话管理器
         
         Args:
             store: 会话存储实现
+            handler_cache: 对话处理器缓存（默认按环境变量配置）
+            rehydrate_message_limit: 重建处理器时恢复的最近消息数量
         """
         self.store = store
-        self.active_handlers: Dict[str, ConversationHandler] = {}
+        # HandlerCache 定义了 __len__，空缓存为假值，不能用 or 判断
+        self.active_handlers: HandlerCache = handler_cache if handler_cache is not None else HandlerCache.from_env()
+        if rehydrate_message_limit is None:
+            rehydrate_message_limit = env_int("EASYPROMPT_REHYDRATE_MESSAGES", 20)
+        self.rehydrate_message_limit = rehydrate_message_limit
+        # 会话级写锁：同一会话的读-改-写串行，不同会话并行；
+        # 与 ProfileManager 的运行时状态写入（在线程池中执行）共用同一张锁表
+        self.session_locks = session_locks
     
     async def create_session(
         self, 
@@ -63,13 +80,9 @@ class SessionManager:
             status=SessionStatus.ACTIVE
         )
         
-        # 通过存储层创建
+        # 通过存储层创建；对话处理器在收到第一条聊天消息时才创建
         session = await self.store.create_session(session, user_id)
         
-        # 创建对话处理器
-        handler = ConversationHandler(session_id=session_id, user_id=user_id)
-        self.active_handlers[session_id] = handler
-        
         return session
     
     async def get_session(
@@ -108,6 +121,61 @@ class SessionManager:
         """
         return await self.store.list_sessions(user_id, limit, offset)
 
+    async def query_sessions(
+        self,
+        user_id: Optional[str] = None,
+        limit: int = 50,
+        cursor: Optional[str] = None,
+        status: Optional[SessionStatus] = None,
+        updated_after: Optional[datetime] = None,
+        updated_before: Optional[datetime] = None
+    ) -> Tuple[List[Session], Optional[str]]:
+        """
+        游标分页查询会话
+        
+        Args:
+            user_id: 用户ID（None表示匿名用户）
+            limit: 每页数量
+            cursor: 上一页返回的游标
+            status: 按会话状态过滤
+            updated_after: 更新时间下限
+            updated_before: 更新时间上限
+            
+        Returns:
+            (会话列表, 下一页游标)
+        """
+        return await self.store.query_sessions(
+            user_id=user_id,
+            limit=limit,
+            cursor=cursor,
+            status=status,
+            updated_after=updated_after,
+            updated_before=updated_before
+        )
+    
+    async def get_messages(
+        self,
+        session_id: str,
+        user_id: Optional[str] = None,
+        since: Optional[datetime] = None,
+        before: Optional[datetime] = None,
+        limit: Optional[int] = None
+    ) -> Optional[List[ChatMessage]]:
+        """
+        获取会话消息窗口
+        
+        Args:
+            session_id: 会话ID
+            user_id: 用户ID
+            since: 起始时间（不含）
+            before: 截止时间（不含）
+            limit: 最大数量
+            
+        Returns:
+            消息列表，会话不存在则返回None
+        """
+        return await self.store.list_messages(session_id, user_id, since, before, limit)
+
     async def get_all_sessions(self) -> List[Session]:
         """向后兼容的别名，用于REST路由"""
         return await self.store.list_sessions(user_id=None, limit=200, offset=0)
@@ -131,17 +199,18 @@ class SessionManager:
         Returns:
             更新后的会话对象
         """
-        session = await self.get_session(session_id, user_id)
-        if not session:
-            return None
-        
-        if name is not None:
-            session.name = name
-        if status is not None:
-            session.status = status
-        
-        session.updated_at = datetime.now()
-        return await self.store.update_session(session, user_id)
+        async with self.session_locks.hold(session_id):
+            session = await self.get_session(session_id, user_id)
+            if not session:
+                return None
+            
+            if name is not None:
+                session.name = name
+            if status is not None:
+                session.status = status
+            
+            session.updated_at = datetime.now()
+            return await self.store.update_session(session, user_id)
     
     async def delete_session(
         self, 
@@ -162,7 +231,8 @@ class SessionManager:
         self.active_handlers.pop(session_id, None)
         
         # 通过存储层删除
-        return await self.store.delete_session(session_id, user_id)
+        async with self.session_locks.hold(session_id):
+            return await self.store.delete_session(session_id, user_id)
     
     async def add_message_to_session(
         self, 
@@ -181,16 +251,20 @@ class SessionManager:
         Returns:
             更新后的会话对象
         """
-        session = await self.get_session(session_id, user_id)
-        if not session:
-            return None
-        
-        session.messages.append(message)
-        session.message_count = len(session.messages)
-        session.last_message = message.content
-        session.updated_at = datetime.now()
-        
-        return await self.store.update_session(session, user_id)
+        async with self.session_locks.hold(session_id):
+            session = await self.get_session(session_id, user_id)
+            if not session:
+                return None
+            
+            session.messages.append(message)
+            session.message_count = len(session.messages)
+            session.last_message = message.content
+            session.updated_at = datetime.now()
+            
+            updated = await self.store.update_session(session, user_id)
+        # 每轮对话的消息写入后，处理器的档案与记忆已变化，重新估算其缓存大小
+        self.active_handlers.refresh_size(session_id)
+        return updated
     
     async def update_evaluation_data(
         self, 
@@ -209,14 +283,37 @@ class SessionManager:
         Returns:
             更新后的会话对象
         """
-        session = await self.get_session(session_id, user_id)
-        if not session:
-            return None
+        async with self.session_locks.hold(session_id):
+            session = await self.get_session(session_id, user_id)
+            if not session:
+                return None
+            
+            session.evaluation_data = evaluation_data
+            session.updated_at = datetime.now()
+            
+            return await self.store.update_session(session, user_id)
+    
+    async def update_session_state(
+        self,
+        session_id: str,
+        updates: Dict[str, Any],
+        user_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        更新会话运行时状态（API配置、诊断报告等）
         
-        session.evaluation_data = evaluation_data
-        session.updated_at = datetime.now()
+        与 ProfileManager 共用 SessionStore 的同一写入路径和同一把会话锁。
         
-        return await self.store.update_session(session, user_id)
+        Args:
+            session_id: 会话ID
+            updates: 要合并的字段
+            user_id: 用户ID
+            
+        Returns:
+            更新后的运行时状态
+        """
+        async with self.session_locks.hold(session_id):
+            return self.store.update_runtime_state(session_id, updates, user_id)
     
     def get_handler(self, session_id: str) -> Optional[ConversationHandler]:
         """
@@ -242,9 +339,51 @@ class SessionManager:
             对话处理器对象
         """
         handler = ConversationHandler(session_id=session_id, user_id=user_id)
-        self.active_handlers[session_id] = handler
+        self.active_handlers.put(session_id, handler)
         return handler
     
+    async def get_or_create_handler(
+        self,
+        session_id: str,
+        user_id: Optional[str] = None
+    ) -> ConversationHandler:
+        """
+        获取会话的对话处理器，不存在（或已被淘汰）时从持久化状态重建
+        
+        重建时恢复 critique（session.json 运行时状态）、角色档案
+        （character_profile.txt）以及最近的聊天记录。
+        
+        Args:
+            session_id: 会话ID
+            user_id: 用户ID
+            
+        Returns:
+            对话处理器对象
+        """
+        handler = self.active_handlers.get(session_id)
+        if handler is not None:
+            return handler
+        
+        recent_messages = []
+        if self.rehydrate_message_limit > 0:
+            recent_messages = await self.store.list_messages(
+                session_id, user_id, limit=self.rehydrate_message_limit
+            ) or []
+        if recent_messages:
+            self.active_handlers.record_rehydration()
+        
+        handler = ConversationHandler(
+            session_id=session_id,
+            user_id=user_id,
+            recent_messages=recent_messages
+        )
+        self.active_handlers.put(session_id, handler)
+        return handler
+    
+    def get_handler_metrics(self) -> Dict[str, Any]:
+        """返回对话处理器缓存的状态与淘汰统计"""
+        return self.active_handlers.get_metrics()
+    
     def remove_handler(self, session_id: str):
         """
         移除会话的对话处理器
@@ -272,8 +411,8 @@ class SessionManager:
         return self.store.get_session_path(session_id, user_id)
 
 
-# 创建默认的会话管理器实例（使用文件系统存储）
-_default_store = FileSystemSessionStore(base_path="./sessions")
+# 创建默认的会话管理器实例（与 ProfileManager 共用同一个文件系统存储实例）
+_default_store = default_store
 session_manager = SessionManager(store=_default_store)
 
 
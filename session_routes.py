@@ -2,8 +2,9 @@
 Session Management REST API Routes
 会话管理REST API路由
 """
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException, status
+from datetime import datetime
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from fastapi.responses import JSONResponse
 
 from schemas import (
@@ -40,15 +41,32 @@ async def create_session(
 
 @router.get("/", response_model=SessionResponse)
 async def get_all_sessions(
+    limit: int = Query(default=200, ge=1, le=200, description="每页数量"),
+    cursor: Optional[str] = Query(default=None, description="上一页返回的 next_cursor"),
+    status_filter: Optional[SessionStatus] = Query(default=None, alias="status", description="按状态过滤"),
+    updated_after: Optional[datetime] = Query(default=None, description="更新时间下限"),
+    updated_before: Optional[datetime] = Query(default=None, description="更新时间上限"),
     service: SessionManager = Depends(get_session_manager)
 ):
-    """获取所有会话"""
+    """分页获取会话（按最后更新时间倒序）"""
     try:
-        sessions = await service.get_all_sessions()
+        sessions, next_cursor = await service.query_sessions(
+            limit=limit,
+            cursor=cursor,
+            status=status_filter,
+            updated_after=updated_after,
+            updated_before=updated_before
+        )
         return SessionResponse(
             success=True,
             message=f"成功获取 {len(sessions)} 个会话",
-            data=sessions
+            data=sessions,
+            next_cursor=next_cursor
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
         )
     except Exception as e:
         raise HTTPException(
@@ -190,13 +208,23 @@ async def update_session_evaluation(
 
 @router.get("/{session_id}/messages", response_model=SessionResponse)
 async def get_session_messages(
-    session: Session = Depends(get_session)
+    session_id: str,
+    since: Optional[datetime] = Query(default=None, description="只返回此时间之后的消息"),
+    before: Optional[datetime] = Query(default=None, description="只返回此时间之前的消息"),
+    limit: Optional[int] = Query(default=None, ge=1, le=500, description="最大消息数量"),
+    service: SessionManager = Depends(get_session_manager)
 ):
-    """获取会话的所有消息"""
+    """获取会话消息，支持 since/before 时间窗口"""
+    messages = await service.get_messages(session_id, since=since, before=before, limit=limit)
+    if messages is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="会话不存在"
+        )
     return SessionResponse(
         success=True,
-        message=f"成功获取 {len(session.messages)} 条消息",
-        data=session.messages
+        message=f"成功获取 {len(messages)} 条消息",
+        data=messages
     )
 
 
@@ -3,13 +3,21 @@ Filesystem-based Session Storage Implementation
 基于文件系统的会话存储实现
 """
 import json
+import os
 import shutil
 from datetime import datetime
 from pathlib import Path
-from typing import Optional, List
+from typing import Optional, List, Dict, Any, Tuple
 
-from storage.session_store import SessionStore
-from schemas import Session
+from storage.session_store import (
+    SessionStore, encode_session_cursor, decode_session_cursor
+)
+from schemas import Session, SessionStatus, ChatMessage
+
+
+SESSION_RECORD_FILE = "session.json"
+LEGACY_METADATA_FILE = "session_metadata.json"
+RUNTIME_STATE_KEY = "runtime"
 
 
 class FileSystemSessionStore(SessionStore):
@@ -19,6 +27,13 @@ class FileSystemSessionStore(SessionStore):
     目录结构：
     - sessions/anonymous/        # 匿名用户（未登录）
     - sessions/users/{user_id}/  # 注册用户
+
+    每个会话目录下只有一条会话记录 session.json，包含 Session 模型字段
+    以及 "runtime" 运行时状态（API配置、最近的诊断报告），所有写入都经过
+    _write_record。
+
+    会话列表查询使用内存中的摘要索引（updated_at、status），
+    通过 session.json 的 mtime 校验，只有变化过的记录才会重新解析。
     """
     
     def __init__(self, base_path: str = "./sessions"):
@@ -38,6 +53,9 @@ class FileSystemSessionStore(SessionStore):
         # 用户目录
         self.users_dir = self.base_path / "users"
         self.users_dir.mkdir(exist_ok=True)
+        
+        # 会话摘要索引: {用户目录: {session_id: 摘要}}
+        self._index: Dict[Path, Dict[str, Dict[str, Any]]] = {}
     
     def _get_user_dir(self, user_id: Optional[str] = None) -> Path:
         """
@@ -63,6 +81,120 @@ class FileSystemSessionStore(SessionStore):
     ) -> Path:
         """获取会话目录路径"""
         return self._get_user_dir(user_id) / session_id
+
+    def _read_record(self, session_dir: Path, strict: bool = False) -> Dict[str, Any]:
+        """
+        读取会话记录原始字典，不存在时返回空字典
+
+        记录损坏时：strict=False 返回空字典（只读路径），strict=True 抛出异常，
+        供“读取-合并-写回”的路径使用，避免用默认记录覆盖已有会话
+        """
+        session_file = session_dir / SESSION_RECORD_FILE
+        if not session_file.exists():
+            return {}
+        try:
+            with open(session_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (json.JSONDecodeError, OSError) as e:
+            print(f"读取会话记录失败 {session_dir.name}: {e}")
+            if strict:
+                raise
+            return {}
+
+    def _write_record(self, session_dir: Path, record: Dict[str, Any]):
+        """会话记录的唯一写入路径：先写临时文件再 os.replace，读取方不会看到写了一半的文件"""
+        session_dir.mkdir(parents=True, exist_ok=True)
+        session_file = session_dir / SESSION_RECORD_FILE
+        tmp_file = session_file.with_suffix(".json.tmp")
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(record, f, ensure_ascii=False, indent=2, default=str)
+        os.replace(tmp_file, session_file)
+        
+        user_index = self._index.get(session_dir.parent)
+        if user_index is not None:
+            entry = self._make_index_entry(record, session_file.stat().st_mtime_ns)
+            if entry:
+                user_index[session_dir.name] = entry
+
+    @staticmethod
+    def _to_naive(value: datetime) -> datetime:
+        """统一转换为本地时间的 naive datetime，便于比较"""
+        if value.tzinfo is not None:
+            return value.astimezone().replace(tzinfo=None)
+        return value
+
+    def _make_index_entry(self, record: Dict[str, Any], mtime_ns: int) -> Optional[Dict[str, Any]]:
+        """从会话记录生成索引摘要"""
+        updated_at = record.get("updated_at")
+        try:
+            if isinstance(updated_at, str):
+                updated_at = datetime.fromisoformat(updated_at)
+            if not isinstance(updated_at, datetime):
+                return None
+        except ValueError:
+            return None
+        status = record.get("status")
+        if isinstance(status, SessionStatus):
+            status = status.value
+        return {
+            "updated_at": self._to_naive(updated_at),
+            "status": status,
+            "mtime_ns": mtime_ns,
+        }
+
+    def _refresh_index(self, user_dir: Path) -> Dict[str, Dict[str, Any]]:
+        """同步用户目录的摘要索引，仅重新解析 mtime 变化的会话记录"""
+        user_index = self._index.setdefault(user_dir, {})
+        if not user_dir.exists():
+            user_index.clear()
+            return user_index
+        
+        seen = set()
+        for session_dir in user_dir.iterdir():
+            if not session_dir.is_dir():
+                continue
+            session_file = session_dir / SESSION_RECORD_FILE
+            try:
+                mtime_ns = session_file.stat().st_mtime_ns
+            except FileNotFoundError:
+                continue
+            seen.add(session_dir.name)
+            entry = user_index.get(session_dir.name)
+            if entry and entry["mtime_ns"] == mtime_ns:
+                continue
+            entry = self._make_index_entry(self._read_record(session_dir), mtime_ns)
+            if entry:
+                user_index[session_dir.name] = entry
+            else:
+                user_index.pop(session_dir.name, None)
+        
+        for session_id in list(user_index.keys()):
+            if session_id not in seen:
+                del user_index[session_id]
+        return user_index
+
+    def _load_legacy_runtime_state(self, session_dir: Path) -> Dict[str, Any]:
+        """从旧版 session_metadata.json 中读取运行时状态（仅用于迁移）"""
+        legacy_file = session_dir / LEGACY_METADATA_FILE
+        if not legacy_file.exists():
+            return {}
+        try:
+            with open(legacy_file, 'r', encoding='utf-8') as f:
+                legacy = json.load(f)
+        except (json.JSONDecodeError, OSError):
+            return {}
+
+        state: Dict[str, Any] = {}
+        if legacy.get("api_config"):
+            state["api_config"] = legacy["api_config"]
+        if legacy.get("api_type"):
+            state["api_type"] = legacy["api_type"]
+        last_critique = (legacy.get("evaluation_data") or {}).get("last_critique")
+        if last_critique:
+            state["last_critique"] = last_critique
+        if legacy.get("last_updated"):
+            state["last_updated"] = legacy["last_updated"]
+        return state
     
     async def create_session(
         self, 
@@ -71,12 +203,11 @@ class FileSystemSessionStore(SessionStore):
     ) -> Session:
         """创建新会话"""
         session_dir = self.get_session_path(session.id, user_id)
-        session_dir.mkdir(parents=True, exist_ok=True)
         
-        # 保存会话元数据
-        session_file = session_dir / "session.json"
-        with open(session_file, 'w', encoding='utf-8') as f:
-            json.dump(session.dict(), f, ensure_ascii=False, indent=2, default=str)
+        # 保存会话记录（保留已有的运行时状态）
+        record = self._read_record(session_dir)
+        record.update(session.dict())
+        self._write_record(session_dir, record)
         
         # 初始化角色档案文件
         profile_file = session_dir / "character_profile.txt"
@@ -91,21 +222,19 @@ class FileSystemSessionStore(SessionStore):
         user_id: Optional[str] = None
     ) -> Optional[Session]:
         """获取指定会话"""
-        session_file = self.get_session_path(session_id, user_id) / "session.json"
+        data = self._read_record(self.get_session_path(session_id, user_id))
         
-        if not session_file.exists():
+        if not data:
             return None
         
         try:
-            with open(session_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                session = Session(**data)
-                
-                # 验证用户权限
-                if user_id and session.user_id and session.user_id != user_id:
-                    return None
-                
-                return session
+            session = Session(**data)
+            
+            # 验证用户权限
+            if user_id and session.user_id and session.user_id != user_id:
+                return None
+            
+            return session
         except Exception as e:
             print(f"加载会话失败 {session_id}: {e}")
             return None
@@ -133,18 +262,103 @@ class FileSystemSessionStore(SessionStore):
         session_dirs = session_dirs[offset:offset + limit]
         
         for session_dir in session_dirs:
-            session_file = session_dir / "session.json"
-            if session_file.exists():
+            data = self._read_record(session_dir)
+            if data:
                 try:
-                    with open(session_file, 'r', encoding='utf-8') as f:
-                        data = json.load(f)
-                        sessions.append(Session(**data))
+                    sessions.append(Session(**data))
                 except Exception as e:
                     print(f"加载会话失败 {session_dir.name}: {e}")
                     continue
         
         return sessions
     
+    async def query_sessions(
+        self,
+        user_id: Optional[str] = None,
+        limit: int = 50,
+        cursor: Optional[str] = None,
+        status: Optional[SessionStatus] = None,
+        updated_after: Optional[datetime] = None,
+        updated_before: Optional[datetime] = None
+    ) -> Tuple[List[Session], Optional[str]]:
+        """基于摘要索引的游标分页查询，只加载当前页的会话记录"""
+        user_dir = self._get_user_dir(user_id)
+        user_index = self._refresh_index(user_dir)
+        
+        after_key = None
+        if cursor:
+            cursor_time, cursor_id = decode_session_cursor(cursor)
+            after_key = (self._to_naive(cursor_time), cursor_id)
+        status_value = status.value if isinstance(status, SessionStatus) else status
+        lower = self._to_naive(updated_after) if updated_after else None
+        upper = self._to_naive(updated_before) if updated_before else None
+        
+        candidates = []
+        for session_id, entry in user_index.items():
+            key = (entry["updated_at"], session_id)
+            if after_key is not None and key >= after_key:
+                continue
+            if status_value and entry["status"] != status_value:
+                continue
+            if lower and entry["updated_at"] <= lower:
+                continue
+            if upper and entry["updated_at"] >= upper:
+                continue
+            candidates.append(key)
+        candidates.sort(reverse=True)
+        
+        page_keys = candidates[:limit]
+        sessions = []
+        for _, session_id in page_keys:
+            data = self._read_record(user_dir / session_id)
+            if not data:
+                continue
+            try:
+                sessions.append(Session(**data))
+            except Exception as e:
+                print(f"加载会话失败 {session_id}: {e}")
+        
+        next_cursor = None
+        if len(candidates) > limit and page_keys:
+            last_time, last_id = page_keys[-1]
+            next_cursor = encode_session_cursor(last_time, last_id)
+        return sessions, next_cursor
+    
+    async def list_messages(
+        self,
+        session_id: str,
+        user_id: Optional[str] = None,
+        since: Optional[datetime] = None,
+        before: Optional[datetime] = None,
+        limit: Optional[int] = None
+    ) -> Optional[List[ChatMessage]]:
+        """在原始记录上筛选时间窗口，只为窗口内的消息构造模型"""
+        data = self._read_record(self.get_session_path(session_id, user_id))
+        if not data:
+            return None
+        owner = data.get("user_id")
+        if user_id and owner and owner != user_id:
+            return None
+        
+        lower = self._to_naive(since) if since else None
+        upper = self._to_naive(before) if before else None
+        window = []
+        for raw in data.get("messages") or []:
+            if lower or upper:
+                try:
+                    timestamp = self._to_naive(datetime.fromisoformat(str(raw.get("timestamp"))))
+                except ValueError:
+                    continue
+                if lower and timestamp <= lower:
+                    continue
+                if upper and timestamp >= upper:
+                    continue
+            window.append(raw)
+        
+        if limit is not None and len(window) > limit:
+            window = window[:limit] if since and not before else window[-limit:]
+        return [ChatMessage(**raw) for raw in window]
+    
     async def update_session(
         self, 
         session: Session, 
@@ -159,10 +373,11 @@ class FileSystemSessionStore(SessionStore):
         # 更新时间戳
         session.updated_at = datetime.now()
         
-        # 保存
-        session_file = self.get_session_path(session.id, user_id) / "session.json"
-        with open(session_file, 'w', encoding='utf-8') as f:
-            json.dump(session.dict(), f, ensure_ascii=False, indent=2, default=str)
+        # 合并保存，保留运行时状态
+        session_dir = self.get_session_path(session.id, user_id)
+        record = self._read_record(session_dir, strict=True)
+        record.update(session.dict())
+        self._write_record(session_dir, record)
         
         return session
     
@@ -179,6 +394,7 @@ class FileSystemSessionStore(SessionStore):
         
         try:
             shutil.rmtree(session_dir)
+            self._index.get(session_dir.parent, {}).pop(session_id, None)
             return True
         except Exception as e:
             print(f"删除会话失败 {session_id}: {e}")
@@ -242,3 +458,49 @@ class FileSystemSessionStore(SessionStore):
         
         return prompt_file.read_text(encoding='utf-8')
 
+    def load_runtime_state(
+        self,
+        session_id: str,
+        user_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """读取会话运行时状态，兼容旧版 session_metadata.json"""
+        session_dir = self.get_session_path(session_id, user_id)
+        record = self._read_record(session_dir)
+        if RUNTIME_STATE_KEY in record:
+            return dict(record[RUNTIME_STATE_KEY] or {})
+        return self._load_legacy_runtime_state(session_dir)
+
+    def update_runtime_state(
+        self,
+        session_id: str,
+        updates: Dict[str, Any],
+        user_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        合并更新会话运行时状态，会话记录不存在时创建默认记录
+
+        记录存在但无法读取时抛出异常，不写入（否则会用默认记录覆盖消息和名称）
+        """
+        session_dir = self.get_session_path(session_id, user_id)
+        record = self._read_record(session_dir, strict=True)
+
+        if not record:
+            now = datetime.now()
+            record = Session(
+                id=session_id,
+                name=f"会话 {now.strftime('%Y-%m-%d %H:%M')}",
+                user_id=user_id,
+                created_at=now,
+                updated_at=now
+            ).dict()
+
+        if RUNTIME_STATE_KEY not in record:
+            record[RUNTIME_STATE_KEY] = self._load_legacy_runtime_state(session_dir)
+
+        state = record[RUNTIME_STATE_KEY] or {}
+        state.update(updates)
+        state["last_updated"] = datetime.now().isoformat()
+        record[RUNTIME_STATE_KEY] = state
+
+        self._write_record(session_dir, record)
+        return dict(state)
@@ -2,11 +2,44 @@
 Session Storage Abstract Interface
 会话存储抽象接口 - 为未来多存储后端支持做准备
 """
+import base64
+import json
 from abc import ABC, abstractmethod
-from typing import Optional, List
+from datetime import datetime
+from typing import Optional, List, Dict, Any, Tuple
 from pathlib import Path
 
-from schemas import Session, ChatMessage, EvaluationData
+from schemas import Session, SessionStatus, ChatMessage, EvaluationData
+
+
+def encode_session_cursor(updated_at: datetime, session_id: str) -> str:
+    """
+    将 (updated_at, id) 编码为不透明的分页游标
+    
+    Args:
+        updated_at: 当前页最后一个会话的更新时间
+        session_id: 当前页最后一个会话的ID
+        
+    Returns:
+        URL安全的游标字符串
+    """
+    raw = json.dumps({"u": updated_at.isoformat(), "i": session_id}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_session_cursor(cursor: str) -> Tuple[datetime, str]:
+    """
+    解码分页游标
+    
+    Raises:
+        ValueError: 游标格式无效
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")).decode("utf-8"))
+        return datetime.fromisoformat(data["u"]), str(data["i"])
+    except Exception as e:
+        raise ValueError(f"无效的分页游标: {cursor}") from e
 
 
 class SessionStore(ABC):
@@ -73,6 +106,59 @@ class SessionStore(ABC):
         """
         pass
     
+    @abstractmethod
+    async def query_sessions(
+        self,
+        user_id: Optional[str] = None,
+        limit: int = 50,
+        cursor: Optional[str] = None,
+        status: Optional[SessionStatus] = None,
+        updated_after: Optional[datetime] = None,
+        updated_before: Optional[datetime] = None
+    ) -> Tuple[List[Session], Optional[str]]:
+        """
+        按游标分页查询会话（按 updated_at、id 倒序）
+        
+        Args:
+            user_id: 用户ID（None表示匿名会话）
+            limit: 每页数量
+            cursor: 上一页返回的游标
+            status: 按会话状态过滤
+            updated_after: 只返回在此时间之后更新的会话
+            updated_before: 只返回在此时间之前更新的会话
+            
+        Returns:
+            (会话列表, 下一页游标)，没有更多数据时游标为None
+            
+        Raises:
+            ValueError: 游标无效
+        """
+        pass
+    
+    @abstractmethod
+    async def list_messages(
+        self,
+        session_id: str,
+        user_id: Optional[str] = None,
+        since: Optional[datetime] = None,
+        before: Optional[datetime] = None,
+        limit: Optional[int] = None
+    ) -> Optional[List[ChatMessage]]:
+        """
+        获取会话中指定时间窗口内的消息（按时间正序）
+        
+        Args:
+            session_id: 会话ID
+            user_id: 用户ID（用于权限验证）
+            since: 只返回此时间之后的消息
+            before: 只返回此时间之前的消息
+            limit: 最大数量；只指定 since 时保留最早的消息，否则保留最新的消息
+            
+        Returns:
+            消息列表，会话不存在或无权限则返回None
+        """
+        pass
+    
     @abstractmethod
     async def update_session(
         self, 
@@ -196,6 +282,50 @@ class SessionStore(ABC):
         """
         pass
     
+    @abstractmethod
+    def load_runtime_state(
+        self,
+        session_id: str,
+        user_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        读取会话的运行时状态（API配置、最近的诊断报告等）
+
+        运行时状态与会话元数据保存在同一条会话记录中，
+        但不属于 Session 模型，因此不会通过 REST 接口暴露。
+
+        Args:
+            session_id: 会话ID
+            user_id: 用户ID
+
+        Returns:
+            运行时状态字典，不存在则返回空字典
+        """
+        pass
+
+    @abstractmethod
+    def update_runtime_state(
+        self,
+        session_id: str,
+        updates: Dict[str, Any],
+        user_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        合并更新会话的运行时状态（同步接口，供对话流程直接调用）
+
+        如果会话记录尚不存在，会创建一条默认记录；记录存在但无法读取时
+        抛出异常，不覆盖原记录。
+
+        Args:
+            session_id: 会话ID
+            updates: 要合并的字段
+            user_id: 用户ID
+
+        Returns:
+            更新后的运行时状态
+        """
+        pass
+
     @abstractmethod
     def get_session_path(
         self, 
@@ -0,0 +1,207 @@
+"""
+Structured (JSON) output for control tasks
+结构化输出：评估器与搜索规划器的 JSON 模式、Schema 定义和容错解析
+
+服务商支持时直接要求 JSON 输出（OpenAI response_format，Gemini
+response_mime_type/response_schema）；其余情况使用 repair_json 容错解析。
+每次解析都会计入统计，解析失败意味着一次模型调用被浪费。
+"""
+import json
+import re
+import threading
+from typing import Any, Dict, Optional
+
+from runtime_config import env_str
+
+EVALUATION_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "is_ready_for_writing": {"type": "boolean"},
+        "evaluation_score": {"type": "number"},
+        "critique": {"type": "string"},
+        "extracted_traits": {"type": "array", "items": {"type": "string"}},
+        "extracted_keywords": {"type": "array", "items": {"type": "string"}},
+        "completeness_breakdown": {
+            "type": "object",
+            "properties": {
+                "core_identity": {"type": "integer"},
+                "personality_traits": {"type": "integer"},
+                "behavioral_patterns": {"type": "integer"},
+                "interaction_patterns": {"type": "integer"},
+            },
+        },
+        "suggestions": {"type": "array", "items": {"type": "string"}},
+    },
+    "required": ["is_ready_for_writing", "evaluation_score", "critique"],
+}
+
+PLANNER_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "should_search": {"type": "boolean"},
+        "intent_type": {"type": "string", "enum": ["concept", "character", "fresh_news"]},
+        "query": {"type": "string"},
+        "confidence": {"type": "number"},
+        "reason": {"type": "string"},
+        "focus_term": {"type": "string"},
+    },
+    "required": ["should_search", "intent_type", "query"],
+}
+
+SCHEMAS = {
+    "evaluator": EVALUATION_SCHEMA,
+    "planner": PLANNER_SCHEMA,
+}
+
+
+def structured_output_mode() -> str:
+    """
+    OpenAI 兼容接口的结构化输出方式（EASYPROMPT_STRUCTURED_OUTPUT）:
+    json_schema / json_object（默认，兼容服务支持最广）/ none
+    """
+    mode = env_str("EASYPROMPT_STRUCTURED_OUTPUT", "json_object").lower()
+    return mode if mode in ("json_schema", "json_object", "none") else "json_object"
+
+
+def openai_response_format(task: str) -> Optional[Dict[str, Any]]:
+    """返回 OpenAI chat/completions 的 response_format 参数"""
+    mode = structured_output_mode()
+    if mode == "none":
+        return None
+    if mode == "json_schema":
+        return {
+            "type": "json_schema",
+            "json_schema": {"name": f"easyprompt_{task}", "schema": SCHEMAS[task]},
+        }
+    return {"type": "json_object"}
+
+
+def gemini_generation_config(task: str, with_schema: bool = True) -> Dict[str, Any]:
+    """
+    返回 Gemini generate_content 的 generation_config 参数
+
+    Gemini 按 response_schema 输出时可能重排字段顺序（当前 SDK 不支持
+    property_ordering），流式评估需要按提示词顺序先拿到评分，因此流式路径
+    只要求 JSON 输出、不附带 schema。
+    """
+    if structured_output_mode() == "none":
+        return {}
+    config: Dict[str, Any] = {"response_mime_type": "application/json"}
+    if with_schema:
+        config["response_schema"] = SCHEMAS[task]
+    return config
+
+
+# --- 容错解析 ---
+
+_FENCE_PATTERN = re.compile(r"^```(?:json)?\s*|\s*```$", re.IGNORECASE)
+_TRAILING_COMMA_PATTERN = re.compile(r",\s*([}\]])")
+_PYTHON_LITERALS = (("True", "true"), ("False", "false"), ("None", "null"))
+
+
+def _extract_object(text: str) -> str:
+    """截取第一个 `{` 开始的对象；对象未闭合时按括号栈补全"""
+    start = text.find("{")
+    if start < 0:
+        raise ValueError("响应中没有 JSON 对象")
+    stack = []
+    in_string = escape = False
+    for index in range(start, len(text)):
+        ch = text[index]
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]":
+            if stack:
+                stack.pop()
+            if not stack:
+                return text[start:index + 1]
+    # 被截断的输出：补全字符串和括号
+    tail = text[start:].rstrip().rstrip(",")
+    if in_string:
+        tail += '"'
+    return tail + "".join(reversed(stack))
+
+
+def repair_json(text: str) -> Dict[str, Any]:
+    """
+    容错解析模型返回的 JSON 对象
+
+    依次处理：代码块标记、对象前后的说明文字、尾随逗号、
+    Python 风格的 True/False/None、被截断的对象。
+    """
+    if not text or not text.strip():
+        raise ValueError("空响应")
+    cleaned = _FENCE_PATTERN.sub("", text.strip())
+    candidate = _extract_object(cleaned)
+    candidate = _TRAILING_COMMA_PATTERN.sub(r"\1", candidate)
+    try:
+        result = json.loads(candidate)
+    except json.JSONDecodeError:
+        for python_literal, json_literal in _PYTHON_LITERALS:
+            candidate = re.sub(rf"\b{python_literal}\b", json_literal, candidate)
+        result = json.loads(candidate)
+    if not isinstance(result, dict):
+        raise ValueError("JSON 顶层不是对象")
+    return result
+
+
+# --- 解析统计 ---
+
+_metrics_lock = threading.Lock()
+parse_metrics: Dict[str, Dict[str, int]] = {}
+
+
+def _record(task: str, outcome: str):
+    with _metrics_lock:
+        bucket = parse_metrics.setdefault(task, {"total": 0, "direct": 0, "repaired": 0, "failed": 0})
+        bucket["total"] += 1
+        bucket[outcome] += 1
+
+
+def parse_structured(text: str, task: str) -> Dict[str, Any]:
+    """
+    解析结构化响应并计入统计；无法解析时抛出 ValueError
+
+    Args:
+        text: 模型返回的文本
+        task: 任务名（evaluator / planner），用于统计
+    """
+    try:
+        result = json.loads(text)
+        if isinstance(result, dict):
+            _record(task, "direct")
+            return result
+    except (TypeError, ValueError):
+        pass
+    try:
+        result = repair_json(text)
+    except (TypeError, ValueError) as exc:
+        _record(task, "failed")
+        raise ValueError(f"无法解析{task}的JSON响应: {exc}")
+    _record(task, "repaired")
+    return result
+
+
+def record_parsed(task: str, repaired: bool = False):
+    """流式路径自行完成解析时，单独计入一次成功解析"""
+    _record(task, "repaired" if repaired else "direct")
+
+
+def get_structured_output_metrics() -> Dict[str, Any]:
+    """各任务的解析次数与失败率"""
+    with _metrics_lock:
+        snapshot = {task: dict(bucket) for task, bucket in parse_metrics.items()}
+    for bucket in snapshot.values():
+        bucket["failure_rate"] = round(bucket["failed"] / bucket["total"], 3) if bucket["total"] else 0.0
+    snapshot["mode"] = structured_output_mode()
+    return snapshot
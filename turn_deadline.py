@@ -0,0 +1,177 @@
+"""
+Per-turn latency budget
+单轮对话的时间预算：首个回复 token 之前的步骤（搜索规划、联网搜索、网页抓取、
+对话前评估）共享同一个截止时间，而不是各自的超时层层叠加
+
+- 预算 = EASYPROMPT_TTFT_SLO（首 token 目标，秒，默认 12；<=0 关闭）
+  减去 EASYPROMPT_TTFT_RESERVE（留给对话模型自身首包的时间，默认 3）
+- 每个步骤的超时取 min(自身超时, 剩余预算)
+- 可选步骤剩余预算不足 STAGE_MIN_BUDGET 时直接跳过；
+  多次请求的步骤（多个搜索词、多个候选网页）在预算用完时提前结束
+
+SearchHelper / WebScraper 显式接收 deadline 参数；LLM 层通过 current_deadline
+（ContextVar）读取，只在规划、评估这类控制调用上生效，对话与写作不受影响。
+"""
+import contextvars
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, List, Optional
+
+from runtime_config import env_float
+
+# 可选步骤至少需要的剩余预算（秒），不足时跳过
+STAGE_MIN_BUDGET = {
+    "planner": 1.0,
+    "search": 2.0,
+    "scrape": 1.5,
+    "link": 2.0,
+    "evaluator": 2.0,
+    "brief": 3.0,
+}
+
+# 受截止时间约束的 LLM 任务
+DEADLINE_TASKS = ("planner", "evaluator")
+
+# 预算几乎用完时单次请求的最短超时，避免传给客户端 0 或负数
+MIN_TIMEOUT = 0.5
+
+current_deadline: contextvars.ContextVar[Optional["TurnDeadline"]] = contextvars.ContextVar("current_deadline", default=None)
+
+
+class TurnDeadline:
+    """
+    一轮对话的截止时间
+
+    Args:
+        budget: 首 token 之前可用的秒数；None 表示不限制
+        slo: 首 token 目标（秒），仅用于统计是否达标
+    """
+
+    def __init__(self, budget: Optional[float], slo: Optional[float] = None):
+        self.started = time.monotonic()
+        self.budget = budget
+        self.slo = slo
+        self.expires_at = None if budget is None else self.started + max(0.0, budget)
+        self.skipped: List[str] = []
+        self.stage_ms: Dict[str, float] = {}
+        self.first_token_ms: Optional[float] = None
+
+    @classmethod
+    def for_turn(cls) -> "TurnDeadline":
+        """按环境变量创建本轮的截止时间"""
+        slo = env_float("EASYPROMPT_TTFT_SLO", 12.0)
+        if slo <= 0:
+            return cls(None)
+        reserve = env_float("EASYPROMPT_TTFT_RESERVE", 3.0)
+        return cls(max(0.0, slo - reserve), slo=slo)
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def remaining(self) -> float:
+        if self.expires_at is None:
+            return float("inf")
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def timeout(self, cap: float) -> float:
+        """某次请求应使用的超时：不超过自身上限，也不超过剩余预算"""
+        return min(cap, max(MIN_TIMEOUT, self.remaining()))
+
+    def allows(self, stage: str) -> bool:
+        """剩余预算是否足够执行可选步骤；不足时记为跳过"""
+        if self.remaining() >= STAGE_MIN_BUDGET.get(stage, 1.0):
+            return True
+        self.skipped.append(stage)
+        _count_skip(stage)
+        return False
+
+    @contextmanager
+    def stage(self, name: str):
+        """统计一个步骤的耗时；期间 LLM 层可通过 current_deadline 读取截止时间"""
+        token = current_deadline.set(self)
+        started = time.monotonic()
+        try:
+            yield self
+        finally:
+            current_deadline.reset(token)
+            self.stage_ms[name] = self.stage_ms.get(name, 0.0) + (time.monotonic() - started) * 1000
+
+    def mark_first_token(self):
+        """对话模型产出第一段内容时调用，记录首 token 延迟"""
+        if self.first_token_ms is not None:
+            return
+        self.first_token_ms = self.elapsed() * 1000
+        _record_turn(self)
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "budget_s": self.budget,
+            "elapsed_ms": round(self.elapsed() * 1000, 1),
+            "first_token_ms": round(self.first_token_ms, 1) if self.first_token_ms is not None else None,
+            "stage_ms": {name: round(ms, 1) for name, ms in self.stage_ms.items()},
+            "skipped": list(self.skipped),
+        }
+
+
+def stage_timeout(cap: float, task: str) -> float:
+    """LLM 层使用：当前处于某轮的截止时间内且任务受约束时，把超时压到剩余预算"""
+    deadline = current_deadline.get()
+    if deadline is None or task not in DEADLINE_TASKS:
+        return cap
+    return deadline.timeout(cap)
+
+
+# --- 统计 ---
+
+_metrics_lock = threading.Lock()
+turn_metrics: Dict[str, Any] = {
+    "turns": 0,
+    "slo_met": 0,
+    "skipped": {},
+}
+_first_token_ms: Deque[float] = deque(maxlen=500)
+_stage_ms: Dict[str, Deque[float]] = {}
+
+
+def _count_skip(stage: str):
+    with _metrics_lock:
+        turn_metrics["skipped"][stage] = turn_metrics["skipped"].get(stage, 0) + 1
+
+
+def _record_turn(deadline: TurnDeadline):
+    with _metrics_lock:
+        turn_metrics["turns"] += 1
+        if deadline.slo is None or deadline.first_token_ms <= deadline.slo * 1000:
+            turn_metrics["slo_met"] += 1
+        _first_token_ms.append(deadline.first_token_ms)
+        for name, ms in deadline.stage_ms.items():
+            _stage_ms.setdefault(name, deque(maxlen=500)).append(ms)
+
+
+def _percentile(values: List[float], percentile: float) -> float:
+    return round(values[int(percentile * (len(values) - 1))], 1) if values else 0.0
+
+
+def get_turn_metrics() -> Dict[str, Any]:
+    """首 token 延迟分位数、SLO 达标率、各步骤耗时与跳过次数"""
+    with _metrics_lock:
+        metrics: Dict[str, Any] = {
+            "turns": turn_metrics["turns"],
+            "slo_met": turn_metrics["slo_met"],
+            "skipped": dict(turn_metrics["skipped"]),
+        }
+        first_token = sorted(_first_token_ms)
+        stages = {name: sorted(values) for name, values in _stage_ms.items()}
+    metrics["slo_s"] = env_float("EASYPROMPT_TTFT_SLO", 12.0)
+    metrics["slo_met_rate"] = round(metrics["slo_met"] / metrics["turns"], 3) if metrics["turns"] else 0.0
+    metrics["first_token_ms"] = {"p50": _percentile(first_token, 0.5), "p95": _percentile(first_token, 0.95)}
+    metrics["stage_ms"] = {
+        name: {"p50": _percentile(values, 0.5), "p95": _percentile(values, 0.95)}
+        for name, values in stages.items()
+    }
+    return metrics
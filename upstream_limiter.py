@@ -0,0 +1,341 @@
+"""
+Per-provider upstream admission control
+上游并发准入：限制同时发往某个服务商的请求数，按优先级和用户公平地分配名额
+
+- 优先级：对话/写作（用户正在等待）> 评估 > 搜索规划
+- 同一优先级内按用户轮询，一个用户的突发请求不会占满全部名额
+- 收到 429 时遵守 Retry-After 暂停放行，并把并发上限减半；
+  之后每次成功请求把上限缓慢加回（AIMD）
+- 同步调用（线程池中）与 Gemini 原生异步调用共用同一个限流器
+
+当前用户通过 ContextVar 传递（main.py 在处理消息前设置，
+llm_helper.iterate_in_thread 会把上下文带入工作线程）。
+"""
+import asyncio
+import contextvars
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Deque, Dict, Optional
+
+from runtime_config import env_float, env_int
+
+# 数字越小优先级越高
+TASK_PRIORITIES = {
+    "conversation": 0,
+    "writer": 0,
+    "evaluator": 1,
+    "planner": 2,
+}
+PRIORITY_NAMES = {0: "interactive", 1: "evaluation", 2: "planner"}
+
+current_upstream_user: contextvars.ContextVar[str] = contextvars.ContextVar("current_upstream_user", default="anonymous")
+
+# 429 未给出 Retry-After 时的默认暂停秒数
+DEFAULT_RETRY_AFTER = 5.0
+
+
+class UpstreamBusyError(RuntimeError):
+    """排队等待超过上限仍未获得名额"""
+
+
+class UpstreamThrottledError(RuntimeError):
+    """上游返回 429（带有建议的重试等待秒数）"""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """解析 Retry-After 头（秒数；HTTP 日期格式不常见，按默认值处理）"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
+
+
+def is_throttle_error(exc: BaseException) -> bool:
+    """判断异常是否表示上游限流（429 / ResourceExhausted）"""
+    if isinstance(exc, UpstreamThrottledError):
+        return True
+    if type(exc).__name__ in ("ResourceExhausted", "TooManyRequests"):
+        return True
+    return getattr(exc, "code", None) == 429 or getattr(exc, "status_code", None) == 429
+
+
+class _Waiter:
+    __slots__ = ("user", "priority", "enqueued_at", "event", "loop", "future", "granted")
+
+    def __init__(self, user: str, priority: int, loop=None):
+        self.user = user
+        self.priority = priority
+        self.enqueued_at = time.monotonic()
+        self.loop = loop
+        self.event = None if loop else threading.Event()
+        self.future = loop.create_future() if loop else None
+        self.granted = False
+
+    def wake(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._resolve)
+        else:
+            self.event.set()
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(True)
+
+
+class UpstreamLimiter:
+    """
+    单个服务商的准入控制器
+
+    Args:
+        provider: 服务商名称（仅用于日志和统计）
+        max_in_flight: 并发上限
+        min_in_flight: 自适应下调的下限
+        queue_timeout: 最长排队秒数，超时抛出 UpstreamBusyError
+    """
+
+    def __init__(self, provider: str, max_in_flight: int = 8, min_in_flight: int = 1, queue_timeout: float = 60.0):
+        self.provider = provider
+        self.max_in_flight = max(1, max_in_flight)
+        self.min_in_flight = max(1, min(min_in_flight, self.max_in_flight))
+        self.queue_timeout = queue_timeout
+        self.limit = float(self.max_in_flight)
+        self.in_flight = 0
+        self.cooldown_until = 0.0
+
+        self._lock = threading.Lock()
+        # 每个优先级: 用户 -> 该用户的等待队列；按用户轮询
+        self._queues: Dict[int, "OrderedDict[str, Deque[_Waiter]]"] = {
+            priority: OrderedDict() for priority in PRIORITY_NAMES
+        }
+        self._timer: Optional[threading.Timer] = None
+
+        self.stats: Dict[str, Any] = {
+            "granted": 0,
+            "queued": 0,
+            "timeouts": 0,
+            "cancelled": 0,
+            "throttled": 0,
+            "wait_ms": {name: deque(maxlen=500) for name in PRIORITY_NAMES.values()},
+        }
+
+    # --- 准入 ---
+
+    def _enqueue(self, waiter: _Waiter) -> bool:
+        """登记等待者；可以立即放行时返回 True"""
+        with self._lock:
+            if self._can_grant() and not self._has_waiters_at_or_above(waiter.priority):
+                self._grant(waiter)
+                return True
+            self._queues[waiter.priority].setdefault(waiter.user, deque()).append(waiter)
+            self.stats["queued"] += 1
+            self._schedule_cooldown_wakeup()
+            return False
+
+    def _cancel(self, waiter: _Waiter, reason: str = "timeouts") -> bool:
+        """放弃排队；名额已在取消前发放时返回 False（调用方需照常释放）"""
+        with self._lock:
+            if waiter.granted:
+                return False
+            users = self._queues[waiter.priority]
+            queue = users.get(waiter.user)
+            if queue and waiter in queue:
+                queue.remove(waiter)
+                if not queue:
+                    del users[waiter.user]
+            self.stats[reason] += 1
+            return True
+
+    def _can_grant(self) -> bool:
+        return self.in_flight < int(self.limit) and time.monotonic() >= self.cooldown_until
+
+    def _has_waiters_at_or_above(self, priority: int) -> bool:
+        return any(self._queues[p] for p in self._queues if p <= priority)
+
+    def _grant(self, waiter: _Waiter):
+        waiter.granted = True
+        self.in_flight += 1
+        self.stats["granted"] += 1
+        waited_ms = (time.monotonic() - waiter.enqueued_at) * 1000
+        self.stats["wait_ms"][PRIORITY_NAMES[waiter.priority]].append(waited_ms)
+
+    def _dispatch_locked(self):
+        """按优先级、同级按用户轮询放行等待者（需持有锁）"""
+        while self._can_grant():
+            waiter = self._next_waiter_locked()
+            if waiter is None:
+                return
+            self._grant(waiter)
+            waiter.wake()
+        self._schedule_cooldown_wakeup()
+
+    def _next_waiter_locked(self) -> Optional[_Waiter]:
+        for priority in sorted(self._queues):
+            users = self._queues[priority]
+            if not users:
+                continue
+            user, queue = next(iter(users.items()))
+            waiter = queue.popleft()
+            # 该用户排到本级队尾，实现同级用户间轮询
+            del users[user]
+            if queue:
+                users[user] = queue
+            return waiter
+        return None
+
+    def _schedule_cooldown_wakeup(self):
+        """处于 Retry-After 暂停期且有人排队时，安排到期后再放行"""
+        remaining = self.cooldown_until - time.monotonic()
+        if remaining <= 0 or self._timer is not None:
+            return
+        if not any(self._queues.values()):
+            return
+        self._timer = threading.Timer(remaining, self._on_cooldown_end)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _on_cooldown_end(self):
+        with self._lock:
+            self._timer = None
+            self._dispatch_locked()
+
+    def release(self, succeeded: bool = True):
+        with self._lock:
+            self.in_flight = max(0, self.in_flight - 1)
+            if succeeded and self.limit < self.max_in_flight:
+                # 加性增加：大约每个“上限”次成功请求加回一个名额
+                self.limit = min(float(self.max_in_flight), self.limit + 1.0 / max(1.0, self.limit))
+            self._dispatch_locked()
+
+    def report_throttled(self, retry_after: Optional[float] = None):
+        """上游返回 429：暂停放行 retry_after 秒，并发上限减半"""
+        delay = retry_after if retry_after is not None else DEFAULT_RETRY_AFTER
+        with self._lock:
+            self.stats["throttled"] += 1
+            self.cooldown_until = max(self.cooldown_until, time.monotonic() + delay)
+            self.limit = max(float(self.min_in_flight), self.limit / 2)
+        print(f"⚠️ {self.provider} 返回 429，暂停 {delay:.1f}s，并发上限降为 {int(self.limit)}")
+
+    # --- 使用方式 ---
+
+    @contextmanager
+    def slot(self, task: str = "conversation", user: Optional[str] = None):
+        """同步获取一个名额（在工作线程中调用）"""
+        waiter = _Waiter(user or current_upstream_user.get(), TASK_PRIORITIES.get(task, 0))
+        if not self._enqueue(waiter):
+            if not waiter.event.wait(self.queue_timeout) and self._cancel(waiter):
+                raise UpstreamBusyError(f"{self.provider} 请求排队超过 {self.queue_timeout:.0f}s")
+        yield from self._hold()
+
+    @asynccontextmanager
+    async def slot_async(self, task: str = "conversation", user: Optional[str] = None):
+        """异步获取一个名额（Gemini 原生异步调用使用）"""
+        loop = asyncio.get_running_loop()
+        waiter = _Waiter(user or current_upstream_user.get(), TASK_PRIORITIES.get(task, 0), loop=loop)
+        if not self._enqueue(waiter):
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter.future), self.queue_timeout)
+            except asyncio.TimeoutError:
+                if self._cancel(waiter):
+                    raise UpstreamBusyError(f"{self.provider} 请求排队超过 {self.queue_timeout:.0f}s")
+            except asyncio.CancelledError:
+                # 排队期间被取消（如客户端断开）：移出队列；名额已发放则归还，否则会永久占用
+                if not self._cancel(waiter, "cancelled"):
+                    self.release(succeeded=False)
+                raise
+        succeeded = True
+        try:
+            yield
+        except BaseException as exc:
+            succeeded = not self._handle_failure(exc)
+            raise
+        finally:
+            self.release(succeeded)
+
+    def _hold(self):
+        succeeded = True
+        try:
+            yield
+        except BaseException as exc:
+            succeeded = not self._handle_failure(exc)
+            raise
+        finally:
+            self.release(succeeded)
+
+    def _handle_failure(self, exc: BaseException) -> bool:
+        """请求体抛出异常：限流错误上报给控制器；返回是否视为失败"""
+        if isinstance(exc, (GeneratorExit, asyncio.CancelledError)):
+            return False
+        if is_throttle_error(exc):
+            self.report_throttled(getattr(exc, "retry_after", None))
+        return True
+
+    # --- 统计 ---
+
+    def get_metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            waits = {name: sorted(values) for name, values in self.stats["wait_ms"].items()}
+            queue_depth = {
+                PRIORITY_NAMES[priority]: sum(len(queue) for queue in users.values())
+                for priority, users in self._queues.items()
+            }
+            metrics = {
+                "provider": self.provider,
+                "in_flight": self.in_flight,
+                "limit": int(self.limit),
+                "max_in_flight": self.max_in_flight,
+                "cooldown_remaining_s": round(max(0.0, self.cooldown_until - time.monotonic()), 2),
+                "queue_depth": queue_depth,
+                "granted": self.stats["granted"],
+                "queued": self.stats["queued"],
+                "timeouts": self.stats["timeouts"],
+                "cancelled": self.stats["cancelled"],
+                "throttled": self.stats["throttled"],
+            }
+        metrics["queue_wait_ms"] = {
+            name: {
+                "count": len(values),
+                "avg": round(sum(values) / len(values), 1) if values else 0.0,
+                "p95": round(values[int(0.95 * (len(values) - 1))], 1) if values else 0.0,
+                "max": round(values[-1], 1) if values else 0.0,
+            }
+            for name, values in waits.items()
+        }
+        return metrics
+
+
+_limiters: Dict[str, UpstreamLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_upstream_limiter(provider: str) -> UpstreamLimiter:
+    """
+    返回某个服务商的全局限流器
+
+    EASYPROMPT_UPSTREAM_MAX_IN_FLIGHT（默认 8）、EASYPROMPT_<PROVIDER>_MAX_IN_FLIGHT、
+    EASYPROMPT_UPSTREAM_QUEUE_TIMEOUT（秒，默认 60）
+    """
+    with _limiters_lock:
+        limiter = _limiters.get(provider)
+        if limiter is None:
+            default_limit = env_int("EASYPROMPT_UPSTREAM_MAX_IN_FLIGHT", 8)
+            limiter = UpstreamLimiter(
+                provider,
+                max_in_flight=env_int(f"EASYPROMPT_{provider.upper()}_MAX_IN_FLIGHT", default_limit),
+                queue_timeout=env_float("EASYPROMPT_UPSTREAM_QUEUE_TIMEOUT", 60.0),
+            )
+            _limiters[provider] = limiter
+        return limiter
+
+
+def get_upstream_metrics() -> Dict[str, Any]:
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {limiter.provider: limiter.get_metrics() for limiter in limiters}
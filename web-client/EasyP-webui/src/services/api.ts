@@ -9,6 +9,32 @@ export interface ApiResponse<T = unknown> {
   success: boolean;
   message: string;
   data?: T;
+  next_cursor?: string | null;
+}
+
+export interface SessionListParams {
+  limit?: number;
+  cursor?: string;
+  status?: string;
+  updatedAfter?: string;
+  updatedBefore?: string;
+}
+
+export interface MessageWindowParams {
+  since?: string;
+  before?: string;
+  limit?: number;
+}
+
+function buildQuery(params: Record<string, string | number | undefined>): string {
+  const search = new URLSearchParams();
+  for (const [key, value] of Object.entries(params)) {
+    if (value !== undefined && value !== '') {
+      search.append(key, String(value));
+    }
+  }
+  const query = search.toString();
+  return query ? `?${query}` : '';
 }
 
 class ApiService {
@@ -60,6 +86,19 @@ class ApiService {
     return response.data!;
   }
 
+  // Cursor-based pagination: pass the returned nextCursor to fetch the next page
+  async listSessions(params: SessionListParams = {}): Promise<{ sessions: Session[]; nextCursor: string | null }> {
+    const query = buildQuery({
+      limit: params.limit,
+      cursor: params.cursor,
+      status: params.status,
+      updated_after: params.updatedAfter,
+      updated_before: params.updatedBefore,
+    });
+    const response = await this.request<Session[]>(`/sessions/${query}`);
+    return { sessions: response.data || [], nextCursor: response.next_cursor ?? null };
+  }
+
   async getSession(sessionId: string): Promise<Session> {
     const response = await this.request<Session>(`/sessions/${sessionId}`);
     return response.data!;
@@ -95,8 +134,9 @@ class ApiService {
     return response.data!;
   }
 
-  async getSessionMessages(sessionId: string): Promise<ChatMessage[]> {
-    const response = await this.request<ChatMessage[]>(`/sessions/${sessionId}/messages`);
+  async getSessionMessages(sessionId: string, params: MessageWindowParams = {}): Promise<ChatMessage[]> {
+    const query = buildQuery({ since: params.since, before: params.before, limit: params.limit });
+    const response = await this.request<ChatMessage[]>(`/sessions/${sessionId}/messages${query}`);
     return response.data!;
   }
 
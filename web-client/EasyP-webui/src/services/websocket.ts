@@ -6,12 +6,14 @@ import type {
   AppState,
   UserResponse,
   UserConfirmation,
-  Session
+  Session,
+  TraitUpdate
 } from 'src/types/websocket';
 import {
   isSystemMessage,
   isAIResponseChunk,
   isEvaluationUpdate,
+  isTraitUpdate,
   isConfirmationRequest,
   isFinalPromptChunk,
   isSessionEnd,
@@ -372,6 +374,9 @@ class WebSocketService {
     } else if (isEvaluationUpdate(message)) {
       console.log('🔬 进入评估更新处理分支');
       this.handleEvaluationUpdate(message.payload);
+    } else if (isTraitUpdate(message)) {
+      console.log('🏷️ 进入实时特征处理分支');
+      this.handleTraitUpdate(message.payload);
     } else if (isConfirmationRequest(message)) {
       console.log('❓ 进入确认请求处理分支');
       this.handleConfirmationRequest(message.payload.reason);
@@ -491,6 +496,8 @@ class WebSocketService {
     };
     suggestions?: string[];
     is_ready?: boolean;
+    provisional?: boolean;
+    partial?: boolean; // 流式评估：字段逐个到达，只更新已有的字段
   }): void {
     this.log('🔬 评估更新详细信息', {
       message: payload.message,
@@ -565,12 +572,23 @@ class WebSocketService {
       }, 3000);
     }
 
-    // 更新当前会话的评估数据
-    void this.updateCurrentSession();
+    // 更新当前会话的评估数据（流式评估的中间结果不保存，只保存最终结果）
+    if (!payload.partial) {
+      void this.updateCurrentSession();
+    }
 
     this.log('📊 更新评估状态完成', payload.message);
   }
 
+  private handleTraitUpdate(payload: TraitUpdate['payload']): void {
+    // 特征随回复流式到达，先展示在特征列表中，评估结果到达后会整体替换
+    const trait = payload.label ? `${payload.label}: ${payload.value}` : payload.value;
+    if (!this.extractedTraits.value.includes(trait)) {
+      this.extractedTraits.value = [...this.extractedTraits.value, trait];
+      this.log('🏷️ 实时特征', payload);
+    }
+  }
+
   private handleConfirmationRequest(reason: string): void {
     console.log('❓ 确认请求:', reason);
 
@@ -1018,12 +1036,7 @@ class WebSocketService {
   private async updateCurrentSession(): Promise<void> {
     if (this.currentSessionId.value) {
       try {
-        // 更新消息
-        const lastMessage = this.chatMessages.value[this.chatMessages.value.length - 1];
-        if (lastMessage) {
-          await apiService.addMessageToSession(this.currentSessionId.value, lastMessage);
-        }
-
+        // 用户消息和 AI 回复由服务端在每轮对话中写入会话，这里只同步评估数据
         // 更新评估数据
         const evaluationData = {
           evaluationStatus: this.evaluationStatus.value,
@@ -20,7 +20,27 @@ export interface EvaluationUpdate {
   payload: {
     message: string;
     extracted_traits?: string[];
+    completeness_breakdown?: {
+      core_identity: number;
+      personality_traits: number;
+      behavioral_patterns: number;
+      interaction_patterns: number;
+    };
+    evaluation_score?: number;
     is_ready?: boolean;
+    provisional?: boolean; // 本地预评分给出的临时结果
+    partial?: boolean; // 流式评估中，仅包含已到达的字段
+  };
+}
+
+// 对话回复中实时解析出的结构化特征
+export interface TraitUpdate {
+  type: 'trait_update';
+  payload: {
+    category: 'core_identity' | 'personality_traits' | 'behavioral_patterns' | 'interaction_patterns';
+    label: string;
+    value: string;
+    seq: number;
   };
 }
 
@@ -90,15 +110,27 @@ export interface UserConfirmation {
   };
 }
 
+export type ModelTask = 'planner' | 'evaluator' | 'conversation' | 'writer';
+
+// 单个任务的模型覆盖配置，未填写的字段继承对话模型
+export interface TaskModelConfig {
+  model?: string;
+  base_url?: string; // 仅OpenAI兼容API
+  api_key?: string; // 仅OpenAI兼容API
+  temperature?: number;
+  max_tokens?: number;
+}
+
 export interface ApiConfiguration {
   api_type: 'gemini' | 'openai';
   api_key?: string;
   base_url?: string;
   model?: string;
-  evaluator_model?: string; // Gemini专用评估模型
+  evaluator_model?: string; // 评估模型，等价于 task_models.evaluator.model
   temperature?: number;
   max_tokens?: number;
   nsfw_mode?: boolean;
+  task_models?: Partial<Record<ModelTask, TaskModelConfig>>;
 }
 
 export interface ApiConfig {
@@ -118,6 +150,7 @@ export type ServerMessage =
   | SystemMessage
   | AIResponseChunk
   | EvaluationUpdate
+  | TraitUpdate
   | ConfirmationRequest
   | FinalPromptChunk
   | SessionEnd
@@ -143,6 +176,10 @@ export function isEvaluationUpdate(message: WebSocketMessage): message is Evalua
   return message.type === 'evaluation_update';
 }
 
+export function isTraitUpdate(message: WebSocketMessage): message is TraitUpdate {
+  return message.type === 'trait_update';
+}
+
 export function isConfirmationRequest(message: WebSocketMessage): message is ConfirmationRequest {
   return message.type === 'confirmation_request';
 }
@@ -0,0 +1,195 @@
+"""
+Per-URL web brief cache
+网页要点缓存（可选）：抓取到的网页正文先由模型压缩成一份简短的角色/概念要点，
+按 规范化 URL + 正文哈希 缓存；之后的轮次和其他会话再用到同一页面时直接复用要点，
+对话模型不再每轮重读原文
+
+- 开关：EASYPROMPT_WEB_BRIEF（默认关闭；关闭时注入 passage_selector 选出的段落）
+- 要点生成使用规划任务的模型路由（EASYPROMPT_PLANNER_MODEL），受本轮时间预算约束；
+  预算不足、LLM 熔断或生成失败时本轮退回段落摘录，不影响对话
+- 页面内容变化（哈希不同）时重新生成；EASYPROMPT_WEB_BRIEF_TTL 秒（默认 86400）后过期
+- 缓存条目上限 EASYPROMPT_WEB_BRIEF_CACHE_SIZE（默认 256）
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from conversation_memory import estimate_tokens
+from llm_helper import get_current_api_type, llm_unavailable_reason, run_structured_prompt
+from passage_selector import select_passages
+from runtime_config import env_bool, env_float, env_int
+from turn_deadline import TurnDeadline
+from web_scraper import canonical_url
+
+# 送给摘要模型的正文上限（token），超出时按搜索对象挑选段落
+BRIEF_INPUT_TOKENS = 3000
+
+# 要点的长度上限（字）
+BRIEF_MAX_CHARS = 400
+
+_BRIEF_INSTRUCTIONS = {
+    "character": "提炼与角色设定有关的信息：身份与出处、背景经历、性格、外貌、能力、人际关系、代表性台词。",
+    "concept": "提炼这个概念的定义、关键特征、常见用途或场景，以及需要注意的限制。",
+    "link": "概括网页的主题，并提炼其中对创作角色设定有用的信息（人物、世界观、风格、设定细节）。",
+}
+
+BRIEF_SYSTEM_PROMPT = (
+    "你是资料整理助手。阅读用户提供的网页正文，{instruction}\n"
+    "只保留正文中明确出现的信息，不要推测或补充；忽略导航、版权声明等无关内容。\n"
+    "用简洁的中文要点列表输出，每行以“- ”开头，总长度不超过 {max_chars} 字。"
+)
+
+
+def is_enabled() -> bool:
+    return env_bool("EASYPROMPT_WEB_BRIEF", False)
+
+
+def content_hash(content: str) -> str:
+    return hashlib.sha1((content or "").encode("utf-8")).hexdigest()
+
+
+# --- 统计 ---
+
+_metrics_lock = threading.Lock()
+brief_metrics: Dict[str, Any] = {
+    "requests": 0,
+    "cache_hits": 0,
+    "generated": 0,
+    "failed": 0,
+    "skipped": 0,
+    "source_tokens_total": 0,
+    "brief_tokens_total": 0,
+}
+
+
+def _count(key: str, amount: int = 1):
+    with _metrics_lock:
+        brief_metrics[key] += amount
+
+
+def get_brief_metrics() -> Dict[str, Any]:
+    """要点缓存命中率、生成/失败/跳过次数，以及要点相对网页正文的 token 比例"""
+    with _metrics_lock:
+        metrics = dict(brief_metrics)
+    metrics["enabled"] = is_enabled()
+    metrics["cache_size"] = len(brief_cache)
+    metrics["hit_rate"] = round(metrics["cache_hits"] / metrics["requests"], 3) if metrics["requests"] else 0.0
+    if metrics["source_tokens_total"]:
+        metrics["brief_token_ratio"] = round(metrics["brief_tokens_total"] / metrics["source_tokens_total"], 3)
+    else:
+        metrics["brief_token_ratio"] = 0.0
+    return metrics
+
+
+# --- 缓存 ---
+
+class BriefCache:
+    """
+    进程内的要点缓存，所有会话共享
+
+    Args:
+        ttl: 要点保留的秒数
+        max_entries: 最多保留的页面数（LRU 淘汰）
+    """
+
+    def __init__(self, ttl: float = 86400.0, max_entries: int = 256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, str, str], Tuple[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Tuple[str, str, str]) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            brief, created_at = entry
+            if time.monotonic() - created_at > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return brief
+
+    def put(self, key: Tuple[str, str, str], brief: str):
+        with self._lock:
+            self._entries[key] = (brief, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+brief_cache = BriefCache(
+    ttl=env_float("EASYPROMPT_WEB_BRIEF_TTL", 86400.0),
+    max_entries=env_int("EASYPROMPT_WEB_BRIEF_CACHE_SIZE", 256),
+)
+
+
+def _generate_brief(content: str, kind: str, focus: Optional[str]) -> str:
+    source = select_passages(content, focus or "", BRIEF_INPUT_TOKENS, focus=focus)
+    system_prompt = BRIEF_SYSTEM_PROMPT.format(
+        instruction=_BRIEF_INSTRUCTIONS.get(kind, _BRIEF_INSTRUCTIONS["link"]),
+        max_chars=BRIEF_MAX_CHARS,
+    )
+    user_prompt = f"<Focus>{focus or '无'}</Focus>\n<WebContent>\n{source}\n</WebContent>"
+    brief = (run_structured_prompt(system_prompt, user_prompt) or "").strip()
+    # 模型偶尔超长时按字数截断，避免缓存一份比摘录还长的要点
+    if len(brief) > BRIEF_MAX_CHARS * 2:
+        brief = brief[:BRIEF_MAX_CHARS * 2] + "..."
+    return brief
+
+
+def get_web_brief(web_content: Dict[str, Any], kind: str, focus: Optional[str] = None,
+                  deadline: Optional[TurnDeadline] = None) -> Optional[str]:
+    """
+    返回某个网页的要点；未开启、无法生成或本轮预算不足时返回 None，调用方改用段落摘录
+
+    Args:
+        web_content: scrape_webpage 的结果
+        kind: character / concept / link，决定要点侧重的内容
+        focus: 搜索对象（角色名/概念名）
+        deadline: 本轮截止时间；缓存未命中时生成要点需要足够的剩余预算
+    """
+    if not is_enabled() or not web_content or not web_content.get('content') or not web_content.get('url'):
+        return None
+    content = web_content['content']
+    key = (canonical_url(web_content['url']), content_hash(content), kind)
+    _count("requests")
+
+    brief = brief_cache.get(key)
+    if brief is not None:
+        _count("cache_hits")
+        return brief
+
+    if get_current_api_type() == "none" or llm_unavailable_reason("planner"):
+        _count("skipped")
+        return None
+    if deadline is not None and not deadline.allows("brief"):
+        print(f"⏱️ 本轮时间预算不足（剩余 {deadline.remaining():.1f}s），网页要点留到之后生成")
+        _count("skipped")
+        return None
+
+    try:
+        brief = _generate_brief(content, kind, focus)
+    except Exception as exc:
+        print(f"⚠️ 网页要点生成失败，使用段落摘录: {exc}")
+        _count("failed")
+        return None
+    if not brief:
+        _count("failed")
+        return None
+
+    brief_cache.put(key, brief)
+    _count("generated")
+    _count("source_tokens_total", estimate_tokens(content))
+    _count("brief_tokens_total", estimate_tokens(brief))
+    print(f"📝 已生成网页要点: {web_content.get('title') or web_content['url']} ({len(brief)} 字)")
+    return brief
@@ -1,10 +1,51 @@
 import re
 import requests
+from requests.compat import chardet
 from bs4 import BeautifulSoup
-from urllib.parse import urlparse, unquote
+from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse, unquote
 import time
-from typing import Optional, Dict, Any
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError, as_completed
+from typing import Optional, Dict, Any, Iterator, List
 import json
+from boilerplate_filter import clean_text, detect_profile
+from circuit_breaker import CircuitOpenError, get_breaker, host_of
+from html_parse_pool import parse_html
+from runtime_config import env_int
+from scrape_transport import HostBusyError, PoliteSession, RobotsDisallowedError
+from turn_deadline import TurnDeadline
+
+# 规范化 URL 时丢弃的跟踪参数前缀
+_TRACKING_PARAMS = ('utm_', 'spm', 'share_')
+
+
+def canonical_url(url: str) -> str:
+    """
+    规范化 URL，用于判断两个链接是否指向同一页面：
+    协议与域名小写、去掉默认端口和 #片段、路径统一为解码后的形式、去掉末尾斜杠和跟踪参数
+    """
+    url = url.strip()
+    if '://' not in url:
+        url = 'https://' + url
+    parsed = urlparse(url)
+    scheme = parsed.scheme.lower()
+    host = (parsed.hostname or '').lower()
+    if parsed.port and not ((scheme == 'http' and parsed.port == 80) or (scheme == 'https' and parsed.port == 443)):
+        host = f"{host}:{parsed.port}"
+    path = unquote(parsed.path).rstrip('/') or '/'
+    query = [(key, value) for key, value in parse_qsl(parsed.query, keep_blank_values=True)
+             if not key.lower().startswith(_TRACKING_PARAMS)]
+    return urlunparse((scheme, host, path, '', urlencode(sorted(query)), ''))
+
+
+# 【@URL 描述】格式与普通URL；普通URL在空白和中文标点处结束
+_BRACKET_URL_PATTERN = re.compile(r'【@\s*([^\s】]+)\s*[^】]*】')
+_BARE_URL_PATTERN = re.compile(r'https?://[^\s，。；、！？（）【】「」『』《》<>"]+')
+
+# 同一条消息中的多个链接并发抓取
+_link_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="link-scrape")
+
+# 正文提取的上限（字符），只防止超长页面占用内存；注入上下文的长度由 passage_selector 按预算控制
+MAX_CONTENT_CHARS = 60000
 
 class WebScraper:
     """
@@ -12,7 +53,8 @@ class WebScraper:
     """
     
     def __init__(self):
-        self.session = requests.Session()
+        # 按站点限并发与速率、遵守 robots.txt，所有用户共用每个站点的配额
+        self.session = PoliteSession(respect_robots=True)
         self.session.headers.update({
             'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
             'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
@@ -24,27 +66,41 @@ class WebScraper:
         })
         self.timeout = 20  # 增加超时时间
     
-    def extract_url_from_text(self, text: str) -> Optional[str]:
+    def extract_urls_from_text(self, text: str) -> List[str]:
         """
-        从文本中提取URL，支持中文链接格式
+        从文本中提取所有URL，支持中文链接格式，按规范化URL去重
         支持格式：
         - https://example.com
         - 【@https://example.com】
         - 【@https://example.com 描述文字】
+        【@URL】格式的链接排在前面，其余按出现顺序
         """
+        urls: List[str] = []
+        seen = set()
+
+        def add(url: str):
+            key = canonical_url(url)
+            if key not in seen:
+                seen.add(key)
+                urls.append(url)
+
         # 匹配【@URL】格式
-        bracket_pattern = r'【@\s*([^\s】]+)\s*[^】]*】'
-        bracket_match = re.search(bracket_pattern, text)
-        if bracket_match:
-            return bracket_match.group(1)
-        
-        # 匹配普通URL格式
-        url_pattern = r'https?://[^\s]+'
-        url_match = re.search(url_pattern, text)
-        if url_match:
-            return url_match.group(0)
-        
-        return None
+        for match in _BRACKET_URL_PATTERN.finditer(text):
+            add(match.group(1))
+
+        # 匹配普通URL格式（去掉已匹配的【@URL】，以及紧跟在链接后的标点）
+        remaining = _BRACKET_URL_PATTERN.sub(' ', text)
+        for match in _BARE_URL_PATTERN.finditer(remaining):
+            url = match.group(0).rstrip('.,;:!?\'"')
+            if url:
+                add(url)
+
+        return urls
+
+    def extract_url_from_text(self, text: str) -> Optional[str]:
+        """从文本中提取第一个URL（优先【@URL】格式）"""
+        urls = self.extract_urls_from_text(text)
+        return urls[0] if urls else None
     
     def is_valid_url(self, url: str) -> bool:
         """检查URL是否有效"""
@@ -54,9 +110,11 @@ class WebScraper:
         except:
             return False
     
-    def scrape_webpage(self, url: str) -> Dict[str, Any]:
+    def scrape_webpage(self, url: str, deadline: Optional[TurnDeadline] = None) -> Dict[str, Any]:
         """
         抓取网页内容并提取关键信息
+
+        deadline: 本轮截止时间，请求超时不超过剩余预算
         """
         try:
             # 确保URL格式正确
@@ -65,47 +123,19 @@ class WebScraper:
             
             print(f"正在抓取网页内容: {url}")
             
-            response = self.session.get(url, timeout=self.timeout, allow_redirects=True)
-            response.raise_for_status()
-            
-            # 优化编码检测
-            # 1. 首先尝试从响应头获取编码
-            content_type = response.headers.get('content-type', '').lower()
-            charset = None
-            if 'charset=' in content_type:
-                charset = content_type.split('charset=')[-1].split(';')[0].strip()
-            
-            # 2. 如果没有从头部获取到，使用chardet检测
-            if not charset or charset in ['iso-8859-1', 'latin-1']:
-                charset = response.apparent_encoding
-            
-            # 3. 默认使用UTF-8
-            if not charset:
-                charset = 'utf-8'
-            
-            # 设置正确的编码
-            response.encoding = charset
-            print(f"检测到编码: {charset}")
+            # 站点连续失败时熔断，直接返回失败而不是每次等满超时
+            with get_breaker(host_of(url)).guard():
+                timeout = deadline.timeout(self.timeout) if deadline is not None else self.timeout
+                response = self.session.get(url, timeout=timeout, allow_redirects=True)
+                response.raise_for_status()
             
-            # 使用lxml解析器，对中文内容更友好
-            try:
-                soup = BeautifulSoup(response.content, 'lxml')
-            except:
-                # 如果lxml不可用，降级到html.parser
-                soup = BeautifulSoup(response.content, 'html.parser')
-            
-            # 提取基本信息
-            title = self._extract_title(soup)
-            description = self._extract_description(soup)
-            content = self._extract_main_content(soup)
-            keywords = self._extract_keywords(soup)
+            # 编码检测与解析是 CPU 密集的工作，开启 EASYPROMPT_PARSE_PROCESSES 时在工作进程中完成
+            page = parse_html(response.content, url, response.headers.get('content-type', ''), deadline)
+            title = page['title']
             
             result = {
                 'url': url,
-                'title': title,
-                'description': description,
-                'content': content,
-                'keywords': keywords,
+                **page,
                 'success': True,
                 'error': None
             }
@@ -113,6 +143,17 @@ class WebScraper:
             print(f"成功抓取网页: {title}")
             return result
             
+        except (CircuitOpenError, HostBusyError, RobotsDisallowedError) as e:
+            print(f"⚡ 跳过网页抓取: {e}")
+            return {
+                'url': url,
+                'title': None,
+                'description': None,
+                'content': None,
+                'keywords': [],
+                'success': False,
+                'error': str(e)
+            }
         except requests.exceptions.RequestException as e:
             print(f"网页抓取失败: {e}")
             return {
@@ -199,8 +240,12 @@ class WebScraper:
         
         return ""
     
-    def _extract_main_content(self, soup: BeautifulSoup) -> str:
-        """提取主要内容，优化MediaWiki支持"""
+    def _extract_main_content(self, soup: BeautifulSoup, profile: str = 'generic') -> str:
+        """
+        提取主要内容，优化MediaWiki支持
+
+        profile: 清理无用文本使用的站点配置（见 boilerplate_filter.SITE_PROFILES）
+        """
         # 移除不需要的标签
         for tag in soup(["script", "style", "nav", "footer", "header", "aside", "noscript"]):
             tag.decompose()
@@ -272,11 +317,15 @@ class WebScraper:
         # 提取段落文本，保留结构
         paragraphs = []
         
-        # 优先提取p标签内容
-        for p in main_content.find_all('p', limit=20):  # 限制段落数量
+        # 优先提取p标签内容；不再只取前若干段，注入上下文前由 passage_selector 按相关性挑选
+        total_chars = 0
+        for p in main_content.find_all('p'):
             text = p.get_text(separator=' ', strip=True)
             if text and len(text) > 20:  # 过滤太短的段落
                 paragraphs.append(text)
+                total_chars += len(text)
+                if total_chars > MAX_CONTENT_CHARS:
+                    break
         
         # 如果段落太少，补充其他文本
         if len(paragraphs) < 3:
@@ -285,43 +334,11 @@ class WebScraper:
                 if text and len(text) > 50 and text not in paragraphs:
                     paragraphs.append(text)
         
-        # 合并段落
-        content = ' '.join(paragraphs)
+        # 合并段落，保留换行作为段落边界
+        content = '\n'.join(paragraphs)
         
-        # 清理文本
-        import re
-        
-        # 移除常见的无用文本模式
-        unwanted_patterns = [
-            r'编辑.*?段落',
-            r'编辑.*?章节',
-            r'跳转至.*?导航',
-            r'萌娘百科.*?欢迎',
-            r'维基百科.*?自由',
-            r'登录.*?创建账户',
-            r'讨论.*?贡献.*?工具',
-            r'个人工具',
-            r'页面工具',
-            r'分类：.*',
-            r'隐藏分类：',
-            r'导航菜单',
-            r'参考资料\[编辑\]',
-            r'外部链接\[编辑\]',
-            r'\[编辑\]',
-            r'\[查看\]',
-            r'\[讨论\]',
-            r'\[×\]',
-        ]
-        
-        for pattern in unwanted_patterns:
-            content = re.sub(pattern, '', content, flags=re.IGNORECASE)
-        
-        # 移除多余的空白字符
-        content = re.sub(r'\s+', ' ', content).strip()
-        
-        # 限制长度
-        if len(content) > 2500:
-            content = content[:2500] + "..."
+        # 清理文本：站点配置的无用文本模式已预编译为单个正则，一次扫描完成，随后按行压缩空白
+        content = clean_text(content, profile)
         
         if not content or len(content) < 50:
             print(f"警告：提取的内容过短或为空，长度: {len(content)}")
@@ -357,38 +374,117 @@ class WebScraper:
         
         return keywords[:10]  # 限制数量
     
-    def process_user_input(self, user_input: str) -> Dict[str, Any]:
+    def prepare_user_links(self, user_input: str, deadline: Optional[TurnDeadline] = None) -> Dict[str, Any]:
         """
-        处理用户输入，检测并抓取链接内容
+        检测用户输入中的链接，但不抓取
+
+        每条消息最多抓取 EASYPROMPT_LINK_MAX_URLS 个链接（默认 3），超出的记入 dropped_urls；
+        deadline: 本轮截止时间；剩余预算不足时 urls 为空并返回 error
         """
-        url = self.extract_url_from_text(user_input)
-        
-        if not url:
-            return {
-                'has_url': False,
-                'url': None,
-                'web_content': None,
-                'original_input': user_input
-            }
-        
-        if not self.is_valid_url(url):
-            return {
-                'has_url': True,
-                'url': url,
-                'web_content': None,
-                'error': '无效的URL格式',
-                'original_input': user_input
-            }
-        
-        web_content = self.scrape_webpage(url)
-        
-        return {
-            'has_url': True,
-            'url': url,
-            'web_content': web_content,
+        found = self.extract_urls_from_text(user_input)
+        valid = [url for url in found if self.is_valid_url(url)]
+        max_urls = max(1, env_int("EASYPROMPT_LINK_MAX_URLS", 3))
+        result = {
+            'has_url': bool(found),
+            'url': found[0] if found else None,
+            'urls': valid[:max_urls],
+            'invalid_urls': [url for url in found if url not in valid],
+            'dropped_urls': valid[max_urls:],
+            'error': None,
             'original_input': user_input
         }
+        
+        if found and not valid:
+            result['error'] = '无效的URL格式'
+        elif valid and deadline is not None and not deadline.allows("link"):
+            result['urls'] = []
+            result['error'] = f'本轮时间预算不足（剩余 {deadline.remaining():.1f}s），跳过网页抓取'
+        return result
+
+    def iter_scrape(self, urls: List[str], deadline: Optional[TurnDeadline] = None) -> Iterator[Dict[str, Any]]:
+        """
+        并发抓取多个网页，按完成顺序逐个返回抓取结果（含 'url'）
+
+        所有链接共享本轮截止时间：预算用完时不再等待未完成的抓取，直接返回失败结果
+        """
+        if not urls:
+            return
+        futures = {_link_executor.submit(self.scrape_webpage, url, deadline): url for url in urls}
+        pending = set(futures)
+        wait_timeout = None if deadline is None or deadline.expires_at is None else deadline.remaining()
+        try:
+            for future in as_completed(futures, timeout=wait_timeout):
+                pending.discard(future)
+                yield future.result()
+        except FutureTimeoutError:
+            for future in pending:
+                future.cancel()
+                yield {
+                    'url': futures[future],
+                    'title': None,
+                    'description': None,
+                    'content': None,
+                    'keywords': [],
+                    'success': False,
+                    'error': '本轮时间预算用完，未等待该网页抓取完成'
+                }
+
+    def process_user_input(self, user_input: str, deadline: Optional[TurnDeadline] = None) -> Dict[str, Any]:
+        """
+        处理用户输入，检测并并发抓取所有链接的内容
+
+        返回 prepare_user_links 的结果，另含 pages（按链接顺序的抓取结果）
+        和 web_content（第一个抓取成功的页面，没有则为第一个结果或 None）
+        deadline: 本轮截止时间；剩余预算不足时不抓取，返回 error
+        """
+        result = self.prepare_user_links(user_input, deadline)
+        by_url = {page['url']: page for page in self.iter_scrape(result['urls'], deadline)}
+        pages = [by_url[url] for url in result['urls'] if url in by_url]
+        result['pages'] = pages
+        result['web_content'] = next((page for page in pages if page.get('success')), pages[0] if pages else None)
+        return result
 
 # 全局实例
 web_scraper = WebScraper()
 
+
+def parse_page(raw: bytes, url: str, content_type: str = '') -> Dict[str, Any]:
+    """
+    解析网页 HTML，提取标题、描述、正文和关键词
+
+    只依赖原始字节，不访问网络，可以在 html_parse_pool 的工作进程中运行
+    """
+    # 优化编码检测
+    # 1. 首先尝试从响应头获取编码
+    content_type = (content_type or '').lower()
+    charset = None
+    if 'charset=' in content_type:
+        charset = content_type.split('charset=')[-1].split(';')[0].strip()
+    
+    # 2. 如果没有从头部获取到，使用chardet检测
+    if not charset or charset in ['iso-8859-1', 'latin-1']:
+        charset = chardet.detect(raw)['encoding']
+    
+    # 3. 默认使用UTF-8
+    if not charset:
+        charset = 'utf-8'
+    print(f"检测到编码: {charset}")
+    
+    # 使用lxml解析器，对中文内容更友好
+    try:
+        soup = BeautifulSoup(raw, 'lxml')
+    except:
+        # 如果lxml不可用，降级到html.parser
+        soup = BeautifulSoup(raw, 'html.parser')
+    
+    # 站点配置需在正文提取删除元素之前识别
+    profile = detect_profile(url, soup)
+    
+    # 提取基本信息
+    return {
+        'title': web_scraper._extract_title(soup),
+        'description': web_scraper._extract_description(soup),
+        'content': web_scraper._extract_main_content(soup, profile),
+        'keywords': web_scraper._extract_keywords(soup),
+    }
+